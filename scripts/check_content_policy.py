@@ -1,9 +1,9 @@
+import argparse
 import os
 import sys
 import json
-from openai import OpenAI
-from typing import List, Dict, Any
-import time # time モジュールをインポート
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, List, Dict, Any, Tuple
 
 # --- sys.path の調整 ---
 project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -12,91 +12,291 @@ if project_root_for_sys_path not in sys.path:
 # --- ここまで追加 ---
 
 from src.config import settings # settings.py からAPIキーを読み込む
+from src.core.rate_limiter import get_shared_rate_limiter
+from src.core.batch_runner import BatchRunner, file_signature
+from src.utils.corpus_store import CorpusStore, add_article_filter_arguments, article_filters_from_args
 
-def check_text_with_moderation_api(client: OpenAI, text_to_check: str) -> Dict[str, Any]:
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# --- バッチ設定 ---
+# Moderation API は input にリストを受け付けるため、複数記事をまとめて1リクエストで送る
+# 1入力あたりの最大文字数。これを超える記事は段落単位で分割し、カテゴリごとの最大スコアを採用する
+MAX_CHARS_PER_INPUT = 4000
+# 1リクエストあたりの合計文字数と入力数の上限
+MAX_CHARS_PER_BATCH = 60000
+MAX_INPUTS_PER_BATCH = 32
+# 同時に送信するバッチ数
+MAX_CONCURRENT_BATCHES = 4
+# Batch API で処理する場合に使うモデルと、ジョブの状態を確認する初期間隔 (秒)
+BATCH_MODERATION_MODEL = "omni-moderation-latest"
+DEFAULT_BATCH_POLL_INTERVAL_SECONDS = 30.0
+
+def split_text_into_chunks(text: str, max_chars: int = MAX_CHARS_PER_INPUT) -> List[str]:
+    """
+    テキストを max_chars 以下のチャンクに分割する。可能な限り段落 (空行) の境界で区切り、
+    1段落が max_chars を超える場合のみ文字数で強制的に分割する。
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks: List[str] = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+def build_moderation_batches(
+    articles: List[Dict[str, Any]],
+    max_chars_per_batch: int = MAX_CHARS_PER_BATCH,
+    max_inputs_per_batch: int = MAX_INPUTS_PER_BATCH,
+    max_chars_per_input: int = MAX_CHARS_PER_INPUT
+) -> List[List[Tuple[int, str]]]:
     """
-    指定されたテキストをOpenAI Moderation APIでチェックする。
+    記事をチャンクに分割し、文字数と入力数の上限に収まるようにバッチへ詰める。
+
+    Returns:
+        List[List[Tuple[int, str]]]: バッチのリスト。各要素は (articles 内のインデックス, チャンク) のリスト。
+    """
+    batches: List[List[Tuple[int, str]]] = []
+    current_batch: List[Tuple[int, str]] = []
+    current_chars = 0
+    for article_index, article in enumerate(articles):
+        for chunk in split_text_into_chunks(article["text"], max_chars_per_input):
+            if current_batch and (current_chars + len(chunk) > max_chars_per_batch
+                                  or len(current_batch) >= max_inputs_per_batch):
+                batches.append(current_batch)
+                current_batch = []
+                current_chars = 0
+            current_batch.append((article_index, chunk))
+            current_chars += len(chunk)
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+def check_texts_with_moderation_api(client: "OpenAI", texts_to_check: List[str]) -> List[Any]:
+    """
+    複数のテキストを1回のOpenAI Moderation API呼び出しでチェックする。
+    呼び出しは共有レートリミッター ("moderation") を経由し、429 は Retry-After に従って再試行する。
+    Moderation API はトークン数では制限されないため、リクエスト数だけで送信ペースを制御する。
+
+    Returns:
+        List[Any]: 入力と同じ順序の結果のリスト。エラー時は None。
     """
     try:
-        response = client.moderations.create(input=text_to_check)
-        # response.results[0] に結果が含まれる
-        return response.results[0]
+        response = get_shared_rate_limiter("moderation").call(
+            client.moderations.create,
+            input=texts_to_check
+        )
+        return response.results
     except Exception as e:
         print(f"Moderation API呼び出し中にエラーが発生しました: {e}")
         return None
 
-def analyze_articles_for_policy_violations(input_file_path: str, output_file_path: str):
+def _normalized_category_items(values: Any):
+    """
+    カテゴリごとの値を (カテゴリ名, 値) で返す。SDKの結果オブジェクト (sexual_minors) と
+    Batch API の結果のJSON (sexual/minors) のどちらも、SDKと同じカテゴリ名に揃える。
+    """
+    items = values.items() if isinstance(values, dict) else values.__dict__.items()
+    for cat, value in items:
+        yield cat.replace("/", "_").replace("-", "_"), value
+
+def _field(result: Any, name: str) -> Any:
+    return result[name] if isinstance(result, dict) else getattr(result, name)
+
+def merge_moderation_results(chunk_results: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    1記事の複数チャンクの結果をまとめる。フラグはいずれかのチャンクで立っていれば True、
+    スコアはカテゴリごとの最大値を採用する。
+    """
+    categories: Dict[str, bool] = {}
+    scores: Dict[str, float] = {}
+    for result in chunk_results:
+        for cat, flagged in _normalized_category_items(_field(result, "categories")):
+            categories[cat] = bool(categories.get(cat) or flagged)
+        for cat, score in _normalized_category_items(_field(result, "category_scores")):
+            if score is not None:
+                scores[cat] = max(scores.get(cat, 0.0), score)
+    return {"categories": categories, "scores": scores}
+
+def moderate_batches_concurrently(client: "OpenAI", batches: List[List[Tuple[int, str]]]) -> Tuple[Dict[int, List[Any]], set]:
+    """
+    バッチを Moderation API に同期的に送信する。複数のバッチを並行して処理する。
+
+    Returns:
+        Tuple[Dict[int, List[Any]], set]: 記事インデックスごとのチャンクの結果と、失敗した記事インデックスの集合。
+    """
+    # 記事インデックスごとにチャンクの結果を集める。1チャンクでも失敗した記事はAPIエラーとして扱う
+    chunk_results: Dict[int, List[Any]] = {}
+    failed_article_indexes = set()
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES) as executor:
+        future_to_batch = {
+            executor.submit(check_texts_with_moderation_api, client, [chunk for _, chunk in batch]): batch
+            for batch in batches
+        }
+        for batch_number, future in enumerate(as_completed(future_to_batch), 1):
+            batch = future_to_batch[future]
+            results = future.result()
+            if results is None or len(results) != len(batch):
+                failed_article_indexes.update(article_index for article_index, _ in batch)
+            else:
+                for (article_index, _), result in zip(batch, results):
+                    chunk_results.setdefault(article_index, []).append(result)
+            print(f"処理中: バッチ {batch_number}/{len(batches)} 完了")
+    return chunk_results, failed_article_indexes
+
+def moderate_batches_with_batch_api(
+    client: "OpenAI",
+    batches: List[List[Tuple[int, str]]],
+    state_path: str,
+    input_signature: str = None,
+    poll_interval_seconds: float = DEFAULT_BATCH_POLL_INTERVAL_SECONDS
+) -> Tuple[Dict[int, List[Any]], set]:
+    """
+    バッチを Batch API で送信し、完了を待って結果を custom_id (バッチ番号) で元の記事に対応付ける。
+    ジョブの状態は state_path に保存され、中断しても同じ入力で再実行すれば続きから再開する。
+
+    Returns:
+        Tuple[Dict[int, List[Any]], set]: moderate_batches_concurrently と同じ形式の結果。
+    """
+    runner = BatchRunner(client, state_path, "/v1/moderations", poll_interval_seconds=poll_interval_seconds)
+    if runner.has_pending_job(input_signature):
+        print(f"情報: 前回投入したバッチジョブを再開します。({state_path})")
+    else:
+        runner.submit(
+            ({"custom_id": f"moderation-{batch_index}",
+              "body": {"model": BATCH_MODERATION_MODEL, "input": [chunk for _, chunk in batch]}}
+             for batch_index, batch in enumerate(batches)),
+            input_signature=input_signature
+        )
+    runner.wait_for_completion()
+
+    chunk_results: Dict[int, List[Any]] = {}
+    answered_batches = set()
+    for custom_id, response_body, error in runner.iter_results():
+        batch_index = int(custom_id.rsplit("-", 1)[1])
+        if batch_index >= len(batches):
+            continue
+        batch = batches[batch_index]
+        results = (response_body or {}).get("results") or []
+        if error is not None or len(results) != len(batch):
+            print(f"警告: バッチ {custom_id} が失敗しました: {error}")
+            continue
+        answered_batches.add(batch_index)
+        for (article_index, _), result in zip(batch, results):
+            chunk_results.setdefault(article_index, []).append(result)
+
+    failed_article_indexes = {
+        article_index
+        for batch_index, batch in enumerate(batches) if batch_index not in answered_batches
+        for article_index, _ in batch
+    }
+    runner.mark_merged()
+    return chunk_results, failed_article_indexes
+
+def analyze_articles_for_policy_violations(
+    input_file_path: str,
+    output_file_path: str,
+    use_batch_api: bool = False,
+    poll_interval_seconds: float = DEFAULT_BATCH_POLL_INTERVAL_SECONDS,
+    article_filters: Dict[str, Any] = None
+):
     """
     入力ファイルの記事を読み込み、Moderation APIでポリシー違反の可能性をチェックし、
     問題のありそうな記事を結果ファイルに出力する。
+    記事はまとめてバッチで送信し、複数のバッチを並行して処理する。
+    use_batch_api が指定された場合は、同じバッチを Batch API でまとめて投入する。
+    article_filters (CorpusStore.iter_entries の article_ids, category, date_from, date_to) を指定した場合は、
+    索引で該当する記事だけを読み込んでチェックする。
     """
     if not settings.OPENAI_API_KEY:
         print("エラー: OpenAI APIキーが settings.py に設定されていません。")
         return
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    # openai の読み込みには時間がかかるため、APIを呼び出す直前にインポートする
+    from src.core.client_factory import get_openai_client
+    client = get_openai_client() # プロセス共有のクライアント (リトライはレートリミッターが行う)
     problematic_articles: List[Dict[str, Any]] = []
-    processed_count = 0
-    api_error_count = 0
+    articles: List[Dict[str, Any]] = []
 
     print(f"入力ファイル: {input_file_path}")
     print(f"出力ファイル: {output_file_path}")
 
     try:
-        with open(input_file_path, 'r', encoding='utf-8') as infile:
-            for line_number, line in enumerate(infile, 1):
+        with CorpusStore(input_file_path) as corpus:
+            for line_number, article_data in corpus.iter_articles(include_invalid=True, **(article_filters or {})):
                 try:
-                    article_data = json.loads(line.strip())
+                    if article_data is None:
+                        print(f"警告: 行 {line_number} のJSONデコードエラー。スキップします。")
+                        continue
                     article_id = article_data.get("id", f"line_{line_number}")
-                    article_title = article_data.get("title", "タイトル不明")
                     article_text = article_data.get("text")
 
                     if not article_text:
                         print(f"警告: ID {article_id} の記事にtextフィールドがありません。スキップします。")
                         continue
 
-                    print(f"処理中: ID {article_id} - {article_title[:30]}...")
-                    moderation_result = check_text_with_moderation_api(client, article_text)
-                    processed_count += 1
-
-                    # --- ここから追加 ---
-                    # API呼び出し後に短いウェイトを入れる (例: 0.5秒)
-                    # レート制限エラーメッセージに "Please try again in X ms" とあるので、
-                    # それを参考に調整する。
-                    # text-moderation-007 の Rate limits (Free tier) は 150,000 TPM なので、
-                    # 1記事あたりの平均トークン数にもよるが、少し余裕を持たせる。
-                    time.sleep(0.5) # 0.5秒待機 (この値は調整が必要な場合があります)
-                    # --- ここまで追加 ---
-
-                    if moderation_result:
-                        # 特に sexual と sexual/minors カテゴリをチェック
-                        flagged_sexual = moderation_result.categories.sexual
-                        score_sexual = moderation_result.category_scores.sexual
-                        flagged_sexual_minors = moderation_result.categories.sexual_minors
-                        score_sexual_minors = moderation_result.category_scores.sexual_minors
-
-                        # いずれかのフラグがTrue、またはスコアが一定以上の場合に記録 (閾値は調整可能)
-                        # OpenAIのドキュメントでは、フラグがTrueのものを主に確認することを推奨
-                        if flagged_sexual or flagged_sexual_minors:
-                            problematic_articles.append({
-                                "id": article_id,
-                                "title": article_title,
-                                "flagged_sexual": flagged_sexual,
-                                "score_sexual": float(f"{score_sexual:.4f}"), # 小数点以下4桁に丸める
-                                "flagged_sexual_minors": flagged_sexual_minors,
-                                "score_sexual_minors": float(f"{score_sexual_minors:.4f}"),
-                                "all_categories": {cat: flagged for cat, flagged in moderation_result.categories.__dict__.items()},
-                                "all_scores": {cat: float(f"{score:.4f}") for cat, score in moderation_result.category_scores.__dict__.items()}
-                            })
-                            print(f"  -> 警告: ID {article_id} にポリシー違反の可能性あり (sexual: {flagged_sexual}, sexual/minors: {flagged_sexual_minors})")
-                    else:
-                        api_error_count +=1
-
-                except json.JSONDecodeError:
-                    print(f"警告: 行 {line_number} のJSONデコードエラー。スキップします: {line.strip()[:100]}...")
+                    articles.append({
+                        "id": article_id,
+                        "title": article_data.get("title", "タイトル不明"),
+                        "text": article_text,
+                    })
                 except Exception as e:
                     print(f"警告: 行 {line_number} の処理中に予期せぬエラー: {e}")
-    
+
+        batches = build_moderation_batches(articles)
+        print(f"{len(articles)}件の記事を {len(batches)}件のリクエストにまとめて送信します。")
+
+        if use_batch_api:
+            chunk_results, failed_article_indexes = moderate_batches_with_batch_api(
+                client, batches, os.path.join(os.path.dirname(output_file_path) or ".", "moderation_batch_state.json"),
+                input_signature=file_signature(input_file_path, article_filters), poll_interval_seconds=poll_interval_seconds
+            )
+        else:
+            chunk_results, failed_article_indexes = moderate_batches_concurrently(client, batches)
+
+        for article_index, article in enumerate(articles):
+            if article_index in failed_article_indexes or article_index not in chunk_results:
+                continue
+            merged = merge_moderation_results(chunk_results[article_index])
+            # 特に sexual と sexual/minors カテゴリをチェック
+            flagged_sexual = merged["categories"].get("sexual", False)
+            score_sexual = merged["scores"].get("sexual", 0.0)
+            flagged_sexual_minors = merged["categories"].get("sexual_minors", False)
+            score_sexual_minors = merged["scores"].get("sexual_minors", 0.0)
+
+            # いずれかのフラグがTrueの場合に記録
+            # OpenAIのドキュメントでは、フラグがTrueのものを主に確認することを推奨
+            if flagged_sexual or flagged_sexual_minors:
+                problematic_articles.append({
+                    "id": article["id"],
+                    "title": article["title"],
+                    "flagged_sexual": flagged_sexual,
+                    "score_sexual": float(f"{score_sexual:.4f}"), # 小数点以下4桁に丸める
+                    "flagged_sexual_minors": flagged_sexual_minors,
+                    "score_sexual_minors": float(f"{score_sexual_minors:.4f}"),
+                    "all_categories": merged["categories"],
+                    "all_scores": {cat: float(f"{score:.4f}") for cat, score in merged["scores"].items()}
+                })
+                print(f"  -> 警告: ID {article['id']} にポリシー違反の可能性あり (sexual: {flagged_sexual}, sexual/minors: {flagged_sexual_minors})")
+
+        processed_count = len(articles) - len(failed_article_indexes)
+        api_error_count = len(failed_article_indexes)
+
         # 結果をJSONファイルに出力
         output_dir = os.path.dirname(output_file_path)
         if output_dir and not os.path.exists(output_dir):
@@ -108,6 +308,7 @@ def analyze_articles_for_policy_violations(input_file_path: str, output_file_pat
 
         print(f"\n処理完了。")
         print(f"処理済み記事数: {processed_count}")
+        print(f"APIリクエスト数: {len(batches)}")
         print(f"APIエラー発生記事数: {api_error_count}")
         print(f"ポリシー違反の可能性のある記事数: {len(problematic_articles)}")
         print(f"詳細は {output_file_path} を確認してください。")
@@ -118,12 +319,26 @@ def analyze_articles_for_policy_violations(input_file_path: str, output_file_pat
         print(f"エラー: ファイル処理中に予期せぬエラーが発生しました: {e}")
 
 
-if __name__ == "__main__":
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    
-    input_jsonl = os.path.join(project_root, "output.jsonl")
+def run_cli(argv: list = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈してコンテンツポリシーのチェックを実行する (python -m src moderate)。
+
+    Args:
+        argv (list, optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="Moderation API で記事のコンテンツポリシー違反の可能性をチェックする。")
+    parser.add_argument("--batch", action="store_true",
+                        help="Batch API でまとめて処理する (完了まで最大24時間。中断しても再実行で再開できる)")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_BATCH_POLL_INTERVAL_SECONDS,
+                        help="--batch 指定時にジョブの状態を確認する初期間隔 (秒)")
+    add_article_filter_arguments(parser, "チェックする")
+    args = parser.parse_args(argv)
+    article_filters = article_filters_from_args(args)
+
+    input_jsonl = settings.CORPUS_PATH
     # 結果出力ファイル (プロジェクトルート/data/moderation_results/problematic_articles.json)
-    output_json = os.path.join(project_root, "data", "moderation_results", "problematic_articles.json")
+    output_json = os.path.join(settings.DATA_DIR, "moderation_results", "problematic_articles.json")
 
     print("OpenAI Moderation API を使用してコンテンツポリシーチェックを開始します。")
     print("注意: この処理にはOpenAI APIの利用料が発生する可能性があります（少量ですが）。")
@@ -135,6 +350,11 @@ if __name__ == "__main__":
     #    print("処理を中止しました。")
     
     # 今回は自動実行
-    analyze_articles_for_policy_violations(input_jsonl, output_json)
+    analyze_articles_for_policy_violations(input_jsonl, output_json, use_batch_api=args.batch,
+                                           poll_interval_seconds=args.poll_interval, article_filters=article_filters)
     
-    print("\nスクリプトを終了します。")
\ No newline at end of file
+    print("\nスクリプトを終了します。")
+
+
+if __name__ == "__main__":
+    run_cli()
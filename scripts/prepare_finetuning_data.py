@@ -1,5 +1,79 @@
+import argparse
 import json
 import os
+import sys
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# --- sys.path の調整 ---
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
+# --- ここまで追加 ---
+
+from src.config import settings
+from src.core import profiling
+from src.core.profiling import span
+from src.core.token_budget import get_context_window, get_token_counter
+from src.utils.corpus_store import CorpusStore
+from src.utils.dataset_linter import (
+    DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+    NearDuplicateIndex,
+    content_fingerprint,
+    estimate_training_cost,
+    fit_record_to_token_limit,
+    minhash_signature,
+    normalize_for_dedup,
+    stratified_split,
+)
+
+# ファインチューニングのベースモデル (run_finetuning_job.py と揃える)
+FINETUNING_BASE_MODEL = "gpt-3.5-turbo-0125"
+DEFAULT_VALIDATION_RATIO = 0.1
+# OpenAI のファインチューニングで n_epochs を自動にした場合の、中規模データでの値
+DEFAULT_N_EPOCHS = 3
+DEFAULT_SPLIT_SEED = 42
+UNCATEGORIZED = "未分類"
+PROGRESS_INTERVAL_RECORDS = 10000
+DEFAULT_CHUNK_SIZE = 200
+
+FINETUNING_SYSTEM_PROMPT = "あなたは、筆者の個人的な視点と文体を強く反映した映画レビューを書くアシスタントです。"
+
+
+def build_finetuning_record(original_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    元のブログ記事1件をファインチューニング用のチャット形式のレコードに変換する。
+
+    Args:
+        original_data (dict): title と text を持つ元の記事データ。
+
+    Returns:
+        Optional[dict]: {"messages": [...]} 形式のレコード。title または text が不足している場合は None。
+    """
+    movie_title = original_data.get("title")
+    blog_text = original_data.get("text")
+    if not movie_title or not blog_text:
+        return None
+
+    # ファインチューニング用のメッセージリストを作成
+    messages = [
+        {
+            "role": "system",
+            "content": FINETUNING_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            # プロンプトは目的に応じて調整可能
+            "content": f"映画「{movie_title}」についてのブログ記事を、私のスタイルで執筆してください。"
+        },
+        {
+            "role": "assistant",
+            "content": blog_text.strip() # 前後の空白を除去
+        }
+    ]
+    return {"messages": messages}
+
 
 def convert_to_finetuning_format(input_file_path: str, output_file_path: str):
     """
@@ -20,44 +94,25 @@ def convert_to_finetuning_format(input_file_path: str, output_file_path: str):
         print(f"作成されたディレクトリ: {output_dir}")
 
     try:
-        with open(input_file_path, 'r', encoding='utf-8') as infile, \
+        with CorpusStore(input_file_path) as corpus, \
              open(output_file_path, 'w', encoding='utf-8') as outfile:
 
-            for line in infile:
+            for line_number, original_data in corpus.iter_articles(include_invalid=True):
                 try:
-                    original_data = json.loads(line.strip())
-                    movie_title = original_data.get("title")
-                    blog_text = original_data.get("text")
-
-                    if not movie_title or not blog_text:
+                    if original_data is None:
+                        print(f"警告: JSONデコードエラーのため、行をスキップします: 行 {line_number}")
+                        skipped_count += 1
+                        continue
+                    record = build_finetuning_record(original_data)
+                    if record is None:
                         print(f"警告: titleまたはtextが不足しているため、エントリをスキップします: {original_data.get('id', 'ID不明')}")
                         skipped_count += 1
                         continue
 
-                    # ファインチューニング用のメッセージリストを作成
-                    messages = [
-                        {
-                            "role": "system",
-                            "content": "あなたは、筆者の個人的な視点と文体を強く反映した映画レビューを書くアシスタントです。"
-                        },
-                        {
-                            "role": "user",
-                            # プロンプトは目的に応じて調整可能
-                            "content": f"映画「{movie_title}」についてのブログ記事を、私のスタイルで執筆してください。"
-                        },
-                        {
-                            "role": "assistant",
-                            "content": blog_text.strip() # 前後の空白を除去
-                        }
-                    ]
-
                     # JSON Lines形式で出力ファイルに書き込む
-                    outfile.write(json.dumps({"messages": messages}, ensure_ascii=False) + "\n")
+                    outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
                     processed_count += 1
 
-                except json.JSONDecodeError:
-                    print(f"警告: JSONデコードエラーのため、行をスキップします: {line.strip()[:100]}...")
-                    skipped_count += 1
                 except Exception as e:
                     print(f"警告: 予期せぬエラーのため、エントリ処理中にエラーが発生しました: {e}")
                     skipped_count += 1
@@ -73,18 +128,393 @@ def convert_to_finetuning_format(input_file_path: str, output_file_path: str):
         print(f"エラー: ファイル処理中に予期せぬエラーが発生しました: {e}")
 
 
-if __name__ == "__main__":
-    # プロジェクトルートを基準にパスを設定
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    
+def _article_category(original_data: Dict[str, Any]) -> str:
+    category = original_data.get("category")
+    if isinstance(category, list):
+        category = category[0] if category else None
+    return str(category).strip() if category else UNCATEGORIZED
+
+
+def _iter_line_chunks(corpus: CorpusStore, chunk_size: int) -> Iterator[List[Tuple[int, str]]]:
+    """
+    入力ファイルの空でない行を (行番号, 行) のリストにまとめて chunk_size 行ずつ返す。
+    """
+    chunk = []
+    for line_number, line in corpus.iter_lines():
+        chunk.append((line_number, line))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _analyze_articles_chunk(
+    lines: List[Tuple[int, str]],
+    model: str,
+    token_limit: int,
+    truncate_long_examples: bool,
+    compute_signature: bool
+) -> List[Dict[str, Any]]:
+    """
+    記事ごとの検査 (レコードの作成、トークン数、重複判定用のフィンガープリントと MinHash 署名) を行う。
+    記事間の比較を含まないため、並列モードではワーカープロセスで実行する。
+    """
+    counter = get_token_counter(model)
+    results = []
+    for line_number, line in lines:
+        try:
+            original_data = json.loads(line)
+        except json.JSONDecodeError:
+            original_data = None
+        if not isinstance(original_data, dict):
+            results.append({"line": line_number, "id": f"line {line_number}", "status": "invalid"})
+            continue
+        result = {"line": line_number, "id": original_data.get("id", f"line {line_number}")}
+        with span("prepare.build_record"):
+            record = build_finetuning_record(original_data)
+        if record is None:
+            result["status"] = "invalid"
+            results.append(result)
+            continue
+
+        with span("prepare.count_tokens"):
+            token_count = counter.count_messages(record["messages"])
+        result["truncated"] = False
+        if token_count > token_limit:
+            with span("prepare.truncate"):
+                fitted = fit_record_to_token_limit(record, counter, token_limit) if truncate_long_examples else None
+            if fitted is None:
+                result.update(status="too_long", tokens=token_count)
+                results.append(result)
+                continue
+            record = fitted
+            token_count = counter.count_messages(record["messages"])
+            result["truncated"] = True
+
+        with span("prepare.fingerprint"):
+            normalized = normalize_for_dedup(record["messages"][-1]["content"])
+            result.update(
+                status="ok",
+                tokens=token_count,
+                category=_article_category(original_data),
+                fingerprint=content_fingerprint(normalized),
+                signature=minhash_signature(normalized) if compute_signature else None,
+            )
+        results.append(result)
+    return results
+
+
+def _analyze_articles_chunk_in_worker(lines: List[Tuple[int, str]], **analyze_kwargs):
+    """
+    ワーカープロセス用の _analyze_articles_chunk。--profile の計測値を結果に添えて親プロセスへ返す。
+    """
+    return _analyze_articles_chunk(lines, **analyze_kwargs), profiling.drain_stats()
+
+
+def _iter_analyzed_articles(
+    corpus: CorpusStore,
+    workers: int,
+    chunk_size: int,
+    **analyze_kwargs
+) -> Iterator[Dict[str, Any]]:
+    """
+    _analyze_articles_chunk の結果を入力順に返す。workers が2以上の場合はワーカープロセスで並列に実行し、
+    処理待ちのチャンクを workers * 2 個までに制限してメモリ使用量を一定に保つ。
+    """
+    chunks = profiling.iter_with_span(_iter_line_chunks(corpus, chunk_size), "prepare.read")
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _analyze_articles_chunk(chunk, **analyze_kwargs)
+        return
+
+    def _oldest_results():
+        with span("prepare.wait_workers"):
+            results, stats = pending.popleft().result()
+        profiling.merge_stats(stats)
+        return results
+
+    # multiprocessing の読み込みには時間がかかるため、ワーカープロセスを使う場合のみインポートする
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=profiling.worker_initializer,
+                             initargs=(profiling.is_enabled(),)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            if len(pending) >= workers * 2:
+                yield from _oldest_results()
+            pending.append(executor.submit(_analyze_articles_chunk_in_worker, chunk, **analyze_kwargs))
+        while pending:
+            yield from _oldest_results()
+
+
+def _token_stats(token_counts) -> Dict[str, Any]:
+    if not token_counts:
+        return {"min": 0, "mean": 0, "p50": 0, "p95": 0, "max": 0}
+    ordered = sorted(token_counts)
+
+    def _at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "min": ordered[0],
+        "mean": round(sum(ordered) / len(ordered), 1),
+        "p50": _at(0.50),
+        "p95": _at(0.95),
+        "max": ordered[-1],
+    }
+
+
+def lint_and_split_finetuning_data(
+    input_file_path: str,
+    train_output_path: str,
+    validation_output_path: str,
+    report_path: str = None,
+    model: str = FINETUNING_BASE_MODEL,
+    max_tokens_per_example: int = None,
+    truncate_long_examples: bool = True,
+    near_duplicate_threshold: float = DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+    validation_ratio: float = DEFAULT_VALIDATION_RATIO,
+    n_epochs: int = DEFAULT_N_EPOCHS,
+    seed: int = DEFAULT_SPLIT_SEED,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Optional[Dict[str, Any]]:
+    """
+    元のブログ記事データを検査しながらファインチューニング用のデータに変換し、学習用と検証用に分割する。
+
+    1. 記事ごとにチャット形式のレコードを作り、トークン数を数える。上限を超えるものは本文を切り詰める (または除外する)
+    2. 本文の完全一致 (正規化後) と、MinHash による類似記事 (推定 Jaccard 類似度が閾値以上) を除外する
+    3. category ごとの比率を保って学習用と検証用に分ける
+    4. 1エポックあたりのトークン数と学習費用の目安を集計する
+
+    入力は2回読み込む (1回目で採否と分割を決め、2回目で書き出す)。メモリに保持するのは
+    採用した記事の行番号・カテゴリー・トークン数と MinHash 署名だけなので、大きなエクスポートでも扱える。
+    2回目は入力の索引 (CorpusStore) から採用した記事の行だけを読み込む。
+    記事ごとの検査は workers を指定するとワーカープロセスで並列に実行する (重複の判定は入力順に行う)。
+
+    Args:
+        input_file_path (str): 元のデータファイル (JSON Lines) のパス。
+        train_output_path (str): 学習用データの出力先。
+        validation_output_path (str): 検証用データの出力先。
+        report_path (str, optional): 検査結果 (JSON) の出力先。
+        model (str): ファインチューニングのベースモデル (トークン数の上限と単価の判定に使う)。
+        max_tokens_per_example (int, optional): 1件あたりのトークン数の上限。Noneの場合はモデルのコンテキストウィンドウ。
+        truncate_long_examples (bool): 上限を超える記事を切り詰めるか (False の場合は除外する)。
+        near_duplicate_threshold (float): 類似記事とみなす推定 Jaccard 類似度。1より大きい値で類似判定を無効にする。
+        validation_ratio (float): 検証用に回す割合。
+        n_epochs (int): 費用の見積もりに使うエポック数。
+        seed (int): 分割の乱数シード。
+        workers (int): 記事ごとの検査を行うワーカープロセス数。1の場合は逐次処理。
+        chunk_size (int): 並列モードで1タスクあたりに検査する記事数。
+
+    Returns:
+        Optional[dict]: 検査結果。入力ファイルが見つからない場合は None。
+    """
+    if not os.path.exists(input_file_path):
+        print(f"エラー: 入力ファイルが見つかりません: {input_file_path}")
+        return None
+
+    counter = get_token_counter(model)
+    token_limit = max_tokens_per_example or get_context_window(model)
+    fingerprints: Dict[str, Any] = {}
+    near_duplicates = NearDuplicateIndex(near_duplicate_threshold)
+    # 採用した記事の行番号 -> (カテゴリー, トークン数)
+    accepted: Dict[int, Tuple[str, int]] = {}
+    accepted_ids: Dict[int, Any] = {}
+    dropped = []
+    truncated_count = 0
+    total_count = 0
+    start_time = time.perf_counter()
+
+    corpus = CorpusStore(input_file_path)
+    # --- 1回目: 採否の判定 ---
+    analyzed_articles = _iter_analyzed_articles(
+        corpus,
+        workers,
+        chunk_size,
+        model=model,
+        token_limit=token_limit,
+        truncate_long_examples=truncate_long_examples,
+        compute_signature=near_duplicate_threshold <= 1.0
+    )
+    for result in analyzed_articles:
+        total_count += 1
+        if total_count % PROGRESS_INTERVAL_RECORDS == 0:
+            print(f"検査中: {total_count}件 ({time.perf_counter() - start_time:.1f}秒)")
+        article_id = result["id"]
+        if result["status"] == "invalid":
+            dropped.append({"id": article_id, "reason": "invalid"})
+            continue
+        if result["status"] == "too_long":
+            dropped.append({"id": article_id, "reason": "too_long", "tokens": result["tokens"]})
+            continue
+
+        fingerprint = result["fingerprint"]
+        if fingerprint in fingerprints:
+            dropped.append({"id": article_id, "reason": "exact_duplicate", "duplicate_of": fingerprints[fingerprint]})
+            continue
+        fingerprints[fingerprint] = article_id
+
+        signature = result["signature"]
+        if signature is not None:
+            with span("prepare.near_duplicate"):
+                duplicate = near_duplicates.find_duplicate(signature)
+            if duplicate is not None:
+                duplicate_line, similarity = duplicate
+                dropped.append({"id": article_id, "reason": "near_duplicate",
+                                "duplicate_of": accepted_ids[duplicate_line],
+                                "similarity": round(similarity, 3)})
+                continue
+            near_duplicates.add(result["line"], signature)
+        truncated_count += result["truncated"]
+        accepted_ids[result["line"]] = article_id
+        accepted[result["line"]] = (result["category"], result["tokens"])
+
+    with span("prepare.split"):
+        train_lines, validation_lines = stratified_split(
+            {line_number: category for line_number, (category, _) in accepted.items()}, validation_ratio, seed
+        )
+    validation_set = set(validation_lines)
+
+    # --- 2回目: 書き出し ---
+    for output_path in (train_output_path, validation_output_path):
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+    with span("prepare.write"), \
+         open(train_output_path, 'w', encoding='utf-8') as train_file, \
+         open(validation_output_path, 'w', encoding='utf-8') as validation_file:
+        for entry in corpus.iter_entries():
+            line_number = entry["line_number"]
+            if line_number not in accepted:
+                continue
+            record = fit_record_to_token_limit(build_finetuning_record(corpus.read(entry)), counter, token_limit)
+            outfile = validation_file if line_number in validation_set else train_file
+            outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
+    corpus.close()
+
+    train_tokens = sum(accepted[line_number][1] for line_number in train_lines)
+    validation_tokens = sum(accepted[line_number][1] for line_number in validation_lines)
+    categories: Dict[str, Dict[str, int]] = {}
+    for line_number, (category, _) in accepted.items():
+        split = "validation" if line_number in validation_set else "train"
+        categories.setdefault(category, {"train": 0, "validation": 0})[split] += 1
+
+    reasons = [entry["reason"] for entry in dropped]
+    report = {
+        "model": model,
+        "token_limit": token_limit,
+        "exact_token_count": counter.is_exact,
+        "total": total_count,
+        "kept": len(accepted),
+        "train": len(train_lines),
+        "validation": len(validation_lines),
+        "truncated": truncated_count,
+        "dropped": {reason: reasons.count(reason) for reason in
+                    ("invalid", "too_long", "exact_duplicate", "near_duplicate")},
+        "tokens_per_example": _token_stats([tokens for _, tokens in accepted.values()]),
+        "validation_tokens": validation_tokens,
+        "cost": estimate_training_cost(train_tokens, model, n_epochs),
+        "categories": categories,
+        "elapsed_seconds": round(time.perf_counter() - start_time, 2),
+        "dropped_examples": dropped,
+    }
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def print_lint_report(report: Dict[str, Any]) -> None:
+    dropped = report["dropped"]
+    stats = report["tokens_per_example"]
+    cost = report["cost"]
+    print(f"\nデータの検査が完了しました。({report['elapsed_seconds']}秒)")
+    print(f"入力: {report['total']}件 / 採用: {report['kept']}件 "
+          f"(学習用 {report['train']}件, 検証用 {report['validation']}件)")
+    print(f"除外: 不正 {dropped['invalid']}件, 上限超過 {dropped['too_long']}件, "
+          f"完全重複 {dropped['exact_duplicate']}件, 類似記事 {dropped['near_duplicate']}件")
+    print(f"切り詰め: {report['truncated']}件 (上限 {report['token_limit']} トークン)")
+    print(f"1件あたりのトークン数{'' if report['exact_token_count'] else ' (概算)'}: "
+          f"最小 {stats['min']} / 平均 {stats['mean']} / p50 {stats['p50']} / p95 {stats['p95']} / 最大 {stats['max']}")
+    print(f"1エポックあたりの学習トークン数: {cost['tokens_per_epoch']} (検証用: {report['validation_tokens']})")
+    if cost["estimated_cost_usd"] is not None:
+        print(f"費用の目安: {cost['n_epochs']}エポック x {cost['tokens_per_epoch']} トークン = "
+              f"{cost['billed_tokens']} トークン -> 約 ${cost['estimated_cost_usd']:.2f} "
+              f"(${cost['price_per_million_tokens']} / 100万トークン)")
+    else:
+        print(f"費用の目安: {report['model']} の単価が不明なため算出できません。")
+    for category, counts in sorted(report["categories"].items()):
+        print(f"  {category}: 学習用 {counts['train']}件 / 検証用 {counts['validation']}件")
+
+
+def run_cli(argv: list = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈してファインチューニング用データの作成を実行する (python -m src prepare)。
+
+    Args:
+        argv (list, optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
+    finetuning_data_dir = os.path.join(settings.DATA_DIR, "finetuning_data")
+
+    parser = argparse.ArgumentParser(prog=prog, description="ブログ記事データをファインチューニング用のデータに変換する。")
     # 入力ファイル (プロジェクトルートにある output.jsonl)
-    input_jsonl = os.path.join(project_root, "output.jsonl")
-    
+    parser.add_argument("--input", default=settings.CORPUS_PATH, help="元の記事データ (JSON Lines)")
     # 出力ファイル (プロジェクトルート/data/finetuning_data/training_corpus.jsonl)
     # Spec.md で定義したパスに合わせる
-    output_finetuning_jsonl = os.path.join(project_root, "data", "finetuning_data", "training_corpus.jsonl")
+    parser.add_argument("--output", default=os.path.join(finetuning_data_dir, "training_corpus.jsonl"),
+                        help="学習用データの出力先")
+    parser.add_argument("--validation-output", default=os.path.join(finetuning_data_dir, "validation_corpus.jsonl"),
+                        help="検証用データの出力先")
+    parser.add_argument("--report", default=os.path.join(finetuning_data_dir, "lint_report.json"),
+                        help="検査結果 (JSON) の出力先")
+    parser.add_argument("--no-lint", action="store_true",
+                        help="検査・重複除去・分割を行わず、全記事をそのまま変換する (従来の動作)")
+    parser.add_argument("--model", default=FINETUNING_BASE_MODEL, help="ファインチューニングのベースモデル")
+    parser.add_argument("--max-tokens", type=int, help="1件あたりのトークン数の上限 (省略時はモデルのコンテキストウィンドウ)")
+    parser.add_argument("--drop-long", action="store_true", help="上限を超える記事を切り詰めずに除外する")
+    parser.add_argument("--near-duplicate-threshold", type=float, default=DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+                        help="類似記事とみなす推定 Jaccard 類似度 (1より大きい値で無効)")
+    parser.add_argument("--validation-ratio", type=float, default=DEFAULT_VALIDATION_RATIO, help="検証用に回す割合")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_N_EPOCHS, help="費用の見積もりに使うエポック数")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SPLIT_SEED, help="分割の乱数シード")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="記事ごとの検査を行うワーカープロセス数 (0でCPUコア数)")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    with profiling.profiling_session(args, "prepare"):
+        _run(args)
+
 
-    print(f"入力ファイル: {input_jsonl}")
-    print(f"出力ファイル: {output_finetuning_jsonl}")
+def _run(args) -> None:
+    """解析済みの引数でファインチューニング用データの作成を実行する。"""
 
-    convert_to_finetuning_format(input_jsonl, output_finetuning_jsonl)
+    print(f"入力ファイル: {args.input}")
+    print(f"出力ファイル: {args.output}")
+
+    if args.no_lint:
+        convert_to_finetuning_format(args.input, args.output)
+    else:
+        lint_report = lint_and_split_finetuning_data(
+            args.input,
+            args.output,
+            args.validation_output,
+            report_path=args.report,
+            model=args.model,
+            max_tokens_per_example=args.max_tokens,
+            truncate_long_examples=not args.drop_long,
+            near_duplicate_threshold=args.near_duplicate_threshold,
+            validation_ratio=args.validation_ratio,
+            n_epochs=args.epochs,
+            seed=args.seed,
+            workers=args.workers or os.cpu_count() or 1
+        )
+        if lint_report:
+            print_lint_report(lint_report)
+            print(f"検証用データ: {args.validation_output}")
+            print(f"検査結果: {args.report}")
+
+
+if __name__ == "__main__":
+    run_cli()
@@ -1,8 +1,31 @@
+import argparse
 import json
 import os
 import re
-from openai import OpenAI
-from tqdm import tqdm # 進捗表示用
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import TYPE_CHECKING
+
+# --- sys.path の調整 ---
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
+# --- ここまで追加 ---
+
+from src.config import settings
+from src.core.response_cache import ResponseCache
+from src.utils.section_filter import strip_unwanted_sections
+from src.core.rate_limiter import get_shared_rate_limiter, estimate_request_tokens
+from src.core.token_budget import get_token_counter, plan_request
+from src.core.batch_runner import BatchRunner, file_signature
+from src.core.instrumentation import CallRecorder
+from src.core import profiling
+from src.core.profiling import span
+from src.utils.corpus_store import CorpusStore, add_article_filter_arguments, article_filters_from_args
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 # APIキーとモデル設定
 # 実際のプロジェクトでは src.config.settings から読み込むことを推奨します。
@@ -13,45 +36,29 @@ from tqdm import tqdm # 進捗表示用
 # OPENAI_API_KEY = settings.OPENAI_API_KEY
 # DEFAULT_MODEL_NAME = settings.DEFAULT_MODEL_NAME
 
+# APIキー・接続先・応答キャッシュの有効化は、.env も反映されるよう main で settings から読み込む
+
 # このスクリプト単体で実行するための仮設定 (環境変数から読み込み)
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 DEFAULT_MODEL_NAME = os.environ.get("DEFAULT_MODEL_NAME", "gpt-3.5-turbo") # gpt-4oなども指定可能
+# AI処理を並行して実行するワーカー数 (--workers で上書き可能)
+DEFAULT_MAX_WORKERS = int(os.environ.get("REFINE_MAX_WORKERS", "4"))
+# 再編後の記事の最大トークン数 (コンテキストウィンドウに収まらない場合は自動で減らす)
+REFINE_MAX_TOKENS = 5000
+# --batch 指定時に Batch API のジョブの状態を確認する初期間隔 (秒)
+DEFAULT_BATCH_POLL_INTERVAL_SECONDS = 30.0
 
 def clean_text_python_pre_ai(text_content: str, title_for_prompt: str) -> str:
     """
     AI処理前にPythonで実行する基本的なテキストクリーニング。
     - 特定の不要セクションの削除
     - @miyakawa2449 のスペース処理
+    処理は src.utils.section_filter の行単位フィルターで1回の走査にまとめて行う。
     """
-    # ルール2: @miyakawa2449 の表記の前後にある半角スペースを消す
-    text_content = re.sub(r"\s*@miyakawa2449\s*", "@miyakawa2449", text_content)
-
-    # ルール3の一部: 明確な不要セクションの削除 (正規表現ベース)
-    # 関連記事セクション (次の主要な見出し、または記事の終わりまで)
-    text_content = re.sub(r"^(関連記事|関連する記事|■関連記事)\s*\n(.|\n)*?(?=\n\n(?:#|\*{2,}.*\*{2,}|\w)|$)", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-    # 引用元
-    text_content = re.sub(r"^引用元:.*$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-    # 海外での Twitter の反応セクション
-    text_content = re.sub(r"^(海外での\s*Twitter\s*の反応|海外の反応)\s*\n(.|\n)*?(?=\n\n(?:#|\*{2,}.*\*{2,}|\w)|$)", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-    # Amazonリンクや商品紹介と思われる行
-    text_content = re.sub(r"^Amazon\s*\|.*$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-    text_content = re.sub(r"^.*(通販\s*\|\s*Amazon|Amazon\s*で見る)$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-    text_content = re.sub(r"^\s*<a href=.*amazon\.co\.jp.*<\/a>\s*$", "", text_content, flags=re.MULTILINE | re.IGNORECASE) # HTMLのAmazonリンク
-    # YouTubeリンクと思われる行
-    text_content = re.sub(r"^.*YouTube$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-    # 公式サイトへのリンク行
-    text_content = re.sub(r"^映画「.*?」公式サイト.*公開$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-    # 目次のようなリスト
-    text_content = re.sub(r"^(目次|この記事の目次)\s*\n(-|\*|\d\.).*\n((?:-|\*|\d\.).*\n)*", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
-
-
-    # 連続する空行を1行にまとめる
-    text_content = re.sub(r"\n\s*\n", "\n\n", text_content)
-    return text_content.strip()
-
-def refine_and_restructure_with_ai(client: OpenAI, title: str, text_content: str) -> str:
+    return strip_unwanted_sections(text_content)
+
+def build_refine_messages(title: str, text_content: str) -> list:
     """
-    OpenAI APIを使用して記事を編集し、6部構成に再編する。
+    記事の編集・6部構成への再編を依頼するメッセージリストを組み立てる。
     """
     system_message_content = f"""あなたはプロの映画ブログ編集者です。提供された映画レビューのテキストを以下の指示に従って編集し、指定された6部構成に再編してください。
 
@@ -85,100 +92,538 @@ def refine_and_restructure_with_ai(client: OpenAI, title: str, text_content: str
 
 編集・再構成された記事:
 """
+    return [
+        {"role": "system", "content": system_message_content},
+        {"role": "user", "content": user_message_content}
+    ]
+
+
+def prepare_refine_request(title: str, text_content: str) -> tuple:
+    """
+    記事の再編リクエストのメッセージと生成パラメータを組み立てる。
+
+    送信前にトークン数を見積もり、コンテキストウィンドウに収まるよう max_tokens を調整する。
+    記事が長すぎて再編後の記事を出力する枠が残らない場合は、本文を切り詰める。
+
+    Returns:
+        tuple: (messages, generation_params)
+    """
+    messages = build_refine_messages(title, text_content)
+    generation_params = {
+        "temperature": 0.3, # 指示への忠実性を高めるため低めに設定
+        "max_tokens": REFINE_MAX_TOKENS, # 出力長に余裕を持たせる
+    }
+
+    plan = plan_request(messages, DEFAULT_MODEL_NAME, REFINE_MAX_TOKENS)
+    if plan["clamped"]:
+        counter = get_token_counter(DEFAULT_MODEL_NAME)
+        if plan["max_tokens"] < min(counter.count_text(text_content), REFINE_MAX_TOKENS):
+            # 再編後の記事は元の本文と同程度の長さになるため、残りの枠を本文と出力で半分ずつ使う
+            available_tokens = plan_request(build_refine_messages(title, ""), DEFAULT_MODEL_NAME)["max_tokens"]
+            truncated_text = counter.truncate_text(text_content, available_tokens // 2)
+            print(f"警告: 記事「{title}」が長すぎるため、本文を {len(text_content)} 文字から {len(truncated_text)} 文字に切り詰めて処理します。")
+            messages = build_refine_messages(title, truncated_text)
+            plan = plan_request(messages, DEFAULT_MODEL_NAME, REFINE_MAX_TOKENS)
+        generation_params["max_tokens"] = plan["max_tokens"]
+    return messages, generation_params
+
+
+def refine_and_restructure_with_ai(client: "OpenAI", title: str, text_content: str, response_cache: ResponseCache = None) -> str:
+    """
+    OpenAI APIを使用して記事を編集し、6部構成に再編する。
+    response_cache が指定された場合、同一入力の結果はキャッシュから返す。
+    """
+    with span("refine.build_request"):
+        messages, generation_params = prepare_refine_request(title, text_content)
+    # 呼び出しごとのトークン数・所要時間などを計測イベントとして記録する (LLM_EVENTS_ENABLED=1 で JSONL に出力)
+    call = CallRecorder(DEFAULT_MODEL_NAME)
+
+    if response_cache:
+        with span("refine.cache_lookup"):
+            cached_text = response_cache.get(DEFAULT_MODEL_NAME, messages, generation_params)
+        if cached_text is not None:
+            call.finish(cache_hit=True)
+            return cached_text
+
     try:
-        completion = client.chat.completions.create(
-            model=DEFAULT_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_message_content},
-                {"role": "user", "content": user_message_content}
-            ],
-            temperature=0.3, # 指示への忠実性を高めるため低めに設定
-            max_tokens=5000, # 出力長に余裕を持たせる
-        )
-        return completion.choices[0].message.content.strip()
+        # 共有レートリミッター経由で呼び出し、429 は Retry-After に従って再試行する
+        # (api_wait にはレート制限による待ち時間も含まれる)
+        with span("refine.api_wait"):
+            completion = get_shared_rate_limiter("chat").call(
+                call.wrap(client.chat.completions.create),
+                estimated_tokens=estimate_request_tokens(messages, generation_params["max_tokens"], DEFAULT_MODEL_NAME),
+                model=DEFAULT_MODEL_NAME,
+                messages=messages,
+                **generation_params
+            )
+        call.finish(response=completion)
+        refined_text = completion.choices[0].message.content.strip()
+        if response_cache:
+            response_cache.put(DEFAULT_MODEL_NAME, messages, generation_params, refined_text)
+        return refined_text
     except Exception as e:
+        call.finish(error=e)
         print(f"Error during OpenAI API call for title '{title}': {e}")
         return f"エラー: AIによる処理に失敗しました。詳細: {e}\n\n元のテキスト:\n{text_content}"
 
 
-def main():
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    input_file_path = os.path.join(project_root, "output.jsonl")
-    output_dir = os.path.join(project_root, "data", "finetuning_data")
+def preprocess_article(article_data: dict) -> dict:
+    """
+    AIに渡す前の前処理 (タイトルの整形と不要セクションの除去) を行う。
+
+    Returns:
+        dict: 出力レコードの元になる項目 (id, title, category, post_date) と、
+              AIへの入力 (title_for_prompt, text)。
+    """
+    # ルール1: title から「映画」という文字を取り除く
+    # 「」や【】なども除去してAIに渡しやすくする
+    processed_title = article_data.get("title", "").replace("映画", "").strip()
+    title_for_prompt = re.sub(r"[「」【】]", "", processed_title)
+
+    return {
+        "id": article_data.get("id"),
+        "title": processed_title,
+        "title_for_prompt": title_for_prompt,
+        # Pythonによる前処理 (ルール2とルール3の一部)
+        "text": clean_text_python_pre_ai(article_data.get("text", ""), title_for_prompt),
+        "category": article_data.get("category"),
+        "post_date": article_data.get("post_date"),
+    }
+
+def unprocessed_article_fields(article_data: dict) -> dict:
+    """
+    前処理に失敗した場合に失敗レコードの作成に使う、元の記事の項目。
+    """
+    return {
+        "id": article_data.get("id"),
+        "title": article_data.get("title", ""),
+        "text": article_data.get("text", ""),
+        "category": article_data.get("category"),
+        "post_date": article_data.get("post_date"),
+    }
+
+def build_output_record(preprocessed: dict, refined_text: str, error: str = None) -> dict:
+    """
+    前処理の結果とAIによる再構成の結果から出力レコードを作る。
+    error が指定された場合は、前処理済みのテキストを保持した失敗レコードを返す (再実行時に再処理される)。
+    """
+    record = {
+        "id": preprocessed["id"],
+        "title": preprocessed["title"],
+        "text": refined_text, # AIによって再構成されたテキスト
+        "category": preprocessed["category"],
+        "post_date": preprocessed["post_date"]
+    }
+    if error is not None:
+        record["text"] = f"エラー発生。元のテキスト:\n{preprocessed['text']}" # Pythonで処理済みのテキスト
+        record["error"] = error
+    return record
+
+def process_article(client: "OpenAI", article_data: dict, response_cache: ResponseCache = None) -> dict:
+    """
+    1記事分の前処理とAIによる再構成を行い、出力用のレコードを返す。
+    処理中に例外が発生した場合は "error" キーを含むレコードを返す。
+    """
+    preprocessed = unprocessed_article_fields(article_data)
+    try:
+        with span("refine.preprocess"):
+            preprocessed = preprocess_article(article_data)
+
+        # AIによる編集と再構成 (ルール3の残り、ルール4、ルール5)
+        refined_text_ai = refine_and_restructure_with_ai(
+            client, preprocessed["title_for_prompt"], preprocessed["text"], response_cache
+        )
+        return build_output_record(preprocessed, refined_text_ai)
+
+    except Exception as e:
+        from tqdm import tqdm # 進捗表示を崩さずに出力する
+        tqdm.write(f"警告: 記事ID {preprocessed['id']} の処理中に予期せぬエラーが発生しました: {e}")
+        # エラーが発生した場合でも、元の情報を保持して返す（再実行時に再処理される）
+        return build_output_record(preprocessed, "", error=str(e))
+
+def is_failed_record(record: dict) -> bool:
+    """
+    AI処理に失敗したレコードかどうかを判定する。
+    """
+    return "error" in record or str(record.get("text", "")).startswith("エラー")
+
+def article_key(article_data: dict, line_number: int) -> str:
+    """
+    チェックポイントで記事を識別するキー。id がない場合は入力ファイルの行番号を使う。
+    """
+    article_id = article_data.get("id")
+    return str(article_id) if article_id is not None else f"line_{line_number}"
+
+def read_article_by_key(corpus: CorpusStore, key: str):
+    """
+    article_key で作ったキーから記事データを読み込む。同じキーの記事が複数ある場合は最後の行のもの。
+    見つからない場合は None。
+    """
+    entries = list(corpus.iter_entries(article_ids=[key]))
+    if not entries and key.startswith("line_") and key[len("line_"):].isdigit():
+        entries = [entry for entry in corpus.iter_entries(line_numbers=[int(key[len("line_"):])])
+                   if entry["id"] is None]
+    return corpus.read(entries[-1]) if entries else None
+
+def load_checkpoint_index(checkpoint_path: str) -> dict:
+    """
+    チェックポイントファイルを走査し、キーごとに最新レコードのバイトオフセットと成否を返す。
+    レコード本体は保持しないため、入力が大きくてもメモリ使用量は記事数に比例する程度に収まる。
+
+    Returns:
+        dict: {キー: (バイトオフセット, 成功したかどうか)}
+    """
+    index = {}
+    if not os.path.exists(checkpoint_path):
+        return index
+
+    with open(checkpoint_path, 'rb') as f:
+        offset = 0
+        for raw_line in f:
+            line_offset = offset
+            offset += len(raw_line)
+            try:
+                entry = json.loads(raw_line)
+            except json.JSONDecodeError:
+                # 書き込み途中で中断された最終行は無視する (再処理対象になる)
+                continue
+            index[entry["key"]] = (line_offset, not is_failed_record(entry["record"]))
+    return index
+
+def append_checkpoint_record(checkpoint_file, key: str, record: dict) -> None:
+    """
+    処理結果を1行追記し、ディスクへ確実に書き出す。
+    """
+    checkpoint_file.write(json.dumps({"key": key, "record": record}, ensure_ascii=False) + "\n")
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
+
+def repair_checkpoint_tail(checkpoint_path: str) -> None:
+    """
+    書き込み途中で中断され、最終行が改行で終わっていない場合に改行を補う。
+    これにより、次に追記するレコードが壊れた行と連結されるのを防ぐ。
+    """
+    if not os.path.exists(checkpoint_path) or os.path.getsize(checkpoint_path) == 0:
+        return
+    with open(checkpoint_path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+def finalize_output(corpus: CorpusStore, checkpoint_path: str, output_file_path: str) -> int:
+    """
+    チェックポイントから各記事の最新レコードを入力と同じ順序で取り出し、最終出力ファイルを書き出す。
+    記事のキーは入力の索引から得るため、入力の本文は読み込まない。
+    一時ファイルに書いてから置き換えるため、途中で中断しても既存の出力は壊れない。
+
+    Returns:
+        int: 出力したレコード数。
+    """
+    index = load_checkpoint_index(checkpoint_path)
+    temp_output_path = output_file_path + ".tmp"
+    written_count = 0
+    with open(checkpoint_path, 'rb') as checkpoint_file, \
+         open(temp_output_path, 'w', encoding='utf-8') as outfile:
+        for entry in corpus.iter_entries():
+            key = article_key(entry, entry["line_number"])
+            if key not in index:
+                continue
+            checkpoint_file.seek(index[key][0])
+            entry = json.loads(checkpoint_file.readline())
+            outfile.write(json.dumps(entry["record"], ensure_ascii=False) + "\n")
+            written_count += 1
+    os.replace(temp_output_path, output_file_path)
+    return written_count
+
+def run_refine_concurrently(client: "OpenAI", corpus: CorpusStore, checkpoint_path: str,
+                            response_cache: ResponseCache, succeeded_keys: set, max_workers: int,
+                            article_filters: dict = None) -> tuple:
+    """
+    未処理の記事をスレッドプールで並行して処理し、結果を1件ずつチェックポイントへ追記する。
+    同時に実行中のリクエストは max_workers 件までに制限する。
+    処理済みかどうかは入力の索引で判定し、未処理の記事の本文だけを読み込む。
+
+    Returns:
+        tuple: (処理件数, 失敗件数, スキップ件数, 所要秒数)
+    """
+    article_filters = article_filters or {}
+    total_lines = corpus.count(include_invalid=True, **article_filters)
+
+    processed_count = 0
+    failed_count = 0
+    skipped_count = 0
+    # 完了した順にチェックポイントへ追記する (キー付きなので順不同で良い)。
+    # 最終出力は finalize_output で入力と同じ順序に並べ直す。
+    in_flight = {}
+    from tqdm import tqdm # 進捗表示用 (読み込みに時間がかかるため、処理を始めるときにインポートする)
+    progress = tqdm(total=total_lines, desc="Processing articles with AI", unit="article")
+
+    def _collect(done_futures) -> None:
+        nonlocal processed_count, failed_count
+        for future in done_futures:
+            key = in_flight.pop(future)
+            record = future.result()
+            with span("refine.checkpoint_write"):
+                append_checkpoint_record(checkpoint_file, key, record)
+            processed_count += 1
+            if is_failed_record(record):
+                failed_count += 1
+            progress.update(1)
+        progress.set_postfix(in_flight=len(in_flight), failed=failed_count)
+
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint_file, \
+         ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for entry in corpus.iter_entries(include_invalid=True, **article_filters):
+            if not entry["valid"]:
+                tqdm.write(f"警告: JSONデコードエラーのため、行をスキップ（読み込み時）: 行 {entry['line_number']}")
+                progress.update(1)
+                continue
+
+            key = article_key(entry, entry["line_number"])
+            if key in succeeded_keys:
+                skipped_count += 1
+                progress.update(1)
+                continue
+            with span("refine.read_article"):
+                article_data = corpus.read(entry)
+
+            # バックプレッシャー: 実行中のリクエストが max_workers 件に達したら、いずれかの完了を待つ
+            if len(in_flight) >= max_workers:
+                with span("refine.wait_workers"):
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                _collect(done)
+
+            # 前処理 (clean_text_python_pre_ai) もワーカー内で行い、他の記事のAPI待ちと重ねる
+            in_flight[executor.submit(process_article, client, article_data, response_cache)] = key
+
+        with span("refine.wait_workers"):
+            done = wait(in_flight).done
+        _collect(done)
+    elapsed_seconds = progress.format_dict["elapsed"]
+    progress.close()
+
+    return processed_count, failed_count, skipped_count, elapsed_seconds
+
+def run_refine_batch(client: "OpenAI", corpus: CorpusStore, checkpoint_path: str, state_path: str,
+                     response_cache: ResponseCache, succeeded_keys: set,
+                     poll_interval_seconds: float = DEFAULT_BATCH_POLL_INTERVAL_SECONDS,
+                     article_filters: dict = None) -> tuple:
+    """
+    未処理の記事を Batch API でまとめて処理し、結果を custom_id (記事のキー) で突き合わせて
+    チェックポイントへ追記する。応答を待つ必要のない夜間の再処理向けで、同期呼び出しより安価に大量処理できる。
+
+    ジョブの状態は state_path に保存され、完了待ちの途中で中断しても、再実行すると
+    同じ入力に対する前回のジョブの完了を待って結果を取り込む。
+
+    Returns:
+        tuple: (処理件数, 失敗件数, スキップ件数, 所要秒数)
+    """
+    start_time = time.perf_counter()
+    runner = BatchRunner(
+        client, state_path, "/v1/chat/completions",
+        work_dir=os.path.join(os.path.dirname(checkpoint_path), "batch"),
+        poll_interval_seconds=poll_interval_seconds
+    )
+    article_filters = article_filters or {}
+    signature = file_signature(corpus.corpus_path, article_filters)
+    processed_count = 0
+    failed_count = 0
+    skipped_count = 0
+
+    def _iter_pending_articles():
+        """
+        未処理の記事を (キー, 前処理結果) で返す。前処理に失敗した記事は失敗レコードとして記録する。
+        """
+        nonlocal skipped_count, processed_count, failed_count
+        for entry in corpus.iter_entries(**article_filters):
+            key = article_key(entry, entry["line_number"])
+            if key in succeeded_keys:
+                skipped_count += 1
+                continue
+            article_data = corpus.read(entry)
+            try:
+                yield key, preprocess_article(article_data)
+            except Exception as e:
+                print(f"警告: 記事ID {article_data.get('id')} の前処理中にエラーが発生しました: {e}")
+                append_checkpoint_record(
+                    checkpoint_file, key, build_output_record(unprocessed_article_fields(article_data), "", error=str(e))
+                )
+                processed_count += 1
+                failed_count += 1
+
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint_file:
+        if runner.has_pending_job(signature):
+            print(f"情報: 前回投入したバッチジョブを再開します。({state_path})")
+            # 投入は前回の実行で済んでいるため、スキップ件数だけを索引から数える (本文は読まない)
+            skipped_count = sum(1 for entry in corpus.iter_entries(**article_filters)
+                                if article_key(entry, entry["line_number"]) in succeeded_keys)
+        else:
+            if runner.has_pending_job():
+                print("警告: 入力ファイルが前回のバッチジョブの投入時から変更されているため、新しいジョブを投入します。")
+
+            def _batch_requests():
+                nonlocal processed_count
+                for key, preprocessed in _iter_pending_articles():
+                    messages, generation_params = prepare_refine_request(preprocessed["title_for_prompt"], preprocessed["text"])
+                    if response_cache:
+                        cached_text = response_cache.get(DEFAULT_MODEL_NAME, messages, generation_params)
+                        if cached_text is not None:
+                            append_checkpoint_record(checkpoint_file, key, build_output_record(preprocessed, cached_text))
+                            processed_count += 1
+                            continue
+                    yield {"custom_id": key, "body": {"model": DEFAULT_MODEL_NAME, "messages": messages, **generation_params}}
+
+            submitted_count = runner.submit(_batch_requests(), input_signature=signature)
+            print(f"{submitted_count}件のリクエストを Batch API に投入しました。")
+            if submitted_count == 0:
+                runner.mark_merged()
+                return processed_count, failed_count, skipped_count, time.perf_counter() - start_time
+        runner.wait_for_completion()
+
+        # 出力レコードの組み立てに必要な前処理は、結果に含まれる記事の分だけ1件ずつやり直す。
+        # 前処理の失敗は投入時に記録済みのため、ここでは数えない
+        for custom_id, response_body, error in runner.iter_results():
+            article_data = read_article_by_key(corpus, custom_id)
+            if article_data is None:
+                continue
+            try:
+                preprocessed = preprocess_article(article_data)
+            except Exception:
+                continue
+            if error is None:
+                refined_text = response_body["choices"][0]["message"]["content"].strip()
+                record = build_output_record(preprocessed, refined_text)
+                if response_cache:
+                    messages, generation_params = prepare_refine_request(preprocessed["title_for_prompt"], preprocessed["text"])
+                    response_cache.put(DEFAULT_MODEL_NAME, messages, generation_params, refined_text)
+            else:
+                record = build_output_record(preprocessed, "", error=error)
+                failed_count += 1
+            append_checkpoint_record(checkpoint_file, custom_id, record)
+            processed_count += 1
+
+    runner.mark_merged()
+    return processed_count, failed_count, skipped_count, time.perf_counter() - start_time
+
+def main(force_reprocess: bool = False, max_workers: int = DEFAULT_MAX_WORKERS, use_batch_api: bool = False,
+         poll_interval_seconds: float = DEFAULT_BATCH_POLL_INTERVAL_SECONDS, article_filters: dict = None):
+    """
+    output.jsonl の各記事をAIで整形し、結果を1件ずつチェックポイントファイルへ追記する。
+    再実行時は成功済みの記事をスキップし、失敗または未処理の記事のみを処理する。
+    記事はスレッドプールで並行して処理するか、use_batch_api が指定された場合は Batch API で処理する。
+
+    Args:
+        force_reprocess (bool): Trueの場合、チェックポイントを破棄して全件を再処理する。
+        max_workers (int): 並行して処理する記事数の上限。
+        use_batch_api (bool): Trueの場合、同期呼び出しの代わりに Batch API でまとめて処理する。
+        poll_interval_seconds (float): Batch API のジョブの状態を確認する初期間隔。
+        article_filters (dict, optional): 処理する記事の絞り込み条件 (CorpusStore.iter_entries の引数)。
+                                          最終出力には、絞り込みに関わらずチェックポイントにある全記事を含める。
+    """
+    input_file_path = settings.CORPUS_PATH
+    output_dir = os.path.join(settings.DATA_DIR, "finetuning_data")
     output_file_path = os.path.join(output_dir, "output_refined_by_ai.jsonl")
+    # 処理済みレコードを1件ずつ追記するチェックポイント。最終出力はここから組み立てる
+    checkpoint_path = output_file_path + ".checkpoint"
 
-    if not OPENAI_API_KEY:
+    if not settings.OPENAI_API_KEY:
         print("エラー: OpenAI APIキーが設定されていません。環境変数 OPENAI_API_KEY を設定してください。")
         return
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    # openai の読み込みには時間がかかるため、APIを呼び出す直前にインポートする
+    from src.core.client_factory import get_openai_client
+    client = get_openai_client(settings.OPENAI_API_KEY, settings.OPENAI_BASE_URL) # プロセス共有のクライアント (リトライはレートリミッターが行う)
     os.makedirs(output_dir, exist_ok=True)
 
-    processed_articles = []
-    all_articles_data = []
+    response_cache = None
+    # RESPONSE_CACHE_ENABLED=1 の場合、同一入力に対するAI処理結果をディスクキャッシュから再利用する
+    if settings.RESPONSE_CACHE_ENABLED:
+        # 保存先と上限は OpenAIAdapter と同じ設定を使う。
+        # 再実行時に同じ記事を再度課金処理しないよう、temperature に関わらずキャッシュする
+        response_cache = ResponseCache(
+            settings.RESPONSE_CACHE_PATH,
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            max_age_seconds=settings.RESPONSE_CACHE_MAX_AGE_DAYS * 24 * 60 * 60,
+            deterministic_only=False
+        )
+
+    # Batch API のジョブの状態。完了待ちの途中で中断した場合は、再実行時にここから再開する
+    batch_state_path = output_file_path + ".batch_state.json"
+
+    if force_reprocess and not article_filters and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+        print("情報: --force が指定されたため、チェックポイントを破棄して全件を再処理します。")
+    if force_reprocess and os.path.exists(batch_state_path):
+        os.remove(batch_state_path)
+
+    repair_checkpoint_tail(checkpoint_path)
+    checkpoint_index = load_checkpoint_index(checkpoint_path)
+    succeeded_keys = {key for key, (_, succeeded) in checkpoint_index.items() if succeeded}
+    if force_reprocess and article_filters:
+        # 絞り込んだ記事だけを再処理し、それ以外の記事の処理結果はチェックポイントに残す
+        print("情報: --force が指定されたため、絞り込んだ記事を処理済みのものも含めて再処理します。")
+        succeeded_keys = set()
+    if succeeded_keys:
+        print(f"情報: 処理済みの {len(succeeded_keys)}件 をスキップします。")
 
-    with open(input_file_path, 'r', encoding='utf-8') as infile:
-        for line in infile:
-            try:
-                all_articles_data.append(json.loads(line.strip()))
-            except json.JSONDecodeError:
-                print(f"警告: JSONデコードエラーのため、行をスキップ（読み込み時）: {line.strip()[:100]}...")
-
-
-    # API呼び出し回数を制限したい場合は、以下のコメントアウトを解除して調整
-    # articles_to_process_ai = all_articles_data[:3] # 例: 最初の3件だけAI処理
-    articles_to_process_ai = all_articles_data # 全件AI処理
-
-    for article_data in tqdm(articles_to_process_ai, desc="Processing articles with AI"):
-        try:
-            original_id = article_data.get("id")
-            original_title = article_data.get("title", "")
-            original_text = article_data.get("text", "")
-            original_category = article_data.get("category")
-            original_post_date = article_data.get("post_date")
-
-            # ルール1: title から「映画」という文字を取り除く
-            # 「」や【】なども除去してAIに渡しやすくする
-            processed_title = original_title.replace("映画", "").strip()
-            title_for_prompt = re.sub(r"[「」【】]", "", processed_title)
-
-
-            # Pythonによる前処理 (ルール2とルール3の一部)
-            text_after_python_clean = clean_text_python_pre_ai(original_text, title_for_prompt)
-
-            # AIによる編集と再構成 (ルール3の残り、ルール4、ルール5)
-            refined_text_ai = refine_and_restructure_with_ai(client, title_for_prompt, text_after_python_clean)
-
-            processed_articles.append({
-                "id": original_id,
-                "title": processed_title,
-                "text": refined_text_ai, # AIによって再構成されたテキスト
-                "category": original_category,
-                "post_date": original_post_date
-            })
-
-        except Exception as e:
-            tqdm.write(f"警告: 記事ID {original_id} の処理中に予期せぬエラーが発生しました: {e}")
-            # エラーが発生した場合でも、元の情報を保持してリストに追加する（オプション）
-            processed_articles.append({
-                "id": original_id,
-                "title": processed_title, # Pythonで処理済みのタイトル
-                "text": f"エラー発生。元のテキスト:\n{text_after_python_clean}", # Pythonで処理済みのテキスト
-                "category": original_category,
-                "post_date": original_post_date,
-                "error": str(e)
-            })
-
-
-    with open(output_file_path, 'w', encoding='utf-8') as outfile:
-        for article in processed_articles:
-            outfile.write(json.dumps(article, ensure_ascii=False) + "\n")
+    try:
+        corpus = CorpusStore(input_file_path)
+    except FileNotFoundError:
+        print(f"エラー: 入力ファイルが見つかりません: {input_file_path}")
+        return
+
+    with corpus:
+        if use_batch_api:
+            processed_count, failed_count, skipped_count, elapsed_seconds = run_refine_batch(
+                client, corpus, checkpoint_path, batch_state_path, response_cache, succeeded_keys, poll_interval_seconds,
+                article_filters
+            )
+        else:
+            processed_count, failed_count, skipped_count, elapsed_seconds = run_refine_concurrently(
+                client, corpus, checkpoint_path, response_cache, succeeded_keys, max_workers, article_filters
+            )
+
+        with span("refine.finalize"):
+            written_count = finalize_output(corpus, checkpoint_path, output_file_path)
 
     print(f"\n処理が完了しました。整形済みデータは {output_file_path} に保存されました。")
-    print(f"処理された記事数: {len(processed_articles)}")
+    print(f"今回処理した記事数: {processed_count} (失敗: {failed_count}) / スキップ: {skipped_count}")
+    print(f"出力された記事数: {written_count}")
+    if processed_count and elapsed_seconds > 0:
+        print(f"所要時間: {elapsed_seconds:.1f}秒 / スループット: {processed_count / elapsed_seconds * 60:.1f}件/分")
+    if failed_count:
+        print("失敗した記事は、再実行すると再処理されます。")
+    if response_cache:
+        print(f"キャッシュ統計: {response_cache.stats()}")
 
-if __name__ == "__main__":
+
+def run_cli(argv: list = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈して記事の整形を実行する (python -m src refine)。
+
+    Args:
+        argv (list, optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
     # 環境変数 OPENAI_API_KEY と DEFAULT_MODEL_NAME を設定してください
     # 例: export OPENAI_API_KEY="your_api_key_here"
     #     export DEFAULT_MODEL_NAME="gpt-4o" (または "gpt-3.5-turbo" など)
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(prog=prog, description="output.jsonl をAIで整形し、6部構成に再編する。")
+    parser.add_argument("--force", action="store_true",
+                        help="処理済みの記事も含め、全件を再処理する")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f"並行して処理する記事数の上限 (デフォルト: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("--batch", action="store_true",
+                        help="Batch API でまとめて処理する (完了まで最大24時間。中断しても再実行で再開できる)")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_BATCH_POLL_INTERVAL_SECONDS,
+                        help=f"--batch 指定時にジョブの状態を確認する初期間隔 (秒, デフォルト: {DEFAULT_BATCH_POLL_INTERVAL_SECONDS:g})")
+    add_article_filter_arguments(parser, "整形する")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    with profiling.profiling_session(args, "refine"):
+        main(force_reprocess=args.force, max_workers=max(1, args.workers), use_batch_api=args.batch,
+             poll_interval_seconds=args.poll_interval, article_filters=article_filters_from_args(args))
+
+
+if __name__ == "__main__":
+    run_cli()
@@ -0,0 +1,303 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from itertools import product
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- sys.path の調整 ---
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
+# --- ここまで追加 ---
+
+from src.config import settings
+from src.core.instrumentation import add_event_hook, remove_event_hook
+
+# main.py と同じ生成パラメータを既定値にする
+DEFAULT_TEMPERATURES = [0.5]
+DEFAULT_FREQUENCY_PENALTIES = [0.5]
+DEFAULT_EXPERIMENT_MAX_TOKENS = 2500
+DEFAULT_PRESENCE_PENALTY = 0
+# 表示する出力の先頭の文字数 (CSV には全文を保存する)
+OUTPUT_PREVIEW_CHARS = 30
+
+# 結果の表の列: (見出し, 結果のキー)
+RESULT_COLUMNS = [
+    ("cell", "cell"),
+    ("title", "title"),
+    ("model", "model"),
+    ("temperature", "temperature"),
+    ("frequency_penalty", "frequency_penalty"),
+    ("status", "status"),
+    ("latency_seconds", "latency_seconds"),
+    ("time_to_first_byte_seconds", "time_to_first_byte_seconds"),
+    ("retries", "retries"),
+    ("cache_hit", "cache_hit"),
+    ("prompt_tokens", "prompt_tokens"),
+    ("completion_tokens", "completion_tokens"),
+    ("finish_reason", "finish_reason"),
+    ("estimated_cost_usd", "estimated_cost_usd"),
+    ("output_chars", "output_chars"),
+    ("output", "output"),
+]
+
+# 実行中のセルの計測イベントの記録先。asyncio のタスクごとに別の値になる
+_cell_events: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("experiment_cell_events", default=None)
+
+
+def _collect_cell_event(event: Dict[str, Any]) -> None:
+    events = _cell_events.get()
+    if events is not None:
+        events.append(event)
+
+
+def default_models() -> List[str]:
+    """
+    比較するモデルの既定値。ベースモデルと、設定されていればファインチューニング済みモデル。
+    """
+    models = [settings.DEFAULT_MODEL_NAME]
+    finetuned_model_id = getattr(settings, "FINETUNED_MODEL_ID", None)
+    if finetuned_model_id:
+        models.append(finetuned_model_id)
+    return models
+
+
+def build_experiment_grid(
+    titles: List[str],
+    models: List[str],
+    temperatures: List[float],
+    frequency_penalties: List[float]
+) -> List[Dict[str, Any]]:
+    """
+    タイトル × モデル × temperature × frequency_penalty のすべての組み合わせ (セル) を作成する。
+    """
+    return [
+        {"cell": index, "title": title, "model": model,
+         "temperature": temperature, "frequency_penalty": frequency_penalty}
+        for index, (title, model, temperature, frequency_penalty)
+        in enumerate(product(titles, models, temperatures, frequency_penalties), start=1)
+    ]
+
+
+def prepare_prompts(
+    generator,
+    cells: List[Dict[str, Any]],
+    style_examples: Dict[str, str],
+    max_tokens: int,
+    tone_and_style_details: str = "",
+    other_notes: str = ""
+) -> Dict[Tuple[str, str], Tuple[list, dict, Dict[str, Any]]]:
+    """
+    (タイトル, モデル) ごとにプロンプトを1回だけ組み立てる。サンプリングのパラメータが違うセルでは同じプロンプトを使い回す。
+    トークン数の上限はモデルごとに異なるため、モデルごとにコンテキストウィンドウへの収まりを確認する。
+
+    Returns:
+        Dict[Tuple[str, str], Tuple[list, dict, dict]]: (タイトル, モデル) -> (メッセージ, 生成パラメータ, トークン数の見積もり)。
+    """
+    prompts = {}
+    for cell in cells:
+        key = (cell["title"], cell["model"])
+        if key in prompts:
+            continue
+        prompts[key] = generator.prepare_request(
+            cell["title"], style_examples.get(cell["title"], ""), tone_and_style_details, other_notes,
+            {"model": cell["model"], "max_tokens": max_tokens, "presence_penalty": DEFAULT_PRESENCE_PENALTY}
+        )
+    return prompts
+
+
+async def run_cells_async(
+    adapter,
+    cells: List[Dict[str, Any]],
+    prompts: Dict[Tuple[str, str], Tuple[list, dict, Dict[str, Any]]],
+    max_concurrency: int
+) -> List[Dict[str, Any]]:
+    """
+    すべてのセルを並行して生成する。同時実行数は max_concurrency 件まで、
+    リクエスト数とトークン数はアダプターのレートリミッターで制限する。
+
+    Returns:
+        List[Dict[str, Any]]: セルと同じ順序の結果 (出力、レイテンシ、トークン数など)。
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run_cell(cell: Dict[str, Any]) -> Dict[str, Any]:
+        result = dict(cell)
+        messages, params, plan = prompts[(cell["title"], cell["model"])]
+        if not plan["fits"]:
+            result.update(status="error", output=(
+                f"エラー: プロンプト ({plan['prompt_tokens']} トークン) が"
+                f"モデルのコンテキストウィンドウ ({plan['context_window']} トークン) に収まりません。"
+            ))
+            return result
+
+        events = []
+        # このタスク内で記録された計測イベントだけをこのセルの結果にする
+        _cell_events.set(events)
+        async with semaphore:
+            output = await adapter.generate_text_async(
+                messages, dict(params, temperature=cell["temperature"], frequency_penalty=cell["frequency_penalty"])
+            )
+        result["status"] = "error" if output.startswith("エラー:") else "ok"
+        result["output"] = output
+        if events:
+            event = events[-1]
+            for key in ("latency_seconds", "time_to_first_byte_seconds", "retries", "cache_hit",
+                        "prompt_tokens", "completion_tokens", "finish_reason", "estimated_cost_usd"):
+                result[key] = event[key]
+        return result
+
+    add_event_hook(_collect_cell_event)
+    try:
+        return await asyncio.gather(*(_run_cell(cell) for cell in cells))
+    finally:
+        remove_event_hook(_collect_cell_event)
+
+
+def run_experiment_matrix(
+    titles: List[str],
+    models: List[str],
+    temperatures: List[float],
+    frequency_penalties: List[float],
+    style_examples: Dict[str, str] = None,
+    max_tokens: int = DEFAULT_EXPERIMENT_MAX_TOKENS,
+    max_concurrency: int = None,
+    client_adapter=None
+) -> List[Dict[str, Any]]:
+    """
+    タイトル × モデル × 生成パラメータの組み合わせで記事を生成し、セルごとの結果を返す。
+
+    Args:
+        titles (List[str]): 映画タイトル。
+        models (List[str]): 比較するモデル (ベースモデルとファインチューニング済みモデルなど)。
+        temperatures (List[float]): 比較する temperature。
+        frequency_penalties (List[float]): 比較する frequency_penalty。
+        style_examples (Dict[str, str], optional): タイトルごとの文体例。
+        max_tokens (int): 生成するトークン数の上限。
+        max_concurrency (int, optional): 同時実行数の上限。Noneの場合、settingsの値を使用。
+        client_adapter (OpenAIAdapter, optional): 生成に使うアダプター。Noneの場合、既定の OpenAIAdapter。
+
+    Returns:
+        List[Dict[str, Any]]: セルごとの結果。
+    """
+    import asyncio
+    from src.generator.article_generator import ArticleGenerator
+
+    if client_adapter is None:
+        # openai の読み込みには時間がかかるため、実験を実行するときにインポートする
+        from src.core.openai_adapter import OpenAIAdapter
+        client_adapter = OpenAIAdapter()
+    generator = ArticleGenerator(client_adapter=client_adapter)
+
+    cells = build_experiment_grid(titles, models, temperatures, frequency_penalties)
+    prompts = prepare_prompts(generator, cells, style_examples or {}, max_tokens)
+    return asyncio.run(run_cells_async(
+        client_adapter, cells, prompts, max_concurrency or settings.DEFAULT_MAX_CONCURRENCY
+    ))
+
+
+def write_results_csv(results: List[Dict[str, Any]], output_path: str) -> None:
+    """
+    セルごとの結果 (出力の全文を含む) を CSV に保存する。
+    """
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    # Excel で開いても文字化けしないよう BOM 付きで保存する
+    with open(output_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([title for title, _ in RESULT_COLUMNS])
+        for result in results:
+            writer.writerow(["" if result.get(key) is None else result.get(key) for _, key in RESULT_COLUMNS])
+
+
+def format_results_table(results: List[Dict[str, Any]]) -> str:
+    """
+    セルごとの結果を表示用の表にする。出力は先頭の数文字だけを表示する。
+    """
+    headers = ["cell", "model", "temp", "freq", "status", "latency(s)", "in_tok", "out_tok", "cost($)", "title / output"]
+    lines = []
+    for result in results:
+        def _fmt(key, fmt):
+            value = result.get(key)
+            return "-" if value is None else fmt.format(value)
+        preview = (result.get("output") or "").replace("\n", " ")[:OUTPUT_PREVIEW_CHARS]
+        lines.append([
+            str(result["cell"]), result["model"], _fmt("temperature", "{:g}"), _fmt("frequency_penalty", "{:g}"),
+            result["status"], _fmt("latency_seconds", "{:.2f}"), _fmt("prompt_tokens", "{:d}"),
+            _fmt("completion_tokens", "{:d}"), _fmt("estimated_cost_usd", "{:.4f}"),
+            f"{result['title']} / {preview}",
+        ])
+    widths = [max(len(header), *(len(cells[i]) for cells in lines)) for i, header in enumerate(headers)]
+    rendered = ["  ".join(header.ljust(width) for header, width in zip(headers, widths))]
+    for cells in lines:
+        rendered.append("  ".join(cell.ljust(width) for cell, width in zip(cells, widths)))
+    return "\n".join(rendered)
+
+
+def run_cli(argv: list = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈して実験を実行する (python -m src experiment)。
+
+    Args:
+        argv (list, optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
+    parser = argparse.ArgumentParser(
+        prog=prog, description="映画タイトル × モデル × 生成パラメータの組み合わせで記事を並行して生成し、結果を1つの表にまとめる。"
+    )
+    parser.add_argument("titles", nargs="+", help="生成する映画のタイトル")
+    parser.add_argument("--model", dest="models", action="append",
+                        help="比較するモデル。複数指定可 (デフォルト: DEFAULT_MODEL_NAME と、設定されていれば FINETUNED_MODEL_ID)")
+    parser.add_argument("--temperature", dest="temperatures", type=float, action="append",
+                        help="比較する temperature。複数指定可 (デフォルト: 0.5)")
+    parser.add_argument("--frequency-penalty", dest="frequency_penalties", type=float, action="append",
+                        help="比較する frequency_penalty。複数指定可 (デフォルト: 0.5)")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_EXPERIMENT_MAX_TOKENS,
+                        help=f"生成するトークン数の上限 (デフォルト: {DEFAULT_EXPERIMENT_MAX_TOKENS})")
+    parser.add_argument("--concurrency", type=int, help="同時実行数の上限 (デフォルト: settings.DEFAULT_MAX_CONCURRENCY)")
+    parser.add_argument("--output", help="結果の CSV の保存先 (デフォルト: data/experiments/experiment_<日時>.csv)")
+    args = parser.parse_args(argv)
+
+    if not settings.warn_if_api_key_missing():
+        print("致命的エラー: OpenAI APIキーが設定されていません。プログラムを終了します。")
+        return
+
+    models = args.models or default_models()
+    temperatures = args.temperatures or DEFAULT_TEMPERATURES
+    frequency_penalties = args.frequency_penalties or DEFAULT_FREQUENCY_PENALTIES
+    output_path = args.output or os.path.join(
+        settings.DATA_DIR, "experiments", f"experiment_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    )
+    cell_count = len(args.titles) * len(models) * len(temperatures) * len(frequency_penalties)
+    print(f"{len(args.titles)}タイトル × {len(models)}モデル × temperature {len(temperatures)}通り"
+          f" × frequency_penalty {len(frequency_penalties)}通り = {cell_count}セルを生成します...")
+
+    from src.main import load_style_examples
+    style_examples = load_style_examples(
+        settings.CORPUS_PATH, os.path.join(settings.DATA_DIR, "index", "style_examples"), args.titles, num_chars=1500
+    )
+
+    start_time = time.perf_counter()
+    results = run_experiment_matrix(
+        args.titles, models, temperatures, frequency_penalties,
+        style_examples=style_examples, max_tokens=args.max_tokens, max_concurrency=args.concurrency
+    )
+    elapsed = time.perf_counter() - start_time
+
+    print("\n" + format_results_table(results))
+    write_results_csv(results, output_path)
+    failed_count = sum(result["status"] != "ok" for result in results)
+    total_cost = sum(result.get("estimated_cost_usd") or 0.0 for result in results)
+    print(f"\n成功: {len(results) - failed_count}セル / 失敗: {failed_count}セル / 所要時間: {elapsed:.1f}秒"
+          f" / 推定費用: ${total_cost:.4f}")
+    print(f"結果 (出力の全文を含む) を保存しました: {output_path}")
+
+
+if __name__ == "__main__":
+    run_cli()
@@ -1,7 +1,7 @@
+import argparse
 import os
 import sys # sysをインポート
-import time
-from openai import OpenAI
+from typing import TYPE_CHECKING
 
 # --- sys.path の調整 ---
 # このスクリプト (scripts/run_finetuning_job.py) の親の親 (プロジェクトルート) を sys.path に追加
@@ -11,23 +11,62 @@ if project_root_for_sys_path not in sys.path:
 # --- ここまで追加 ---
 
 from src.config import settings # settings.py から設定をインポート
+from src.core.finetuning_monitor import FineTuningMonitor, latest_registered_model
+from src.core.rate_limiter import get_shared_rate_limiter
 
-def run_openai_finetuning():
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+FINETUNING_DATA_DIR = os.path.join(settings.DATA_DIR, "finetuning_data")
+# 作成したジョブの状態 (中断後に --attach で監視を再開するために使う)
+JOB_STATE_PATH = os.path.join(FINETUNING_DATA_DIR, "finetuning_jobs.json")
+# 成功したジョブのファインチューニング済みモデルIDの登録簿
+MODEL_REGISTRY_PATH = os.path.join(FINETUNING_DATA_DIR, "model_registry.json")
+DEFAULT_POLL_INTERVAL_SECONDS = 15.0
+MAX_POLL_INTERVAL_SECONDS = 300.0
+
+
+def create_client() -> "OpenAI":
+    # openai の読み込みには時間がかかるため、APIを呼び出す直前にインポートする
+    from src.core.client_factory import get_openai_client
+    return get_openai_client() # プロセス共有のクライアント (リトライはレートリミッターが行う)
+
+
+def create_monitor(client, poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS) -> FineTuningMonitor:
+    return FineTuningMonitor(
+        client,
+        JOB_STATE_PATH,
+        MODEL_REGISTRY_PATH,
+        poll_interval_seconds=poll_interval_seconds,
+        max_poll_interval_seconds=MAX_POLL_INTERVAL_SECONDS
+    )
+
+
+def run_openai_finetuning(n_epochs_values=None, wait: bool = True, poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS):
     """
     OpenAI APIを使用してファインチューニングジョブを実行する。
-    1. トレーニングファイルをアップロード
-    2. ファインチューニングジョブを作成
-    3. ジョブのステータスを監視 (簡易的)
+    1. トレーニングファイル (と検証用ファイル) をアップロード
+    2. ファインチューニングジョブを作成 (n_epochs_values を複数指定した場合は値ごとに作成)
+    3. ジョブのステータスとイベントを監視し、成功したモデルを登録簿に追加
+
+    Args:
+        n_epochs_values (List[int], optional): n_epochs の値のリスト。Noneの場合はAPIの自動設定で1件作成する。
+        wait (bool): ジョブの完了まで監視するか。False の場合は作成後に終了し、--attach で監視を再開できる。
+        poll_interval_seconds (float): 状態確認の初期間隔 (秒)。
     """
     if not settings.OPENAI_API_KEY:
         print("エラー: OpenAI APIキーが settings.py に設定されていません。")
         return
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    client = create_client()
+    # ファイル・ファインチューニングAPIの呼び出しも共有レートリミッター経由で行う
+    limiter = get_shared_rate_limiter("fine_tuning")
+    monitor = create_monitor(client, poll_interval_seconds)
 
     # --- 1. トレーニングファイルの準備 ---
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    training_file_path = os.path.join(project_root, "data", "finetuning_data", "training_corpus.jsonl")
+    training_file_path = os.path.join(FINETUNING_DATA_DIR, "training_corpus.jsonl")
+    # prepare_finetuning_data.py が分割した検証用データ (あれば学習中の検証ロスの計算に使う)
+    validation_file_path = os.path.join(FINETUNING_DATA_DIR, "validation_corpus.jsonl")
 
     if not os.path.exists(training_file_path):
         print(f"エラー: トレーニングファイルが見つかりません: {training_file_path}")
@@ -41,12 +80,32 @@ def run_openai_finetuning():
     try:
         print("トレーニングファイルをOpenAIにアップロードしています...")
         with open(training_file_path, "rb") as f:
-            uploaded_file = client.files.create(file=f, purpose="fine-tune")
+            # リトライ時にも同じ内容を送れるよう、ファイル内容をバイト列として渡す
+            uploaded_file = limiter.call(
+                client.files.create,
+                file=(os.path.basename(training_file_path), f.read()),
+                purpose="fine-tune"
+            )
         print(f"ファイルがアップロードされました。File ID: {uploaded_file.id}")
     except Exception as e:
         print(f"エラー: ファイルのアップロード中にエラーが発生しました: {e}")
         return
 
+    uploaded_validation_file = None
+    if os.path.exists(validation_file_path) and os.path.getsize(validation_file_path) > 0:
+        try:
+            print("検証用ファイルをOpenAIにアップロードしています...")
+            with open(validation_file_path, "rb") as f:
+                uploaded_validation_file = limiter.call(
+                    client.files.create,
+                    file=(os.path.basename(validation_file_path), f.read()),
+                    purpose="fine-tune"
+                )
+            print(f"検証用ファイルがアップロードされました。File ID: {uploaded_validation_file.id}")
+        except Exception as e:
+            print(f"エラー: 検証用ファイルのアップロード中にエラーが発生しました: {e}")
+            return
+
     # --- 3. ファインチューニングジョブの作成 ---
     # ベースモデルはOpenAIのドキュメントで最新の推奨を確認してください。
     # 例: "gpt-3.5-turbo-0125", "gpt-3.5-turbo-1106"
@@ -56,76 +115,112 @@ def run_openai_finetuning():
     # 例: "movieblog-v1"
     custom_suffix = "movieblog" # 必要に応じて変更してください
 
-    finetuning_job = None
-    try:
-        print(f"\nファインチューニングジョブを作成しています...")
-        print(f"  トレーニングファイルID: {uploaded_file.id}")
-        print(f"  ベースモデル: {base_model}")
-        print(f"  サフィックス: {custom_suffix}")
-
-        finetuning_job = client.fine_tuning.jobs.create(
-            training_file=uploaded_file.id,
-            model=base_model,
-            suffix=custom_suffix,
-            # hyperparameters={"n_epochs": 3} # 必要に応じてエポック数などを指定
-        )
-        print(f"ファインチューニングジョブが作成されました。Job ID: {finetuning_job.id}")
-        print(f"ステータス: {finetuning_job.status}")
-        print("ジョブの完了には時間がかかることがあります。OpenAIダッシュボードでも確認できます。")
+    # n_epochs を複数指定した場合は、値ごとにジョブを作成して並べて比較する (None はAPIの自動設定)
+    sweep_values = n_epochs_values or [None]
+    created_jobs = 0
+    print(f"\nファインチューニングジョブを作成しています...")
+    print(f"  トレーニングファイルID: {uploaded_file.id}")
+    if uploaded_validation_file:
+        print(f"  検証用ファイルID: {uploaded_validation_file.id}")
+    print(f"  ベースモデル: {base_model}")
+    print(f"  サフィックス: {custom_suffix}")
+    for n_epochs in sweep_values:
+        label = f"n_epochs={n_epochs}" if n_epochs else "n_epochs=auto"
+        job_params = {"hyperparameters": {"n_epochs": n_epochs}} if n_epochs else {}
+        if uploaded_validation_file:
+            job_params["validation_file"] = uploaded_validation_file.id
+        try:
+            finetuning_job = limiter.call(
+                client.fine_tuning.jobs.create,
+                training_file=uploaded_file.id,
+                model=base_model,
+                suffix=custom_suffix,
+                **job_params
+            )
+        except Exception as e:
+            print(f"エラー: ファインチューニングジョブ ({label}) の作成中にエラーが発生しました: {e}")
+            continue
+        monitor.track(finetuning_job, label=label, suffix=custom_suffix)
+        created_jobs += 1
+        print(f"ファインチューニングジョブが作成されました。[{label}] Job ID: {finetuning_job.id} (ステータス: {finetuning_job.status})")
+
+    if not created_jobs:
+        return
+    print("ジョブの完了には時間がかかることがあります。OpenAIダッシュボードでも確認できます。")
+    if wait:
+        watch_finetuning_jobs(monitor)
+    else:
+        print(f"ジョブの状態を保存しました: {JOB_STATE_PATH}")
+        print("監視するには --attach を指定して再実行してください。")
+
 
+def watch_finetuning_jobs(monitor: FineTuningMonitor):
+    """
+    追跡中のジョブが終了するまで監視し、結果の一覧を表示する。
+    """
+    if not monitor.active_job_ids():
+        print("監視中のジョブはありません。")
+        return
+    print(f"\n{len(monitor.active_job_ids())}件のジョブを監視中 (Ctrl+Cで中断)...")
+    try:
+        jobs = monitor.wait()
+    except KeyboardInterrupt:
+        print("\nステータス監視を中断しました。ジョブの状態は保存されています。")
+        print("監視を再開するには --attach を指定して再実行してください。")
+        return
     except Exception as e:
-        print(f"エラー: ファインチューニングジョブの作成中にエラーが発生しました: {e}")
-        if finetuning_job:
-            print(f"作成されたジョブID (エラー発生時): {finetuning_job.id}")
+        print(f"エラー: ジョブステータスの取得中にエラーが発生しました: {e}")
+        print("監視を再開するには --attach を指定して再実行してください。")
         return
 
-    # --- 4. ジョブのステータス監視 (簡易版) ---
-    if finetuning_job:
-        print("\nジョブのステータスを監視中 (Ctrl+Cで中断)...")
-        try:
-            while True:
-                job_status = client.fine_tuning.jobs.retrieve(finetuning_job.id)
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Job ID: {job_status.id}, Status: {job_status.status}, Fine-tuned Model: {job_status.fine_tuned_model}")
-
-                if job_status.status == "succeeded":
-                    print("\nファインチューニングが成功しました！")
-                    print(f"ファインチューニング済みモデルID: {job_status.fine_tuned_model}")
-                    print(f"このモデルIDを settings.py の FINETUNED_MODEL_ID に設定してください。")
-                    break
-                elif job_status.status in ["failed", "cancelled"]:
-                    print(f"\nファインチューニングが {job_status.status} しました。")
-                    print("エラー詳細:")
-                    if job_status.error:
-                         print(f"  Code: {job_status.error.code}")
-                         print(f"  Message: {job_status.error.message}")
-                         print(f"  Param: {job_status.error.param}")
-                    # イベントログも確認すると良い
-                    events = client.fine_tuning.jobs.list_events(fine_tuning_job_id=job_status.id, limit=5)
-                    print("最新のイベント:")
-                    for event in reversed(events.data): # 新しい順に表示
-                        print(f"  - {event.created_at} [{event.level}]: {event.message}")
-                    break
-                
-                # APIへの過度なリクエストを避けるため、適切な間隔でポーリング
-                time.sleep(60)  # 60秒ごとにステータスを確認
-        except KeyboardInterrupt:
-            print("\nステータス監視を中断しました。")
-            print(f"ジョブID: {finetuning_job.id} の状況はOpenAIダッシュボードで確認してください。")
-        except Exception as e:
-            print(f"エラー: ジョブステータスの取得中にエラーが発生しました: {e}")
+    print("\nジョブの結果:")
+    for job_id, job in jobs.items():
+        print(f"  [{job['label']}] {job_id}: {job['status']} {job.get('fine_tuned_model') or ''}".rstrip())
+    if any(job.get("fine_tuned_model") for job in jobs.values()):
+        print(f"成功したモデルは登録簿に記録されています: {MODEL_REGISTRY_PATH}")
+        print(f"最新のファインチューニング済みモデルID: {latest_registered_model(MODEL_REGISTRY_PATH)}")
+        print(f"このモデルIDを settings.py の FINETUNED_MODEL_ID に設定してください。")
 
-if __name__ == "__main__":
-    print("OpenAI ファインチューニングジョブ実行スクリプトを開始します。")
-    print("注意: この処理にはOpenAI APIの利用料が発生します。")
-    
-    # ユーザーに実行確認を求める
-    # proceed = input("ファインチューニングジョブを開始しますか？ (yes/no): ")
-    # if proceed.lower() != 'yes':
-    #     print("処理を中止しました。")
-    # else:
-    #     run_openai_finetuning()
-    
-    # 今回は自動実行するが、実際の運用では上記のような確認を入れると安全
-    run_openai_finetuning()
+
+def run_cli(argv: list = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈してファインチューニングジョブの作成・監視を実行する (python -m src finetune)。
+
+    Args:
+        argv (list, optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="OpenAI のファインチューニングジョブを作成・監視する。")
+    parser.add_argument("--epochs", type=int, nargs="+",
+                        help="n_epochs の値。複数指定すると値ごとにジョブを作成する (省略時はAPIの自動設定)")
+    parser.add_argument("--attach", action="store_true",
+                        help="新しいジョブを作成せず、保存済みの未完了ジョブの監視を再開する")
+    parser.add_argument("--no-wait", action="store_true", help="ジョブを作成したら監視せずに終了する")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL_SECONDS,
+                        help="状態確認の初期間隔 (秒)。変化がない間は自動で延ばす")
+    args = parser.parse_args(argv)
+
+    if args.attach:
+        if not settings.OPENAI_API_KEY:
+            print("エラー: OpenAI APIキーが settings.py に設定されていません。")
+        else:
+            watch_finetuning_jobs(create_monitor(create_client(), args.poll_interval))
+    else:
+        print("OpenAI ファインチューニングジョブ実行スクリプトを開始します。")
+        print("注意: この処理にはOpenAI APIの利用料が発生します。")
+
+        # ユーザーに実行確認を求める
+        # proceed = input("ファインチューニングジョブを開始しますか？ (yes/no): ")
+        # if proceed.lower() != 'yes':
+        #     print("処理を中止しました。")
+        # else:
+        #     run_openai_finetuning()
+
+        # 今回は自動実行するが、実際の運用では上記のような確認を入れると安全
+        run_openai_finetuning(args.epochs, wait=not args.no_wait, poll_interval_seconds=args.poll_interval)
 
     print("\nスクリプトを終了します。")
+
+
+if __name__ == "__main__":
+    run_cli()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import sys
+
+# --- sys.path の調整 ---
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
+# --- ここまで追加 ---
+
+from src.config import settings
+from src.core.instrumentation import read_events, summarize_events
+
+# 表の列: (見出し, 集計結果のキー, 書式)
+SUMMARY_COLUMNS = [
+    ("calls", "calls", "{:d}"),
+    ("err", "errors", "{:d}"),
+    ("cache", "cache_hits", "{:d}"),
+    ("retry", "retries", "{:d}"),
+    ("p50(s)", "p50_latency_seconds", "{:.2f}"),
+    ("p95(s)", "p95_latency_seconds", "{:.2f}"),
+    ("p99(s)", "p99_latency_seconds", "{:.2f}"),
+    ("ttfb50(s)", "p50_time_to_first_byte_seconds", "{:.2f}"),
+    ("in_tok", "prompt_tokens", "{:d}"),
+    ("out_tok", "completion_tokens", "{:d}"),
+    ("tok/s", "completion_tokens_per_second", "{:.1f}"),
+    ("cost($)", "estimated_cost_usd", "{:.4f}"),
+]
+
+
+def format_summary_table(rows: list, group_by: tuple) -> str:
+    """
+    summarize_events の結果を固定幅の表にする。値がない欄は "-" を表示する。
+    """
+    headers = list(group_by) + [title for title, _, _ in SUMMARY_COLUMNS]
+    lines = []
+    for row in rows:
+        cells = [str(row.get(key)) for key in group_by]
+        for _, key, fmt in SUMMARY_COLUMNS:
+            value = row.get(key)
+            cells.append("-" if value is None else fmt.format(value))
+        lines.append(cells)
+    widths = [max([len(header)] + [len(cells[i]) for cells in lines]) for i, header in enumerate(headers)]
+    rendered = ["  ".join(header.ljust(width) for header, width in zip(headers, widths))]
+    for cells in lines:
+        rendered.append("  ".join(
+            cell.ljust(width) if i < len(group_by) else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(cells, widths))
+        ))
+    return "\n".join(rendered)
+
+
+def run_cli(argv: list = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈してAPI呼び出しの計測イベントの集計を表示する (python -m src metrics)。
+
+    Args:
+        argv (list, optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
+    parser = argparse.ArgumentParser(
+        prog=prog, description="API呼び出しの計測イベント (LLM_EVENTS_ENABLED=1 で記録) をモデル・スクリプトごとに集計する。"
+    )
+    parser.add_argument("--events", help="計測イベントのファイル (デフォルト: 環境変数 LLM_EVENTS_PATH。"
+                                         "未設定なら data/metrics/llm_calls.jsonl)")
+    parser.add_argument("--by", choices=["model", "script", "script,model"], action="append",
+                        help="集計の単位。複数指定可 (デフォルト: model と script をそれぞれ表示)")
+    parser.add_argument("--json", action="store_true", help="表の代わりに集計結果をJSONで出力する")
+    args = parser.parse_args(argv)
+
+    events_path = args.events or settings.LLM_EVENTS_PATH
+    if not os.path.exists(events_path):
+        print(f"エラー: 計測イベントのファイルが見つかりません: {events_path}")
+        print("環境変数 LLM_EVENTS_ENABLED=1 を設定して生成や整形を実行すると記録されます。")
+        return
+
+    events = list(read_events(events_path))
+    if not events:
+        print(f"計測イベントがありません: {events_path}")
+        return
+    groupings = [tuple(by.split(",")) for by in (args.by or ["model", "script"])]
+    summaries = {",".join(group_by): summarize_events(events, group_by) for group_by in groupings}
+    if args.json:
+        print(json.dumps(summaries, ensure_ascii=False, indent=2))
+        return
+
+    print(f"計測イベント: {events_path} ({len(events)}件)")
+    for group_by in groupings:
+        print(f"\n--- {' / '.join(group_by)} ごと ---")
+        print(format_summary_table(summaries[",".join(group_by)], group_by))
+
+
+if __name__ == "__main__":
+    run_cli()
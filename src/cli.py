@@ -0,0 +1,139 @@
+"""
+プロジェクトのコマンドラインの入口 (python -m src)。
+
+サブコマンドごとに実装モジュールを持ち、選ばれたサブコマンドのモジュールだけを読み込んでから
+その run_cli に残りの引数を渡す。openai・tqdm・bs4 などの重いライブラリは各モジュールが使う直前に読み込むため、
+--help や API を呼ばない処理はそれらの読み込みを待たずに起動する。
+
+batch サブコマンドは、ファイル (または標準入力) に1行ずつ書いたサブコマンドを同じプロセスで順に実行する。
+モジュールの読み込みや共有クライアントの接続プールを使い回せるため、シェルのループで何度も起動するより速い。
+"""
+import argparse
+import importlib
+import shlex
+import sys
+from typing import List
+
+from src.config import settings
+from src.core.instrumentation import set_event_source
+
+# サブコマンド名 -> (実装モジュール, 説明)。モジュールは run_cli(argv, prog) を持つ
+COMMANDS = {
+    "generate": ("src.main", "過去のブログ記事の文体で映画レビュー記事を生成する"),
+    "refine": ("scripts.refine_output_jsonl", "output.jsonl をAIで整形し、6部構成に再編する"),
+    "prepare": ("scripts.prepare_finetuning_data", "ブログ記事データをファインチューニング用のデータに変換する"),
+    "moderate": ("scripts.check_content_policy", "Moderation API で記事のコンテンツポリシー違反の可能性をチェックする"),
+    "finetune": ("scripts.run_finetuning_job", "OpenAI のファインチューニングジョブを作成・監視する"),
+    "convert": ("tools.process_download_data", "WordPressのCSVエクスポートをJSONLに変換する"),
+    "metrics": ("scripts.summarize_llm_calls", "API呼び出しの計測イベントをモデル・スクリプトごとに集計する"),
+    "experiment": ("scripts.run_experiment_matrix", "タイトル × モデル × 生成パラメータの組み合わせで記事を並行生成して比較する"),
+}
+BATCH_COMMAND = "batch"
+PROG = "python -m src"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    サブコマンドを選ぶためのパーサーを作成する。サブコマンドの引数は各モジュールのパーサーが解釈する。
+    """
+    command_help = "\n".join(f"  {name:<10}{description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog=PROG,
+        description="映画ブログ記事の生成・整形・ファインチューニングを行う。",
+        epilog=(
+            f"サブコマンド:\n{command_help}\n"
+            f"  {BATCH_COMMAND:<10}ファイル (省略時は標準入力) の各行のサブコマンドを同じプロセスで順に実行する\n\n"
+            f"各サブコマンドの引数は `{PROG} <サブコマンド> --help` で確認できます。"
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", metavar="サブコマンド", choices=[*COMMANDS, BATCH_COMMAND],
+                        help="実行するサブコマンド (下記参照)")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="サブコマンドに渡す引数")
+    return parser
+
+
+def run_command(command: str, argv: List[str]) -> None:
+    """
+    サブコマンドの実装モジュールを読み込み、引数を渡して実行する。
+
+    Args:
+        command (str): サブコマンド名 (COMMANDS のキー)。
+        argv (List[str]): サブコマンドに渡す引数。
+    """
+    module_name, _ = COMMANDS[command]
+    # 計測イベントにはサブコマンド名を実行元として記録する
+    set_event_source(command)
+    module = importlib.import_module(module_name)
+    module.run_cli(argv, prog=f"{PROG} {command}")
+
+
+def run_batch(argv: List[str]) -> int:
+    """
+    ファイル (省略時または "-" の場合は標準入力) の各行に書かれたサブコマンドを順に実行する。
+    空行と # で始まる行は無視する。失敗したコマンドがあっても残りのコマンドは実行する。
+
+    Args:
+        argv (List[str]): batch サブコマンドの引数。
+
+    Returns:
+        int: 終了コード。失敗したコマンドがあれば1。
+    """
+    parser = argparse.ArgumentParser(prog=f"{PROG} {BATCH_COMMAND}",
+                                     description="各行のサブコマンドを同じプロセスで順に実行する。")
+    parser.add_argument("file", nargs="?", default="-", help="1行に1コマンドを書いたファイル (省略時は標準入力)")
+    args = parser.parse_args(argv)
+
+    command_file = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8")
+    failed_count = 0
+    try:
+        for line_number, line in enumerate(command_file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                words = shlex.split(line)
+            except ValueError as e:
+                # 閉じていない引用符など。その行だけを失敗として扱う
+                print(f"エラー: {line_number}行目のコマンドを解釈できません: {e}")
+                failed_count += 1
+                continue
+            if words[0] not in COMMANDS:
+                print(f"エラー: {line_number}行目: 不明なサブコマンドです: {words[0]}")
+                failed_count += 1
+                continue
+            print(f"\n=== [{line_number}] {PROG} {line} ===")
+            try:
+                run_command(words[0], words[1:])
+            except SystemExit as e:
+                # 引数の誤り (argparse) や --help による終了で、残りのコマンドを止めない
+                if e.code not in (None, 0):
+                    print(f"エラー: {line_number}行目のコマンドが終了コード {e.code} で終了しました。")
+                    failed_count += 1
+            except Exception as e:
+                print(f"エラー: {line_number}行目のコマンドの実行中にエラーが発生しました: {e}")
+                failed_count += 1
+    finally:
+        if command_file is not sys.stdin:
+            command_file.close()
+    return 1 if failed_count else 0
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    コマンドライン引数からサブコマンドを選んで実行する。
+
+    Args:
+        argv (List[str], optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+
+    Returns:
+        int: 終了コード。
+    """
+    args = build_parser().parse_args(argv)
+    # scripts/ と tools/ はプロジェクトルートからのパッケージとして読み込む
+    if settings.PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, settings.PROJECT_ROOT)
+    if args.command == BATCH_COMMAND:
+        return run_batch(args.args)
+    run_command(args.command, args.args)
+    return 0
@@ -1,10 +1,21 @@
-import os
-from dotenv import load_dotenv
+"""
+プロジェクト全体の設定。
 
-load_dotenv()
+定数はそのまま定義し、環境変数 (.env を含む) から決まる値は最初に参照されたときに解決する
+(モジュールの __getattr__)。そのため、このモジュールの読み込み自体は .env の読み込みや
+python-dotenv の import を伴わず、CLI (python -m src) の起動や --help を遅くしない。
+解決した値はモジュール属性として保持するため、二回目以降の参照や `settings.X = ...` による上書きは通常の属性と同じに扱われる。
+"""
+import os
+import sys
+from typing import Any, Callable, Dict
 
-# --- API Keys ---
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# --- Paths ---
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
+# ブログ記事のコーパス (1行1記事のJSONL)
+CORPUS_PATH = os.path.join(PROJECT_ROOT, 'output.jsonl')
+DOTENV_PATH = os.path.join(PROJECT_ROOT, '.env')
 
 # --- Model Configuration ---
 # ファインチューニング前のベースモデル (例)
@@ -19,34 +30,116 @@ DEFAULT_MODEL_NAME = "gpt-3.5-turbo"
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = 2000 # ブログ記事なので少し長めに設定
 DEFAULT_TOP_P = 1.0
+# 一括生成 (ArticleGenerator.generate_many) で同時に実行するAPI呼び出しの上限
+DEFAULT_MAX_CONCURRENCY = 5
+# 6部構成の見出しの検証で構成の崩れを検出した場合に、同じ記事の生成を試みる回数の上限 (初回を含む)
+STRUCTURE_MAX_ATTEMPTS = 3
 # 必要に応じて他のデフォルトパラメータも追加できます
 # DEFAULT_FREQUENCY_PENALTY = 0.0
 # DEFAULT_PRESENCE_PENALTY = 0.0
 
-# --- File Paths (Optional, if needed globally) ---
-# 例:
-# DATA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
-# FINETUNING_DATA_PATH = os.path.join(DATA_DIR, 'finetuning_data', 'training_corpus.jsonl')
-# GENERATED_ARTICLES_DIR = os.path.join(DATA_DIR, 'generated_articles')
+# --- Environment-derived Settings ---
+# 名前 -> 環境変数から値を求める関数。値は最初の参照時に解決する
+_ENV_SETTINGS: Dict[str, Callable[[], Any]] = {
+    # --- API Keys ---
+    "OPENAI_API_KEY": lambda: os.getenv("OPENAI_API_KEY"),
+    # APIの接続先。未設定ならOpenAIの既定のエンドポイントを使う
+    # 例: ローカルのスタブサーバー (tools/mock_openai_server.py) を使う場合は http://127.0.0.1:8010/v1
+    "OPENAI_BASE_URL": lambda: os.getenv("OPENAI_BASE_URL") or None,
+
+    # --- HTTP Connection Pool ---
+    # OpenAI クライアントはプロセス内で共有し (src/core/client_factory.py)、Keep-Alive 済みの接続を使い回す
+    "HTTP_MAX_CONNECTIONS": lambda: int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+    "HTTP_MAX_KEEPALIVE_CONNECTIONS": lambda: int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+    # 使われていない接続を保持する秒数。ジョブの状態確認のように間隔の空く呼び出しでも接続を再利用できるよう長めにする
+    "HTTP_KEEPALIVE_EXPIRY_SECONDS": lambda: float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60")),
+    "HTTP_TIMEOUT_SECONDS": lambda: float(os.getenv("HTTP_TIMEOUT_SECONDS", "600")),
+    "HTTP_CONNECT_TIMEOUT_SECONDS": lambda: float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5")),
+
+    # --- Response Cache (Optional) ---
+    # 同一のメッセージ・パラメータによるAPI呼び出しの結果をディスクにキャッシュする (オプトイン)
+    # 有効にするには環境変数 RESPONSE_CACHE_ENABLED=1 を設定する
+    "RESPONSE_CACHE_ENABLED": lambda: os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1",
+    "RESPONSE_CACHE_PATH": lambda: os.getenv(
+        "RESPONSE_CACHE_PATH", os.path.join(DATA_DIR, 'cache', 'responses.sqlite3')
+    ),
+    "RESPONSE_CACHE_MAX_ENTRIES": lambda: int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+    "RESPONSE_CACHE_MAX_AGE_DAYS": lambda: float(os.getenv("RESPONSE_CACHE_MAX_AGE_DAYS", "30")),
+
+    # --- LLM Call Events (Optional) ---
+    # API呼び出しごとの計測イベント (src/core/instrumentation.py) を JSONL に追記する (オプトイン)
+    # 有効にするには環境変数 LLM_EVENTS_ENABLED=1 を設定する。集計は python -m src metrics
+    "LLM_EVENTS_ENABLED": lambda: os.getenv("LLM_EVENTS_ENABLED", "0") == "1",
+    "LLM_EVENTS_PATH": lambda: os.getenv("LLM_EVENTS_PATH", os.path.join(DATA_DIR, 'metrics', 'llm_calls.jsonl')),
+
+    # --- Local Model (Optional) ---
+    # LLM_BACKEND=local を設定すると、OpenAI API の代わりにローカルの Hugging Face モデル
+    # (src/core/local_hf_adapter.py) で生成する。torch と transformers が必要
+    "LLM_BACKEND": lambda: os.getenv("LLM_BACKEND", "openai"),
+    "LOCAL_MODEL_PATH": lambda: os.getenv("LOCAL_MODEL_PATH"),
+    # 同時に届いたリクエストを1バッチにまとめる上限件数と、後続のリクエストを待つ時間 (ミリ秒)
+    "LOCAL_MAX_BATCH_SIZE": lambda: int(os.getenv("LOCAL_MAX_BATCH_SIZE", "8")),
+    "LOCAL_BATCH_WAIT_MS": lambda: float(os.getenv("LOCAL_BATCH_WAIT_MS", "20")),
+}
 
 # --- Logging Configuration (Optional) ---
 # LOG_LEVEL = "INFO"
 
-# --- Sanity Check ---
-if not OPENAI_API_KEY:
+_dotenv_loaded = False
+
+
+def _load_dotenv_once() -> None:
+    global _dotenv_loaded
+    if _dotenv_loaded:
+        return
+    _dotenv_loaded = True
+    # python-dotenv の読み込みは時間がかかるため、環境変数由来の設定が初めて参照されたときに読み込む
+    from dotenv import load_dotenv
+    load_dotenv(DOTENV_PATH if os.path.exists(DOTENV_PATH) else None)
+
+
+def __getattr__(name: str) -> Any:
+    resolve = _ENV_SETTINGS.get(name)
+    if resolve is None:
+        # 未定義の設定は通常の属性と同じく AttributeError にする (hasattr(settings, ...) で判定できるように)
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    _load_dotenv_once()
+    value = resolve()
+    globals()[name] = value
+    return value
+
+
+def reload_env_settings() -> None:
+    """
+    解決済みの環境変数由来の設定を破棄し、次の参照時に環境変数から読み直すようにする。
+    テストや長時間動くプロセスで環境変数を変更した場合に使う。
+    """
+    for name in _ENV_SETTINGS:
+        globals().pop(name, None)
+
+
+def warn_if_api_key_missing() -> bool:
+    """
+    OPENAI_API_KEY が設定されているかを確認し、未設定なら警告を表示する。
+
+    Returns:
+        bool: 設定されていればTrue。
+    """
+    if getattr(sys.modules[__name__], "OPENAI_API_KEY"):
+        return True
     print("警告: 環境変数 OPENAI_API_KEY が設定されていません。")
-    print(f".envファイルのパス: {dotenv_path}")
-    print(f"OPENAI_API_KEY の値: {OPENAI_API_KEY}") # デバッグ用
-else:
-    print("環境変数 OPENAI_API_KEY は正常に読み込まれました。") # 成功時のメッセージを追加
+    print(f".envファイルのパス: {DOTENV_PATH}")
+    return False
+
 
 # --- For direct execution test ---
 if __name__ == "__main__":
+    api_key = getattr(sys.modules[__name__], "OPENAI_API_KEY")
     print("\n--- settings.py 実行テスト ---")
-    print(f"OpenAI API Key (最初の5文字): {OPENAI_API_KEY[:5]}..." if OPENAI_API_KEY else "OpenAI API Key: 未設定")
+    print(f"OpenAI API Key (最初の5文字): {api_key[:5]}..." if api_key else "OpenAI API Key: 未設定")
     print(f"Default Model Name: {DEFAULT_MODEL_NAME}")
-    print(f"Finetuned Model ID: {FINETUNED_MODEL_ID}")
+    print(f"Finetuned Model ID: {globals().get('FINETUNED_MODEL_ID', '未設定')}")
     print(f"Default Temperature: {DEFAULT_TEMPERATURE}")
     print(f"Default Max Tokens: {DEFAULT_MAX_TOKENS}")
-    print(f".env file path used: {dotenv_path}")
+    print(f".env file path used: {DOTENV_PATH}")
     print("--- テスト終了 ---")
@@ -0,0 +1,313 @@
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.core.rate_limiter import get_shared_rate_limiter
+
+# Batch API の1ファイルあたりの上限 (50,000 リクエスト / 200MB)。余裕を持たせて分割する
+MAX_REQUESTS_PER_BATCH_FILE = 50000
+MAX_BYTES_PER_BATCH_FILE = 190 * 1024 * 1024
+
+# これ以上状態が変わらないバッチのステータス
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def file_signature(file_path: str, variant: Dict[str, Any] = None) -> str:
+    """
+    入力ファイルの同一性を判定するための署名 (サイズと更新時刻)。
+    保存済みのジョブが今回の入力に対するものかどうかの確認に使う。
+    variant (記事の絞り込み条件など) を指定した場合は署名に含め、条件が違えば別の入力として扱う。
+    """
+    stat = os.stat(file_path)
+    signature = f"{stat.st_size}:{stat.st_mtime_ns}"
+    if variant:
+        signature += ":" + json.dumps(variant, ensure_ascii=False, sort_keys=True)
+    return signature
+
+
+class BatchRunner:
+    """
+    OpenAI Batch API へのリクエストの投入・完了待ち・結果の取得を行う。
+
+    ジョブの状態 (入力ファイル、アップロード済みファイルID、バッチID、結果ファイル) は
+    各ステップの後に state_path へ保存する。途中で中断しても、再実行時に続きから再開できる。
+    """
+
+    def __init__(
+        self,
+        client,
+        state_path: str,
+        endpoint: str,
+        work_dir: str = None,
+        completion_window: str = "24h",
+        poll_interval_seconds: float = 30.0,
+        max_poll_interval_seconds: float = 600.0,
+        max_requests_per_file: int = MAX_REQUESTS_PER_BATCH_FILE,
+        max_bytes_per_file: int = MAX_BYTES_PER_BATCH_FILE
+    ):
+        """
+        BatchRunnerのコンストラクタ。
+
+        Args:
+            client (OpenAI): OpenAIクライアント。
+            state_path (str): ジョブの状態を保存するJSONファイルのパス。
+            endpoint (str): バッチで呼び出すエンドポイント (例: "/v1/chat/completions")。
+            work_dir (str, optional): リクエストと結果のJSONLを置くディレクトリ。Noneの場合は state_path と同じ場所。
+            completion_window (str): バッチの完了期限。
+            poll_interval_seconds (float): 状態確認の初期間隔。
+            max_poll_interval_seconds (float): 状態に変化がない場合に延ばす確認間隔の上限。
+            max_requests_per_file (int): 1ファイル (1バッチ) あたりのリクエスト数の上限。
+            max_bytes_per_file (int): 1ファイルあたりのバイト数の上限。
+        """
+        self.client = client
+        self.state_path = state_path
+        self.endpoint = endpoint
+        self.work_dir = work_dir or os.path.dirname(os.path.abspath(state_path))
+        self.completion_window = completion_window
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+        self.max_requests_per_file = max_requests_per_file
+        self.max_bytes_per_file = max_bytes_per_file
+        self.rate_limiter = get_shared_rate_limiter("batch")
+        self.state = self._load_state()
+
+    # --- 状態の保存と読み込み ---
+
+    def _load_state(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"警告: バッチの状態ファイルを読み込めませんでした: {self.state_path} ({e})")
+            return None
+
+    def _save_state(self) -> None:
+        """
+        一時ファイルに書いてから置き換え、書き込み途中で中断しても状態ファイルが壊れないようにする。
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.state_path)
+
+    def has_pending_job(self, input_signature: str = None) -> bool:
+        """
+        結果をまだ取り込んでいないジョブがあるかどうか。input_signature を指定した場合は、
+        同じ入力から作ったジョブのみを対象とする。
+        """
+        if not self.state or self.state.get("merged"):
+            return False
+        if self.state.get("endpoint") != self.endpoint:
+            return False
+        return input_signature is None or self.state.get("input_signature") == input_signature
+
+    def mark_merged(self) -> None:
+        """
+        結果を出力に取り込み終えたことを記録する。以後の実行では新しいジョブを作成する。
+        """
+        if self.state:
+            self.state["merged"] = True
+            self.state["merged_at"] = datetime.now().isoformat(timespec="seconds")
+            self._save_state()
+
+    # --- 投入 ---
+
+    def _write_request_files(self, requests: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        リクエストを Batch API 形式のJSONLに書き出す。上限を超える場合は複数ファイルに分割する。
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        prefix = os.path.splitext(os.path.basename(self.state_path))[0]
+        entries: List[Dict[str, Any]] = []
+        current_file = None
+        current_count = 0
+        current_bytes = 0
+
+        def _open_next():
+            path = os.path.join(self.work_dir, f"{prefix}_input_{len(entries):03d}.jsonl")
+            entries.append({"input_path": path, "request_count": 0})
+            return open(path, 'w', encoding='utf-8')
+
+        try:
+            for request in requests:
+                line = json.dumps({
+                    "custom_id": request["custom_id"],
+                    "method": "POST",
+                    "url": self.endpoint,
+                    "body": request["body"],
+                }, ensure_ascii=False) + "\n"
+                line_bytes = len(line.encode("utf-8"))
+                if current_file is None or current_count >= self.max_requests_per_file \
+                        or current_bytes + line_bytes > self.max_bytes_per_file:
+                    if current_file is not None:
+                        current_file.close()
+                    current_file = _open_next()
+                    current_count = 0
+                    current_bytes = 0
+                current_file.write(line)
+                current_count += 1
+                current_bytes += line_bytes
+                entries[-1]["request_count"] = current_count
+        finally:
+            if current_file is not None:
+                current_file.close()
+        return entries
+
+    def submit(self, requests: Iterable[Dict[str, Any]], input_signature: str = None) -> int:
+        """
+        リクエストをファイルに書き出し、アップロードしてバッチを作成する。
+
+        Args:
+            requests (Iterable[dict]): {"custom_id": str, "body": dict} のリクエスト。
+            input_signature (str, optional): 入力ファイルの署名 (再開時の照合に使う)。
+
+        Returns:
+            int: 投入したリクエスト数。
+        """
+        batches = self._write_request_files(requests)
+        self.state = {
+            "endpoint": self.endpoint,
+            "input_signature": input_signature,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "merged": False,
+            "batches": batches,
+        }
+        self._save_state()
+        self._create_pending_batches()
+        return sum(entry["request_count"] for entry in batches)
+
+    def _create_pending_batches(self) -> None:
+        """
+        アップロードやバッチ作成が済んでいないファイルについて、残りのステップを実行する。
+        """
+        for entry in self.state["batches"]:
+            if not entry.get("input_file_id"):
+                with open(entry["input_path"], 'rb') as f:
+                    uploaded = self.rate_limiter.call(
+                        self.client.files.create,
+                        file=(os.path.basename(entry["input_path"]), f.read()),
+                        purpose="batch"
+                    )
+                entry["input_file_id"] = uploaded.id
+                self._save_state()
+                print(f"アップロード完了: {os.path.basename(entry['input_path'])} -> {uploaded.id}")
+            if not entry.get("batch_id"):
+                batch = self.rate_limiter.call(
+                    self.client.batches.create,
+                    input_file_id=entry["input_file_id"],
+                    endpoint=self.endpoint,
+                    completion_window=self.completion_window
+                )
+                entry["batch_id"] = batch.id
+                entry["status"] = batch.status
+                self._save_state()
+                print(f"バッチを作成しました: {batch.id} ({entry['request_count']}件)")
+
+    # --- 完了待ちと結果の取得 ---
+
+    def wait_for_completion(self) -> List[Dict[str, Any]]:
+        """
+        すべてのバッチが終了状態になるまで待ち、結果ファイルをダウンロードする。
+        状態や進捗に変化がない間は確認間隔を倍々に延ばし、変化があれば初期間隔に戻す。
+
+        Returns:
+            List[dict]: 各バッチの状態 (status, request_counts, output_path など)。
+        """
+        if not self.state:
+            return []
+        self._create_pending_batches()
+
+        interval = self.poll_interval_seconds
+        while True:
+            changed = False
+            for entry in self.state["batches"]:
+                if entry.get("status") in BATCH_TERMINAL_STATUSES:
+                    continue
+                batch = self.rate_limiter.call(self.client.batches.retrieve, entry["batch_id"])
+                counts = _request_counts(batch)
+                if batch.status != entry.get("status") or counts != entry.get("request_counts"):
+                    changed = True
+                    print(f"バッチ {entry['batch_id']}: {batch.status} "
+                          f"(完了 {counts.get('completed', 0)} / 失敗 {counts.get('failed', 0)} / 全 {counts.get('total', 0)})")
+                entry["status"] = batch.status
+                entry["request_counts"] = counts
+                entry["output_file_id"] = getattr(batch, "output_file_id", None)
+                entry["error_file_id"] = getattr(batch, "error_file_id", None)
+            if changed:
+                self._save_state()
+
+            if all(entry.get("status") in BATCH_TERMINAL_STATUSES for entry in self.state["batches"]):
+                break
+            interval = self.poll_interval_seconds if changed else min(self.max_poll_interval_seconds, interval * 2)
+            time.sleep(interval)
+
+        self._download_results()
+        return self.state["batches"]
+
+    def _download_results(self) -> None:
+        for entry in self.state["batches"]:
+            for file_key, path_key, suffix in (("output_file_id", "output_path", "output"),
+                                               ("error_file_id", "error_path", "errors")):
+                file_id = entry.get(file_key)
+                if not file_id or (entry.get(path_key) and os.path.exists(entry[path_key])):
+                    continue
+                path = entry["input_path"].replace("_input_", f"_{suffix}_")
+                temp_path = path + ".tmp"
+                content = self.rate_limiter.call(self.client.files.content, file_id)
+                with open(temp_path, 'wb') as f:
+                    f.write(content.read())
+                os.replace(temp_path, path)
+                entry[path_key] = path
+                self._save_state()
+
+    def iter_results(self) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]:
+        """
+        ダウンロード済みの結果を1件ずつ返す。
+
+        Yields:
+            Tuple[str, Optional[dict], Optional[str]]: (custom_id, 応答本文, エラーメッセージ)。
+            成功した場合はエラーメッセージが None、失敗した場合は応答本文が None。
+        """
+        returned_ids = set()
+        for entry in (self.state or {}).get("batches", []):
+            for path_key in ("output_path", "error_path"):
+                path = entry.get(path_key)
+                if not path or not os.path.exists(path):
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        result = json.loads(line)
+                        custom_id = result.get("custom_id")
+                        returned_ids.add(custom_id)
+                        response = result.get("response") or {}
+                        if result.get("error") or response.get("status_code") != 200:
+                            error = result.get("error") or (response.get("body") or {}).get("error") or {}
+                            yield custom_id, None, error.get("message") or f"status_code={response.get('status_code')}"
+                        else:
+                            yield custom_id, response.get("body"), None
+
+            # 期限切れやキャンセルで結果が返らなかったリクエストも失敗として返す
+            if entry.get("status") in BATCH_TERMINAL_STATUSES:
+                with open(entry["input_path"], 'r', encoding='utf-8') as f:
+                    for line in f:
+                        custom_id = json.loads(line).get("custom_id")
+                        if custom_id not in returned_ids:
+                            yield custom_id, None, f"バッチが {entry.get('status')} で終了し、結果がありません"
+
+
+def _request_counts(batch: Any) -> Dict[str, int]:
+    counts = getattr(batch, "request_counts", None)
+    if counts is None:
+        return {}
+    if isinstance(counts, dict):
+        return counts
+    return {key: getattr(counts, key, 0) for key in ("total", "completed", "failed")}
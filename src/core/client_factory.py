@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+try:
+    import httpx
+except ImportError:  # 新しい openai SDK は httpx の代わりに httpx2 に依存している
+    import httpx2 as httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from src.config import settings
+from src.core.instrumentation import on_http_response, on_http_response_async
+
+_lock = threading.Lock()
+# (APIキー, 接続先) -> 同期クライアント
+_sync_clients: Dict[Tuple[Optional[str], Optional[str]], OpenAI] = {}
+# イベントループ -> {(APIキー, 接続先) -> 非同期クライアント}
+# 非同期クライアントの接続は作成したイベントループでしか使えないため、ループごとに分けて持つ
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _connection_limits() -> "httpx.Limits":
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def _timeout() -> "httpx.Timeout":
+    return httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS)
+
+
+def get_openai_client(api_key: str = None, base_url: str = None) -> OpenAI:
+    """
+    プロセス内で共有する OpenAI クライアントを返す。同じAPIキーと接続先には同じクライアントを返すため、
+    アダプターやスクリプトが別々にクライアントを作っても、接続プール (Keep-Alive 済みの接続) を共有できる。
+
+    リトライはレートリミッターが Retry-After に従って行うため、SDK 側のリトライは無効にしている。
+
+    Args:
+        api_key (str, optional): APIキー。Noneの場合、settings の値を使用。
+        base_url (str, optional): 接続先。Noneの場合、settings の値を使用。
+
+    Returns:
+        OpenAI: 共有のクライアント。
+    """
+    key = (api_key or settings.OPENAI_API_KEY, base_url or settings.OPENAI_BASE_URL)
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                max_retries=0,
+                # 応答フックで最初のバイトの受信時刻を計測する (src/core/instrumentation.py)
+                http_client=DefaultHttpxClient(limits=_connection_limits(), timeout=_timeout(),
+                                               event_hooks={"response": [on_http_response]}),
+            )
+            _sync_clients[key] = client
+        return client
+
+
+def get_async_openai_client(api_key: str = None, base_url: str = None) -> AsyncOpenAI:
+    """
+    実行中のイベントループで共有する AsyncOpenAI クライアントを返す。
+    イベントループの外から呼び出した場合は、共有しない新しいクライアントを返す。
+
+    Args:
+        api_key (str, optional): APIキー。Noneの場合、settings の値を使用。
+        base_url (str, optional): 接続先。Noneの場合、settings の値を使用。
+
+    Returns:
+        AsyncOpenAI: 共有の非同期クライアント。
+    """
+    key = (api_key or settings.OPENAI_API_KEY, base_url or settings.OPENAI_BASE_URL)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    with _lock:
+        clients = _async_clients.setdefault(loop, {}) if loop is not None else {}
+        client = clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=_connection_limits(), timeout=_timeout(),
+                                                    event_hooks={"response": [on_http_response_async]}),
+            )
+            clients[key] = client
+        return client
+
+
+def close_openai_clients() -> None:
+    """
+    共有の同期クライアントを閉じ、接続プールを解放する。非同期クライアントはイベントループの終了とともに破棄される。
+    """
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,267 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from src.core.rate_limiter import get_shared_rate_limiter
+
+# これ以上状態が変わらないファインチューニングジョブのステータス
+JOB_TERMINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+# list_events の1ページあたりの件数 (API の上限は100)
+EVENTS_PAGE_SIZE = 100
+
+
+def _save_json_atomically(file_path: str, data: Any) -> None:
+    """
+    一時ファイルに書いてから置き換え、書き込み途中で中断してもファイルが壊れないようにする。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+def load_model_registry(registry_path: str) -> List[Dict[str, Any]]:
+    """
+    ファインチューニング済みモデルの登録簿を読み込む。ファイルがなければ空のリスト。
+    """
+    if not os.path.exists(registry_path):
+        return []
+    with open(registry_path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("models", [])
+
+
+def register_finetuned_model(registry_path: str, entry: Dict[str, Any]) -> bool:
+    """
+    ファインチューニング済みモデルを登録簿に追加する。同じモデルIDが登録済みなら何もしない。
+
+    Args:
+        registry_path (str): 登録簿 (JSON) のパス。
+        entry (dict): model_id, job_id, base_model, suffix, hyperparameters などを持つ登録内容。
+
+    Returns:
+        bool: 新しく登録した場合は True。
+    """
+    models = load_model_registry(registry_path)
+    if any(model.get("model_id") == entry["model_id"] for model in models):
+        return False
+    models.append({**entry, "registered_at": datetime.now().isoformat(timespec="seconds")})
+    _save_json_atomically(registry_path, {"models": models})
+    return True
+
+
+def latest_registered_model(registry_path: str, suffix: str = None) -> Optional[str]:
+    """
+    登録簿で最も新しいモデルのIDを返す。suffix を指定した場合はそのサフィックスのモデルに限る。
+    """
+    for model in reversed(load_model_registry(registry_path)):
+        if suffix is None or model.get("suffix") == suffix:
+            return model["model_id"]
+    return None
+
+
+class FineTuningMonitor:
+    """
+    複数のファインチューニングジョブのステータスとイベントを追跡する。
+
+    イベントは前回までに受け取った最新のイベントIDをカーソルとして、新しいものだけを取得する。
+    ジョブの状態 (ステータス、イベントのカーソル、最新のイベント) は変化のたびに state_path へ保存するため、
+    監視を中断しても、再実行時に同じジョブの監視を続きから再開できる。
+    ジョブが成功すると、ファインチューニング済みモデルのIDを registry_path の登録簿に追加する。
+    """
+
+    def __init__(
+        self,
+        client,
+        state_path: str,
+        registry_path: str,
+        poll_interval_seconds: float = 15.0,
+        max_poll_interval_seconds: float = 300.0,
+        max_workers: int = 4
+    ):
+        """
+        FineTuningMonitorのコンストラクタ。
+
+        Args:
+            client (OpenAI): OpenAIクライアント。
+            state_path (str): 追跡中のジョブの状態を保存するJSONファイルのパス。
+            registry_path (str): ファインチューニング済みモデルの登録簿 (JSON) のパス。
+            poll_interval_seconds (float): 状態確認の初期間隔。
+            max_poll_interval_seconds (float): 状態に変化がない場合に延ばす確認間隔の上限。
+            max_workers (int): 複数のジョブの状態を同時に確認するスレッド数。
+        """
+        self.client = client
+        self.state_path = state_path
+        self.registry_path = registry_path
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+        self.max_workers = max_workers
+        self.rate_limiter = get_shared_rate_limiter("fine_tuning")
+        self.state = self._load_state()
+
+    # --- 状態の保存と読み込み ---
+
+    def _load_state(self) -> Dict[str, Any]:
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"警告: ジョブの状態ファイルを読み込めませんでした: {self.state_path} ({e})")
+        return {"jobs": {}}
+
+    def _save_state(self) -> None:
+        _save_json_atomically(self.state_path, self.state)
+
+    # --- ジョブの登録 ---
+
+    def track(self, job: Any, label: str = None, suffix: str = None) -> None:
+        """
+        作成したジョブを追跡対象に加える。
+
+        Args:
+            job (FineTuningJob): fine_tuning.jobs.create の戻り値。
+            label (str, optional): 表示用の名前 (例: "n_epochs=3")。省略時はジョブID。
+            suffix (str, optional): ジョブの作成時に指定したサフィックス (登録簿に記録する)。
+        """
+        self.state["jobs"][job.id] = {
+            "label": label or job.id,
+            "status": job.status,
+            "base_model": job.model,
+            "suffix": suffix or getattr(job, "user_provided_suffix", None),
+            "training_file": job.training_file,
+            "validation_file": getattr(job, "validation_file", None),
+            "hyperparameters": _hyperparameters(job),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "last_event_id": None,
+            "last_message": None,
+            "fine_tuned_model": None,
+        }
+        self._save_state()
+
+    def active_job_ids(self) -> List[str]:
+        return [job_id for job_id, job in self.state["jobs"].items()
+                if job.get("status") not in JOB_TERMINAL_STATUSES]
+
+    # --- 監視 ---
+
+    def _fetch_new_events(self, job_id: str, last_event_id: Optional[str]) -> List[Any]:
+        """
+        last_event_id より新しいイベントを古い順に返す。
+        API は新しい順に返し、after には前のページの最後 (最も古い) のイベントIDを指定して遡る。
+        """
+        new_events = []
+        after = None
+        while True:
+            params = {"fine_tuning_job_id": job_id, "limit": EVENTS_PAGE_SIZE}
+            if after:
+                params["after"] = after
+            page = self.rate_limiter.call(self.client.fine_tuning.jobs.list_events, **params)
+            for event in page.data:
+                if event.id == last_event_id:
+                    return list(reversed(new_events))
+                new_events.append(event)
+            if not page.data or not getattr(page, "has_more", False):
+                return list(reversed(new_events))
+            after = page.data[-1].id
+
+    def _poll_job(self, job_id: str):
+        job = self.rate_limiter.call(self.client.fine_tuning.jobs.retrieve, job_id)
+        events = self._fetch_new_events(job_id, self.state["jobs"][job_id].get("last_event_id"))
+        return job, events
+
+    def poll_once(self) -> bool:
+        """
+        追跡中で未完了のジョブの状態と新しいイベントを取得する。複数のジョブはスレッドで同時に確認する。
+
+        Returns:
+            bool: いずれかのジョブに変化 (ステータスの変化または新しいイベント) があった場合は True。
+        """
+        job_ids = self.active_job_ids()
+        if not job_ids:
+            return False
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(job_ids)))) as executor:
+            polled = list(zip(job_ids, executor.map(self._poll_job, job_ids)))
+
+        changed = False
+        for job_id, (job, events) in polled:
+            entry = self.state["jobs"][job_id]
+            for event in events:
+                timestamp = datetime.fromtimestamp(event.created_at).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"[{entry['label']}] {timestamp} [{event.level}] {event.message}")
+            if events:
+                entry["last_event_id"] = events[-1].id
+                entry["last_message"] = events[-1].message
+                changed = True
+            if job.status != entry.get("status"):
+                print(f"[{entry['label']}] ステータス: {entry.get('status')} -> {job.status}")
+                entry["status"] = job.status
+                changed = True
+                if job.status in JOB_TERMINAL_STATUSES:
+                    self._finish_job(job_id, job)
+        if changed:
+            self._save_state()
+        return changed
+
+    def _finish_job(self, job_id: str, job: Any) -> None:
+        entry = self.state["jobs"][job_id]
+        entry["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        if job.status == "succeeded":
+            entry["fine_tuned_model"] = job.fine_tuned_model
+            entry["trained_tokens"] = getattr(job, "trained_tokens", None)
+            registered = register_finetuned_model(self.registry_path, {
+                "model_id": job.fine_tuned_model,
+                "job_id": job_id,
+                "label": entry["label"],
+                "base_model": entry["base_model"],
+                "suffix": entry.get("suffix"),
+                "hyperparameters": _hyperparameters(job) or entry.get("hyperparameters"),
+                "trained_tokens": entry["trained_tokens"],
+                "training_file": entry.get("training_file"),
+                "validation_file": entry.get("validation_file"),
+            })
+            print(f"[{entry['label']}] ファインチューニングが成功しました！ モデルID: {job.fine_tuned_model}")
+            if registered:
+                print(f"[{entry['label']}] モデルを登録簿に追加しました: {self.registry_path}")
+        else:
+            error = getattr(job, "error", None)
+            entry["error"] = getattr(error, "message", None) if error else None
+            print(f"[{entry['label']}] ファインチューニングが {job.status} しました。")
+            if error and getattr(error, "message", None):
+                print(f"  Code: {error.code}")
+                print(f"  Message: {error.message}")
+                print(f"  Param: {error.param}")
+
+    def wait(self) -> Dict[str, Dict[str, Any]]:
+        """
+        追跡中のすべてのジョブが終了するまで監視する。
+        変化がない間は確認間隔を倍々に延ばし、変化があれば初期間隔に戻す。
+        Ctrl+C で中断しても状態は保存済みなので、新しい FineTuningMonitor から再開できる。
+
+        Returns:
+            Dict[str, dict]: ジョブIDごとの最終的な状態。
+        """
+        interval = self.poll_interval_seconds
+        while True:
+            changed = self.poll_once()
+            if not self.active_job_ids():
+                return self.state["jobs"]
+            interval = self.poll_interval_seconds if changed else min(self.max_poll_interval_seconds, interval * 2)
+            time.sleep(interval)
+
+
+def _hyperparameters(job: Any) -> Dict[str, Any]:
+    hyperparameters = getattr(job, "hyperparameters", None)
+    if hyperparameters is None:
+        return {}
+    if isinstance(hyperparameters, dict):
+        return hyperparameters
+    if hasattr(hyperparameters, "model_dump"):
+        return hyperparameters.model_dump(exclude_none=True)
+    return {key: getattr(hyperparameters, key) for key in ("n_epochs", "batch_size", "learning_rate_multiplier")
+            if getattr(hyperparameters, key, None) is not None}
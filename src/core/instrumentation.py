@@ -0,0 +1,332 @@
+"""
+LLM API 呼び出しの計測。
+
+呼び出しごとに、モデル・トークン数・所要時間・最初のバイトまでの時間・リトライ回数・キャッシュヒット・
+finish_reason・推定費用を1件のイベント (dict) にまとめ、登録されたフックへ渡す。
+settings.LLM_EVENTS_ENABLED が真の場合は、既定のフックとして settings.LLM_EVENTS_PATH (JSONL) へ追記する。
+集計は summarize_events で行う (python -m src metrics)。
+
+フックが1つも登録されていない場合、イベントは作成されるだけで書き出されない。
+"""
+import json
+import math
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from src.config import settings
+
+# チャットの利用料金 (USD / 100万トークン, (入力, 出力))。モデル名の前方一致で探す。料金改定時はここを更新する
+CHAT_PRICE_PER_MILLION_TOKENS = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "ft:gpt-3.5-turbo": (3.00, 6.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "ft:gpt-4o-mini": (0.30, 1.20),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+EventHook = Callable[[Dict[str, Any]], None]
+
+_hooks: List[EventHook] = []
+_hooks_lock = threading.Lock()
+_default_sink_checked = False
+# イベントの "script" に入れる実行元の名前。python -m src では実行中のサブコマンド名に置き換える
+_event_source = os.path.splitext(os.path.basename(sys.argv[0] or ""))[0] or "python"
+# 実行中の呼び出しの計測 (HTTPの応答フックから最初のバイトの受信時刻を書き込むために使う)
+_current_call: ContextVar[Optional["CallRecorder"]] = ContextVar("llm_call", default=None)
+
+
+class JsonlEventSink:
+    """
+    イベントを1行1件のJSONとしてファイルに追記するフック。複数スレッドから呼び出してよい。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            # 途中で中断しても、それまでのイベントは残るように1件ごとに書き出す
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def add_event_hook(hook: EventHook) -> None:
+    """
+    呼び出しごとのイベントを受け取るフックを登録する。
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_event_hook(hook: EventHook) -> None:
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def set_event_source(name: str) -> None:
+    """
+    以降のイベントの "script" に記録する実行元の名前を設定する。
+    """
+    global _event_source
+    _event_source = name
+
+
+def _ensure_default_sink() -> None:
+    global _default_sink_checked
+    if _default_sink_checked:
+        return
+    with _hooks_lock:
+        if _default_sink_checked:
+            return
+        _default_sink_checked = True
+        if settings.LLM_EVENTS_ENABLED:
+            _hooks.append(JsonlEventSink(settings.LLM_EVENTS_PATH))
+
+
+def emit_event(event: Dict[str, Any]) -> None:
+    """
+    イベントを登録済みのフックへ渡す。フックで発生した例外は呼び出し元の処理を止めないよう警告にとどめる。
+    """
+    _ensure_default_sink()
+    if not _hooks:
+        return
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            print(f"警告: 計測イベントの記録に失敗しました: {e}")
+
+
+def estimate_cost_usd(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Optional[float]:
+    """
+    トークン数から利用料金を推定する。単価が分からないモデルやトークン数が不明な場合は None。
+    """
+    if prompt_tokens is None and completion_tokens is None:
+        return None
+    for known_model in sorted(CHAT_PRICE_PER_MILLION_TOKENS, key=len, reverse=True):
+        if (model or "").startswith(known_model):
+            input_price, output_price = CHAT_PRICE_PER_MILLION_TOKENS[known_model]
+            return ((prompt_tokens or 0) * input_price + (completion_tokens or 0) * output_price) / 1_000_000
+    return None
+
+
+def _field(value: Any, name: str) -> Any:
+    return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+
+class CallRecorder:
+    """
+    1回のAPI呼び出しの計測値を集め、finish でイベントとして記録する。
+
+    使い方:
+        call = CallRecorder(model)
+        response = limiter.call(call.wrap(client.chat.completions.create), ...)
+        call.finish(response=response)
+
+    wrap した関数が呼ばれた回数を試行回数 (リトライを含む) として数える。
+    最初のバイトまでの時間は、最後の試行の開始から応答ヘッダーを受信するまでの時間
+    (client_factory のクライアントに登録した HTTP の応答フックで記録する)。
+    """
+
+    def __init__(self, model: str, operation: str = "chat.completions", stream: bool = False):
+        self.model = model
+        self.operation = operation
+        self.stream = stream
+        self.attempts = 0
+        self._start = time.perf_counter()
+        self._attempt_start: Optional[float] = None
+        self._first_byte: Optional[float] = None
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        同期関数を試行回数と最初のバイトの計測付きで呼び出す関数を返す。
+        """
+        def _call(*args: Any, **kwargs: Any) -> Any:
+            token = self._begin_attempt()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current_call.reset(token)
+        return _call
+
+    def wrap_async(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        wrap のコルーチン関数版。
+        """
+        async def _call(*args: Any, **kwargs: Any) -> Any:
+            token = self._begin_attempt()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current_call.reset(token)
+        return _call
+
+    def _begin_attempt(self):
+        self.attempts += 1
+        self._attempt_start = time.perf_counter()
+        self._first_byte = None
+        return _current_call.set(self)
+
+    def mark_first_byte(self) -> None:
+        if self._first_byte is None:
+            self._first_byte = time.perf_counter()
+
+    def finish(self, response: Any = None, usage: Any = None, finish_reason: str = None,
+               time_to_first_token: float = None, cache_hit: bool = False,
+               error: Exception = None) -> Dict[str, Any]:
+        """
+        計測を終えてイベントを記録する。
+
+        Args:
+            response (Any, optional): API の応答。usage と finish_reason を取り出す。
+            usage (Any, optional): ストリーミングの最後のチャンクなどで受け取った usage。
+            finish_reason (str, optional): response から取り出せない場合の finish_reason。
+            time_to_first_token (float, optional): ストリーミングで最初のテキストを受信するまでの秒数。
+            cache_hit (bool): 応答キャッシュから返した場合はTrue。
+            error (Exception, optional): 呼び出しが失敗した場合の例外。
+
+        Returns:
+            Dict[str, Any]: 記録したイベント。
+        """
+        latency = time.perf_counter() - self._start
+        if response is not None:
+            usage = usage or _field(response, "usage")
+            choices = _field(response, "choices") or []
+            if choices and finish_reason is None:
+                finish_reason = _field(choices[0], "finish_reason")
+        prompt_tokens = _field(usage, "prompt_tokens") if usage is not None else None
+        completion_tokens = _field(usage, "completion_tokens") if usage is not None else None
+        time_to_first_byte = None
+        if self._first_byte is not None and self._attempt_start is not None:
+            time_to_first_byte = self._first_byte - self._attempt_start
+
+        event = {
+            "timestamp": time.time(),
+            "script": _event_source,
+            "operation": self.operation,
+            "model": self.model,
+            "stream": self.stream,
+            "latency_seconds": round(latency, 6),
+            "time_to_first_byte_seconds": None if time_to_first_byte is None else round(time_to_first_byte, 6),
+            "time_to_first_token_seconds": None if time_to_first_token is None else round(time_to_first_token, 6),
+            "attempts": self.attempts,
+            "retries": max(0, self.attempts - 1),
+            "cache_hit": cache_hit,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "finish_reason": finish_reason,
+            # キャッシュから返した呼び出しは課金されない
+            "estimated_cost_usd": 0.0 if cache_hit else estimate_cost_usd(self.model, prompt_tokens, completion_tokens),
+            "error": None if error is None else f"{type(error).__name__}: {error}",
+        }
+        emit_event(event)
+        return event
+
+
+def on_http_response(response: Any) -> None:
+    """
+    同期 HTTP クライアントの応答フック。応答ヘッダーの受信時刻を実行中の呼び出しに記録する。
+    """
+    call = _current_call.get()
+    if call is not None:
+        call.mark_first_byte()
+
+
+async def on_http_response_async(response: Any) -> None:
+    """
+    非同期 HTTP クライアントの応答フック。
+    """
+    on_http_response(response)
+
+
+# --- 集計 ---
+
+def read_events(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    JSONL のイベントファイルを読み込む。壊れた行 (書き込み途中で中断した末尾など) は読み飛ばす。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """
+    昇順に並んだ値から最近接順位法でパーセンタイルを求める。値がなければ None。
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize_events(events: Iterable[Dict[str, Any]], group_by: Iterable[str] = ("script", "model")) -> List[Dict[str, Any]]:
+    """
+    イベントを group_by のキーごとに集計する。
+    レイテンシのパーセンタイルとトークン/秒は、キャッシュヒットと失敗を除いた API 呼び出しだけから求める。
+
+    Args:
+        events (Iterable[Dict[str, Any]]): イベント。
+        group_by (Iterable[str]): 集計の単位にするキー (例: ("model",), ("script", "model"))。
+
+    Returns:
+        List[Dict[str, Any]]: グループごとの集計。calls, errors, cache_hits, retries,
+            p50/p95/p99_latency_seconds, p50_time_to_first_byte_seconds, prompt_tokens, completion_tokens,
+            completion_tokens_per_second, estimated_cost_usd を含む。
+    """
+    group_by = tuple(group_by)
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for event in events:
+        groups.setdefault(tuple(event.get(key) for key in group_by), []).append(event)
+
+    rows = []
+    for key in sorted(groups, key=lambda k: tuple(str(v) for v in k)):
+        group = groups[key]
+        api_calls = [e for e in group if not e.get("cache_hit") and not e.get("error")]
+        latencies = sorted(e["latency_seconds"] for e in api_calls if e.get("latency_seconds") is not None)
+        first_bytes = sorted(e["time_to_first_byte_seconds"] for e in api_calls
+                             if e.get("time_to_first_byte_seconds") is not None)
+        timed_completion_tokens = sum(e.get("completion_tokens") or 0 for e in api_calls)
+        total_latency = sum(latencies)
+        costs = [e["estimated_cost_usd"] for e in group if e.get("estimated_cost_usd") is not None]
+        row = dict(zip(group_by, key))
+        row.update({
+            "calls": len(group),
+            "errors": sum(1 for e in group if e.get("error")),
+            "cache_hits": sum(1 for e in group if e.get("cache_hit")),
+            "retries": sum(e.get("retries") or 0 for e in group),
+            "p50_latency_seconds": percentile(latencies, 0.50),
+            "p95_latency_seconds": percentile(latencies, 0.95),
+            "p99_latency_seconds": percentile(latencies, 0.99),
+            "p50_time_to_first_byte_seconds": percentile(first_bytes, 0.50),
+            "prompt_tokens": sum(e.get("prompt_tokens") or 0 for e in group),
+            "completion_tokens": sum(e.get("completion_tokens") or 0 for e in group),
+            # 呼び出しの所要時間の合計あたりの出力トークン数 (同時実行による重なりは考慮しない)
+            "completion_tokens_per_second": timed_completion_tokens / total_latency if total_latency > 0 else None,
+            "estimated_cost_usd": sum(costs) if costs else None,
+        })
+        rows.append(row)
+    return rows
@@ -0,0 +1,363 @@
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+except ImportError:  # torch と transformers は任意。ローカルモデルを使う場合のみ必要
+    torch = None
+    AutoModelForCausalLM = AutoTokenizer = None
+
+from src.config import settings
+from src.core.dynamic_batcher import DynamicBatcher
+from src.core.llm_client_interface import LLMClientInterface
+
+DEFAULT_LOCAL_MAX_TOKENS = 1024
+DEFAULT_PREFIX_CACHE_SIZE = 8
+# 共通部分がこれより短い場合は、KVキャッシュを作って再利用しても効果が小さいため作らない
+MIN_SHARED_PREFIX_TOKENS = 16
+
+
+def common_prefix_length(sequences: Sequence[Sequence[int]]) -> int:
+    """
+    トークンID列の先頭から一致している長さを返す。
+    """
+    if not sequences:
+        return 0
+    shortest = min(len(sequence) for sequence in sequences)
+    first = sequences[0]
+    for index in range(shortest):
+        token = first[index]
+        if any(sequence[index] != token for sequence in sequences[1:]):
+            return index
+    return shortest
+
+
+class PrefixKVCache:
+    """
+    プロンプトの共通部分 (システムプロンプトや文体例など) の KV キャッシュを保持する LRU キャッシュ。
+    キーは共通部分のトークンID列。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_PREFIX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, ...], Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, sequences: Sequence[Sequence[int]], max_length: int) -> Tuple[int, Any]:
+        """
+        すべての sequences の先頭に一致し、長さが max_length 以下の最長のキャッシュを探す。
+
+        Returns:
+            Tuple[int, Any]: (共通部分の長さ, past_key_values)。見つからなければ (0, None)。
+        """
+        best_key = None
+        for key in self._entries:
+            if len(key) > max_length or (best_key is not None and len(key) <= len(best_key)):
+                continue
+            if all(tuple(sequence[:len(key)]) == key for sequence in sequences):
+                best_key = key
+        if best_key is None:
+            self.misses += 1
+            return 0, None
+        self.hits += 1
+        self._entries.move_to_end(best_key)
+        return len(best_key), self._entries[best_key]
+
+    def store(self, prefix_ids: Sequence[int], past_key_values: Any) -> None:
+        key = tuple(prefix_ids)
+        self._entries[key] = past_key_values
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class LocalHFAdapter(LLMClientInterface):
+    """
+    ローカルの Hugging Face (transformers) モデルでテキスト生成を行うアダプター。
+    OpenAIAdapter と同じ呼び出し方 (messages と generation_params) に対応しており、
+    ArticleGenerator の client_adapter としてそのまま使える。
+
+    同時に届いた generate_text / generate_text_async の呼び出しは DynamicBatcher で1つのバッチにまとめ、
+    パディングした上で1回の forward で処理する。バッチ内のプロンプトに共通する先頭部分は
+    KV キャッシュを作って保存し、次のバッチからは共通部分の計算を省略する。
+    """
+
+    def __init__(
+        self,
+        model_name_or_path: str = None,
+        device: str = "cpu",
+        max_batch_size: int = None,
+        max_batch_wait_ms: float = None,
+        prefix_cache_size: int = DEFAULT_PREFIX_CACHE_SIZE,
+        torch_dtype: Any = None
+    ):
+        """
+        LocalHFAdapterのコンストラクタ。モデルとトークナイザーを読み込む。
+
+        Args:
+            model_name_or_path (str, optional): モデルのパスまたは Hugging Face Hub のモデル名。
+                                                Noneの場合、settings.LOCAL_MODEL_PATH を使用。
+            device (str): 推論に使うデバイス ("cpu", "cuda" など)。
+            max_batch_size (int, optional): 1バッチにまとめるリクエスト数の上限。Noneの場合、settingsの値を使用。
+            max_batch_wait_ms (float, optional): 後続のリクエストを待つ最大時間 (ミリ秒)。Noneの場合、settingsの値を使用。
+            prefix_cache_size (int): 保持する共通部分の KV キャッシュの数。
+            torch_dtype (torch.dtype, optional): モデルの重みの型。Noneの場合は float32。
+
+        Raises:
+            ImportError: torch または transformers がインストールされていない場合。
+            ValueError: モデルのパスが指定されていない場合。
+        """
+        if torch is None:
+            raise ImportError("LocalHFAdapter を使うには torch と transformers をインストールしてください。")
+        model_name_or_path = model_name_or_path or settings.LOCAL_MODEL_PATH
+        if not model_name_or_path:
+            raise ValueError("ローカルモデルのパスが指定されていません。環境変数 LOCAL_MODEL_PATH を設定してください。")
+
+        self.default_model = model_name_or_path
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch_dtype or torch.float32)
+        self.model.to(device)
+        self.model.eval()
+
+        self.pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None \
+            else self.tokenizer.eos_token_id
+        eos_token_ids = getattr(self.model.generation_config, "eos_token_id", None) or self.tokenizer.eos_token_id
+        self.eos_token_ids = set(eos_token_ids if isinstance(eos_token_ids, (list, tuple)) else [eos_token_ids])
+        self.max_positions = getattr(self.model.config, "max_position_embeddings", None)
+
+        # OpenAIAdapter と同じ属性。ローカルモデルでは応答キャッシュを使わない
+        self.response_cache = None
+        self.last_stream_metrics = {}
+        self.prefix_cache = PrefixKVCache(prefix_cache_size)
+        self.batcher = DynamicBatcher(
+            self._run_batch,
+            max_batch_size=max_batch_size or settings.LOCAL_MAX_BATCH_SIZE,
+            max_wait_seconds=(max_batch_wait_ms if max_batch_wait_ms is not None else settings.LOCAL_BATCH_WAIT_MS) / 1000,
+            name="local-hf-batcher"
+        )
+
+    # --- 公開メソッド ---
+
+    def generate_text(self, messages=None, generation_params: dict = None, **kwargs: Any) -> str:
+        """
+        ローカルモデルでテキストを生成する。他のスレッドからの同時呼び出しとまとめてバッチ処理される。
+
+        Args:
+            messages (list | str): チャット形式のメッセージのリスト。文字列の場合は1件のユーザーメッセージとして扱う。
+            generation_params (dict, optional): temperature, max_tokens, top_p,
+                                                frequency_penalty, presence_penalty に対応する。
+            **kwargs: LLMClientInterface の prompt, temperature, max_tokens (generation_params より優先)。
+
+        Returns:
+            str: 生成されたテキスト。エラー時は "エラー:" で始まるメッセージ。
+        """
+        if messages is None:
+            messages = kwargs.pop("prompt", "")
+        try:
+            request = self._build_request(messages, generation_params, kwargs)
+            return self.batcher.submit(request).result()
+        except Exception as e:
+            error_message = f"エラー: ローカルモデルでの生成中にエラーが発生しました ({e})"
+            print(error_message)
+            return error_message
+
+    async def generate_text_async(self, messages, generation_params: dict = None) -> str:
+        """
+        generate_text の asyncio 版。generate_many_async から並行に呼ばれたリクエストは同じバッチにまとまる。
+        """
+        try:
+            request = self._build_request(messages, generation_params, {})
+            return await asyncio.wrap_future(self.batcher.submit(request))
+        except Exception as e:
+            error_message = f"エラー: ローカルモデルでの生成中にエラーが発生しました ({e})"
+            print(error_message)
+            return error_message
+
+    def generate_text_stream(self, messages, generation_params: dict = None) -> Iterator[str]:
+        """
+        OpenAIAdapter.generate_text_stream と同じ呼び出し方に対応する。
+        バッチ処理では生成が終わるまで結果が確定しないため、生成したテキスト全体を1チャンクで返す。
+        """
+        start_time = time.perf_counter()
+        self.last_stream_metrics = {
+            "model": self.default_model,
+            "time_to_first_token": None,
+            "total_latency": None,
+            "chunks": 0,
+            "cache_hit": False,
+        }
+        generated_text = self.generate_text(messages, generation_params)
+        elapsed = time.perf_counter() - start_time
+        self.last_stream_metrics.update(time_to_first_token=elapsed, total_latency=elapsed, chunks=1)
+        yield generated_text
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        バッチ処理と共通部分の KV キャッシュの統計を返す。
+        """
+        return {
+            **self.batcher.stats(),
+            "prefix_cache_hits": self.prefix_cache.hits,
+            "prefix_cache_misses": self.prefix_cache.misses,
+        }
+
+    def close(self) -> None:
+        self.batcher.close()
+
+    # --- リクエストの組み立て ---
+
+    def _encode_messages(self, messages: List[Dict[str, Any]]) -> List[int]:
+        if getattr(self.tokenizer, "chat_template", None):
+            return list(self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=True))
+        # チャットテンプレートを持たないモデルでは、役割名を付けた単純な形式にする
+        text = "".join(f"{message['role']}: {message['content']}\n" for message in messages) + "assistant: "
+        return self.tokenizer.encode(text)
+
+    def _build_request(self, messages, generation_params: Optional[dict], overrides: Dict[str, Any]) -> Dict[str, Any]:
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        params = dict(generation_params) if generation_params else {}
+        params.update({key: value for key, value in overrides.items() if value is not None})
+
+        input_ids = self._encode_messages(messages)
+        max_new_tokens = int(params.get("max_tokens") or DEFAULT_LOCAL_MAX_TOKENS)
+        if self.max_positions:
+            if len(input_ids) >= self.max_positions:
+                raise ValueError(f"プロンプト ({len(input_ids)} トークン) がモデルの上限 ({self.max_positions} トークン) を超えています。")
+            max_new_tokens = min(max_new_tokens, self.max_positions - len(input_ids))
+        return {
+            "input_ids": input_ids,
+            "max_new_tokens": max_new_tokens,
+            "temperature": float(params.get("temperature", settings.DEFAULT_TEMPERATURE)),
+            "top_p": float(params.get("top_p", settings.DEFAULT_TOP_P)),
+            "frequency_penalty": float(params.get("frequency_penalty") or 0.0),
+            "presence_penalty": float(params.get("presence_penalty") or 0.0),
+        }
+
+    # --- バッチ処理 (DynamicBatcher のワーカースレッドで実行) ---
+
+    def _resolve_prefix(self, sequences: List[List[int]]) -> Tuple[int, Any]:
+        """
+        バッチ内のプロンプトに共通する先頭部分の KV キャッシュを返す。
+        保存済みのものがなければ、2件以上のバッチに限り新しく計算して保存する
+        (1件だけのバッチではプロンプト全体が「共通部分」になり、再利用されないため)。
+        """
+        # 各行に1トークン以上の残りを残し、その forward の出力から次のトークンを得る
+        shared_length = min(common_prefix_length(sequences), min(len(sequence) for sequence in sequences) - 1)
+        cached_length, cached_past = self.prefix_cache.lookup(sequences, shared_length)
+        if len(sequences) > 1 and shared_length >= MIN_SHARED_PREFIX_TOKENS and cached_length < shared_length:
+            prefix_ids = sequences[0][:shared_length]
+            output = self.model(
+                input_ids=torch.tensor([prefix_ids], device=self.device),
+                use_cache=True
+            )
+            self.prefix_cache.store(prefix_ids, output.past_key_values)
+            return shared_length, output.past_key_values
+        return cached_length, cached_past
+
+    @staticmethod
+    def _expand_past(past_key_values: Any, batch_size: int) -> Any:
+        """
+        1件分の KV キャッシュをバッチサイズ分に複製する。生成中にキャッシュは追記されるため、保存済みのものは変更しない。
+        """
+        if hasattr(past_key_values, "batch_repeat_interleave"):
+            expanded = copy.deepcopy(past_key_values)
+            expanded.batch_repeat_interleave(batch_size)
+            return expanded
+        return tuple(tuple(tensor.repeat_interleave(batch_size, dim=0) for tensor in layer) for layer in past_key_values)
+
+    def _sample(self, logits, requests: List[Dict[str, Any]], token_counts):
+        logits = logits.float()
+        frequency = torch.tensor([r["frequency_penalty"] for r in requests], device=logits.device).unsqueeze(1)
+        presence = torch.tensor([r["presence_penalty"] for r in requests], device=logits.device).unsqueeze(1)
+        # OpenAI と同じ定義: 生成済みの出現回数に比例するペナルティと、出現の有無によるペナルティ
+        logits = logits - frequency * token_counts - presence * (token_counts > 0).float()
+
+        temperatures = torch.tensor([r["temperature"] for r in requests], device=logits.device)
+        top_ps = torch.tensor([r["top_p"] for r in requests], device=logits.device).unsqueeze(1)
+        probabilities = torch.softmax(logits / temperatures.clamp(min=1e-5).unsqueeze(1), dim=-1)
+        sorted_probabilities, sorted_indices = probabilities.sort(dim=-1, descending=True)
+        # 累積確率が top_p を超えた後のトークンを除外する (最も確率の高いトークンは常に残る)
+        outside_top_p = sorted_probabilities.cumsum(dim=-1) - sorted_probabilities > top_ps
+        sorted_probabilities = sorted_probabilities.masked_fill(outside_top_p, 0.0)
+        sampled = sorted_indices.gather(-1, torch.multinomial(sorted_probabilities, 1)).squeeze(-1)
+        return torch.where(temperatures <= 0, logits.argmax(dim=-1), sampled)
+
+    def _run_batch(self, requests: List[Dict[str, Any]]) -> List[str]:
+        """
+        リクエストのバッチをまとめて生成する。
+        共通部分は KV キャッシュで済ませ、残りの部分を左側にパディングして揃えてから1トークンずつ生成する。
+        """
+        with torch.inference_mode():
+            batch_size = len(requests)
+            sequences = [request["input_ids"] for request in requests]
+            prefix_length, prefix_past = self._resolve_prefix(sequences)
+            past_key_values = self._expand_past(prefix_past, batch_size) if prefix_past is not None else None
+
+            suffixes = [sequence[prefix_length:] for sequence in sequences]
+            suffix_length = max(len(suffix) for suffix in suffixes)
+            input_ids = torch.full((batch_size, suffix_length), self.pad_token_id, dtype=torch.long, device=self.device)
+            suffix_mask = torch.zeros((batch_size, suffix_length), dtype=torch.long, device=self.device)
+            for row, suffix in enumerate(suffixes):
+                input_ids[row, suffix_length - len(suffix):] = torch.tensor(suffix, dtype=torch.long, device=self.device)
+                suffix_mask[row, suffix_length - len(suffix):] = 1
+            attention_mask = torch.cat(
+                [torch.ones((batch_size, prefix_length), dtype=torch.long, device=self.device), suffix_mask], dim=1
+            )
+            # パディングを挟んでも各トークンの位置が元のプロンプトと同じになるよう、位置を明示する
+            position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)[:, prefix_length:]
+
+            output = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True
+            )
+            logits, past_key_values = output.logits[:, -1, :], output.past_key_values
+            next_positions = position_ids[:, -1] + 1
+
+            generated: List[List[int]] = [[] for _ in requests]
+            finished = [request["max_new_tokens"] <= 0 for request in requests]
+            token_counts = torch.zeros_like(logits, dtype=torch.float)
+            while not all(finished):
+                next_tokens = self._sample(logits, requests, token_counts)
+                for row, token in enumerate(next_tokens.tolist()):
+                    if finished[row]:
+                        continue
+                    if token in self.eos_token_ids:
+                        finished[row] = True
+                        continue
+                    generated[row].append(token)
+                    token_counts[row, token] += 1
+                    if len(generated[row]) >= requests[row]["max_new_tokens"]:
+                        finished[row] = True
+                if all(finished):
+                    break
+
+                # 終了した行にはパディングを入力して計算を続ける (結果は使わない)
+                next_tokens = torch.where(
+                    torch.tensor(finished, device=self.device),
+                    torch.full_like(next_tokens, self.pad_token_id),
+                    next_tokens
+                )
+                attention_mask = torch.cat(
+                    [attention_mask, torch.ones((batch_size, 1), dtype=torch.long, device=self.device)], dim=1
+                )
+                output = self.model(
+                    input_ids=next_tokens.unsqueeze(1),
+                    attention_mask=attention_mask,
+                    position_ids=next_positions.unsqueeze(1),
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+                logits, past_key_values = output.logits[:, -1, :], output.past_key_values
+                next_positions = next_positions + 1
+
+        return [self.tokenizer.decode(tokens, skip_special_tokens=True) for tokens in generated]
@@ -1,25 +1,62 @@
-from openai import OpenAI
+import time
+from typing import Iterator
+
+from openai import AsyncOpenAI
 from src.config import settings
+from src.core.client_factory import get_async_openai_client, get_openai_client
+from src.core.instrumentation import CallRecorder
+from src.core.response_cache import ResponseCache
+from src.core.rate_limiter import RateLimiter, get_shared_rate_limiter, estimate_request_tokens
+from src.utils.structure_validator import SectionStructureValidator
+
+
+def structure_violation_message(violation: str) -> str:
+    """
+    構成の検証で生成を中断したときに返すエラーメッセージ。
+    """
+    return f"エラー: 記事の構成が崩れたため生成を中断しました ({violation})"
+
+
+def _finish_structure_validation(validator: SectionStructureValidator, finish_reason: str) -> None:
+    # max_tokens で打ち切られた場合は見出しが足りなくても構成の崩れとはみなさない (再試行しても同じ結果になるため)
+    if validator is not None and finish_reason != "length":
+        validator.finish()
 
 class OpenAIAdapter:
     """
     OpenAI APIを利用してテキスト生成を行うためのアダプタークラス。
     """
 
-    def __init__(self, api_key: str = None, default_model: str = None):
+    def __init__(self, api_key: str = None, default_model: str = None, response_cache: ResponseCache = None,
+                 rate_limiter: RateLimiter = None):
         """
         OpenAIAdapterのコンストラクタ。
 
         Args:
             api_key (str, optional): OpenAI APIキー。Noneの場合、settingsから読み込む。
             default_model (str, optional): デフォルトで使用するモデル名。Noneの場合、settingsから読み込む。
+            response_cache (ResponseCache, optional): 応答キャッシュ。Noneの場合、
+                                                     settings.RESPONSE_CACHE_ENABLED が真のときのみ既定のキャッシュを使用する。
+            rate_limiter (RateLimiter, optional): レートリミッター。Noneの場合、プロセス共有の "chat" リミッターを使用。
         """
         self.api_key = api_key or settings.OPENAI_API_KEY
-        self.client = OpenAI(api_key=self.api_key)
+        # クライアントはプロセス内で共有し、他のアダプターやスクリプトと接続プールを使い回す
+        self.client = get_openai_client(self.api_key)
         # デフォルトモデルはここで設定するか、呼び出し側で必ず指定するようにする
         # main.py で FINETUNED_MODEL_ID が渡されることを期待
         self.default_model = default_model or settings.DEFAULT_MODEL_NAME
 
+        if response_cache is None and settings.RESPONSE_CACHE_ENABLED:
+            response_cache = ResponseCache(
+                settings.RESPONSE_CACHE_PATH,
+                max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+                max_age_seconds=settings.RESPONSE_CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+            )
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter or get_shared_rate_limiter("chat")
+        # 直近のストリーミング生成の計測値 (time_to_first_token, total_latency など)
+        self.last_stream_metrics = {}
+
     def generate_text(self, messages: list, generation_params: dict = None) -> str:
         """
         OpenAI APIを使用してテキストを生成する。
@@ -38,17 +75,34 @@ class OpenAIAdapter:
         # なければ、インスタンスのデフォルトモデルを使用する。
         # main.py で FINETUNED_MODEL_ID を指定しているので、それが優先される。
         model_to_use = params_for_api.pop('model', self.default_model)
+        # 呼び出しごとのトークン数・所要時間・リトライ回数などを計測イベントとして記録する
+        call = CallRecorder(model_to_use)
+
+        # 決定的なリクエストはキャッシュから即座に返す
+        if self.response_cache:
+            cached_text = self.response_cache.get(model_to_use, messages, params_for_api)
+            if cached_text is not None:
+                call.finish(cache_hit=True)
+                return cached_text
 
         try:
             # client.chat.completions.create に model を明示的に渡し、
             # 残りのパラメータを **params_for_api で展開する
-            response = self.client.chat.completions.create(
+            # レートリミッター経由で呼び出し、429 は Retry-After に従って自動で再試行する
+            response = self.rate_limiter.call(
+                call.wrap(self.client.chat.completions.create),
+                estimated_tokens=estimate_request_tokens(messages, params_for_api.get('max_tokens'), model_to_use),
                 model=model_to_use, # model はここで一度だけ指定
                 messages=messages,
                 **params_for_api  # ここにはもう 'model' は含まれない
             )
-            return response.choices[0].message.content
+            call.finish(response=response)
+            generated_text = response.choices[0].message.content
+            if self.response_cache:
+                self.response_cache.put(model_to_use, messages, params_for_api, generated_text)
+            return generated_text
         except Exception as e:
+            call.finish(error=e)
             error_message = f"エラー: OpenAI API呼び出し中にエラーが発生しました ({e})"
             print(error_message) # ターミナルにもエラー出力
             # エラーを呼び出し元に伝えるために、エラーメッセージを含む文字列を返すか、
@@ -56,6 +110,248 @@ class OpenAIAdapter:
             # ここでは、main.py のエラー処理に合わせてエラーメッセージ文字列を返します。
             return error_message
 
+    def generate_text_stream(self, messages: list, generation_params: dict = None,
+                             validator: SectionStructureValidator = None) -> Iterator[str]:
+        """
+        OpenAI APIのストリーミングモードでテキストを生成し、受信したチャンクを順に返す。
+
+        最初のチャンクまでの時間 (time_to_first_token) と全体の所要時間 (total_latency) を
+        秒単位で self.last_stream_metrics に記録する。
+
+        Args:
+            messages (list): システムメッセージとユーザープロンプトを含むメッセージのリスト。
+            generation_params (dict, optional): テキスト生成に関する追加パラメータ。
+            validator (SectionStructureValidator, optional): 受信したチャンクを逐次検証するバリデーター。
+                構成の崩れを検出した時点で接続を閉じて生成を中断し、エラーメッセージを返す (validator.violation に内容が残る)。
+
+        Yields:
+            str: 生成されたテキストのチャンク。エラー時は "エラー:" で始まるメッセージを返して終了する。
+        """
+        params_for_api = generation_params.copy() if generation_params else {}
+        model_to_use = params_for_api.pop('model', self.default_model)
+        params_for_api.pop('stream', None)
+        # 最後のチャンクで usage を受け取る (トークン数と費用の計測に使う)
+        stream_options = params_for_api.pop('stream_options', None) or {"include_usage": True}
+        call = CallRecorder(model_to_use, stream=True)
+
+        start_time = time.perf_counter()
+        self.last_stream_metrics = {
+            "model": model_to_use,
+            "time_to_first_token": None,
+            "total_latency": None,
+            "chunks": 0,
+            "cache_hit": False,
+        }
+
+        if self.response_cache:
+            cached_text = self.response_cache.get(model_to_use, messages, params_for_api)
+            if cached_text is not None and validator is not None:
+                # 検証前にキャッシュされた構成の崩れた応答は使わない
+                cache_validator = SectionStructureValidator(validator.headings)
+                if cache_validator.feed(cached_text) or cache_validator.finish():
+                    cached_text = None
+            if cached_text is not None:
+                elapsed = time.perf_counter() - start_time
+                self.last_stream_metrics.update(
+                    time_to_first_token=elapsed, total_latency=elapsed, chunks=1, cache_hit=True
+                )
+                call.finish(time_to_first_token=elapsed, cache_hit=True)
+                yield cached_text
+                return
+
+        received_chunks = []
+        usage = None
+        finish_reason = None
+        try:
+            # 応答を読み終えるまで同時実行の枠を保持し、最後に受け取った usage でトークン数を精算する
+            with self.rate_limiter.hold_stream(
+                call.wrap(self.client.chat.completions.create),
+                estimated_tokens=estimate_request_tokens(messages, params_for_api.get('max_tokens'), model_to_use),
+                model=model_to_use,
+                messages=messages,
+                stream=True,
+                stream_options=stream_options,
+                **params_for_api
+            ) as lease:
+                stream = lease.stream
+                try:
+                    for event in stream:
+                        if getattr(event, "usage", None):
+                            usage = lease.usage = event.usage
+                        if not event.choices:
+                            continue
+                        finish_reason = event.choices[0].finish_reason or finish_reason
+                        content = event.choices[0].delta.content
+                        if not content:
+                            continue
+                        if self.last_stream_metrics["time_to_first_token"] is None:
+                            self.last_stream_metrics["time_to_first_token"] = time.perf_counter() - start_time
+                        if validator is not None and validator.feed(content):
+                            # 残りの生成に時間とトークンを使わないよう打ち切る
+                            break
+                        self.last_stream_metrics["chunks"] += 1
+                        received_chunks.append(content)
+                        yield content
+                finally:
+                    # 検証による打ち切りや、呼び出し側が途中で読むのをやめた場合 (break や close) も接続を閉じる
+                    stream.close()
+        except Exception as e:
+            call.finish(time_to_first_token=self.last_stream_metrics["time_to_first_token"], error=e)
+            error_message = f"エラー: OpenAI API呼び出し中にエラーが発生しました ({e})"
+            print(error_message)
+            yield error_message
+            return
+        except BaseException:
+            # 呼び出し側が途中で読むのをやめた (GeneratorExit) 場合などは、受信した分までを打ち切りとして記録する
+            call.finish(usage=usage, finish_reason="cancelled",
+                        time_to_first_token=self.last_stream_metrics["time_to_first_token"])
+            raise
+        finally:
+            self.last_stream_metrics["total_latency"] = time.perf_counter() - start_time
+
+        if validator is not None and validator.violation is None:
+            _finish_structure_validation(validator, finish_reason)
+        if validator is not None and validator.violation is not None:
+            call.finish(finish_reason="structure_violation",
+                        time_to_first_token=self.last_stream_metrics["time_to_first_token"])
+            yield structure_violation_message(validator.violation)
+            return
+
+        call.finish(usage=usage, finish_reason=finish_reason,
+                    time_to_first_token=self.last_stream_metrics["time_to_first_token"])
+
+        if self.response_cache:
+            self.response_cache.put(model_to_use, messages, params_for_api, "".join(received_chunks))
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """
+        一括生成用の AsyncOpenAI クライアント。実行中のイベントループで共有するものを返す。
+        """
+        return get_async_openai_client(self.api_key)
+
+    async def generate_text_async(self, messages: list, generation_params: dict = None,
+                                  validator: SectionStructureValidator = None) -> str:
+        """
+        generate_text の asyncio 版。イベントループをブロックせずにAPIを呼び出す。
+
+        Args:
+            messages (list): システムメッセージとユーザープロンプトを含むメッセージのリスト。
+            generation_params (dict, optional): テキスト生成に関する追加パラメータ。
+            validator (SectionStructureValidator, optional): 指定した場合はストリーミングで受信しながら構成を検証し、
+                崩れを検出した時点で生成を中断してエラーメッセージを返す (validator.violation に内容が残る)。
+
+        Returns:
+            str: LLMによって生成されたテキスト。エラー時はエラーメッセージを返す。
+        """
+        if validator is not None:
+            return await self._generate_text_validated_async(messages, generation_params, validator)
+
+        params_for_api = generation_params.copy() if generation_params else {}
+        model_to_use = params_for_api.pop('model', self.default_model)
+        call = CallRecorder(model_to_use)
+
+        if self.response_cache:
+            cached_text = self.response_cache.get(model_to_use, messages, params_for_api)
+            if cached_text is not None:
+                call.finish(cache_hit=True)
+                return cached_text
+
+        try:
+            response = await self.rate_limiter.call_async(
+                call.wrap_async(self.async_client.chat.completions.create),
+                estimated_tokens=estimate_request_tokens(messages, params_for_api.get('max_tokens'), model_to_use),
+                model=model_to_use,
+                messages=messages,
+                **params_for_api
+            )
+            call.finish(response=response)
+            generated_text = response.choices[0].message.content
+            if self.response_cache:
+                self.response_cache.put(model_to_use, messages, params_for_api, generated_text)
+            return generated_text
+        except Exception as e:
+            call.finish(error=e)
+            error_message = f"エラー: OpenAI API呼び出し中にエラーが発生しました ({e})"
+            print(error_message)
+            return error_message
+
+    async def _generate_text_validated_async(self, messages: list, generation_params: dict,
+                                             validator: SectionStructureValidator) -> str:
+        """
+        generate_text_async の構成検証版。ストリーミングで受信したチャンクを逐次検証する。
+        """
+        params_for_api = generation_params.copy() if generation_params else {}
+        model_to_use = params_for_api.pop('model', self.default_model)
+        params_for_api.pop('stream', None)
+        stream_options = params_for_api.pop('stream_options', None) or {"include_usage": True}
+        call = CallRecorder(model_to_use, stream=True)
+        start_time = time.perf_counter()
+
+        if self.response_cache:
+            cached_text = self.response_cache.get(model_to_use, messages, params_for_api)
+            if cached_text is not None:
+                cache_validator = SectionStructureValidator(validator.headings)
+                if not (cache_validator.feed(cached_text) or cache_validator.finish()):
+                    call.finish(cache_hit=True)
+                    return cached_text
+
+        received_chunks = []
+        usage = None
+        finish_reason = None
+        time_to_first_token = None
+        try:
+            async with self.rate_limiter.hold_stream_async(
+                call.wrap_async(self.async_client.chat.completions.create),
+                estimated_tokens=estimate_request_tokens(messages, params_for_api.get('max_tokens'), model_to_use),
+                model=model_to_use,
+                messages=messages,
+                stream=True,
+                stream_options=stream_options,
+                **params_for_api
+            ) as lease:
+                stream = lease.stream
+                try:
+                    async for event in stream:
+                        if getattr(event, "usage", None):
+                            usage = lease.usage = event.usage
+                        if not event.choices:
+                            continue
+                        finish_reason = event.choices[0].finish_reason or finish_reason
+                        content = event.choices[0].delta.content
+                        if not content:
+                            continue
+                        if time_to_first_token is None:
+                            time_to_first_token = time.perf_counter() - start_time
+                        if validator.feed(content):
+                            # 残りの生成に時間とトークンを使わないよう打ち切る
+                            break
+                        received_chunks.append(content)
+                finally:
+                    # 検証による打ち切りや、タスクのキャンセルで中断した場合も接続を閉じる
+                    await stream.close()
+        except Exception as e:
+            call.finish(time_to_first_token=time_to_first_token, error=e)
+            error_message = f"エラー: OpenAI API呼び出し中にエラーが発生しました ({e})"
+            print(error_message)
+            return error_message
+        except BaseException:
+            # タスクのキャンセル (CancelledError) などで中断した場合は、受信した分までを打ち切りとして記録する
+            call.finish(usage=usage, finish_reason="cancelled", time_to_first_token=time_to_first_token)
+            raise
+
+        if validator.violation is None:
+            _finish_structure_validation(validator, finish_reason)
+        if validator.violation is not None:
+            call.finish(finish_reason="structure_violation", time_to_first_token=time_to_first_token)
+            return structure_violation_message(validator.violation)
+
+        call.finish(usage=usage, finish_reason=finish_reason, time_to_first_token=time_to_first_token)
+        generated_text = "".join(received_chunks)
+        if self.response_cache:
+            self.response_cache.put(model_to_use, messages, params_for_api, generated_text)
+        return generated_text
+
     # 将来的にOpenAI特有の他の機能 (例: ファインチューニングジョブの作成・管理) を
     # 実装する場合は、ここに追加のメソッドを定義できる。
     # def create_finetuning_job(self, training_file_id: str, model: str = "gpt-3.5-turbo"):
@@ -0,0 +1,295 @@
+"""
+処理段階 (ステージ) ごとの所要時間の計測 (--profile)。
+
+処理の区切りを span("名前") で囲むと、プロファイルが有効な間だけステージごとに
+呼び出し回数・経過時間・CPU時間・メモリ確保のピークを集計する。
+無効な場合の span は何もしない共有のコンテキストマネージャーを返すだけなので、処理はほとんど遅くならない。
+
+各スクリプトは add_profile_arguments でオプションを追加し、profiling_session(args, 名前) の中で処理を実行する。
+--profile-cprofile で cProfile の結果、--profile-memory で tracemalloc によるステージごとのメモリ確保のピークも記録する。
+
+ワーカープロセスでの計測値は、worker_initializer で計測を有効にしたうえで、
+タスクの結果とともに drain_stats で返し、親プロセスで merge_stats して合算する。
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from src.config import settings
+
+DEFAULT_PROFILE_DIR = os.path.join(settings.DATA_DIR, "profiles")
+# cProfile の結果として表示する関数の数
+CPROFILE_TOP_FUNCTIONS = 25
+
+_enabled = False
+_memory_enabled = False
+_lock = threading.Lock()
+# ステージ名 -> {"count", "wall_seconds", "cpu_seconds", "peak_alloc_bytes"}
+_stats: Dict[str, Dict[str, float]] = {}
+_local = threading.local()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "_wall", "_cpu", "_baseline")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._baseline = 0
+
+    def __enter__(self):
+        if _memory_enabled:
+            self._baseline = _enter_memory_scope()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        peak = _exit_memory_scope(self._baseline) if _memory_enabled else 0
+        _record(self.name, 1, wall, cpu, peak)
+        return False
+
+
+def span(name: str):
+    """
+    name のステージとして計測するコンテキストマネージャーを返す。プロファイルが無効なら何もしない。
+
+    Args:
+        name (str): ステージ名 (例: "convert.html_parse")。
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def iter_with_span(iterable, name: str):
+    """
+    iterable の各要素の取り出し (ファイルの読み込みなど) を name のステージとして計測する。
+    プロファイルが無効なら iterable をそのまま返す。
+    """
+    if not _enabled:
+        return iterable
+    return _iter_with_span(iter(iterable), name)
+
+
+def _iter_with_span(iterator, name: str):
+    while True:
+        with _Span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def _record(name: str, count: int, wall: float, cpu: float, peak: float) -> None:
+    with _lock:
+        stage = _stats.get(name)
+        if stage is None:
+            stage = _stats[name] = {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_alloc_bytes": 0}
+        stage["count"] += count
+        stage["wall_seconds"] += wall
+        stage["cpu_seconds"] += cpu
+        stage["peak_alloc_bytes"] = max(stage["peak_alloc_bytes"], peak)
+
+
+# --- tracemalloc ---
+# tracemalloc のピークはプロセスで1つしかないため、入れ子のステージごとに
+# 「入った時点の確保量」と「内側で観測したピーク」をスレッドごとのスタックで持ち、抜けるときに親へ引き継ぐ。
+# 複数のスレッドが同時にステージを実行する場合、ピークには他のスレッドの確保も含まれる (目安として扱う)。
+
+def _enter_memory_scope() -> int:
+    import tracemalloc
+    stack = getattr(_local, "memory_stack", None)
+    if stack is None:
+        stack = _local.memory_stack = []
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        stack[-1] = max(stack[-1], peak)
+    tracemalloc.reset_peak()
+    stack.append(current)
+    return current
+
+
+def _exit_memory_scope(baseline: int) -> int:
+    import tracemalloc
+    stack = _local.memory_stack
+    _, peak = tracemalloc.get_traced_memory()
+    observed = max(stack.pop(), peak)
+    if stack:
+        stack[-1] = max(stack[-1], observed)
+    return max(0, observed - baseline)
+
+
+# --- ワーカープロセス ---
+
+def worker_initializer(enabled: bool) -> None:
+    """
+    ProcessPoolExecutor の initializer。ワーカープロセスで計測を有効にし、fork で引き継いだ集計を空にする。
+    """
+    global _enabled, _memory_enabled
+    _enabled = enabled
+    _memory_enabled = False
+    with _lock:
+        _stats.clear()
+
+
+def drain_stats() -> Optional[Dict[str, Dict[str, float]]]:
+    """
+    これまでの集計を返して空にする。プロファイルが無効なら None。ワーカープロセスのタスクの結果に添えて返す。
+    """
+    if not _enabled:
+        return None
+    with _lock:
+        drained = {name: dict(stage) for name, stage in _stats.items()}
+        _stats.clear()
+    return drained
+
+
+def merge_stats(stats: Optional[Dict[str, Dict[str, float]]]) -> None:
+    """
+    drain_stats で受け取った集計を現在のプロセスの集計に加える。
+    """
+    for name, stage in (stats or {}).items():
+        _record(name, stage["count"], stage["wall_seconds"], stage["cpu_seconds"], stage["peak_alloc_bytes"])
+
+
+# --- セッション ---
+
+def add_profile_arguments(parser) -> None:
+    """
+    --profile 関連のオプションを argparse のパーサーに追加する。
+    """
+    group = parser.add_argument_group("プロファイル")
+    group.add_argument("--profile", action="store_true",
+                       help="ステージごとの経過時間・CPU時間を計測し、終了時にレポートを表示・保存する")
+    group.add_argument("--profile-cprofile", action="store_true",
+                       help="--profile に加えて cProfile で関数ごとの時間を記録する (メインスレッドのみ)")
+    group.add_argument("--profile-memory", action="store_true",
+                       help="--profile に加えて tracemalloc でステージごとのメモリ確保のピークを記録する (処理が遅くなる)")
+    group.add_argument("--profile-output",
+                       help="レポートの保存先ディレクトリ (デフォルト: data/profiles)")
+
+
+@contextmanager
+def profiling_session(args, name: str) -> Iterator[None]:
+    """
+    args で --profile が指定されていれば、ブロック内の処理を計測してレポートを表示・保存する。
+    指定されていなければ何もしない。
+
+    Args:
+        args: add_profile_arguments を追加したパーサーの解析結果。
+        name (str): レポートのファイル名に使う処理名 (例: "refine")。
+    """
+    use_cprofile = getattr(args, "profile_cprofile", False)
+    use_memory = getattr(args, "profile_memory", False)
+    if not (getattr(args, "profile", False) or use_cprofile or use_memory):
+        yield
+        return
+
+    global _enabled, _memory_enabled
+    with _lock:
+        _stats.clear()
+    profiler = None
+    if use_cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+    if use_memory:
+        import tracemalloc
+        tracemalloc.start()
+        _memory_enabled = True
+    _enabled = True
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        total_wall = time.perf_counter() - start_wall
+        total_cpu = time.process_time() - start_cpu
+        _enabled = False
+        peak_total = None
+        if use_memory:
+            import tracemalloc
+            peak_total = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            _memory_enabled = False
+        report = build_report(name, total_wall, total_cpu, peak_total)
+        _write_report(report, profiler, getattr(args, "profile_output", None) or DEFAULT_PROFILE_DIR)
+
+
+def build_report(name: str, total_wall: float, total_cpu: float, peak_total: Optional[int] = None) -> Dict[str, Any]:
+    """
+    現在の集計からレポート (dict) を作成する。ステージは経過時間の長い順に並べる。
+    """
+    with _lock:
+        stages = [dict(stage, name=stage_name) for stage_name, stage in _stats.items()]
+    stages.sort(key=lambda stage: stage["wall_seconds"], reverse=True)
+    for stage in stages:
+        stage["share_of_total"] = stage["wall_seconds"] / total_wall if total_wall > 0 else None
+    return {
+        "name": name,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "total_wall_seconds": total_wall,
+        "total_cpu_seconds": total_cpu,
+        "peak_alloc_bytes": peak_total,
+        "stages": stages,
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    レポートを表示用の表にする。並行して実行したステージの経過時間は合計のため、全体の時間を超えることがある。
+    """
+    lines = [f"--- プロファイル: {report['name']} ---",
+             f"全体: 経過 {report['total_wall_seconds']:.3f}秒 / CPU {report['total_cpu_seconds']:.3f}秒 (ワーカープロセスを除く)"]
+    if report["peak_alloc_bytes"] is not None:
+        lines[-1] += f" / メモリ確保のピーク {report['peak_alloc_bytes'] / 1024 / 1024:.1f}MB"
+    header = f"{'stage':<32}{'calls':>8}{'wall(s)':>12}{'cpu(s)':>12}{'share':>8}{'peak(MB)':>12}"
+    lines.append(header)
+    for stage in report["stages"]:
+        share = "-" if stage["share_of_total"] is None else f"{stage['share_of_total'] * 100:.1f}%"
+        peak = f"{stage['peak_alloc_bytes'] / 1024 / 1024:.2f}" if report["peak_alloc_bytes"] is not None else "-"
+        lines.append(f"{stage['name']:<32}{stage['count']:>8}{stage['wall_seconds']:>12.3f}"
+                     f"{stage['cpu_seconds']:>12.3f}{share:>8}{peak:>12}")
+    return "\n".join(lines)
+
+
+def _write_report(report: Dict[str, Any], profiler, output_dir: str) -> None:
+    print("\n" + format_report(report))
+    os.makedirs(output_dir, exist_ok=True)
+    base_path = os.path.join(output_dir, f"{report['name']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    with open(base_path + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"プロファイルのレポートを保存しました: {base_path}.json")
+    if profiler is not None:
+        import io
+        import pstats
+        profiler.dump_stats(base_path + ".prof")
+        buffer = io.StringIO()
+        pstats.Stats(profiler, stream=buffer).sort_stats("cumulative").print_stats(CPROFILE_TOP_FUNCTIONS)
+        print(buffer.getvalue())
+        print(f"cProfile の結果を保存しました: {base_path}.prof (python -m pstats で確認できます)")
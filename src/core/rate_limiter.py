@@ -0,0 +1,400 @@
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from src.core.token_budget import get_token_counter
+
+# アカウントのレート制限 (環境変数で上書き可能)。既定値は gpt-3.5-turbo の Tier 1 相当
+DEFAULT_REQUESTS_PER_MINUTE = float(os.environ.get("OPENAI_RPM_LIMIT", "3500"))
+DEFAULT_TOKENS_PER_MINUTE = float(os.environ.get("OPENAI_TPM_LIMIT", "60000"))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "8"))
+# Moderation API はトークン数ではなくリクエスト数だけで制限されるため、TPM のバケットを持たない
+DEFAULT_MODERATION_REQUESTS_PER_MINUTE = float(os.environ.get("OPENAI_MODERATION_RPM_LIMIT", "1000"))
+
+# get_shared_rate_limiter で名前ごとに使う既定の設定 (chat 以外のエンドポイントで制限が異なるもの)
+_SHARED_LIMITER_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "moderation": {"requests_per_minute": DEFAULT_MODERATION_REQUESTS_PER_MINUTE, "tokens_per_minute": 0},
+}
+
+# 429 以外でリトライ対象とするHTTPステータス
+_RETRYABLE_STATUS_CODES = {408, 409, 500, 502, 503, 504}
+
+
+class _TokenBucket:
+    """
+    1分あたりの上限から補充レートを計算する単純なトークンバケット。上限が0以下の場合は制限しない。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.refill_per_second = per_minute / 60.0
+        self.available = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.available = min(self.capacity, self.available + elapsed * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        amount を取り出せるまでの待ち時間 (秒) を返す。0 なら即座に取り出せる。
+        """
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        # バケット容量を超える要求は、満杯になった時点で通す (永久に待たないため)
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.refill_per_second
+
+    def take(self, amount: float) -> None:
+        if self.capacity > 0:
+            self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        if self.capacity > 0:
+            self.available = min(self.capacity, self.available + amount)
+
+
+class StreamLease:
+    """
+    RateLimiter.hold_stream で取得した、同時実行の枠を保持したままのストリーミング応答。
+    ストリームの最後で受け取った usage を self.usage に設定すると、枠の解放時に実際の使用トークン数をバケットに反映する。
+    """
+
+    def __init__(self, stream: Any):
+        self.stream = stream
+        self.usage: Any = None
+
+
+class RateLimiter:
+    """
+    RPM/TPM のトークンバケットと適応的な同時実行数制御を組み合わせたレートリミッター。
+
+    - リクエスト数とトークン数の2つのバケットで送信ペースを制御する。
+    - 429 を受けた場合は Retry-After ヘッダーに従って全呼び出しを一時停止し、
+      同時実行数の上限を半減させる。成功が続くと上限を徐々に戻す (AIMD)。
+    - スレッド (同期呼び出し) と asyncio の両方から共有して利用できる。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        min_concurrency: int = 1,
+        max_retries: int = 6,
+        base_backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 60.0
+    ):
+        """
+        RateLimiterのコンストラクタ。
+
+        Args:
+            requests_per_minute (float): 1分あたりのリクエスト数上限。0の場合は制限しない。
+            tokens_per_minute (float): 1分あたりのトークン数上限。0の場合は制限しない。
+            max_concurrency (int): 同時実行数の上限の最大値。
+            min_concurrency (int): 429 を受けて縮小する際の下限。
+            max_retries (int): 429 や一時的なエラーに対する最大リトライ回数。
+            base_backoff_seconds (float): Retry-After がない場合の指数バックオフの初期値。
+            max_backoff_seconds (float): バックオフ待ち時間の上限。
+        """
+        self._lock = threading.Lock()
+        self._request_bucket = _TokenBucket(requests_per_minute)
+        self._token_bucket = _TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.max_retries = max_retries
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._paused_until = 0.0
+        self.rate_limited_count = 0
+
+    # --- 取得と解放 ---
+
+    def _try_acquire(self, estimated_tokens: float) -> float:
+        """
+        枠の取得を試みる。取得できた場合は 0、できなかった場合は次に試すまでの待ち時間を返す。
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.in_flight >= int(self.concurrency_limit):
+                # 解放を待つ。短い間隔で再確認する
+                return 0.05
+            wait = max(
+                self._request_bucket.wait_time(1, now),
+                self._token_bucket.wait_time(estimated_tokens, now)
+            )
+            if wait > 0:
+                return wait
+            self._request_bucket.take(1)
+            self._token_bucket.take(estimated_tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, estimated_tokens: float = 0) -> None:
+        """
+        送信可能になるまでブロックして待つ。
+        """
+        while True:
+            wait = self._try_acquire(estimated_tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens: float = 0) -> None:
+        """
+        acquire の asyncio 版。待機中もイベントループはブロックしない。
+        """
+        # asyncio の読み込みには時間がかかるため、同期呼び出しだけのスクリプトでは読み込まない
+        # (イベントループの実行中はすでに読み込まれている)
+        import asyncio
+        while True:
+            wait = self._try_acquire(estimated_tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    # --- 結果のフィードバック ---
+
+    def record_success(self) -> None:
+        """
+        成功を記録し、同時実行数の上限を少しずつ戻す (加算的増加)。
+        """
+        with self._lock:
+            if self.concurrency_limit < self.max_concurrency:
+                self.concurrency_limit = min(
+                    self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit
+                )
+
+    def record_rate_limited(self, retry_after: Optional[float] = None, attempt: int = 0) -> float:
+        """
+        429 を記録し、全呼び出しを一時停止して同時実行数の上限を半減させる (乗算的減少)。
+
+        Returns:
+            float: 一時停止する秒数。
+        """
+        delay = retry_after if retry_after is not None else self._backoff_seconds(attempt)
+        with self._lock:
+            self.rate_limited_count += 1
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def reconcile_tokens(self, estimated_tokens: float, actual_tokens: float) -> None:
+        """
+        事前の見積もりと実際の使用トークン数の差をバケットに反映する。
+        """
+        with self._lock:
+            difference = estimated_tokens - actual_tokens
+            if difference > 0:
+                self._token_bucket.give_back(difference)
+            else:
+                self._token_bucket.take(-difference)
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        delay = min(self.max_backoff_seconds, self.base_backoff_seconds * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    # --- 呼び出しラッパー ---
+
+    def _after_success(self, result: Any, estimated_tokens: float) -> None:
+        self.record_success()
+        actual_tokens = _usage_total_tokens(result)
+        if actual_tokens is not None:
+            self.reconcile_tokens(estimated_tokens, actual_tokens)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        リトライすべきエラーなら待ち時間を返し、そうでなければ None を返す。
+        """
+        status_code = getattr(error, "status_code", None)
+        if status_code == 429:
+            delay = self.record_rate_limited(get_retry_after_seconds(error), attempt)
+            print(f"警告: レート制限 (429) を受けました。{delay:.1f}秒待機して再試行します。"
+                  f" (同時実行数上限: {int(self.concurrency_limit)})")
+            return delay
+        if status_code in _RETRYABLE_STATUS_CODES or _is_connection_error(error):
+            return get_retry_after_seconds(error) or self._backoff_seconds(attempt)
+        return None
+
+    def _call_holding_slot(self, func: Callable[..., Any], args: tuple, kwargs: dict, estimated_tokens: float) -> Any:
+        """
+        枠を取得して func を呼び出す。429 や一時的なエラーは自動でリトライする。
+        成功した場合は枠を保持したまま結果を返す (解放は呼び出し側で行う)。
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                self.release()
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                time.sleep(delay)
+
+    async def _call_holding_slot_async(self, func: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict,
+                                       estimated_tokens: float) -> Any:
+        """
+        _call_holding_slot の asyncio 版。
+        """
+        import asyncio
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(estimated_tokens)
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                self.release()
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(delay)
+
+    def _release_stream(self, lease: StreamLease, estimated_tokens: float) -> None:
+        self.release()
+        actual_tokens = _usage_total_tokens(lease)
+        if actual_tokens is not None:
+            self.reconcile_tokens(estimated_tokens, actual_tokens)
+
+    def call(self, func: Callable[..., Any], *args: Any, estimated_tokens: float = 0, **kwargs: Any) -> Any:
+        """
+        レート制限を守って func を呼び出す。429 や一時的なエラーは自動でリトライする。
+        リトライ回数を超えた場合や、リトライ対象外のエラーはそのまま送出する。
+        ストリーミング応答を返す呼び出しには hold_stream を使う。
+        """
+        result = self._call_holding_slot(func, args, kwargs, estimated_tokens)
+        self.release()
+        self._after_success(result, estimated_tokens)
+        return result
+
+    async def call_async(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        estimated_tokens: float = 0,
+        **kwargs: Any
+    ) -> Any:
+        """
+        call の asyncio 版。func はコルーチン関数を渡す。
+        """
+        result = await self._call_holding_slot_async(func, args, kwargs, estimated_tokens)
+        self.release()
+        self._after_success(result, estimated_tokens)
+        return result
+
+    @contextmanager
+    def hold_stream(self, func: Callable[..., Any], *args: Any, estimated_tokens: float = 0,
+                    **kwargs: Any) -> Iterator[StreamLease]:
+        """
+        ストリーミング応答を返す func を call と同様に呼び出し、with ブロックを抜けるまで同時実行の枠を保持する。
+        応答を読み終えるまで (または途中で打ち切るまで) の間も同時実行数に数えるため、
+        ストリームの読み出しは with ブロックの中で行う。
+
+        使い方:
+            with limiter.hold_stream(client.chat.completions.create, ..., stream=True) as lease:
+                for event in lease.stream:
+                    ...
+                    lease.usage = event.usage
+
+        ブロックを抜けるときに枠を解放し、lease.usage があれば見積もりとの差をトークンのバケットに反映する。
+        """
+        lease = StreamLease(self._call_holding_slot(func, args, kwargs, estimated_tokens))
+        try:
+            yield lease
+        finally:
+            self._release_stream(lease, estimated_tokens)
+        # 途中で例外が発生した場合は成功として扱わない
+        self.record_success()
+
+    @asynccontextmanager
+    async def hold_stream_async(self, func: Callable[..., Awaitable[Any]], *args: Any, estimated_tokens: float = 0,
+                                **kwargs: Any) -> AsyncIterator[StreamLease]:
+        """
+        hold_stream の asyncio 版。func はコルーチン関数を渡し、async with で使う。
+        """
+        lease = StreamLease(await self._call_holding_slot_async(func, args, kwargs, estimated_tokens))
+        try:
+            yield lease
+        finally:
+            self._release_stream(lease, estimated_tokens)
+        self.record_success()
+
+
+def get_retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    OpenAIのエラー応答から Retry-After (秒) を取り出す。見つからない場合は None。
+    retry-after-ms、retry-after (秒またはHTTP日付) の順に確認する。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def _is_connection_error(error: Exception) -> bool:
+    # openai をここで import しないよう、クラス名で判定する
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _usage_total_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def estimate_request_tokens(messages: List[Dict[str, Any]], max_tokens: int = 0, model: str = None) -> int:
+    """
+    リクエストが消費するトークン数の見積もり。プロンプトを token_budget のトークナイザー
+    (tiktoken がなければ文字種ごとの概算) で数え、max_tokens を加える。
+    """
+    return get_token_counter(model).count_messages(messages) + (max_tokens or 0)
+
+
+_shared_limiters: Dict[str, RateLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(name: str = "chat", **kwargs: Any) -> RateLimiter:
+    """
+    プロセス内で共有するレートリミッターを名前ごとに返す。
+    chat completions と moderations のように制限が別枠のエンドポイントは名前を分けて使う。
+    kwargs は初回生成時のみ RateLimiter のコンストラクタに渡され、名前ごとの既定の設定より優先される。
+    """
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(**{**_SHARED_LIMITER_DEFAULTS.get(name, {}), **kwargs})
+            _shared_limiters[name] = limiter
+        return limiter
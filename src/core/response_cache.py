@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# 生成パラメータのうち、出力内容に影響しないためキーから除外するもの
+_NON_SEMANTIC_PARAMS = {"stream", "timeout", "user"}
+
+
+class ResponseCache:
+    """
+    チャット補完APIの応答をSQLiteに保存するディスクキャッシュ。
+
+    キーはモデル名・正規化したメッセージリスト・生成パラメータから計算する。
+    エントリ数の上限と有効期限による追い出し、およびヒット/ミス数の記録を行う。
+    "エラー:" で始まる応答や空の応答は保存しない。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_entries: int = 10000,
+        max_age_seconds: float = 30 * 24 * 60 * 60,
+        deterministic_only: bool = True
+    ):
+        """
+        ResponseCacheのコンストラクタ。
+
+        Args:
+            db_path (str): SQLiteデータベースファイルのパス。親ディレクトリがなければ作成する。
+            max_entries (int): 保持する最大エントリ数。超えた分は最終アクセスが古い順に削除する。
+            max_age_seconds (float): エントリの有効期限 (秒)。
+            deterministic_only (bool): Trueの場合、temperature 0 または seed 指定の
+                                       決定的なリクエストのみをキャッシュ対象にする。
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.deterministic_only = deterministic_only
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+
+        # スレッドプールや asyncio からも利用するため、接続はロックで保護して共有する
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " response TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any] = None) -> str:
+        """
+        モデル名・メッセージ・生成パラメータからキャッシュキー (SHA-256) を計算する。
+        メッセージは role/content/name のみを残し、辞書のキー順に依存しない形に正規化する。
+        """
+        normalized_messages = [
+            {k: message[k] for k in ("role", "content", "name") if message.get(k) is not None}
+            for message in messages
+        ]
+        normalized_params = {
+            k: v for k, v in (params or {}).items()
+            if k not in _NON_SEMANTIC_PARAMS and k != "model"
+        }
+        payload = json.dumps(
+            {"model": model, "messages": normalized_messages, "params": normalized_params},
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def is_cacheable_request(self, params: Dict[str, Any] = None) -> bool:
+        """
+        指定されたパラメータのリクエストがキャッシュ対象かどうかを判定する。
+        """
+        params = params or {}
+        if params.get("stream"):
+            return False
+        if not self.deterministic_only:
+            return True
+        return params.get("temperature") == 0 or params.get("seed") is not None
+
+    def get(self, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any] = None) -> Optional[str]:
+        """
+        キャッシュされた応答を返す。見つからない、または期限切れの場合は None。
+        """
+        if not self.is_cacheable_request(params):
+            return None
+
+        key = self.make_key(model, messages, params)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self._increment("misses")
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._increment("hits")
+            return row[0]
+
+    def put(self, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any], response_text: str) -> None:
+        """
+        応答をキャッシュに保存する。エラーメッセージや空の応答は保存しない。
+        """
+        if not response_text or response_text.startswith("エラー:"):
+            return
+        if not self.is_cacheable_request(params):
+            return
+
+        key = self.make_key(model, messages, params)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, model, response_text, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """
+        期限切れのエントリと、上限数を超えた古いエントリを削除する。ロック取得済みで呼び出すこと。
+        """
+        self._conn.execute(
+            "DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)
+        )
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def _increment(self, name: str) -> None:
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """
+        ヒット数・ミス数・現在のエントリ数を返す。
+        """
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "entries": entries,
+        }
+
+    def clear(self) -> None:
+        """
+        すべてのエントリとカウンターを削除する。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM counters")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
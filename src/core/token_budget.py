@@ -0,0 +1,215 @@
+import functools
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken は任意。未インストールの場合は文字数からの概算で数える
+    tiktoken = None
+
+# モデルごとのコンテキストウィンドウ (入力と出力の合計トークン数の上限)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-0125": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+# 一覧にないモデルは最も小さい gpt-3.5-turbo の値とみなす
+DEFAULT_CONTEXT_WINDOW = 16385
+
+# チャット形式の1メッセージあたりの付加トークン数と、応答の開始に使われるトークン数
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# tiktoken がない場合の概算。cl100k_base では日本語 (非ASCII) は1文字1トークン前後、英数字は4文字で1トークン程度
+NON_ASCII_TOKENS_PER_CHAR = 1.2
+ASCII_CHARS_PER_TOKEN = 4.0
+# 概算のずれに備えて、コンテキストウィンドウから差し引いておく余裕分
+HEURISTIC_SAFETY_MARGIN = 0.05
+
+# 生成に最低限確保したいトークン数。これを下回る場合はリクエストが収まらないとみなす
+MIN_COMPLETION_TOKENS = 256
+
+# エンコーディングの読み込みに失敗した場合の理由。以降は読み込みを試みずに概算で数える
+_encoding_load_error: Optional[Exception] = None
+
+
+def _load_encoding(model: Optional[str]):
+    """
+    モデルに対応する tiktoken のエンコーディングを返す。読み込めない場合は None。
+    tiktoken は初回にエンコーディングのファイルをダウンロードするため、オフライン環境などでは失敗することがある。
+    """
+    global _encoding_load_error
+    if tiktoken is None or _encoding_load_error is not None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model or "gpt-3.5-turbo")
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        _encoding_load_error = e
+        print(f"警告: tiktoken のエンコーディングを読み込めないため、トークン数を文字数から概算します ({e})")
+        return None
+
+
+def get_context_window(model: Optional[str]) -> int:
+    """
+    モデル名からコンテキストウィンドウのトークン数を返す。
+    ファインチューニング済みモデル (ft:gpt-3.5-turbo-0125:...) はベースモデルの値を使う。
+    """
+    if not model:
+        return DEFAULT_CONTEXT_WINDOW
+    if model.startswith("ft:"):
+        model = model.split(":")[1]
+    if model in MODEL_CONTEXT_WINDOWS:
+        return MODEL_CONTEXT_WINDOWS[model]
+    # 日付付きのスナップショット (gpt-4o-2024-08-06 など) は前方一致で判定する
+    for known_model in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(known_model):
+            return MODEL_CONTEXT_WINDOWS[known_model]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+class TokenCounter:
+    """
+    テキストとチャットメッセージのトークン数を数える。
+    tiktoken があればモデルのエンコーディングで正確に数え、なければ文字種ごとの概算を使う。
+    """
+
+    def __init__(self, model: str = None):
+        """
+        TokenCounterのコンストラクタ。
+
+        Args:
+            model (str, optional): エンコーディングの選択に使うモデル名。
+        """
+        self.model = model
+        base_model = model.split(":")[1] if model and model.startswith("ft:") else model
+        self._encoding = _load_encoding(base_model)
+
+    @property
+    def is_exact(self) -> bool:
+        return self._encoding is not None
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        # ASCII 以外を取り除いたバイト数 = ASCII 文字数 (文字ごとのループより大幅に速い)
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        return math.ceil((len(text) - ascii_chars) * NON_ASCII_TOKENS_PER_CHAR + ascii_chars / ASCII_CHARS_PER_TOKEN)
+
+    def count_messages(self, messages: Sequence[Dict[str, Any]]) -> int:
+        """
+        チャット形式のメッセージリスト全体のプロンプトトークン数を返す。
+        """
+        total = TOKENS_PER_REPLY
+        for message in messages:
+            total += TOKENS_PER_MESSAGE
+            total += self.count_text(str(message.get("content") or ""))
+            total += self.count_text(str(message.get("role") or ""))
+        return total
+
+    def truncate_text(self, text: str, max_tokens: int) -> str:
+        """
+        text を max_tokens 以内に収まるよう末尾から切り詰める。
+        なるべく段落・文の区切り (改行、句点) で切る。
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.count_text(text) <= max_tokens:
+            return text
+
+        # トークン数は文字数に対して単調に増えるため、収まる最長の文字数を二分探索する
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_text(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        truncated = text[:low]
+
+        # 区切りが切り詰め後の後半にあれば、そこまでに揃える
+        boundary = max(truncated.rfind("\n"), truncated.rfind("。"))
+        if boundary >= len(truncated) // 2:
+            truncated = truncated[:boundary + 1]
+        return truncated.rstrip()
+
+
+@functools.lru_cache(maxsize=32)
+def get_token_counter(model: str = None) -> TokenCounter:
+    """
+    モデルごとの TokenCounter を返す。エンコーディングの読み込みは初回のみ行う。
+    """
+    return TokenCounter(model)
+
+
+def plan_request(messages: List[Dict[str, Any]], model: str = None, max_tokens: int = None) -> Dict[str, Any]:
+    """
+    リクエストのトークン数を送信前に見積もり、max_tokens をコンテキストウィンドウの残りに収める。
+
+    Args:
+        messages (List[dict]): 送信するメッセージのリスト。
+        model (str, optional): 使用するモデル名。
+        max_tokens (int, optional): 要求する最大生成トークン数。Noneの場合はコンテキストの残り全体。
+
+    Returns:
+        dict: 見積もり結果。
+            prompt_tokens: プロンプトのトークン数
+            max_tokens: コンテキストに収まるよう調整した最大生成トークン数
+            predicted_total_tokens: prompt_tokens + max_tokens (スケジューラーが枠の確保に使う値)
+            context_window: モデルのコンテキストウィンドウ
+            clamped: max_tokens を要求より小さくしたかどうか
+            fits: MIN_COMPLETION_TOKENS 以上の生成枠が残るかどうか
+            exact: tiktoken で数えたかどうか
+    """
+    counter = get_token_counter(model)
+    context_window = get_context_window(model)
+    usable_window = context_window if counter.is_exact else int(context_window * (1 - HEURISTIC_SAFETY_MARGIN))
+
+    prompt_tokens = counter.count_messages(messages)
+    remaining = max(0, usable_window - prompt_tokens)
+    allowed_max_tokens = remaining if max_tokens is None else min(max_tokens, remaining)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "max_tokens": allowed_max_tokens,
+        "predicted_total_tokens": prompt_tokens + allowed_max_tokens,
+        "context_window": context_window,
+        "clamped": max_tokens is not None and allowed_max_tokens < max_tokens,
+        "fits": allowed_max_tokens >= min(MIN_COMPLETION_TOKENS, max_tokens or MIN_COMPLETION_TOKENS),
+        "exact": counter.is_exact,
+    }
+
+
+def fit_text_to_budget(
+    messages: List[Dict[str, Any]],
+    text: str,
+    model: str = None,
+    max_tokens: int = None,
+    min_completion_tokens: int = MIN_COMPLETION_TOKENS
+) -> str:
+    """
+    text を含めずに組み立てた messages に text を追加しても、max_tokens (Noneの場合は
+    min_completion_tokens) の生成枠が残るよう text を切り詰めて返す。
+
+    Args:
+        messages (List[dict]): text を差し込む前のメッセージのリスト。
+        text (str): 差し込む可変長のテキスト (文体例や記事本文)。
+        model (str, optional): 使用するモデル名。
+        max_tokens (int, optional): 確保したい生成トークン数。
+        min_completion_tokens (int, optional): max_tokens がない場合に確保する生成トークン数。
+
+    Returns:
+        str: 予算内に収まるテキスト。収まる余地がなければ空文字列。
+    """
+    plan = plan_request(messages, model)
+    reserved = max_tokens if max_tokens is not None else min_completion_tokens
+    text_budget = plan["max_tokens"] - reserved
+    return get_token_counter(model).truncate_text(text, text_budget)
+
@@ -1,12 +1,22 @@
-from src.core.openai_adapter import OpenAIAdapter
+import asyncio
+from typing import Any, Dict, Iterator, List, Tuple
+
 from src.prompts.prompt_manager import PromptManager # 実際のPromptManagerを使用
+from src.config import settings
+from src.core.profiling import span
+from src.core.token_budget import fit_text_to_budget, plan_request
+from src.utils.structure_validator import STRUCTURE_RETRY_PREFIX, SectionStructureValidator
+
+# 映画レビュー生成に使用するテンプレートとシステムプロンプト
+MOVIE_REVIEW_TEMPLATE_NAME = "movie_review_template.txt"
+MOVIE_REVIEW_SYSTEM_PROMPT = "あなたはプロの映画ブロガーです。依頼された映画の魅力的なレビュー記事を執筆してください。"
 
 class ArticleGenerator:
     """
     映画レビュー記事の生成を行うクラス。
     LLMクライアントとプロンプトマネージャーを利用する。
     """
-    def __init__(self, client_adapter=None, prompt_manager=None):
+    def __init__(self, client_adapter=None, prompt_manager=None, template_name: str = MOVIE_REVIEW_TEMPLATE_NAME):
         """
         ArticleGeneratorのコンストラクタ。
 
@@ -15,9 +25,15 @@ class ArticleGenerator:
                                                      Noneの場合、デフォルトのOpenAIAdapterを初期化。
             prompt_manager (PromptManager, optional): 使用するプロンプトマネージャー。
                                                      Noneの場合、デフォルトのPromptManagerを初期化。
+            template_name (str, optional): ユーザープロンプトの組み立てに使用するテンプレート名。
         """
-        self.client = client_adapter or OpenAIAdapter()
+        if client_adapter is None:
+            # openai の読み込みには時間がかかるため、既定のクライアントを使う場合のみインポートする
+            from src.core.openai_adapter import OpenAIAdapter
+            client_adapter = OpenAIAdapter()
+        self.client = client_adapter
         self.prompter = prompt_manager or PromptManager() # 実際のPromptManagerを使用
+        self.template_name = template_name
 
     def generate_movie_review(
         self,
@@ -25,7 +41,8 @@ class ArticleGenerator:
         user_blog_style_example: str = "",
         tone_and_style_details: str = "",
         other_notes: str = "",
-        generation_params: dict = None # main.py から渡される
+        generation_params: dict = None, # main.py から渡される
+        validate_structure: bool = False
     ) -> str:
         """
         指定された情報に基づいて映画レビュー記事を生成する。
@@ -38,42 +55,33 @@ class ArticleGenerator:
             generation_params (dict, optional): LLMに渡す生成パラメータ
                                                 (temperature, max_tokensなど)。
                                                 Noneの場合、settingsのデフォルト値が使用される。
+            validate_structure (bool, optional): Trueの場合、ストリーミングで受信しながら6部構成の見出しを検証し、
+                                                 崩れた時点で中断して settings.STRUCTURE_MAX_ATTEMPTS 回まで生成をやり直す。
 
         Returns:
             str: 生成された映画レビュー記事。エラー時は空文字列やエラーメッセージ。
         """
-        # PromptManagerを使用してプロンプトを構築
-        # この部分はPromptManagerの実装に依存します
-        # 例:
-        # prompt_data = {
-        #     "movie_title": movie_title,
-        #     "user_blog_style_example": user_blog_style_example,
-        #     "tone_and_style_details": tone_and_style_details,
-        #     "other_notes": other_notes,
-        # }
-        # system_prompt = self.prompter.get_system_prompt_for_movie_review()
-        # user_prompt = self.prompter.get_user_prompt_for_movie_review(prompt_data)
-        # messages = [
-        #     {"role": "system", "content": system_prompt},
-        #     {"role": "user", "content": user_prompt},
-        # ]
-
-        # --- 以下は仮のプロンプト作成ロジックです。実際のPromptManagerを使ってください ---
-        system_prompt_content = "あなたはプロの映画ブロガーです。依頼された映画の魅力的なレビュー記事を執筆してください。"
-        user_prompt_content = f"映画「{movie_title}」について、以下の点を考慮してレビュー記事を作成してください。\n"
-        if user_blog_style_example:
-            user_prompt_content += f"\n参考にする文体:\n{user_blog_style_example}\n"
-        if tone_and_style_details:
-            user_prompt_content += f"\nトーンとスタイル: {tone_and_style_details}\n"
-        if other_notes:
-            user_prompt_content += f"\nその他の指示: {other_notes}\n"
-        messages = [
-            {"role": "system", "content": system_prompt_content},
-            {"role": "user", "content": user_prompt_content.strip()}
-        ]
-        # --- 仮のプロンプト作成ロジックここまで ---
+        if validate_structure:
+            received_chunks = []
+            for chunk in self.generate_movie_review_stream(
+                movie_title, user_blog_style_example, tone_and_style_details, other_notes, generation_params,
+                validate_structure=True
+            ):
+                if chunk.startswith(STRUCTURE_RETRY_PREFIX):
+                    print(chunk)
+                    received_chunks = []
+                    continue
+                if chunk.startswith("エラー:"):
+                    return chunk
+                received_chunks.append(chunk)
+            return "".join(received_chunks)
 
         try:
+            messages, generation_params, plan = self.prepare_request(
+                movie_title, user_blog_style_example, tone_and_style_details, other_notes, generation_params
+            )
+            if not plan["fits"]:
+                return self._context_overflow_error(movie_title, plan)
             # OpenAIAdapter の generate_text メソッドに messages と generation_params を渡す
             generated_text = self.client.generate_text(
                 messages=messages,
@@ -85,3 +93,255 @@ class ArticleGenerator:
             error_message = f"エラー: 記事生成処理中に予期せぬ問題が発生しました ({e})"
             print(error_message)
             return error_message # main.py のエラー処理に合わせる
+
+    def generate_movie_review_stream(
+        self,
+        movie_title: str,
+        user_blog_style_example: str = "",
+        tone_and_style_details: str = "",
+        other_notes: str = "",
+        generation_params: dict = None,
+        validate_structure: bool = False
+    ) -> Iterator[str]:
+        """
+        generate_movie_review のストリーミング版。生成されたチャンクを受信した順に返す。
+        計測値 (time_to_first_token, total_latency) は self.client.last_stream_metrics に記録される。
+
+        validate_structure が真の場合は受信しながら6部構成の見出しを検証し、崩れた時点で生成を中断する。
+        やり直すときは STRUCTURE_RETRY_PREFIX で始まるメッセージを返すので、それまでのチャンクは破棄すること。
+
+        Yields:
+            str: 生成された記事のチャンク。エラー時は "エラー:" で始まるメッセージ。
+        """
+        try:
+            messages, generation_params, plan = self.prepare_request(
+                movie_title, user_blog_style_example, tone_and_style_details, other_notes, generation_params
+            )
+            if not plan["fits"]:
+                yield self._context_overflow_error(movie_title, plan)
+                return
+            max_attempts = max(1, settings.STRUCTURE_MAX_ATTEMPTS) if validate_structure else 1
+            for attempt in range(1, max_attempts + 1):
+                validator = SectionStructureValidator() if validate_structure else None
+                # 検証しない場合は validator を渡さない (LocalHFAdapter など検証に対応しないアダプターもそのまま使える)
+                stream_kwargs = {"validator": validator} if validator is not None else {}
+                for chunk in self.client.generate_text_stream(
+                    messages=messages,
+                    generation_params=generation_params,
+                    **stream_kwargs
+                ):
+                    if validator is not None and validator.violation is not None and attempt < max_attempts:
+                        yield self._structure_retry_message(movie_title, validator.violation, attempt, max_attempts)
+                        break
+                    yield chunk
+                else:
+                    return
+        except Exception as e:
+            error_message = f"エラー: 記事生成処理中に予期せぬ問題が発生しました ({e})"
+            print(error_message)
+            yield error_message
+
+    def _build_messages(
+        self,
+        movie_title: str,
+        user_blog_style_example: str = "",
+        tone_and_style_details: str = "",
+        other_notes: str = ""
+    ) -> list:
+        """
+        映画レビュー生成用のメッセージリストを構築する。
+        generate_movie_review と generate_many で共通して使用する。
+        """
+        system_prompt_content = MOVIE_REVIEW_SYSTEM_PROMPT
+        # コンパイル済みテンプレートはキャッシュされるため、一括生成時もテンプレートの読み込みは発生しない
+        user_prompt_content = self.prompter.build_prompt(
+            self.template_name,
+            {
+                "movie_title": movie_title,
+                "user_blog_style_example": user_blog_style_example,
+                "tone_and_style_details": tone_and_style_details,
+                "other_notes": other_notes,
+            }
+        )
+
+        if not user_prompt_content:
+            # テンプレートが読み込めない場合は、最低限の指示だけでプロンプトを組み立てる
+            user_prompt_content = f"映画「{movie_title}」について、以下の点を考慮してレビュー記事を作成してください。\n"
+            if user_blog_style_example:
+                user_prompt_content += f"\n参考にする文体:\n{user_blog_style_example}\n"
+            if tone_and_style_details:
+                user_prompt_content += f"\nトーンとスタイル: {tone_and_style_details}\n"
+            if other_notes:
+                user_prompt_content += f"\nその他の指示: {other_notes}\n"
+
+        messages = [
+            {"role": "system", "content": system_prompt_content},
+            {"role": "user", "content": user_prompt_content.strip()}
+        ]
+        return messages
+
+    def predict_tokens(
+        self,
+        movie_title: str,
+        user_blog_style_example: str = "",
+        tone_and_style_details: str = "",
+        other_notes: str = "",
+        generation_params: dict = None
+    ) -> Dict[str, Any]:
+        """
+        API を呼び出さずに、generate_movie_review が送信するリクエストのトークン数を見積もる。
+        一括生成のスケジューリングやレート制限の計画に使う。
+
+        Returns:
+            dict: token_budget.plan_request の結果 (prompt_tokens, max_tokens, predicted_total_tokens など)。
+        """
+        _, _, plan = self.prepare_request(
+            movie_title, user_blog_style_example, tone_and_style_details, other_notes, generation_params
+        )
+        return plan
+
+    def prepare_request(
+        self,
+        movie_title: str,
+        user_blog_style_example: str,
+        tone_and_style_details: str,
+        other_notes: str,
+        generation_params: dict = None
+    ) -> Tuple[list, dict, Dict[str, Any]]:
+        """
+        メッセージを組み立て、モデルのコンテキストウィンドウに収まるよう調整する。
+        収まらない場合は、まず文体例を切り詰め、それでも足りなければ max_tokens を残りの枠まで減らす。
+
+        Returns:
+            Tuple[list, dict, dict]: メッセージ、調整後の生成パラメータ、トークン数の見積もり。
+        """
+        with span("generate.build_prompt"):
+            params = dict(generation_params) if generation_params else {}
+            model = params.get("model") or getattr(self.client, "default_model", None) or settings.DEFAULT_MODEL_NAME
+            max_tokens = params.get("max_tokens")
+
+            messages = self._build_messages(movie_title, user_blog_style_example, tone_and_style_details, other_notes)
+            plan = plan_request(messages, model, max_tokens)
+            if plan["clamped"] and user_blog_style_example:
+                skeleton = self._build_messages(movie_title, "", tone_and_style_details, other_notes)
+                fitted_example = fit_text_to_budget(skeleton, user_blog_style_example, model, max_tokens)
+                print(f"情報: 文体例をコンテキストに収まるよう {len(user_blog_style_example)} 文字から"
+                      f" {len(fitted_example)} 文字に切り詰めました。")
+                messages = self._build_messages(movie_title, fitted_example, tone_and_style_details, other_notes)
+                plan = plan_request(messages, model, max_tokens)
+
+            if plan["clamped"]:
+                print(f"情報: max_tokens を {max_tokens} から {plan['max_tokens']} に減らしました。"
+                      f" (プロンプト: {plan['prompt_tokens']} トークン / 上限: {plan['context_window']} トークン)")
+                params["max_tokens"] = plan["max_tokens"]
+        return messages, params, plan
+
+    @staticmethod
+    def _context_overflow_error(movie_title: str, plan: Dict[str, Any]) -> str:
+        error_message = (f"エラー: 映画「{movie_title}」のプロンプト ({plan['prompt_tokens']} トークン) が"
+                         f"モデルのコンテキストウィンドウ ({plan['context_window']} トークン) に収まりません。")
+        print(error_message)
+        return error_message
+
+    @staticmethod
+    def _structure_retry_message(movie_title: str, violation: str, attempt: int, max_attempts: int) -> str:
+        return (f"{STRUCTURE_RETRY_PREFIX} 映画「{movie_title}」の記事の構成が崩れたため生成をやり直します"
+                f" ({attempt + 1}/{max_attempts}回目): {violation}")
+
+    async def generate_many_async(
+        self,
+        movie_titles: List[str],
+        user_blog_style_example: str = "",
+        tone_and_style_details: str = "",
+        other_notes: str = "",
+        generation_params: dict = None,
+        max_concurrency: int = None,
+        style_examples: Dict[str, str] = None,
+        validate_structure: bool = False
+    ) -> List[str]:
+        """
+        複数の映画タイトルについてレビュー記事を並行して生成する (asyncio版)。
+
+        同時に実行中のAPI呼び出しは max_concurrency 件までに制限される。
+        1件の失敗が他のタイトルの生成を止めることはなく、失敗したタイトルには
+        "エラー:" で始まるメッセージが入る。
+
+        Args:
+            movie_titles (List[str]): レビュー対象の映画タイトルのリスト。
+            user_blog_style_example (str): ユーザーのブログ文体の例。
+            tone_and_style_details (str, optional): 記事のトーンやスタイルの詳細指示。
+            other_notes (str, optional): その他特記事項。
+            generation_params (dict, optional): LLMに渡す生成パラメータ。
+            max_concurrency (int, optional): 同時実行数の上限。Noneの場合、settingsの値を使用。
+            style_examples (Dict[str, str], optional): タイトルごとの文体例。
+                含まれないタイトルには user_blog_style_example を使う。
+            validate_structure (bool, optional): Trueの場合、受信しながら6部構成の見出しを検証し、
+                崩れた時点で中断して settings.STRUCTURE_MAX_ATTEMPTS 回まで生成をやり直す。
+
+        Returns:
+            List[str]: 入力と同じ順序の生成結果のリスト。
+        """
+        style_examples = style_examples or {}
+        max_attempts = max(1, settings.STRUCTURE_MAX_ATTEMPTS) if validate_structure else 1
+        limit = max_concurrency or settings.DEFAULT_MAX_CONCURRENCY
+        semaphore = asyncio.Semaphore(max(1, limit))
+
+        async def _generate_one(movie_title: str) -> str:
+            async with semaphore:
+                try:
+                    messages, params, plan = self.prepare_request(
+                        movie_title, style_examples.get(movie_title, user_blog_style_example),
+                        tone_and_style_details, other_notes, generation_params
+                    )
+                    if not plan["fits"]:
+                        return self._context_overflow_error(movie_title, plan)
+                    if not validate_structure:
+                        return await self.client.generate_text_async(
+                            messages=messages,
+                            generation_params=params
+                        )
+                    for attempt in range(1, max_attempts + 1):
+                        validator = SectionStructureValidator()
+                        generated_text = await self.client.generate_text_async(
+                            messages=messages,
+                            generation_params=params,
+                            validator=validator
+                        )
+                        if validator.violation is None or attempt == max_attempts:
+                            return generated_text
+                        print(self._structure_retry_message(movie_title, validator.violation, attempt, max_attempts))
+                except Exception as e:
+                    error_message = f"エラー: 映画「{movie_title}」の記事生成中に予期せぬ問題が発生しました ({e})"
+                    print(error_message)
+                    return error_message
+
+        # gather は入力順に結果を返すため、完了順に関わらず順序が保たれる
+        return await asyncio.gather(*(_generate_one(title) for title in movie_titles))
+
+    def generate_many(
+        self,
+        movie_titles: List[str],
+        user_blog_style_example: str = "",
+        tone_and_style_details: str = "",
+        other_notes: str = "",
+        generation_params: dict = None,
+        max_concurrency: int = None,
+        style_examples: Dict[str, str] = None,
+        validate_structure: bool = False
+    ) -> List[str]:
+        """
+        generate_many_async の同期ラッパー。main.py などのスクリプトから呼び出す。
+
+        Returns:
+            List[str]: 入力と同じ順序の生成結果のリスト。
+        """
+        return asyncio.run(self.generate_many_async(
+            movie_titles,
+            user_blog_style_example=user_blog_style_example,
+            tone_and_style_details=tone_and_style_details,
+            other_notes=other_notes,
+            generation_params=generation_params,
+            max_concurrency=max_concurrency,
+            style_examples=style_examples,
+            validate_structure=validate_structure
+        ))
@@ -1,10 +1,16 @@
+import argparse
 import os
 import json
 from datetime import datetime
+from typing import Dict, Iterator, List
 
-from src.generator.article_generator import ArticleGenerator
 from src.prompts.prompt_manager import PromptManager # 仮のPromptManager
 from src.config import settings # FINETUNED_MODEL_ID を直接使う場合
+from src.core import profiling
+from src.core.profiling import span
+from src.utils.corpus_store import CorpusStore
+from src.utils.style_index import select_style_example
+from src.utils.structure_validator import STRUCTURE_RETRY_PREFIX
 
 def load_user_blog_style_example(file_path: str, num_chars: int = 1000) -> str:
     """
@@ -12,10 +18,8 @@ def load_user_blog_style_example(file_path: str, num_chars: int = 1000) -> str:
     指定文字数分の文体例として返す。
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            first_line = f.readline()
-            if first_line:
-                data = json.loads(first_line)
+        with CorpusStore(file_path) as corpus:
+            for _, data in corpus.iter_articles(limit=1):
                 # textがNoneでないことを確認
                 text_content = data.get("text", "")
                 return text_content[:num_chars] if text_content else ""
@@ -30,10 +34,27 @@ def load_user_blog_style_example(file_path: str, num_chars: int = 1000) -> str:
         print(f"エラー: 文体例ファイルの読み込み中に予期せぬエラーが発生しました: {e}")
         return ""
 
-def save_generated_article(article_content: str, movie_title: str, output_dir: str) -> None:
+def load_style_examples(file_path: str, index_dir: str, movie_titles: List[str], num_chars: int = 1000) -> Dict[str, str]:
     """
-    生成された記事を指定されたディレクトリに保存する。
-    ファイル名は映画タイトルとタイムスタンプから生成する。
+    映画タイトルごとに、検索インデックスで最も近い過去の記事を選んで文体例とする。
+    近い記事が見つからないタイトルや、インデックスを使えない場合は先頭の記事を文体例にする。
+    """
+    style_examples = {}
+    for movie_title in movie_titles:
+        example = None
+        try:
+            example = select_style_example(file_path, index_dir, movie_title, num_chars=num_chars)
+        except FileNotFoundError:
+            print(f"エラー: 文体例ファイルが見つかりません: {file_path}")
+        except Exception as e:
+            print(f"警告: 文体例の検索中にエラーが発生しました。先頭の記事を使用します: {e}")
+        style_examples[movie_title] = example or load_user_blog_style_example(file_path, num_chars=num_chars)
+    return style_examples
+
+def build_article_file_path(movie_title: str, output_dir: str) -> str:
+    """
+    保存先ディレクトリを作成し、映画タイトルとタイムスタンプから記事のファイルパスを生成する。
+    ディレクトリの作成に失敗した場合は空文字列を返す。
     """
     if not os.path.exists(output_dir):
         try:
@@ -41,13 +62,22 @@ def save_generated_article(article_content: str, movie_title: str, output_dir: s
             print(f"作成されたディレクトリ: {output_dir}")
         except OSError as e:
             print(f"エラー: 出力ディレクトリの作成に失敗しました: {output_dir} ({e})")
-            return
+            return ""
 
     # ファイル名に使えない文字を置換・削除
     safe_movie_title = "".join(c if c.isalnum() or c in " .-_" else "_" for c in movie_title)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     file_name = f"{safe_movie_title}_{timestamp}.txt"
-    file_path = os.path.join(output_dir, file_name)
+    return os.path.join(output_dir, file_name)
+
+def save_generated_article(article_content: str, movie_title: str, output_dir: str) -> None:
+    """
+    生成された記事を指定されたディレクトリに保存する。
+    ファイル名は映画タイトルとタイムスタンプから生成する。
+    """
+    file_path = build_article_file_path(movie_title, output_dir)
+    if not file_path:
+        return
 
     try:
         with open(file_path, 'w', encoding='utf-8') as f:
@@ -56,42 +86,114 @@ def save_generated_article(article_content: str, movie_title: str, output_dir: s
     except Exception as e:
         print(f"エラー: 記事の保存中にエラーが発生しました: {file_path} ({e})")
 
+def stream_generated_article(chunks: Iterator[str], movie_title: str, output_dir: str) -> str:
+    """
+    ストリーミング生成されたチャンクをターミナルに表示しながら、受信するたびにファイルへ追記する。
+    途中で異常終了しても、それまでに受信した部分はファイルに残る。
+    ファイルは最初の本文のチャンクを受信したときに作り、本文を受信しなかった場合は残さない。
+
+    Returns:
+        str: 生成された記事全文。エラーが発生した場合は "エラー:" で始まるメッセージ。
+    """
+    file_path = build_article_file_path(movie_title, output_dir)
+    if not file_path:
+        return "エラー: 出力ディレクトリを作成できませんでした。"
 
-def main():
+    received_chunks = []
+    f = None
+    try:
+        for chunk in chunks:
+            if chunk.startswith(STRUCTURE_RETRY_PREFIX):
+                # 構成が崩れて生成をやり直す場合は、それまでの表示とファイルの内容を破棄する
+                print(f"\n{chunk}\n")
+                if f is not None:
+                    f.seek(0)
+                    f.truncate()
+                received_chunks = []
+                continue
+            if chunk.startswith("エラー:"):
+                if received_chunks:
+                    print(f"\n途中までの記事を保存しました: {file_path}")
+                return chunk
+            if f is None:
+                # 最初のチャンクで開く (最初からエラーの場合に空のファイルを残さないため)
+                f = open(file_path, 'w', encoding='utf-8')
+            print(chunk, end="", flush=True)
+            f.write(chunk)
+            f.flush()
+            received_chunks.append(chunk)
+        if received_chunks:
+            print(f"\n生成された記事を保存しました: {file_path}")
+    except Exception as e:
+        print(f"\nエラー: 記事の保存中にエラーが発生しました: {file_path} ({e})")
+        return f"エラー: 記事の保存中にエラーが発生しました ({e})"
+    finally:
+        if f is not None:
+            f.close()
+            # 再試行で内容を破棄した後に何も受信しなかった場合も、空のファイルは残さない
+            if not received_chunks:
+                os.remove(file_path)
+    return "".join(received_chunks)
+
+
+def main(target_movie_titles: List[str] = None, validate_structure: bool = None):
+    """
+    映画レビュー記事を生成して保存する。
+
+    Args:
+        target_movie_titles (List[str], optional): 生成したい映画のタイトル。複数指定すると並行して一括生成する。
+            Noneの場合、既定のタイトルを使用。
+        validate_structure (bool, optional): 生成中に6部構成の見出しを検証し、崩れたら中断してやり直すかどうか。
+            Noneの場合、ファインチューニング済みモデルを使うときのみ検証する。
+    """
     print("映画レビュー記事生成システムを開始します...")
 
     # --- 設定 ---
-    # settings.pyからAPIキーが読み込まれているか確認 (settings.py内のprint文で確認)
-    if not settings.OPENAI_API_KEY:
+    use_local_model = settings.LLM_BACKEND == "local"
+    if not use_local_model and not settings.warn_if_api_key_missing():
         print("致命的エラー: OpenAI APIキーが設定されていません。プログラムを終了します。")
-        exit()
+        return
 
     # 文体例として使用する過去のブログ記事データ (output.jsonl)
-    # main.py は src/ にあるので、プロジェクトルートの output.jsonl を指すには '../output.jsonl'
-    # または、より堅牢なパス指定方法として settings.py に定義することも検討
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    user_blog_data_path = os.path.join(project_root, "output.jsonl")
-    user_style_example = load_user_blog_style_example(user_blog_data_path, num_chars=1500) # 少し長めに
+    user_blog_data_path = settings.CORPUS_PATH
+    style_index_dir = os.path.join(settings.DATA_DIR, "index", "style_examples")
+
+    # 生成したい映画のタイトル (複数指定すると並行して一括生成する)
+    if not target_movie_titles:
+        target_movie_titles = ["君の名は。"]
+        # target_movie_titles = ["君の名は。", " ヴァチカンのエクソシスト(2023年公開)"] # 複数の映画で試す場合
 
-    if not user_style_example:
+    # タイトルごとに、内容の近い過去の記事を文体例として選ぶ
+    with span("generate.style_examples"):
+        style_examples = load_style_examples(user_blog_data_path, style_index_dir, target_movie_titles, num_chars=1500) # 少し長めに
+
+    if not any(style_examples.values()):
         print("警告: ユーザーの文体例を読み込めませんでした。デフォルトの文体で生成が試みられます。")
         # user_style_example = "ここにデフォルトの文体例を記述するか、プロンプトを調整してください。" # フォールバック
 
-    # 生成したい映画のタイトル
-    target_movie_title = "君の名は。"
-    # target_movie_title = " ヴァチカンのエクソシスト(2023年公開)" # 他の映画で試す場合
-
     # 使用するモデルを決定
     # FINETUNED_MODEL_ID が settings.py に定義されていて、かつ値が設定されていればそれを使用し、
     # コメントアウトされているなどで未定義、または値が空の場合は DEFAULT_MODEL_NAME を使用
     model_to_use = settings.DEFAULT_MODEL_NAME # デフォルトを設定
-    if hasattr(settings, 'FINETUNED_MODEL_ID') and settings.FINETUNED_MODEL_ID:
+    use_finetuned_model = False
+    if use_local_model:
+        model_to_use = settings.LOCAL_MODEL_PATH
+        print(f"情報: ローカルモデルを使用します: {model_to_use}")
+    elif hasattr(settings, 'FINETUNED_MODEL_ID') and settings.FINETUNED_MODEL_ID:
         # FINETUNED_MODEL_ID が存在し、空文字列やNoneでないことを確認
         model_to_use = settings.FINETUNED_MODEL_ID
+        use_finetuned_model = True
         print(f"情報: ファインチューニング済みモデルを使用します: {model_to_use}")
     else:
         print(f"情報: デフォルトモデルを使用します: {model_to_use}")
 
+    # 6部構成を学習したファインチューニング済みモデルの出力だけを検証する (ベースモデルは構成に従わないため)
+    if validate_structure is None:
+        validate_structure = use_finetuned_model
+    if validate_structure and use_local_model:
+        print("警告: ローカルモデルでは構成の検証に対応していないため、検証せずに生成します。")
+        validate_structure = False
+
     # 生成パラメータ (オプション)
     # これらを指定しない場合、settings.pyのデフォルト値やOpenAIAdapterのデフォルトが使われる
     custom_generation_params = {
@@ -104,37 +206,112 @@ def main():
     }
 
     # 出力ディレクトリ (プロジェクトルート/data/generated_articles)
-    output_directory = os.path.join(project_root, "data", "generated_articles")
+    output_directory = os.path.join(settings.DATA_DIR, "generated_articles")
 
     # --- 記事生成の実行 ---
-    print(f"\n映画「{target_movie_title}」のレビューを生成します...")
+    print(f"\n{len(target_movie_titles)}件の映画のレビューを生成します...")
     print(f"使用モデル: {custom_generation_params.get('model', settings.DEFAULT_MODEL_NAME)}")
     print(f"Temperature: {custom_generation_params.get('temperature', settings.DEFAULT_TEMPERATURE)}")
     print(f"Max Tokens: {custom_generation_params.get('max_tokens', settings.DEFAULT_MAX_TOKENS)}")
+    print(f"同時実行数: {settings.DEFAULT_MAX_CONCURRENCY}")
+    if validate_structure:
+        print(f"構成の検証: 有効 (崩れた場合は最大{settings.STRUCTURE_MAX_ATTEMPTS}回まで生成)")
 
+    with span("generate.client_setup"):
+        # openai の読み込みには時間がかかるため、生成を実行するときにインポートする
+        from src.generator.article_generator import ArticleGenerator
 
-    article_gen = ArticleGenerator() # デフォルトのクライアントとプロンプトマネージャーを使用
+        if use_local_model:
+            # torch / transformers の読み込みには時間がかかるため、ローカルモデルを使う場合のみインポートする
+            from src.core.local_hf_adapter import LocalHFAdapter
+            article_gen = ArticleGenerator(client_adapter=LocalHFAdapter(model_to_use))
+        else:
+            article_gen = ArticleGenerator() # デフォルトのクライアントとプロンプトマネージャーを使用
 
-    generated_review = article_gen.generate_movie_review(
-        movie_title=target_movie_title,
-        user_blog_style_example=user_style_example,
-        tone_and_style_details="あなたのブログ読者が親しみを感じ、映画の魅力が伝わるように、熱意を込めて書いてください。",
-        other_notes="映画の核心的なネタバレは避けつつ、期待感を高めるような記述を心がけてください。",
-        generation_params=custom_generation_params
-    )
+    tone_and_style_details = "あなたのブログ読者が親しみを感じ、映画の魅力が伝わるように、熱意を込めて書いてください。"
+    other_notes = "映画の核心的なネタバレは避けつつ、期待感を高めるような記述を心がけてください。"
 
-    # --- 結果の表示と保存 ---
-    if generated_review and not generated_review.startswith("エラー:"):
-        print("\n--- 生成されたレビュー ---")
-        print(generated_review)
+    # --- 記事生成と結果の表示・保存 ---
+    failed_count = 0
+    if len(target_movie_titles) == 1:
+        # 1件だけの場合はストリーミングで生成し、受信しながら表示・保存する
+        target_movie_title = target_movie_titles[0]
+        print(f"\n--- 生成されたレビュー: {target_movie_title} ---")
+        # ストリーミングでは受信と保存が交互に行われるため、まとめて1つのステージとして計測する
+        with span("generate.stream_and_save"):
+            generated_review = stream_generated_article(
+                article_gen.generate_movie_review_stream(
+                    movie_title=target_movie_title,
+                    user_blog_style_example=style_examples[target_movie_title],
+                    tone_and_style_details=tone_and_style_details,
+                    other_notes=other_notes,
+                    generation_params=custom_generation_params,
+                    validate_structure=validate_structure
+                ),
+                target_movie_title,
+                output_directory
+            )
         print("------------------------")
-        save_generated_article(generated_review, target_movie_title, output_directory)
+        metrics = article_gen.client.last_stream_metrics
+        if metrics.get("time_to_first_token") is not None:
+            print(f"最初のトークンまで: {metrics['time_to_first_token']:.2f}秒 / 合計: {metrics['total_latency']:.2f}秒")
+        if not generated_review or generated_review.startswith("エラー:"):
+            failed_count += 1
+            print(f"\n映画「{target_movie_title}」のレビューの生成に失敗しました。")
+            if generated_review:
+                print(f"エラー詳細: {generated_review}")
     else:
-        print("\nレビューの生成に失敗しました。")
-        if generated_review:
-            print(f"エラー詳細: {generated_review}")
+        # 複数件の場合は全タイトルを並行して生成する (結果は target_movie_titles と同じ順序で返る)
+        with span("generate.generate_many"):
+            generated_reviews = article_gen.generate_many(
+                target_movie_titles,
+                style_examples=style_examples,
+                tone_and_style_details=tone_and_style_details,
+                other_notes=other_notes,
+                generation_params=custom_generation_params,
+                max_concurrency=settings.DEFAULT_MAX_CONCURRENCY,
+                validate_structure=validate_structure
+            )
+
+        for target_movie_title, generated_review in zip(target_movie_titles, generated_reviews):
+            if generated_review and not generated_review.startswith("エラー:"):
+                print(f"\n--- 生成されたレビュー: {target_movie_title} ---")
+                print(generated_review)
+                print("------------------------")
+                with span("generate.save"):
+                    save_generated_article(generated_review, target_movie_title, output_directory)
+            else:
+                failed_count += 1
+                print(f"\n映画「{target_movie_title}」のレビューの生成に失敗しました。")
+                if generated_review:
+                    print(f"エラー詳細: {generated_review}")
+
+    print(f"\n生成成功: {len(target_movie_titles) - failed_count}件 / 失敗: {failed_count}件")
+    if article_gen.client.response_cache:
+        print(f"キャッシュ統計: {article_gen.client.response_cache.stats()}")
+    if use_local_model:
+        print(f"バッチ処理の統計: {article_gen.client.stats()}")
 
     print("\n映画レビュー記事生成システムを終了します。")
 
+def run_cli(argv: List[str] = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈して main を実行する (python -m src generate)。
+
+    Args:
+        argv (List[str], optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="過去のブログ記事の文体で映画レビュー記事を生成する")
+    parser.add_argument("titles", nargs="*", help="生成したい映画のタイトル (複数指定すると並行して一括生成する。省略時は既定のタイトル)")
+    parser.add_argument("--validate-structure", action=argparse.BooleanOptionalAction, default=None,
+                        help="生成中に6部構成の見出しを検証し、崩れたら中断してやり直す"
+                             " (デフォルト: ファインチューニング済みモデルを使う場合のみ検証)")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    with profiling.profiling_session(args, "generate"):
+        main(args.titles, validate_structure=args.validate_structure)
+
+
 if __name__ == "__main__":
-    main()
+    run_cli()
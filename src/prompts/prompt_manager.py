@@ -1,17 +1,85 @@
 import os
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+PLACEHOLDER_START = "{{"
+PLACEHOLDER_END = "}}"
+
+
+class CompiledTemplate:
+    """
+    プレースホルダー位置で分割済みのテンプレート。
+    リテラル部分と値の部分を順に連結するだけで、1回の走査でプロンプトを組み立てる。
+    """
+    def __init__(self, source: str):
+        """
+        CompiledTemplateのコンストラクタ。
+
+        Args:
+            source (str): テンプレート文字列。プレースホルダーは {{name}} の形式。
+        """
+        # (プレースホルダーかどうか, リテラル文字列またはプレースホルダー名) のリスト
+        self.segments: List[Tuple[bool, str]] = []
+        self.placeholders = set()
+
+        position = 0
+        while True:
+            start = source.find(PLACEHOLDER_START, position)
+            if start == -1:
+                break
+            end = source.find(PLACEHOLDER_END, start + len(PLACEHOLDER_START))
+            if end == -1:
+                break
+            name = source[start + len(PLACEHOLDER_START):end]
+            if not name or "{" in name or "\n" in name:
+                # プレースホルダーとして扱えないものはリテラルとして残す
+                self._append_literal(source[position:start + len(PLACEHOLDER_START)])
+                position = start + len(PLACEHOLDER_START)
+                continue
+            self._append_literal(source[position:start])
+            self.segments.append((True, name))
+            self.placeholders.add(name)
+            position = end + len(PLACEHOLDER_END)
+        self._append_literal(source[position:])
+
+    def _append_literal(self, text: str) -> None:
+        if not text:
+            return
+        if self.segments and not self.segments[-1][0]:
+            self.segments[-1] = (False, self.segments[-1][1] + text)
+        else:
+            self.segments.append((False, text))
+
+    def render(self, context: Dict[str, Any]) -> str:
+        """
+        コンテキストの値を埋め込んだ文字列を返す。
+        コンテキストにないプレースホルダーは {{name}} のまま残す。
+        """
+        parts = []
+        for is_placeholder, text in self.segments:
+            if not is_placeholder:
+                parts.append(text)
+            elif text in context:
+                parts.append(str(context[text])) # 値は文字列に変換して埋め込む
+            else:
+                parts.append(PLACEHOLDER_START + text + PLACEHOLDER_END)
+        return "".join(parts)
+
 
 class PromptManager:
     """
     プロンプトテンプレートの読み込みと、動的な値の埋め込みを行うクラス。
+    読み込んだテンプレートはコンパイルしてキャッシュし、ファイルの更新時刻が変わった場合のみ読み直す。
     """
-    def __init__(self, template_dir: str = None):
+    def __init__(self, template_dir: str = None, check_interval_seconds: float = 2.0):
         """
         PromptManagerのコンストラクタ。
 
         Args:
             template_dir (str, optional): プロンプトテンプレートが格納されているディレクトリのパス。
                                          Noneの場合、このファイルからの相対パスで 'templates' を使用。
+            check_interval_seconds (float): テンプレートファイルの更新を確認する最短間隔 (秒)。
+                                            この間隔内の呼び出しではファイルにアクセスしない。
         """
         if template_dir is None:
             # このファイルの場所を基準に 'templates' ディレクトリを指定
@@ -19,11 +87,44 @@ class PromptManager:
             self.template_dir = os.path.join(base_dir, 'templates')
         else:
             self.template_dir = template_dir
+        self.check_interval_seconds = check_interval_seconds
+
+        # テンプレート名 -> (更新時刻, 最終確認時刻, テンプレート文字列, CompiledTemplate)
+        self._cache: Dict[str, Tuple[float, float, str, CompiledTemplate]] = {}
+        # 警告済みの (テンプレート名, 更新時刻, キーの集合)
+        self._reported_key_sets = set()
 
         if not os.path.isdir(self.template_dir):
             # 開発初期段階ではディレクトリが存在しない可能性もあるため、警告に留める
             print(f"警告: プロンプトテンプレートディレクトリが見つかりません: {self.template_dir}")
 
+    def _load_cached(self, template_name: str) -> Optional[Tuple[float, float, str, CompiledTemplate]]:
+        """
+        キャッシュ済みのテンプレートを返す。確認間隔を過ぎていればファイルの更新時刻を確認し、
+        変更されていれば読み直してコンパイルする。読み込めない場合は None。
+        """
+        now = time.monotonic()
+        cached = self._cache.get(template_name)
+        if cached and now - cached[1] < self.check_interval_seconds:
+            return cached
+
+        template_path = os.path.join(self.template_dir, template_name)
+        try:
+            mtime = os.path.getmtime(template_path)
+            if cached and cached[0] == mtime:
+                cached = (mtime, now, cached[2], cached[3])
+            else:
+                with open(template_path, 'r', encoding='utf-8') as f:
+                    source = f.read()
+                cached = (mtime, now, source, CompiledTemplate(source))
+            self._cache[template_name] = cached
+            return cached
+        except FileNotFoundError:
+            print(f"エラー: プロンプトテンプレートファイルが見つかりません: {template_path}")
+        except Exception as e:
+            print(f"エラー: プロンプトテンプレートファイルの読み込み中にエラーが発生しました: {e}")
+        self._cache.pop(template_name, None)
+        return None
 
     def load_template(self, template_name: str) -> str:
         """
@@ -35,16 +136,40 @@ class PromptManager:
         Returns:
             str: 読み込まれたテンプレート文字列。ファイルが見つからない場合は空文字列。
         """
-        template_path = os.path.join(self.template_dir, template_name)
-        try:
-            with open(template_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except FileNotFoundError:
-            print(f"エラー: プロンプトテンプレートファイルが見つかりません: {template_path}")
-            return ""
-        except Exception as e:
-            print(f"エラー: プロンプトテンプレートファイルの読み込み中にエラーが発生しました: {e}")
-            return ""
+        cached = self._load_cached(template_name)
+        return cached[2] if cached else ""
+
+    def get_compiled_template(self, template_name: str, expected_keys: Iterable[str] = None) -> Optional[CompiledTemplate]:
+        """
+        コンパイル済みのテンプレートを返す。
+
+        expected_keys が指定された場合、値が渡されないプレースホルダーと、テンプレートで
+        使われていないキーを警告する。警告はテンプレートとキーの組み合わせごとに1回のみ行う。
+
+        Args:
+            template_name (str): テンプレートファイル名。
+            expected_keys (Iterable[str], optional): 埋め込む予定のキー。
+
+        Returns:
+            Optional[CompiledTemplate]: コンパイル済みテンプレート。読み込めない場合は None。
+        """
+        cached = self._load_cached(template_name)
+        if not cached:
+            return None
+        mtime, _, _, compiled = cached
+
+        if expected_keys is not None:
+            key_set = frozenset(expected_keys)
+            report_key = (template_name, mtime, key_set)
+            if report_key not in self._reported_key_sets:
+                self._reported_key_sets.add(report_key)
+                missing = sorted(compiled.placeholders - key_set)
+                unused = sorted(key_set - compiled.placeholders)
+                if missing:
+                    print(f"警告: テンプレート '{template_name}' のプレースホルダーに対応する値がありません: {', '.join(missing)}")
+                if unused:
+                    print(f"警告: テンプレート '{template_name}' で使われていないキーがあります: {', '.join(unused)}")
+        return compiled
 
     def build_prompt(self, template_name: str, context: Dict[str, Any]) -> str:
         """
@@ -60,13 +185,7 @@ class PromptManager:
         Returns:
             str: 構築されたプロンプト文字列。テンプレートが見つからない場合は空文字列。
         """
-        template_content = self.load_template(template_name)
-        if not template_content:
+        compiled = self.get_compiled_template(template_name, expected_keys=context.keys())
+        if not compiled:
             return ""
-
-        prompt = template_content
-        for key, value in context.items():
-            placeholder = "{{" + key + "}}"
-            prompt = prompt.replace(placeholder, str(value)) # 値は文字列に変換して埋め込む
-
-        return prompt
+        return compiled.render(context)
@@ -0,0 +1,322 @@
+import json
+import mmap
+import os
+import sqlite3
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+INDEX_SUFFIX = ".index.sqlite3"
+# 追記かどうかの判定に使う、索引済み部分の末尾のバイト数
+TAIL_CHECK_BYTES = 4096
+INDEX_SCHEMA_VERSION = "1"
+
+
+def _article_category(article: Dict[str, Any]) -> Optional[str]:
+    category = article.get("category")
+    if isinstance(category, list):
+        category = category[0] if category else None
+    return str(category).strip() if category else None
+
+
+def add_article_filter_arguments(parser, verb: str = "処理する") -> None:
+    """
+    記事を絞り込むコマンドライン引数 (--id, --category, --since, --until) を parser に追加する。
+    """
+    parser.add_argument("--id", dest="article_ids", action="append", help=f"{verb}記事の id (複数指定可)")
+    parser.add_argument("--category", help=f"{verb}記事のカテゴリー")
+    parser.add_argument("--since", help=f"{verb}記事の投稿日の下限 (例: 2023-01-01)")
+    parser.add_argument("--until", help=f"{verb}記事の投稿日の上限 (例: 2023-12-31)")
+
+
+def article_filters_from_args(args) -> Dict[str, Any]:
+    """
+    add_article_filter_arguments で追加した引数から、CorpusStore.iter_entries に渡す絞り込み条件を作る。
+    """
+    filters = {"article_ids": args.article_ids, "category": args.category,
+               "date_from": args.since, "date_to": args.until}
+    return {key: value for key, value in filters.items() if value is not None}
+
+
+class CorpusStore:
+    """
+    記事データ (JSON Lines) に、行ごとのバイトオフセットとメタデータ (id, title, category, post_date) の索引を付けて読む。
+
+    索引は SQLite のファイル (既定ではコーパスの隣の <コーパス名>.index.sqlite3) に保存し、
+    id による検索や category・投稿日での絞り込みは索引だけで行う。本文は mmap したコーパスから
+    該当する行だけを読み込むため、全件を走査せずに必要な記事を取り出せる。
+
+    コーパスが更新されていれば開くときに索引を更新する。末尾への追記であれば追記分だけを索引に加え、
+    それ以外の変更の場合は索引を作り直す。
+    """
+
+    def __init__(self, corpus_path: str, index_path: str = None):
+        """
+        CorpusStoreのコンストラクタ。
+
+        Args:
+            corpus_path (str): 記事データ (JSON Lines) のパス。
+            index_path (str, optional): 索引 (SQLite) のパス。省略時は corpus_path + ".index.sqlite3"。
+
+        Raises:
+            FileNotFoundError: コーパスが見つからない場合。
+        """
+        if not os.path.exists(corpus_path):
+            raise FileNotFoundError(f"コーパスが見つかりません: {corpus_path}")
+        self.corpus_path = corpus_path
+        self.index_path = index_path or corpus_path + INDEX_SUFFIX
+        self._file = None
+        self._mmap = None
+
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.index_path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS articles ("
+                " line_number INTEGER PRIMARY KEY,"
+                " offset INTEGER NOT NULL,"
+                " length INTEGER NOT NULL,"
+                " article_id TEXT,"
+                " title TEXT,"
+                " category TEXT,"
+                " post_date TEXT,"
+                " valid INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_id ON articles (article_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_category ON articles (category, post_date)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_post_date ON articles (post_date)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.last_refresh = self.refresh()
+
+    def __enter__(self) -> "CorpusStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # --- 索引の更新 ---
+
+    def _meta(self) -> Dict[str, str]:
+        return dict(self._conn.execute("SELECT name, value FROM meta").fetchall())
+
+    def _tail_checksum(self, f, end: int) -> str:
+        start = max(0, end - TAIL_CHECK_BYTES)
+        f.seek(start)
+        return f"{zlib.crc32(f.read(end - start)):08x}"
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        コーパスの変更を索引に反映する。
+
+        Returns:
+            dict: mode ("unchanged", "appended", "rebuilt") と、今回索引に加えた行数 (indexed_lines)。
+        """
+        stat = os.stat(self.corpus_path)
+        signature = f"{stat.st_size}:{stat.st_mtime_ns}"
+        meta = self._meta()
+        if meta.get("version") == INDEX_SCHEMA_VERSION and meta.get("signature") == signature:
+            return {"mode": "unchanged", "indexed_lines": 0}
+
+        with open(self.corpus_path, 'rb') as f:
+            mode = "rebuilt"
+            scan = {"line_count": 0, "indexed_bytes": 0}
+            indexed_bytes = int(meta.get("indexed_bytes", -1))
+            if meta.get("version") == INDEX_SCHEMA_VERSION and 0 < indexed_bytes <= stat.st_size \
+                    and self._tail_checksum(f, indexed_bytes) == meta.get("tail_checksum"):
+                # 索引済みの部分が変わっていなければ、末尾に追記された行だけを読む
+                mode = "appended"
+                scan = {"line_count": int(meta["line_count"]), "indexed_bytes": indexed_bytes}
+            first_line_number = scan["line_count"]
+
+            with self._conn:
+                if mode == "rebuilt":
+                    self._conn.execute("DELETE FROM articles")
+                f.seek(scan["indexed_bytes"])
+                self._conn.executemany("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                       self._index_lines(f, scan))
+                self._conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", [
+                    ("version", INDEX_SCHEMA_VERSION),
+                    ("signature", signature),
+                    ("indexed_bytes", str(scan["indexed_bytes"])),
+                    ("line_count", str(scan["line_count"])),
+                    ("tail_checksum", self._tail_checksum(f, scan["indexed_bytes"])),
+                ])
+        self._close_mmap()
+        return {"mode": mode, "indexed_lines": scan["line_count"] - first_line_number}
+
+    def _index_lines(self, f, scan: Dict[str, int]) -> Iterator[Tuple]:
+        """
+        f の現在位置から各行を読み、索引の行を返す。空行は行番号だけを進める。
+
+        scan の line_count と indexed_bytes は、改行で終わる (書き込みが完了した) 行までの行数と位置に更新する。
+        改行で終わらない最終行は索引に加えるが、次回の追記時に読み直す。
+        """
+        line_number, offset = scan["line_count"], scan["indexed_bytes"]
+        for raw_line in f:
+            line_number += 1
+            line_offset = offset
+            offset += len(raw_line)
+            if raw_line.endswith(b"\n"):
+                scan["line_count"], scan["indexed_bytes"] = line_number, offset
+            if not raw_line.strip():
+                continue
+            try:
+                article = json.loads(raw_line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                article = None
+            if not isinstance(article, dict):
+                yield (line_number, line_offset, len(raw_line), None, None, None, None, 0)
+                continue
+            article_id = article.get("id")
+            post_date = article.get("post_date")
+            yield (
+                line_number, line_offset, len(raw_line),
+                str(article_id) if article_id is not None else None,
+                article.get("title"),
+                _article_category(article),
+                str(post_date) if post_date else None,
+                1,
+            )
+
+    # --- 読み込み ---
+
+    def _buffer(self):
+        if self._mmap is None:
+            self._file = open(self.corpus_path, 'rb')
+            size = os.fstat(self._file.fileno()).st_size
+            # 空のファイルは mmap できないため、その場合は空のバイト列を使う
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        return self._mmap
+
+    def read_line(self, entry: Dict[str, Any]) -> bytes:
+        """
+        索引のエントリに対応する行をコーパスから読み込む。
+        """
+        return self._buffer()[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def read(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        索引のエントリに対応する記事データを返す。JSONとして読めない行の場合は None。
+        """
+        if not entry["valid"]:
+            return None
+        return json.loads(self.read_line(entry))
+
+    def get(self, article_id: Any) -> Optional[Dict[str, Any]]:
+        """
+        id で記事データを取得する。同じ id の記事が複数ある場合は最後の行のもの。見つからない場合は None。
+        """
+        entries = list(self.iter_entries(article_ids=[article_id]))
+        return self.read(entries[-1]) if entries else None
+
+    def iter_entries(
+        self,
+        article_ids: Iterable[Any] = None,
+        category: str = None,
+        date_from: str = None,
+        date_to: str = None,
+        line_numbers: Iterable[int] = None,
+        include_invalid: bool = False,
+        limit: int = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        条件に合う記事の索引のエントリを行番号順に返す (本文は読み込まない)。
+        索引から少しずつ読み出すため、全件を対象にしてもメモリに溜め込まない。
+
+        Args:
+            article_ids (Iterable, optional): 取得する記事の id。
+            category (str, optional): カテゴリー。
+            date_from (str, optional): 投稿日の下限 (例: "2023-01-01")。
+            date_to (str, optional): 投稿日の上限。日付だけを指定した場合はその日の記事を含む。
+            line_numbers (Iterable[int], optional): 取得する行番号 (1始まり)。
+            include_invalid (bool): JSONとして読めない行のエントリも含めるか。
+            limit (int, optional): 最大件数。
+
+        Returns:
+            Iterator[dict]: line_number, offset, length, id, title, category, post_date, valid を持つエントリ。
+        """
+        where, params = self._where(article_ids, category, date_from, date_to, line_numbers, include_invalid)
+        query = ("SELECT line_number, offset, length, article_id, title, category, post_date, valid FROM articles"
+                 + where + " ORDER BY line_number")
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        columns = ("line_number", "offset", "length", "id", "title", "category", "post_date", "valid")
+        for row in self._conn.execute(query, params):
+            yield dict(zip(columns, row))
+
+    def iter_articles(self, include_invalid: bool = False, **filters) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+        """
+        条件に合う記事を (行番号, 記事データ) で行番号順に返す。
+        include_invalid が True の場合、JSONとして読めない行は記事データが None になる。
+        条件は iter_entries と同じ。
+        """
+        for entry in self.iter_entries(include_invalid=include_invalid, **filters):
+            yield entry["line_number"], self.read(entry)
+
+    def iter_lines(self, include_invalid: bool = True, **filters) -> Iterator[Tuple[int, str]]:
+        """
+        条件に合う行を (行番号, 行の文字列) で返す。解析をワーカープロセスで行う場合に使う。
+        """
+        for entry in self.iter_entries(include_invalid=include_invalid, **filters):
+            yield entry["line_number"], self.read_line(entry).decode("utf-8", errors="replace")
+
+    def count(
+        self,
+        article_ids: Iterable[Any] = None,
+        category: str = None,
+        date_from: str = None,
+        date_to: str = None,
+        line_numbers: Iterable[int] = None,
+        include_invalid: bool = False
+    ) -> int:
+        """
+        条件に合う記事数を索引から数える。条件は iter_entries と同じ。
+        """
+        where, params = self._where(article_ids, category, date_from, date_to, line_numbers, include_invalid)
+        return self._conn.execute("SELECT COUNT(*) FROM articles" + where, params).fetchone()[0]
+
+    @staticmethod
+    def _where(article_ids, category, date_from, date_to, line_numbers, include_invalid) -> Tuple[str, list]:
+        conditions, params = [], []
+        if not include_invalid:
+            conditions.append("valid = 1")
+        if article_ids is not None:
+            article_ids = [str(article_id) for article_id in article_ids]
+            conditions.append(f"article_id IN ({', '.join('?' * len(article_ids))})")
+            params.extend(article_ids)
+        if line_numbers is not None:
+            line_numbers = [int(line_number) for line_number in line_numbers]
+            conditions.append(f"line_number IN ({', '.join('?' * len(line_numbers))})")
+            params.extend(line_numbers)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if date_from:
+            conditions.append("post_date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("substr(post_date, 1, ?) <= ?")
+            params.extend([len(date_to), date_to])
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def categories(self) -> Dict[str, int]:
+        """
+        カテゴリーごとの記事数を返す。
+        """
+        return dict(self._conn.execute(
+            "SELECT category, COUNT(*) FROM articles WHERE valid = 1 AND category IS NOT NULL GROUP BY category"
+        ).fetchall())
+
+    def _close_mmap(self) -> None:
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._mmap = None
+
+    def close(self) -> None:
+        self._close_mmap()
+        self._conn.close()
@@ -0,0 +1,230 @@
+import random
+import re
+import unicodedata
+import zlib
+from array import array
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from src.core.token_budget import TokenCounter
+
+# ファインチューニングの学習トークン単価 (USD / 100万トークン)。料金改定時はここを更新する
+FINETUNING_PRICE_PER_MILLION_TOKENS = {
+    "gpt-3.5-turbo": 8.0,
+    "gpt-4o-mini": 3.0,
+    "gpt-4o": 25.0,
+}
+
+# MinHash の署名の長さと、LSH で署名を分割するバンド数 (1バンド = 4値)。
+# 16バンド x 4値では、Jaccard 類似度 0.5 前後から候補として拾われ始める
+MINHASH_NUM_BINS = 64
+MINHASH_NUM_BANDS = 16
+# 文字 n-gram (shingle) の長さ。日本語の文章では5文字程度で文の言い回しの一致を捉えられる
+SHINGLE_SIZE = 5
+DEFAULT_NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_WHITESPACE = re.compile(r"\s+")
+_HASH_MASK = 0xFFFFFFFF
+# crc32 は線形なハッシュなので、乗算で上位ビットを撹拌してから使う (黄金比に基づく定数)
+_HASH_MULTIPLIER = 0x9E3779B1
+# 空のビンを埋めるときに、借りた値と区別するために加える値
+_DENSIFY_OFFSET = 0x10000
+
+
+def normalize_for_dedup(text: str) -> str:
+    """
+    重複判定用にテキストを正規化する (NFKC、小文字化、空白の除去)。
+    全角・半角や改行位置だけが異なる記事を同一とみなすため。
+    """
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    return _WHITESPACE.sub("", normalized)
+
+
+def content_fingerprint(normalized_text: str) -> str:
+    """
+    完全重複の判定に使うフィンガープリント (crc32 と長さ)。
+    normalized_text は normalize_for_dedup で正規化したテキストを渡す。
+    """
+    return f"{zlib.crc32(normalized_text.encode('utf-8')):08x}:{len(normalized_text)}"
+
+
+def minhash_signature(normalized_text: str, num_bins: int = MINHASH_NUM_BINS, shingle_size: int = SHINGLE_SIZE) -> Optional[array]:
+    """
+    テキストの文字 n-gram 集合から MinHash 署名を作る。
+    normalized_text は normalize_for_dedup で正規化したテキストを渡す。
+
+    ハッシュ関数を num_bins 個用意する代わりに、1回のハッシュ値をビンに振り分けて各ビンの最小値を取る
+    (One Permutation Hashing)。記事1件あたりのハッシュ計算が n-gram 数回で済むため、大きなコーパスでも速い。
+
+    Returns:
+        Optional[array]: 長さ num_bins の署名。テキストが空の場合は None。
+    """
+    if not normalized_text:
+        return None
+    # 1文字4バイトの固定長にエンコードし、n-gram をバイト列のスライスとして切り出す (文字列ごとの encode を避ける)
+    data = normalized_text.encode("utf-32-le")
+    width = 4 * shingle_size
+    if len(data) <= width:
+        shingles = {data}
+    else:
+        shingles = {data[i:i + width] for i in range(0, len(data) - width + 4, 4)}
+
+    empty = _HASH_MASK + 1
+    mins = [empty] * num_bins
+    for value in map(zlib.crc32, shingles):
+        value = (value * _HASH_MULTIPLIER) & _HASH_MASK
+        bin_index = (value * num_bins) >> 32
+        if value < mins[bin_index]:
+            mins[bin_index] = value
+
+    # 短いテキストでは空のビンが残るので、右隣の空でないビンの値を借りて埋める
+    if empty in mins:
+        for index in range(num_bins):
+            if mins[index] != empty:
+                continue
+            distance = 1
+            while mins[(index + distance) % num_bins] == empty:
+                distance += 1
+            mins[index] = mins[(index + distance) % num_bins] + distance * _DENSIFY_OFFSET
+    return array("Q", mins)
+
+
+def estimate_jaccard(signature_a: array, signature_b: array) -> float:
+    """
+    2つの MinHash 署名から Jaccard 類似度を推定する (一致するビンの割合)。
+    """
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / len(signature_a)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash 署名を LSH (バンド分割) で索引し、既に登録した記事と似ている記事を見つける。
+    候補の検索はバンドのハッシュ表の参照のみで行うため、記事数が増えても1件あたりの検索時間はほぼ一定。
+    """
+
+    def __init__(self, threshold: float = DEFAULT_NEAR_DUPLICATE_THRESHOLD, num_bands: int = MINHASH_NUM_BANDS):
+        """
+        NearDuplicateIndexのコンストラクタ。
+
+        Args:
+            threshold (float): 推定 Jaccard 類似度がこの値以上なら重複とみなす。
+            num_bands (int): 署名を分割するバンド数。署名の長さを割り切れる値にする。
+        """
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self._buckets: Dict[Tuple[int, bytes], List[Hashable]] = {}
+        self._signatures: Dict[Hashable, array] = {}
+
+    def _band_keys(self, signature: array) -> Iterable[Tuple[int, bytes]]:
+        rows = len(signature) // self.num_bands
+        for band in range(self.num_bands):
+            yield band, signature[band * rows:(band + 1) * rows].tobytes()
+
+    def find_duplicate(self, signature: array) -> Optional[Tuple[Hashable, float]]:
+        """
+        signature と類似度が閾値以上の登録済みの記事を探す。
+
+        Returns:
+            Optional[Tuple[Hashable, float]]: (記事のキー, 推定類似度)。見つからなければ None。
+        """
+        checked = set()
+        for band_key in self._band_keys(signature):
+            for key in self._buckets.get(band_key, ()):
+                if key in checked:
+                    continue
+                checked.add(key)
+                similarity = estimate_jaccard(signature, self._signatures[key])
+                if similarity >= self.threshold:
+                    return key, similarity
+        return None
+
+    def add(self, key: Hashable, signature: array) -> None:
+        self._signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(key)
+
+
+def fit_record_to_token_limit(record: Dict[str, Any], counter: TokenCounter, max_tokens: int) -> Optional[Dict[str, Any]]:
+    """
+    チャット形式のレコードが max_tokens に収まるよう、最後の assistant メッセージの本文を切り詰める。
+
+    Returns:
+        Optional[dict]: 収まるレコード (元のレコードは変更しない)。system/user だけで上限を超える場合は None。
+    """
+    messages = record["messages"]
+    if counter.count_messages(messages) <= max_tokens:
+        return record
+    assistant_index = max((i for i, m in enumerate(messages) if m.get("role") == "assistant"), default=None)
+    if assistant_index is None:
+        return None
+    content = messages[assistant_index].get("content") or ""
+    others = messages[:assistant_index] + [{**messages[assistant_index], "content": ""}] + messages[assistant_index + 1:]
+    budget = max_tokens - counter.count_messages(others)
+    truncated = counter.truncate_text(content, budget)
+    if not truncated:
+        return None
+    fitted_messages = list(messages)
+    fitted_messages[assistant_index] = {**messages[assistant_index], "content": truncated}
+    return {**record, "messages": fitted_messages}
+
+
+def stratified_split(
+    categories: Dict[Hashable, str],
+    validation_ratio: float,
+    seed: int = 42
+) -> Tuple[List[Hashable], List[Hashable]]:
+    """
+    カテゴリーごとの比率を保ったまま学習用と検証用に分割する。
+
+    各カテゴリーから round(件数 * validation_ratio) 件 (2件以上あるカテゴリーは最低1件) を検証用にする。
+    1件しかないカテゴリーは学習用に入れる。シャッフルは seed で固定するため、同じ入力なら同じ分割になる。
+
+    Args:
+        categories (Dict[Hashable, str]): 記事のキーからカテゴリー名への対応 (キーは入力順)。
+        validation_ratio (float): 検証用に回す割合 (0〜1)。
+        seed (int): シャッフルの乱数シード。
+
+    Returns:
+        Tuple[List, List]: (学習用のキー, 検証用のキー)。それぞれ入力順に並ぶ。
+    """
+    keys_by_category: Dict[str, List[Hashable]] = {}
+    for key, category in categories.items():
+        keys_by_category.setdefault(category, []).append(key)
+
+    rng = random.Random(seed)
+    validation_keys = set()
+    for category in sorted(keys_by_category):
+        keys = keys_by_category[category]
+        if validation_ratio <= 0 or len(keys) < 2:
+            continue
+        count = min(len(keys) - 1, max(1, round(len(keys) * validation_ratio)))
+        shuffled = list(keys)
+        rng.shuffle(shuffled)
+        validation_keys.update(shuffled[:count])
+
+    train = [key for key in categories if key not in validation_keys]
+    validation = [key for key in categories if key in validation_keys]
+    return train, validation
+
+
+def estimate_training_cost(train_tokens: int, model: str, n_epochs: int) -> Dict[str, Any]:
+    """
+    学習トークン数とエポック数から、課金対象のトークン数と費用の目安を求める。
+
+    Returns:
+        dict: tokens_per_epoch, n_epochs, billed_tokens, price_per_million_tokens, estimated_cost_usd。
+              単価が分からないモデルでは price_per_million_tokens と estimated_cost_usd が None。
+    """
+    price = None
+    for known_model in sorted(FINETUNING_PRICE_PER_MILLION_TOKENS, key=len, reverse=True):
+        if model and model.startswith(known_model):
+            price = FINETUNING_PRICE_PER_MILLION_TOKENS[known_model]
+            break
+    billed_tokens = train_tokens * n_epochs
+    return {
+        "tokens_per_epoch": train_tokens,
+        "n_epochs": n_epochs,
+        "billed_tokens": billed_tokens,
+        "price_per_million_tokens": price,
+        "estimated_cost_usd": round(billed_tokens / 1_000_000 * price, 2) if price is not None else None,
+    }
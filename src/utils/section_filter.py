@@ -0,0 +1,191 @@
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional
+
+# Twitterアカウント表記。前後の空白 (改行を含む) を取り除いて前後の文と連結する
+TWITTER_HANDLE = "@miyakawa2449"
+
+# 見出し行の次の本文1行 (空行を挟んでも可) までを削除するセクション
+RELATED_ARTICLE_HEADINGS = {"関連記事", "関連する記事", "■関連記事"}
+_OVERSEAS_REACTION_HEADING = re.compile(r"(?:海外での\s*Twitter\s*の反応|海外の反応)\s*", re.IGNORECASE)
+
+# 見出しの直後に続くリスト (-, *, 1. など) を見出しごと削除するセクション
+TABLE_OF_CONTENTS_HEADINGS = {"目次", "この記事の目次"}
+
+# 1行単位で空行に置き換える行のパターン
+_AMAZON_PIPE_LINE = re.compile(r"Amazon\s*\|", re.IGNORECASE)
+_AMAZON_SHOP_LINE_SUFFIX = re.compile(r"(?:通販\s*\|\s*Amazon|Amazon\s*で見る)$", re.IGNORECASE)
+_OFFICIAL_SITE_MARKER = "」公式サイト"
+
+
+class _LineStream:
+    """
+    先読みと押し戻しができる行イテレーター。各ルールはこれを1行ずつ読み進める。
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self._lines = iter(lines)
+        self._pushed_back = deque()
+
+    def next(self) -> Optional[str]:
+        if self._pushed_back:
+            return self._pushed_back.popleft()
+        return next(self._lines, None)
+
+    def push_back(self, line: str) -> None:
+        self._pushed_back.appendleft(line)
+
+
+def _is_blank(line: str) -> bool:
+    return not line.strip()
+
+
+def _join_twitter_handle(text: str) -> str:
+    """
+    @miyakawa2449 の前後にある空白を取り除く。正規表現を使わず、出現位置で分割して処理する。
+    """
+    if TWITTER_HANDLE not in text:
+        return text
+    parts = text.split(TWITTER_HANDLE)
+    stripped_parts = [parts[0].rstrip()]
+    stripped_parts.extend(part.strip() for part in parts[1:-1])
+    stripped_parts.append(parts[-1].lstrip())
+    return TWITTER_HANDLE.join(stripped_parts)
+
+
+def _drop_heading_and_next_line(lines: Iterable[str], is_heading: Callable[[str], bool]) -> Iterator[str]:
+    """
+    見出し行と、それに続く空白行、および最初の本文行を1つの空行に置き換える。
+    見出しが最終行 (後ろに改行がない) の場合は削除しない。
+    """
+    stream = _LineStream(lines)
+    line = stream.next()
+    while line is not None:
+        following = stream.next()
+        if following is None or not is_heading(line):
+            yield line
+            line = following
+            continue
+        while following is not None and _is_blank(following):
+            following = stream.next()
+        # following は見出し後の最初の本文行 (または末尾)。これも削除対象に含める
+        yield ""
+        line = stream.next() if following is not None else None
+
+
+def _blank_quote_source_lines(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        yield "" if line.startswith("引用元:") else line
+
+
+def _is_link_line(line: str) -> bool:
+    """
+    Amazon や YouTube へのリンク、公式サイトへの誘導など、1行単位で削除する行かどうか。
+    """
+    if _AMAZON_PIPE_LINE.match(line) or _AMAZON_SHOP_LINE_SUFFIX.search(line):
+        return True
+
+    stripped_lower = line.strip().lower()
+    if stripped_lower.startswith("<a href=") and stripped_lower.endswith("</a>"):
+        if stripped_lower.find("amazon.co.jp", len("<a href="), len(stripped_lower) - len("</a>")) != -1:
+            return True
+
+    if line[-len("youtube"):].lower() == "youtube":
+        return True
+
+    if line.startswith("映画「") and line.endswith("公開"):
+        marker_index = line.find(_OFFICIAL_SITE_MARKER, len("映画「"))
+        if marker_index != -1 and marker_index + len(_OFFICIAL_SITE_MARKER) <= len(line) - len("公開"):
+            return True
+    return False
+
+
+def _blank_link_lines(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        yield "" if _is_link_line(line) else line
+
+
+def _is_list_item(line: str) -> bool:
+    if line[:1] in ("-", "*"):
+        return True
+    return len(line) >= 2 and line[0].isdecimal() and line[1] == "."
+
+
+def _drop_table_of_contents(lines: Iterable[str]) -> Iterator[str]:
+    """
+    目次見出しと、その直後 (空白行を挟んでも可) に続くリスト行をまとめて削除する。
+    リスト行は後ろに改行が続くもののみを対象とし、リストがなければ見出しも残す。
+    """
+    stream = _LineStream(lines)
+    line = stream.next()
+    while line is not None:
+        if line.rstrip() not in TABLE_OF_CONTENTS_HEADINGS:
+            yield line
+            line = stream.next()
+            continue
+
+        skipped_blank_lines: List[str] = []
+        following = stream.next()
+        while following is not None and _is_blank(following):
+            skipped_blank_lines.append(following)
+            following = stream.next()
+
+        after_first_item = stream.next() if following is not None else None
+        if following is None or after_first_item is None or not _is_list_item(following):
+            # 目次ではなかったので見出しと空白行はそのまま出力し、続きの行を改めて調べる
+            if after_first_item is not None:
+                stream.push_back(after_first_item)
+            if following is not None:
+                stream.push_back(following)
+            yield line
+            yield from skipped_blank_lines
+            line = stream.next()
+            continue
+
+        line = after_first_item
+        while line is not None and _is_list_item(line):
+            following = stream.next()
+            if following is None:
+                break
+            line = following
+
+
+def _collapse_blank_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    空白のみの行が連続する箇所を1つの空行にまとめる。
+    """
+    previous_blank = False
+    for line in lines:
+        is_blank = _is_blank(line)
+        if is_blank and previous_blank:
+            continue
+        yield "" if is_blank else line
+        previous_blank = is_blank
+
+
+def strip_unwanted_sections(text_content: str) -> str:
+    """
+    ブログ記事から関連記事・引用元・海外の反応・Amazon/YouTubeリンク・公式サイト誘導・目次などの
+    不要なセクションを取り除き、連続する空行を1行にまとめる。
+
+    行単位のフィルターをジェネレーターで連結し、記事全体を1回走査するだけで全ルールを適用する。
+    各ルールの適用順と結果は、従来の正規表現による実装 (ルールごとに re.sub を適用) と同じになる。
+    ただし、従来の正規表現で見出しやリンク行の途中に改行を含む場合にまで一致していたケースは、
+    行単位で判定するため対象外とする。
+
+    Args:
+        text_content (str): 対象の記事本文。
+
+    Returns:
+        str: 不要セクションを除去し、前後の空白を取り除いた本文。
+    """
+    text_content = _join_twitter_handle(text_content)
+
+    lines: Iterable[str] = text_content.split("\n")
+    lines = _drop_heading_and_next_line(lines, lambda line: line.rstrip() in RELATED_ARTICLE_HEADINGS)
+    lines = _blank_quote_source_lines(lines)
+    lines = _drop_heading_and_next_line(lines, lambda line: _OVERSEAS_REACTION_HEADING.fullmatch(line) is not None)
+    lines = _blank_link_lines(lines)
+    lines = _drop_table_of_contents(lines)
+    lines = _collapse_blank_lines(lines)
+    return "\n".join(lines).strip()
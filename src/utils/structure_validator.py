@@ -0,0 +1,124 @@
+import re
+from typing import List, Optional
+
+# 生成する記事の6部構成 (scripts/refine_output_jsonl.py の再編指示と同じ順序)。
+# src/prompts/templates/movie_review_template.txt の「**# 感想・レビュー**」「**# メインキャスト紹介（1名または2名程度）**」
+# のような表記の揺れは normalize_heading_name で吸収して比較する
+ARTICLE_SECTION_HEADINGS = ["導入", "予告編とあらすじ", "出演者・スタッフ情報", "感想レビュー", "メインキャスト紹介", "まとめ"]
+# ストリーミング生成で構成の崩れにより生成をやり直すときに返すチャンクの接頭辞。
+# 受け取った側はそれまでに受信したチャンクを破棄する
+STRUCTURE_RETRY_PREFIX = "再試行:"
+
+
+# 見出しの末尾の補足 ("（1名または2名程度）" など)
+_TRAILING_PARENTHETICAL = re.compile(r"\s*[（(][^（()）]*[)）]\s*$")
+# 見出し名の比較で無視する文字 (中黒と空白)
+_IGNORED_HEADING_CHARS = re.compile(r"[・･\s]")
+
+
+def normalize_heading_name(name: str) -> str:
+    """
+    見出し名を比較用に正規化する。強調 (** や __)、末尾の括弧書き、中黒と空白を取り除く。
+    例: "**感想・レビュー**" -> "感想レビュー"、"メインキャスト紹介（1名または2名程度）" -> "メインキャスト紹介"
+    """
+    name = name.strip().strip("*_").strip()
+    name = _TRAILING_PARENTHETICAL.sub("", name)
+    return _IGNORED_HEADING_CHARS.sub("", name)
+
+
+def _heading_level_and_name(line: str):
+    """
+    見出し行 ("# 導入" や "**# 導入**" など) の見出しレベルと見出し名を返す。見出し行でなければ (0, None)。
+    Markdown と同様に、"#" の直後が空白でない行 ("#ハッシュタグ" など) は見出しとみなさない。
+    """
+    # 行全体を強調した見出し ("**# 導入**") も見出しとして扱う
+    stripped = line.strip().strip("*_").strip()
+    level = len(stripped) - len(stripped.lstrip("#"))
+    if level == 0 or (len(stripped) > level and not stripped[level].isspace()):
+        return 0, None
+    return level, stripped[level:].strip()
+
+
+class SectionStructureValidator:
+    """
+    ストリーミングで受信した記事を逐次検証し、6部構成の見出しが崩れた時点で検出する。
+
+    feed で受信したチャンクを渡すと、完成した行ごとに以下を確認する。
+    - 最初の見出し "# 導入" より前に本文がない (前置きや見出しのない文章になっていない)
+    - レベル1の見出しが ARTICLE_SECTION_HEADINGS の順序どおりに現れる (重複・欠落・想定外の見出しがない)。
+      見出し名は normalize_heading_name で正規化してから比較する
+    レベル2以下の見出し ("## ...") は、いずれかのセクションの中であれば本文として扱う。
+    """
+
+    def __init__(self, headings: List[str] = None):
+        """
+        Args:
+            headings (List[str], optional): 期待するレベル1の見出し名の順序。Noneの場合、ARTICLE_SECTION_HEADINGS。
+        """
+        self.headings = list(headings or ARTICLE_SECTION_HEADINGS)
+        self._normalized_headings = [normalize_heading_name(heading) for heading in self.headings]
+        self.sections_found = 0
+        self.violation: Optional[str] = None
+        self._partial_line = ""
+
+    def feed(self, text: str) -> Optional[str]:
+        """
+        受信したチャンクを検証する。
+
+        Args:
+            text (str): ストリーミングで受信したテキストのチャンク。
+
+        Returns:
+            Optional[str]: 構成の崩れを検出した場合はその内容。問題がなければNone。一度検出した後は同じ内容を返し続ける。
+        """
+        if self.violation is not None:
+            return self.violation
+        lines = (self._partial_line + text).split("\n")
+        self._partial_line = lines.pop()
+        for line in lines:
+            if self._check_line(line) is not None:
+                return self.violation
+        # 最初の見出しより前は、行の途中でも先頭が "#" (強調された見出しの "*" を含む) でなければ
+        # 見出しのない文章と判断できる
+        partial = self._partial_line.lstrip()
+        if self.sections_found == 0 and partial and not partial.startswith(("#", "*", "_")):
+            self.violation = f"最初の見出し「# {self.headings[0]}」の前に本文があります"
+        return self.violation
+
+    def finish(self) -> Optional[str]:
+        """
+        ストリームの終了時に、残りの行を検証し、すべての見出しが揃っているかを確認する。
+
+        Returns:
+            Optional[str]: 構成の崩れを検出した場合はその内容。問題がなければNone。
+        """
+        if self.violation is None and self._partial_line:
+            line, self._partial_line = self._partial_line, ""
+            self._check_line(line)
+        if self.violation is None and self.sections_found < len(self.headings):
+            missing = ", ".join(f"# {heading}" for heading in self.headings[self.sections_found:])
+            self.violation = f"見出しが不足しています: {missing}"
+        return self.violation
+
+    def _check_line(self, line: str) -> Optional[str]:
+        if not line.strip():
+            return None
+        level, name = _heading_level_and_name(line)
+        if level == 0 or (level >= 2 and self.sections_found > 0):
+            if self.sections_found == 0:
+                self.violation = f"最初の見出し「# {self.headings[0]}」の前に本文があります"
+            return self.violation
+        if level >= 2:
+            self.violation = f"最初の見出し「# {self.headings[0]}」の前に見出し「{line.strip()}」があります"
+            return self.violation
+
+        expected = self.headings[self.sections_found] if self.sections_found < len(self.headings) else None
+        normalized = normalize_heading_name(name)
+        if expected is not None and normalized == self._normalized_headings[self.sections_found]:
+            self.sections_found += 1
+        elif normalized in self._normalized_headings:
+            self.violation = (f"見出しの順序が違います: 「# {expected}」の位置に「# {name}」があります"
+                              if expected else f"見出し「# {name}」が重複しています")
+        else:
+            self.violation = f"想定外の見出しがあります: 「{line.strip()}」"
+        return self.violation
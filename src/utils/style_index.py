@@ -0,0 +1,306 @@
+import json
+import math
+import mmap
+import os
+import re
+import unicodedata
+import zlib
+from array import array
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.corpus_store import CorpusStore
+
+INDEX_VERSION = 1
+INDEX_FILE = "index.json"
+POSTINGS_DOCS_FILE = "postings_docs.u32"
+POSTINGS_WEIGHTS_FILE = "postings_weights.f32"
+# 記事ごとの n-gram の出現回数。コーパスが変わったときに、変わっていない記事の再計算を省くために使う
+DOC_TERMS_FILE = "doc_terms.jsonl"
+
+# タイトルの n-gram は本文より重く扱う
+TITLE_WEIGHT = 3.0
+# 本文から索引に入れる n-gram の数 (TF-IDF の上位)。候補は出現回数の上位から選ぶ
+BODY_TERMS_PER_DOCUMENT = 64
+BODY_CANDIDATE_TERMS = 256
+# 検索時、これより多くの記事に出現する n-gram は識別力が低いので使わない (検索時間を一定に保つため)
+MAX_DOCUMENT_FREQUENCY_RATIO = 0.2
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def extract_bigrams(text: str) -> Counter:
+    """
+    テキストを正規化し (NFKC、小文字化)、記号や空白で区切った各部分から文字 bigram を数える。
+    1文字だけの部分はその1文字を語として扱う。
+    """
+    counts: Counter = Counter()
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    for run in _NON_WORD.split(normalized):
+        if len(run) == 1:
+            counts[run] += 1
+        else:
+            counts.update(run[i:i + 2] for i in range(len(run) - 1))
+    return counts
+
+
+def _corpus_signature(corpus_path: str) -> str:
+    stat = os.stat(corpus_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class StyleExampleIndex:
+    """
+    過去のレビュー記事から、生成する映画に近い記事を文体例として選ぶための検索インデックス。
+
+    記事ごとにタイトルと本文の文字 bigram で TF-IDF ベクトルを作り、転置インデックスとして保存する。
+    転置リスト (記事番号 uint32 と重み float32 の配列) は別ファイルに置いて mmap で読むため、
+    読み込み時にコピーが発生せず、検索は該当する n-gram の転置リストをたどるだけで済む。
+    """
+
+    def __init__(self, index_dir: str):
+        """
+        保存済みのインデックスを読み込む。インデックスの作成・更新は build_or_update で行う。
+
+        Args:
+            index_dir (str): インデックスを保存したディレクトリ。
+
+        Raises:
+            FileNotFoundError: インデックスが見つからない場合。
+        """
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.corpus_path = meta["corpus_path"]
+        self.corpus_signature = meta["corpus_signature"]
+        self.documents: List[Dict[str, Any]] = meta["documents"]
+        # n-gram -> [転置リストの開始位置, 件数, idf]
+        self.terms: Dict[str, List[float]] = meta["terms"]
+        self._postings_docs = self._map_array(POSTINGS_DOCS_FILE, "I")
+        self._postings_weights = self._map_array(POSTINGS_WEIGHTS_FILE, "f")
+
+    def _map_array(self, file_name: str, type_code: str):
+        path = os.path.join(self.index_dir, file_name)
+        if os.path.getsize(path) == 0:
+            return memoryview(array(type_code))
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast(type_code)
+
+    # --- 検索 ---
+
+    def search(self, query: str, category: str = None, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        query (映画タイトルやジャンル) に近い記事を類似度の高い順に返す。
+
+        Args:
+            query (str): 検索語。タイトルやジャンル名をそのまま渡す。
+            category (str, optional): 指定した場合、同じカテゴリーの記事に限る (該当がなければ全記事から選ぶ)。
+            top_k (int): 返す件数。
+
+        Returns:
+            List[dict]: 記事の情報 (id, title, category, post_date, offset, length) に score を加えたもの。
+        """
+        max_document_frequency = max(10, int(len(self.documents) * MAX_DOCUMENT_FREQUENCY_RATIO))
+        query_terms = [(term, count, self.terms[term]) for term, count in extract_bigrams(query).items()
+                       if term in self.terms]
+        # 出現する記事が少ない (識別力の高い) n-gram から使い、それで一致する記事がなかった場合だけ残りも使う
+        query_terms.sort(key=lambda item: item[2][1])
+        scores: Dict[int, float] = {}
+        for term, count, entry in query_terms:
+            start, length, idf = int(entry[0]), int(entry[1]), entry[2]
+            if length > max_document_frequency and scores:
+                break
+            query_weight = (1 + math.log(count)) * idf
+            for doc_index, weight in zip(self._postings_docs[start:start + length],
+                                         self._postings_weights[start:start + length]):
+                scores[doc_index] = scores.get(doc_index, 0.0) + query_weight * weight
+
+        candidates = scores.items()
+        if category:
+            in_category = [(i, s) for i, s in candidates if self.documents[i]["category"] == category]
+            if in_category:
+                candidates = in_category
+        ranked = sorted(candidates, key=lambda item: item[1], reverse=True)[:top_k]
+        return [{**self.documents[doc_index], "score": round(score, 4)} for doc_index, score in ranked]
+
+    def load_article(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        検索結果の記事データをコーパスから読み込む (保存してあるバイトオフセットから1行だけ読む)。
+        """
+        with open(self.corpus_path, 'rb') as f:
+            f.seek(document["offset"])
+            return json.loads(f.read(document["length"]))
+
+    # --- 作成と更新 ---
+
+    @classmethod
+    def build_or_update(cls, corpus_path: str, index_dir: str) -> Tuple["StyleExampleIndex", Dict[str, int]]:
+        """
+        コーパスからインデックスを作成する。既存のインデックスがあり、コーパスが変わっていなければそのまま読み込む。
+        コーパスが変わっている場合は、内容が変わっていない記事の n-gram の集計を再利用し、
+        追加・変更された記事だけを解析してからインデックスを作り直す。
+
+        Returns:
+            Tuple[StyleExampleIndex, dict]: インデックスと、更新の統計 (documents, analyzed, reused)。
+        """
+        corpus_path = os.path.abspath(corpus_path)
+        signature = _corpus_signature(corpus_path)
+        index_path = os.path.join(index_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get("version") == INDEX_VERSION and meta.get("corpus_path") == corpus_path \
+                        and meta.get("corpus_signature") == signature:
+                    return cls(index_dir), {"documents": len(meta["documents"]), "analyzed": 0, "reused": 0}
+            except (OSError, json.JSONDecodeError, KeyError):
+                pass
+
+        os.makedirs(index_dir, exist_ok=True)
+        cached_terms = _load_doc_terms(os.path.join(index_dir, DOC_TERMS_FILE))
+        documents, doc_terms = [], []
+        stats = {"documents": 0, "analyzed": 0, "reused": 0}
+        with CorpusStore(corpus_path) as corpus:
+            for entry in corpus.iter_entries():
+                line = corpus.read_line(entry)
+                fingerprint = f"{zlib.crc32(line):08x}:{len(line)}"
+                if fingerprint in cached_terms:
+                    # 変わっていない記事は、本文を解析せずに前回の集計を使う
+                    terms = cached_terms[fingerprint]
+                    stats["reused"] += 1
+                else:
+                    article = json.loads(line)
+                    body_counts = extract_bigrams(article.get("text", ""))
+                    terms = {
+                        "title": dict(extract_bigrams(article.get("title", ""))),
+                        "body": dict(body_counts.most_common(BODY_CANDIDATE_TERMS)),
+                    }
+                    stats["analyzed"] += 1
+                documents.append({
+                    "id": entry["id"],
+                    "title": entry["title"] or "",
+                    "category": entry["category"] or "",
+                    "post_date": entry["post_date"],
+                    "offset": entry["offset"],
+                    "length": entry["length"],
+                    "fingerprint": fingerprint,
+                })
+                doc_terms.append(terms)
+        stats["documents"] = len(documents)
+
+        _write_index(index_dir, corpus_path, signature, documents, doc_terms)
+        return cls(index_dir), stats
+
+
+def _load_doc_terms(path: str) -> Dict[str, Dict[str, Dict[str, int]]]:
+    cached = {}
+    if not os.path.exists(path):
+        return cached
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                cached[entry["fingerprint"]] = entry["terms"]
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return cached
+
+
+def _write_atomically(path: str, write) -> None:
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _write_index(index_dir: str, corpus_path: str, signature: str,
+                 documents: List[Dict[str, Any]], doc_terms: List[Dict[str, Dict[str, int]]]) -> None:
+    """
+    記事ごとの n-gram の集計から TF-IDF の重みを計算し、転置インデックスを書き出す。
+    """
+    document_count = len(documents)
+    document_frequency: Counter = Counter()
+    for terms in doc_terms:
+        document_frequency.update(set(terms["title"]) | set(terms["body"]))
+    idf = {term: math.log((1 + document_count) / (1 + df)) + 1 for term, df in document_frequency.items()}
+
+    postings: Dict[str, List[Tuple[int, float]]] = {}
+    for doc_index, terms in enumerate(doc_terms):
+        weights: Dict[str, float] = {}
+        body_weights = {term: (1 + math.log(count)) * idf[term] for term, count in terms["body"].items()}
+        for term in sorted(body_weights, key=body_weights.get, reverse=True)[:BODY_TERMS_PER_DOCUMENT]:
+            weights[term] = body_weights[term]
+        for term, count in terms["title"].items():
+            weights[term] = weights.get(term, 0.0) + TITLE_WEIGHT * (1 + math.log(count)) * idf[term]
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        for term, weight in weights.items():
+            postings.setdefault(term, []).append((doc_index, weight / norm))
+
+    postings_docs, postings_weights = array("I"), array("f")
+    term_entries = {}
+    for term in sorted(postings):
+        entries = postings[term]
+        term_entries[term] = [len(postings_docs), len(entries), round(idf[term], 6)]
+        postings_docs.extend(doc_index for doc_index, _ in entries)
+        postings_weights.extend(weight for _, weight in entries)
+
+    _write_atomically(os.path.join(index_dir, POSTINGS_DOCS_FILE), postings_docs.tofile)
+    _write_atomically(os.path.join(index_dir, POSTINGS_WEIGHTS_FILE), postings_weights.tofile)
+    _write_atomically(os.path.join(index_dir, DOC_TERMS_FILE), lambda f: f.writelines(
+        (json.dumps({"fingerprint": document["fingerprint"], "terms": terms}, ensure_ascii=False) + "\n").encode("utf-8")
+        for document, terms in zip(documents, doc_terms)
+    ))
+    # index.json は最後に書き換える (転置リストより先に新しくなると、古い転置リストを参照してしまうため)
+    meta = {
+        "version": INDEX_VERSION,
+        "corpus_path": corpus_path,
+        "corpus_signature": signature,
+        "documents": documents,
+        "terms": term_entries,
+    }
+    _write_atomically(os.path.join(index_dir, INDEX_FILE),
+                      lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+
+
+_loaded_indexes: Dict[Tuple[str, str], StyleExampleIndex] = {}
+
+
+def get_style_index(corpus_path: str, index_dir: str) -> StyleExampleIndex:
+    """
+    プロセス内で共有するインデックスを返す。コーパスが更新されていれば差分を反映してから返す。
+    """
+    key = (os.path.abspath(corpus_path), os.path.abspath(index_dir))
+    index = _loaded_indexes.get(key)
+    if index is None or index.corpus_signature != _corpus_signature(corpus_path):
+        index, stats = StyleExampleIndex.build_or_update(corpus_path, index_dir)
+        if stats["analyzed"] or stats["reused"]:
+            print(f"情報: 文体例のインデックスを更新しました ({stats['documents']}件, "
+                  f"解析 {stats['analyzed']}件 / 再利用 {stats['reused']}件)")
+        _loaded_indexes[key] = index
+    return index
+
+
+def select_style_example(
+    corpus_path: str,
+    index_dir: str,
+    movie_title: str,
+    num_chars: int = 1000,
+    genre: str = None,
+    category: str = None
+) -> Optional[str]:
+    """
+    movie_title (とジャンル) に最も近い過去の記事の本文を、先頭 num_chars 文字の文体例として返す。
+
+    Returns:
+        Optional[str]: 文体例。近い記事が見つからない場合は None。
+    """
+    index = get_style_index(corpus_path, index_dir)
+    query = f"{movie_title} {genre}" if genre else movie_title
+    results = index.search(query, category=category, top_k=1)
+    if not results:
+        return None
+    text = index.load_article(results[0]).get("text") or ""
+    return text[:num_chars] if text else None
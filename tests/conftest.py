@@ -0,0 +1,8 @@
+import os
+import sys
+
+# --- sys.path の調整 ---
+# scripts/ と同様に、プロジェクトルートを sys.path に追加して src パッケージを import 可能にする
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
@@ -0,0 +1,44 @@
+import asyncio
+import re
+
+from src.generator.article_generator import ArticleGenerator
+
+
+class _FakeAsyncAdapter:
+    """
+    generate_text_async だけを持つアダプター。タイトルごとに応答までの時間を変え、同時実行数の最大値を記録する。
+    """
+
+    default_model = "gpt-3.5-turbo"
+
+    def __init__(self, delays, failing_title):
+        self.delays = delays
+        self.failing_title = failing_title
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate_text_async(self, messages, generation_params=None, validator=None):
+        title = re.search(r"映画「(.+?)」", messages[-1]["content"]).group(1)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays[title])
+            if title == self.failing_title:
+                raise RuntimeError("接続が切れました")
+            return f"記事: {title}"
+        finally:
+            self.in_flight -= 1
+
+
+def test_generate_many_keeps_input_order_and_isolates_failures():
+    # 先頭のタイトルほど応答が遅く、完了順は入力と逆になる
+    titles = [f"作品{i}" for i in range(8)]
+    adapter = _FakeAsyncAdapter({title: 0.05 * (8 - i) / 8 for i, title in enumerate(titles)}, failing_title="作品3")
+    results = ArticleGenerator(client_adapter=adapter).generate_many(titles, max_concurrency=3)
+
+    assert len(results) == 8
+    assert results[3].startswith("エラー: 映画「作品3」の記事生成中に予期せぬ問題が発生しました")
+    assert [result for i, result in enumerate(results) if i != 3] == [
+        f"記事: {title}" for i, title in enumerate(titles) if i != 3
+    ]
+    assert adapter.max_in_flight == 3
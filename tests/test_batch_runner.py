@@ -0,0 +1,38 @@
+import pytest
+
+from src.core.batch_runner import BatchRunner
+from tools.mock_openai_server import StubConfig, start_server_in_thread
+
+openai = pytest.importorskip("openai")
+
+
+def test_batch_job_resumes_from_state_file(tmp_path):
+    server, base_url = start_server_in_thread(StubConfig(batch_seconds=0.5))
+    try:
+        client = openai.OpenAI(api_key="test", base_url=base_url, max_retries=0)
+        state_path = str(tmp_path / "state.json")
+        requests = [
+            {"custom_id": f"article-{i}", "body": {"model": "m", "messages": [{"role": "user", "content": f"映画「{i}」"}]}}
+            for i in range(3)
+        ]
+
+        runner = BatchRunner(client, state_path, "/v1/chat/completions", poll_interval_seconds=0.1,
+                             max_requests_per_file=2)
+        assert runner.submit(requests, input_signature="sig") == 3
+        assert len(runner.state["batches"]) == 2
+
+        # 完了待ちの前に中断したとみなし、状態ファイルから再開する
+        resumed = BatchRunner(client, state_path, "/v1/chat/completions", poll_interval_seconds=0.1)
+        assert resumed.has_pending_job("sig")
+        assert not resumed.has_pending_job("other")
+        resumed.wait_for_completion()
+
+        results = {custom_id: (body, error) for custom_id, body, error in resumed.iter_results()}
+        assert sorted(results) == ["article-0", "article-1", "article-2"]
+        assert all(error is None for _, error in results.values())
+        assert results["article-1"][0]["choices"][0]["message"]["content"].startswith("# 導入\n1")
+
+        resumed.mark_merged()
+        assert not BatchRunner(client, state_path, "/v1/chat/completions").has_pending_job("sig")
+    finally:
+        server.shutdown()
@@ -0,0 +1,20 @@
+from tools.benchmark_pipeline import find_regressions, percentile, replicate_corpus
+
+
+def test_replicate_corpus_makes_unique_ids():
+    articles = [{"id": "1", "title": "A", "text": "a"}, {"id": "2", "title": "B", "text": "b"}]
+    replicated = list(replicate_corpus(articles, 5))
+    assert len(replicated) == 5
+    assert len({article["id"] for article in replicated}) == 5
+    assert replicated[2]["text"] == "a"
+
+
+def test_percentile_and_regression_detection():
+    values = sorted(float(i) for i in range(1, 101))
+    assert percentile(values, 0.50) == 50.0
+    assert percentile(values, 0.99) == 99.0
+
+    baseline = {"stages": {"stage": {"items_per_second": 100.0, "p50_ms": 1.0, "p99_ms": 2.0, "peak_memory_mb": 1.0}}}
+    current = {"stages": {"stage": {"items_per_second": 70.0, "p50_ms": 1.1, "p99_ms": 2.0, "peak_memory_mb": 1.0}}}
+    regressions = find_regressions(current, baseline, tolerance=0.2)
+    assert len(regressions) == 1 and "items_per_second" in regressions[0]
@@ -0,0 +1,56 @@
+import time
+
+from scripts import check_content_policy as moderation
+
+
+def test_long_texts_are_split_on_paragraph_boundaries():
+    paragraphs = ["あ" * 30, "い" * 30, "う" * 30]
+    assert moderation.split_text_into_chunks("\n\n".join(paragraphs), max_chars=70) == [
+        paragraphs[0] + "\n\n" + paragraphs[1], paragraphs[2]
+    ]
+    # 1段落が上限を超える場合だけ文字数で分割する
+    assert moderation.split_text_into_chunks("え" * 150, max_chars=70) == ["え" * 70, "え" * 70, "え" * 10]
+    assert moderation.split_text_into_chunks("短い本文", max_chars=70) == ["短い本文"]
+
+
+def test_batches_respect_char_and_input_limits():
+    articles = [{"text": "a" * 50}, {"text": "b" * 120}, {"text": "c" * 10}, {"text": "d"}, {"text": "e"}]
+    batches = moderation.build_moderation_batches(
+        articles, max_chars_per_batch=100, max_inputs_per_batch=3, max_chars_per_input=60
+    )
+    assert [[index for index, _ in batch] for batch in batches] == [[0], [1], [1, 2, 3], [4]]
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or sum(len(chunk) for _, chunk in batch) <= 100
+    assert "".join(chunk for index, chunk in sum(batches, []) if index == 1) == "b" * 120
+
+
+def test_chunk_results_keep_the_maximum_score_per_category():
+    merged = moderation.merge_moderation_results([
+        {"categories": {"violence": False, "sexual/minors": False},
+         "category_scores": {"violence": 0.2, "sexual/minors": 0.01}},
+        {"categories": {"violence": True, "sexual/minors": False},
+         "category_scores": {"violence": 0.9, "sexual/minors": 0.0}},
+    ])
+    assert merged["categories"] == {"violence": True, "sexual_minors": False}
+    assert merged["scores"] == {"violence": 0.9, "sexual_minors": 0.01}
+
+
+class _FakeModerations:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, input):
+        self.calls += 1
+        return type("Response", (), {"results": [{"index": i} for i in range(len(input))]})()
+
+
+def test_full_batches_are_not_throttled_by_a_token_budget():
+    # 上限いっぱいのバッチを続けて送っても、トークン数の制限で待たされない
+    client = type("Client", (), {"moderations": _FakeModerations()})()
+    batch = ["x" * (moderation.MAX_CHARS_PER_BATCH // 4)] * 4
+    start = time.monotonic()
+    for _ in range(11):
+        assert len(moderation.check_texts_with_moderation_api(client, batch)) == 4
+    assert time.monotonic() - start < 1.0
+    assert client.moderations.calls == 11
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+from src import cli
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_help_of_every_subcommand_skips_heavy_imports():
+    # 各サブコマンドの --help を同じプロセスで実行し、重いライブラリが読み込まれていないことを確認する
+    code = (
+        "import sys\n"
+        "from src.cli import COMMANDS, main\n"
+        "for command in COMMANDS:\n"
+        "    try:\n"
+        "        main([command, '--help'])\n"
+        "    except SystemExit:\n"
+        "        pass\n"
+        "print([m for m in ('openai', 'tqdm', 'bs4', 'dotenv') if m in sys.modules], file=sys.stderr)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stderr.strip() == "[]"
+    for command in cli.COMMANDS:
+        assert f"python -m src {command}" in result.stdout
+
+
+def test_batch_runs_each_line_in_the_same_process(tmp_path, capsys):
+    csv_path = tmp_path / "downloaded_data.csv"
+    csv_path.write_text(
+        "ID,post_title,post_content,post_date,category\n"
+        '1,作品A,"<p>本文A</p><!--more-->",2019-01-01,映画\n',
+        encoding="utf-8"
+    )
+    commands = tmp_path / "commands.txt"
+    commands.write_text(
+        "# コメント行は無視する\n"
+        f"convert {csv_path} {tmp_path / 'a.jsonl'}\n"
+        "\n"
+        f"convert {csv_path} {tmp_path / 'b.jsonl'}\n"
+        "convert --no-such-option\n"
+        'convert "unterminated\n'
+        f"convert {csv_path} {tmp_path / 'c.jsonl'}\n",
+        encoding="utf-8"
+    )
+
+    assert cli.main(["batch", str(commands)]) == 1
+    for name in ("a.jsonl", "b.jsonl", "c.jsonl"):
+        record = json.loads((tmp_path / name).read_text(encoding="utf-8"))
+        assert record["text"] == "本文A"
+    output = capsys.readouterr().out
+    assert "5行目のコマンドが終了コード 2 で終了しました" in output
+    # 引用符が閉じていない行があっても、残りのコマンドは実行する
+    assert "6行目のコマンドを解釈できません: No closing quotation" in output
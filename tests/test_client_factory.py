@@ -0,0 +1,79 @@
+import asyncio
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.mock_openai_server import StubConfig, start_server_in_thread
+
+
+def _client_factory(monkeypatch):
+    # 既定のAPIキーを使う呼び出しに備えて、テスト用の値を設定してから読み込む
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    return importlib.import_module("src.core.client_factory")
+
+
+def test_sync_client_is_shared_per_key_and_base_url(monkeypatch):
+    client_factory = _client_factory(monkeypatch)
+    server, base_url = start_server_in_thread(StubConfig(completion_chars=20))
+    try:
+        client = client_factory.get_openai_client("sk-test", base_url)
+        assert client_factory.get_openai_client("sk-test", base_url) is client
+        assert client_factory.get_openai_client("sk-other", base_url) is not client
+        assert client.max_retries == 0
+        for _ in range(2):
+            response = client.chat.completions.create(model="gpt-3.5-turbo", messages=[{"role": "user", "content": "hi"}])
+            assert response.choices[0].message.content
+    finally:
+        client_factory.close_openai_clients()
+        server.shutdown()
+
+
+def test_clients_use_pool_limits_and_timeouts_from_settings(monkeypatch):
+    client_factory = _client_factory(monkeypatch)
+    from src.config import settings
+    from src.core.openai_adapter import OpenAIAdapter
+
+    for name, value in {"HTTP_MAX_CONNECTIONS": 7, "HTTP_MAX_KEEPALIVE_CONNECTIONS": 3,
+                        "HTTP_KEEPALIVE_EXPIRY_SECONDS": 12.0, "HTTP_TIMEOUT_SECONDS": 42.0,
+                        "HTTP_CONNECT_TIMEOUT_SECONDS": 2.5}.items():
+        monkeypatch.setattr(settings, name, value)
+    http_clients = []
+    for name in ("DefaultHttpxClient", "DefaultAsyncHttpxClient"):
+        original = getattr(client_factory, name)
+        monkeypatch.setattr(client_factory, name,
+                            lambda original=original, **kwargs: http_clients.append(kwargs) or original(**kwargs))
+    base_url = "http://127.0.0.1:9/settings-test/v1"
+    try:
+        # 複数のスレッドから同時に取得しても、プロセス内で1つのクライアントを共有する
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: client_factory.get_openai_client("sk-test", base_url), range(8)))
+        assert all(client is clients[0] for client in clients)
+        monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+        assert OpenAIAdapter(api_key="sk-test").client is clients[0]
+
+        async def _async_client():
+            return client_factory.get_async_openai_client("sk-test", base_url)
+
+        async_client = asyncio.run(_async_client())
+    finally:
+        client_factory.close_openai_clients()
+
+    assert len(http_clients) == 2
+    for kwargs in http_clients:
+        limits = kwargs["limits"]
+        assert (limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry) == (7, 3, 12.0)
+    for client in (clients[0], async_client):
+        assert (client.timeout.connect, client.timeout.read, client.timeout.write) == (2.5, 42.0, 42.0)
+        assert client.max_retries == 0
+
+
+def test_async_client_is_shared_within_an_event_loop(monkeypatch):
+    client_factory = _client_factory(monkeypatch)
+
+    async def _clients():
+        return (client_factory.get_async_openai_client("sk-test", "http://127.0.0.1:9/v1"),
+                client_factory.get_async_openai_client("sk-test", "http://127.0.0.1:9/v1"))
+
+    first, same_loop = asyncio.run(_clients())
+    second, _ = asyncio.run(_clients())
+    assert first is same_loop
+    assert first is not second
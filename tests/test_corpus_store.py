@@ -0,0 +1,55 @@
+import json
+
+from src.utils.corpus_store import CorpusStore
+
+ARTICLES = [
+    {"id": 1, "title": "作品A", "text": "本文A", "category": "映画", "post_date": "2018-01-12 19:19:01"},
+    {"id": 2, "title": "作品B", "text": "本文B", "category": "ドラマ", "post_date": "2019-05-01 10:00:00"},
+    {"id": 3, "title": "作品C", "text": "本文C", "category": "映画", "post_date": "2019-12-31 23:00:00"},
+]
+
+
+def _lines(articles):
+    return "".join(json.dumps(a, ensure_ascii=False) + "\n" for a in articles)
+
+
+def test_lookup_and_filters_use_the_index(tmp_path):
+    corpus_path = tmp_path / "output.jsonl"
+    corpus_path.write_text(_lines(ARTICLES[:2]) + "\n{壊れた行\n" + _lines(ARTICLES[2:]), encoding="utf-8")
+
+    with CorpusStore(str(corpus_path)) as corpus:
+        assert corpus.last_refresh == {"mode": "rebuilt", "indexed_lines": 5}
+        assert corpus.get(2)["text"] == "本文B"
+        assert corpus.get("404") is None
+        assert [line for line, _ in corpus.iter_articles(category="映画")] == [1, 5]
+        assert [a["id"] for _, a in corpus.iter_articles(date_from="2019-01-01", date_to="2019-12-31")] == [2, 3]
+        assert [a for _, a in corpus.iter_articles(include_invalid=True)][2] is None
+        assert corpus.count() == 3 and corpus.count(include_invalid=True) == 4
+        assert corpus.categories() == {"映画": 2, "ドラマ": 1}
+
+    with CorpusStore(str(corpus_path)) as corpus:
+        assert corpus.last_refresh["mode"] == "unchanged"
+
+
+def test_refresh_indexes_appended_lines_and_rebuilds_on_edit(tmp_path):
+    corpus_path = tmp_path / "output.jsonl"
+    corpus_path.write_text(_lines(ARTICLES[:1]), encoding="utf-8")
+    CorpusStore(str(corpus_path)).close()
+
+    # 書き込み途中の行 (改行なし) は、追記で完成したときに読み直す
+    partial = json.dumps(ARTICLES[1], ensure_ascii=False)
+    with open(corpus_path, "a", encoding="utf-8") as f:
+        f.write(partial[:10])
+    with CorpusStore(str(corpus_path)) as corpus:
+        assert corpus.last_refresh == {"mode": "appended", "indexed_lines": 0}
+        assert corpus.count() == 1
+    with open(corpus_path, "a", encoding="utf-8") as f:
+        f.write(partial[10:] + "\n" + _lines(ARTICLES[2:]))
+    with CorpusStore(str(corpus_path)) as corpus:
+        assert corpus.last_refresh == {"mode": "appended", "indexed_lines": 2}
+        assert [a["id"] for _, a in corpus.iter_articles()] == [1, 2, 3]
+
+    corpus_path.write_text(_lines(ARTICLES[1:]), encoding="utf-8")
+    with CorpusStore(str(corpus_path)) as corpus:
+        assert corpus.last_refresh["mode"] == "rebuilt"
+        assert corpus.get(3)["title"] == "作品C" and corpus.get(1) is None
@@ -0,0 +1,68 @@
+import json
+
+from scripts.prepare_finetuning_data import lint_and_split_finetuning_data
+from src.core.token_budget import TokenCounter
+from src.utils.dataset_linter import (
+    estimate_jaccard,
+    fit_record_to_token_limit,
+    minhash_signature,
+    normalize_for_dedup,
+    stratified_split,
+)
+
+BASE_TEXT = "".join(f"この映画の{i}番目の場面は印象的で、登場人物の表情が心に残りました。" for i in range(40))
+
+
+def test_minhash_separates_near_duplicates_from_different_texts():
+    original = minhash_signature(normalize_for_dedup(BASE_TEXT))
+    edited = minhash_signature(normalize_for_dedup(BASE_TEXT + "最後に一言だけ追記します。"))
+    different = minhash_signature(normalize_for_dedup("まったく別の作品について、音楽と映像の美しさを語る記事です。" * 20))
+    assert estimate_jaccard(original, edited) >= 0.8
+    assert estimate_jaccard(original, different) < 0.3
+    assert minhash_signature("") is None
+
+
+def test_fit_record_to_token_limit_truncates_assistant_only():
+    counter = TokenCounter("gpt-3.5-turbo")
+    record = {"messages": [{"role": "system", "content": "システム"},
+                           {"role": "user", "content": "依頼"},
+                           {"role": "assistant", "content": BASE_TEXT}]}
+    fitted = fit_record_to_token_limit(record, counter, 300)
+    assert counter.count_messages(fitted["messages"]) <= 300
+    assert fitted["messages"][:2] == record["messages"][:2]
+    assert record["messages"][2]["content"] == BASE_TEXT
+    assert fit_record_to_token_limit(record, counter, 5) is None
+
+
+def test_stratified_split_keeps_category_ratio_and_is_deterministic():
+    categories = {i: ("映画" if i < 80 else "ドラマ") for i in range(100)}
+    categories[100] = "アニメ"
+    train, validation = stratified_split(categories, 0.1, seed=1)
+    assert sum(categories[key] == "映画" for key in validation) == 8
+    assert sum(categories[key] == "ドラマ" for key in validation) == 2
+    assert 100 in train
+    assert (train, validation) == stratified_split(categories, 0.1, seed=1)
+
+
+def test_lint_and_split_drops_duplicates_and_reports_cost(tmp_path):
+    articles = [
+        {"id": 1, "title": "作品A", "text": BASE_TEXT, "category": "映画"},
+        {"id": 2, "title": "作品A (再掲)", "text": BASE_TEXT.replace("。", "。\n"), "category": "映画"},
+        {"id": 3, "title": "作品A (追記)", "text": BASE_TEXT + "追記です。", "category": "映画"},
+        {"id": 4, "title": "", "text": "タイトルなし", "category": "映画"},
+    ]
+    articles += [{"id": 10 + i, "title": f"作品{i}", "text": f"作品{i}の感想。" * (10 + i), "category": "映画"}
+                 for i in range(9)]
+    input_path = tmp_path / "output.jsonl"
+    input_path.write_text("\n".join(json.dumps(a, ensure_ascii=False) for a in articles) + "\n", encoding="utf-8")
+
+    report = lint_and_split_finetuning_data(
+        str(input_path), str(tmp_path / "train.jsonl"), str(tmp_path / "validation.jsonl"),
+        validation_ratio=0.2, n_epochs=2
+    )
+    assert report["dropped"] == {"invalid": 1, "too_long": 0, "exact_duplicate": 1, "near_duplicate": 1}
+    assert report["kept"] == 10 and report["validation"] == 2
+    train_lines = (tmp_path / "train.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(train_lines) == 8
+    assert report["cost"]["billed_tokens"] == report["cost"]["tokens_per_epoch"] * 2
+    assert report["cost"]["estimated_cost_usd"] is not None
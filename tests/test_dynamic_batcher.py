@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from src.core.dynamic_batcher import DynamicBatcher
+
+
+def test_concurrent_requests_are_merged_into_batches():
+    batch_sizes = []
+    release = threading.Event()
+
+    def run_batch(requests):
+        # 最初のバッチの処理中に残りのリクエストを溜め、次のバッチにまとめさせる
+        release.wait(1)
+        batch_sizes.append(len(requests))
+        return [request * 2 for request in requests]
+
+    batcher = DynamicBatcher(run_batch, max_batch_size=4, max_wait_seconds=0.05)
+    futures = [batcher.submit(0)]
+    futures += [batcher.submit(i) for i in range(1, 7)]
+    release.set()
+    assert [future.result(timeout=5) for future in futures] == [i * 2 for i in range(7)]
+    assert max(batch_sizes) <= 4 and sum(batch_sizes) == 7 and len(batch_sizes) < 7
+    stats = batcher.stats()
+    assert stats["requests"] == 7 and stats["average_batch_size"] > 1
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+
+
+def test_batch_failure_is_reported_to_every_request():
+    def run_batch(requests):
+        raise ValueError("model error")
+
+    batcher = DynamicBatcher(run_batch, max_batch_size=2, max_wait_seconds=0.05)
+    futures = [batcher.submit(i) for i in range(2)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    batcher.close()
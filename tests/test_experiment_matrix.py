@@ -0,0 +1,48 @@
+import csv
+import importlib
+
+from scripts import run_experiment_matrix as experiment
+from tools.mock_openai_server import StubConfig, start_server_in_thread
+
+
+def test_matrix_builds_each_prompt_once_and_reports_every_cell(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    openai_adapter = importlib.import_module("src.core.openai_adapter")
+    from src.config import settings
+    from src.core.rate_limiter import RateLimiter
+    from src.generator.article_generator import ArticleGenerator
+
+    server, base_url = start_server_in_thread(StubConfig(latency="uniform:0.05,0.1", completion_chars=40, seed=5))
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+    prepared = []
+    original_prepare_request = ArticleGenerator.prepare_request
+    monkeypatch.setattr(ArticleGenerator, "prepare_request",
+                        lambda self, title, *args: prepared.append(title) or original_prepare_request(self, title, *args))
+    try:
+        adapter = openai_adapter.OpenAIAdapter(
+            api_key="sk-test", rate_limiter=RateLimiter(requests_per_minute=60000, tokens_per_minute=10_000_000)
+        )
+        results = experiment.run_experiment_matrix(
+            ["作品A", "作品B"], ["gpt-3.5-turbo", "gpt-4o-mini"], [0.2, 0.8], [0.0, 0.5],
+            max_tokens=200, max_concurrency=16, client_adapter=adapter
+        )
+    finally:
+        server.shutdown()
+
+    # プロンプトは (タイトル, モデル) ごとに1回だけ組み立てる
+    assert sorted(prepared) == ["作品A", "作品A", "作品B", "作品B"]
+    assert [result["cell"] for result in results] == list(range(1, 17))
+    for result in results:
+        assert result["status"] == "ok" and result["output"]
+        assert result["prompt_tokens"] > 0 and result["completion_tokens"] > 0
+        assert result["latency_seconds"] >= 0.05
+    assert {(r["model"], r["temperature"], r["frequency_penalty"]) for r in results if r["title"] == "作品B"} == {
+        (model, t, f) for model in ("gpt-3.5-turbo", "gpt-4o-mini") for t in (0.2, 0.8) for f in (0.0, 0.5)
+    }
+
+    output_path = tmp_path / "experiment.csv"
+    experiment.write_results_csv(results, str(output_path))
+    with open(output_path, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 16 and rows[0]["output"] == results[0]["output"]
+    assert "作品A / " in experiment.format_results_table(results)
@@ -0,0 +1,39 @@
+import pytest
+
+from src.core.finetuning_monitor import FineTuningMonitor, latest_registered_model, load_model_registry
+from tools.mock_openai_server import StubConfig, start_server_in_thread
+
+openai = pytest.importorskip("openai")
+
+
+def test_monitor_tracks_jobs_across_restarts_and_registers_models(tmp_path):
+    server, base_url = start_server_in_thread(StubConfig(fine_tuning_seconds=0.5))
+    try:
+        client = openai.OpenAI(api_key="test", base_url=base_url, max_retries=0)
+        training_file = client.files.create(file=("train.jsonl", b'{"messages": []}\n'), purpose="fine-tune")
+        state_path = str(tmp_path / "jobs.json")
+        registry_path = str(tmp_path / "registry.json")
+
+        monitor = FineTuningMonitor(client, state_path, registry_path, poll_interval_seconds=0.05)
+        for n_epochs in (1, 2):
+            job = client.fine_tuning.jobs.create(training_file=training_file.id, model="gpt-3.5-turbo-0125",
+                                                 suffix="movieblog", hyperparameters={"n_epochs": n_epochs})
+            monitor.track(job, label=f"n_epochs={n_epochs}", suffix="movieblog")
+        monitor.poll_once()
+        first_cursor = {job_id: job["last_event_id"] for job_id, job in monitor.state["jobs"].items()}
+        assert all(first_cursor.values())
+
+        # 中断したとみなし、状態ファイルから監視を再開する
+        resumed = FineTuningMonitor(client, state_path, registry_path, poll_interval_seconds=0.05)
+        assert len(resumed.active_job_ids()) == 2
+        jobs = resumed.wait()
+        assert all(job["status"] == "succeeded" for job in jobs.values())
+        assert all(job["last_event_id"] != first_cursor[job_id] for job_id, job in jobs.items())
+        assert "successfully completed" in next(iter(jobs.values()))["last_message"]
+
+        registry = load_model_registry(registry_path)
+        assert sorted(model["hyperparameters"]["n_epochs"] for model in registry) == [1, 2]
+        assert latest_registered_model(registry_path, suffix="movieblog") == registry[-1]["model_id"]
+        assert resumed.poll_once() is False
+    finally:
+        server.shutdown()
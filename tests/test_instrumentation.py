@@ -0,0 +1,95 @@
+import importlib
+
+from src.core.instrumentation import add_event_hook, remove_event_hook, summarize_events
+from tools.mock_openai_server import StubConfig, start_server_in_thread
+
+
+def test_adapter_records_usage_retries_and_first_byte(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    openai_adapter = importlib.import_module("src.core.openai_adapter")
+    from src.config import settings
+    from src.core.rate_limiter import RateLimiter
+
+    server, base_url = start_server_in_thread(StubConfig(
+        latency="fixed:0.02", completion_chars=40, rate_limit_probability=0.5, retry_after_seconds=0.01, seed=3
+    ))
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+    events = []
+    add_event_hook(events.append)
+    try:
+        adapter = openai_adapter.OpenAIAdapter(
+            api_key="sk-test", rate_limiter=RateLimiter(requests_per_minute=60000, tokens_per_minute=10_000_000)
+        )
+        messages = [{"role": "user", "content": "映画「テスト」"}]
+        for _ in range(4):
+            assert not adapter.generate_text(messages, {"max_tokens": 100}).startswith("エラー:")
+        streamed = "".join(adapter.generate_text_stream(messages, {"max_tokens": 100}))
+    finally:
+        remove_event_hook(events.append)
+        server.shutdown()
+
+    assert len(events) == 5
+    assert sum(event["retries"] for event in events) > 0
+    for event in events:
+        assert event["attempts"] == event["retries"] + 1
+        assert event["prompt_tokens"] > 0 and event["completion_tokens"] > 0
+        assert event["finish_reason"] == "stop"
+        assert 0.02 <= event["time_to_first_byte_seconds"] <= event["latency_seconds"]
+        assert event["estimated_cost_usd"] > 0
+    # ストリーミングでも最後のチャンクの usage からトークン数を記録する
+    assert events[-1]["stream"] and streamed
+    assert events[-1]["time_to_first_token_seconds"] is not None
+
+
+def test_stream_closed_early_is_recorded_as_cancelled(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    openai_adapter = importlib.import_module("src.core.openai_adapter")
+    from src.config import settings
+    from src.core.rate_limiter import RateLimiter
+
+    server, base_url = start_server_in_thread(StubConfig(latency="fixed:0", completion_chars=3000,
+                                                         tokens_per_second=200, stream_chunk_chars=4))
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+    events = []
+    add_event_hook(events.append)
+    limiter = RateLimiter(requests_per_minute=60000, tokens_per_minute=10_000_000)
+    try:
+        adapter = openai_adapter.OpenAIAdapter(api_key="sk-test", rate_limiter=limiter)
+        stream = adapter.generate_text_stream([{"role": "user", "content": "映画「テスト」"}], {"max_tokens": 3000})
+        next(stream)
+        assert limiter.in_flight == 1
+        # 呼び出し側が途中で読むのをやめても、接続を閉じて枠を返し、打ち切りとして記録する
+        stream.close()
+    finally:
+        remove_event_hook(events.append)
+        server.shutdown()
+
+    assert limiter.in_flight == 0
+    assert len(events) == 1 and events[0]["finish_reason"] == "cancelled" and events[0]["error"] is None
+    assert events[0]["latency_seconds"] < 1.0
+
+
+def test_summarize_events_by_model_excludes_cache_hits_from_latency():
+    events = [{"script": "refine", "model": "m", "latency_seconds": i / 100, "completion_tokens": 10,
+               "estimated_cost_usd": 0.01} for i in range(1, 101)]
+    events.append({"script": "refine", "model": "m", "latency_seconds": 0.0, "cache_hit": True,
+                   "completion_tokens": 10, "estimated_cost_usd": 0.0})
+    events.append({"script": "generate", "model": "other", "latency_seconds": 5.0, "error": "APIError: boom"})
+
+    rows = {row["model"]: row for row in summarize_events(events, ("model",))}
+    assert rows["m"]["calls"] == 101 and rows["m"]["cache_hits"] == 1
+    assert (rows["m"]["p50_latency_seconds"], rows["m"]["p95_latency_seconds"], rows["m"]["p99_latency_seconds"]) == (0.5, 0.95, 0.99)
+    assert round(rows["m"]["completion_tokens_per_second"], 4) == round(1000 / 50.5, 4)
+    assert rows["other"]["errors"] == 1 and rows["other"]["p50_latency_seconds"] is None
+    assert [row["script"] for row in summarize_events(events, ("script",))] == ["generate", "refine"]
+
+
+def test_metrics_reports_an_empty_events_file(tmp_path, capsys):
+    from scripts.summarize_llm_calls import SUMMARY_COLUMNS, format_summary_table, run_cli
+
+    events_path = tmp_path / "llm_calls.jsonl"
+    events_path.write_text("", encoding="utf-8")
+    run_cli(["--events", str(events_path)])
+    assert "計測イベントがありません" in capsys.readouterr().out
+    # 集計結果が空でも見出しだけの表を返す
+    assert format_summary_table([], ("model",)).split() == ["model"] + [title for title, _, _ in SUMMARY_COLUMNS]
@@ -0,0 +1,94 @@
+import pytest
+
+from src.core import local_hf_adapter
+from src.core.local_hf_adapter import PrefixKVCache, common_prefix_length
+
+
+def test_common_prefix_length():
+    assert common_prefix_length([[1, 2, 3, 4], [1, 2, 3, 9], [1, 2, 3]]) == 3
+    assert common_prefix_length([[1, 2], [1, 2]]) == 2
+    assert common_prefix_length([[5, 1], [1, 5]]) == 0
+    assert common_prefix_length([[1, 2, 3]]) == 3
+    assert common_prefix_length([[], [1]]) == 0
+    assert common_prefix_length([]) == 0
+
+
+def test_prefix_cache_returns_the_longest_usable_prefix_and_evicts_lru():
+    cache = PrefixKVCache(max_entries=2)
+    cache.store([1, 2], "short")
+    cache.store([1, 2, 3, 4], "long")
+    sequences = [[1, 2, 3, 4, 5], [1, 2, 3, 4, 6]]
+
+    assert cache.lookup(sequences, max_length=10) == (4, "long")
+    # 各行に残すトークンの分、max_length より長いキャッシュは使わない
+    assert cache.lookup(sequences, max_length=3) == (2, "short")
+    # すべての行の先頭に一致しなければ使わない
+    assert cache.lookup([[1, 2, 3, 4, 5], [1, 2, 9]], max_length=10) == (2, "short")
+    assert cache.lookup([[7, 8, 9]], max_length=10) == (0, None)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # 直近に使った "short" を残し、最も古い "long" を追い出す
+    cache.store([7, 8], "other")
+    assert cache.lookup(sequences, max_length=10) == (2, "short")
+    assert cache.lookup([[7, 8, 9]], max_length=10) == (2, "other")
+
+
+class _CharTokenizer:
+    """
+    文字ごとに1トークンを割り当てる最小限のトークナイザー (チャットテンプレートなし)。
+    """
+
+    pad_token_id = 0
+    eos_token_id = 1
+    chat_template = None
+
+    def encode(self, text):
+        return [2 + ord(char) % 60 for char in text]
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return " ".join(str(token) for token in tokens)
+
+
+def _tiny_adapter(monkeypatch):
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    torch.manual_seed(0)
+    # 重みの初期値を大きめにして、プロンプトや位置によって出力が変わるようにする
+    config = transformers.GPT2Config(vocab_size=64, n_positions=256, n_embd=32, n_layer=2, n_head=2,
+                                     bos_token_id=1, eos_token_id=1, pad_token_id=0, initializer_range=0.5)
+    model = transformers.GPT2LMHeadModel(config)
+    monkeypatch.setattr(local_hf_adapter.AutoTokenizer, "from_pretrained", lambda *args, **kwargs: _CharTokenizer())
+    monkeypatch.setattr(local_hf_adapter.AutoModelForCausalLM, "from_pretrained", lambda *args, **kwargs: model)
+    return local_hf_adapter.LocalHFAdapter("tiny-random-gpt2", max_batch_wait_ms=0)
+
+
+def test_padded_batch_matches_each_prompt_alone_with_and_without_prefix_cache(monkeypatch):
+    system = {"role": "system", "content": "あなたはプロの映画ブロガーです。記事を書いてください。"}
+    prompts = [[system, {"role": "user", "content": content}] for content in ("短い", "少し長めの依頼です", "中くらいの依頼")]
+    params = {"temperature": 0, "max_tokens": 12}
+
+    alone_adapter = _tiny_adapter(monkeypatch)
+    try:
+        alone = [alone_adapter._run_batch([alone_adapter._build_request(messages, params, {})])[0]
+                 for messages in prompts]
+    finally:
+        alone_adapter.close()
+    assert alone_adapter.prefix_cache.hits == 0
+
+    adapter = _tiny_adapter(monkeypatch)
+    try:
+        requests = [adapter._build_request(messages, params, {}) for messages in prompts]
+        assert len({len(request["input_ids"]) for request in requests}) == 3
+        # 1回目は共通部分の KV キャッシュを作り、2回目は保存済みのものを再利用する
+        first = adapter._run_batch(requests)
+        assert (adapter.prefix_cache.hits, len(adapter.prefix_cache._entries)) == (0, 1)
+        second = adapter._run_batch(requests)
+        assert adapter.prefix_cache.hits == 1
+    finally:
+        adapter.close()
+
+    # プロンプトごとに異なる出力になっており、比較が意味を持つことを確認する
+    assert len(set(alone)) == 3
+    assert first == alone
+    assert second == alone
@@ -0,0 +1,20 @@
+from src.main import stream_generated_article
+from src.utils.structure_validator import STRUCTURE_RETRY_PREFIX
+
+
+def test_stream_leaves_no_file_when_no_text_was_received(tmp_path, capsys):
+    error = "エラー: プロンプトがコンテキストウィンドウに収まりません"
+    assert stream_generated_article(iter([error]), "作品", str(tmp_path)) == error
+    # 再試行で受信済みの内容を破棄した後にエラーになった場合も、空のファイルを残さない
+    chunks = ["# 導入\n", f"{STRUCTURE_RETRY_PREFIX} 構成が崩れました", "エラー: 中断しました"]
+    assert stream_generated_article(iter(chunks), "作品", str(tmp_path)) == "エラー: 中断しました"
+    assert list(tmp_path.iterdir()) == []
+    assert "途中までの記事を保存しました" not in capsys.readouterr().out
+
+
+def test_stream_keeps_partial_text_before_an_error(tmp_path, capsys):
+    chunks = ["# 導入\n", "本文", "エラー: 接続が切れました"]
+    assert stream_generated_article(iter(chunks), "作品", str(tmp_path)) == "エラー: 接続が切れました"
+    [saved] = list(tmp_path.iterdir())
+    assert saved.read_text(encoding="utf-8") == "# 導入\n本文"
+    assert "途中までの記事を保存しました" in capsys.readouterr().out
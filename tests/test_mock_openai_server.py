@@ -0,0 +1,41 @@
+import json
+import urllib.error
+import urllib.request
+
+from tools.mock_openai_server import StubConfig, start_server_in_thread
+
+
+def _post(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_chat_completion_and_request_quota():
+    server, base_url = start_server_in_thread(StubConfig(requests_per_minute=1))
+    try:
+        payload = {"model": "m", "messages": [{"role": "user", "content": "映画「テスト」"}], "max_tokens": 600}
+        completion = _post(f"{base_url}/chat/completions", payload)
+        content = completion["choices"][0]["message"]["content"]
+        assert content.startswith("# 導入\nテスト")
+        assert completion["usage"]["total_tokens"] > 0
+
+        try:
+            _post(f"{base_url}/chat/completions", payload)
+            assert False, "2回目のリクエストは 429 になるはず"
+        except urllib.error.HTTPError as e:
+            assert e.code == 429
+            assert float(e.headers["retry-after-ms"]) > 0
+    finally:
+        server.shutdown()
+
+
+def test_moderation_returns_one_result_per_input():
+    server, base_url = start_server_in_thread()
+    try:
+        response = _post(f"{base_url}/moderations", {"input": ["a", "b", "c"]})
+        assert [result["flagged"] for result in response["results"]] == [False, False, False]
+    finally:
+        server.shutdown()
@@ -0,0 +1,33 @@
+import csv
+
+from tools import process_download_data as converter
+
+
+def _write_csv(path, row_count):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ID", "post_title", "post_content", "post_date", "category"])
+        for i in range(row_count):
+            # 先頭の行ほど本文を長くし、ワーカーでの処理の完了順が入力順と入れ替わるようにする
+            paragraphs = "".join(f"<p>作品{i}の段落{j}です。<br>改行</p>" for j in range(row_count - i))
+            content = (
+                f"{paragraphs}<!--more-->"
+                '<div class="hatena-asin-detail">アフィリエイト</div>'
+                f"[caption id=\"{i}\"]画像[/caption]<p>https://www.amazon.co.jp/dp/{i}</p>"
+            )
+            writer.writerow([str(i), f"映画「作品{i}」", content, "2019-01-01 00:00:00", "映画"])
+
+
+def test_parallel_conversion_matches_sequential_output(tmp_path):
+    csv_path = tmp_path / "downloaded_data.csv"
+    _write_csv(csv_path, 40)
+    sequential_path = tmp_path / "sequential.jsonl"
+    parallel_path = tmp_path / "parallel.jsonl"
+
+    converter.convert_csv_to_jsonl(str(csv_path), str(sequential_path))
+    converter.convert_csv_to_jsonl_parallel(str(csv_path), str(parallel_path), workers=2, chunk_size=3)
+
+    sequential = sequential_path.read_text(encoding="utf-8")
+    assert len(sequential.splitlines()) == 40
+    assert "アフィリエイト" not in sequential and "[caption" not in sequential
+    assert parallel_path.read_text(encoding="utf-8") == sequential
@@ -0,0 +1,35 @@
+import argparse
+import json
+
+from src.core import profiling
+
+
+def test_spans_are_no_ops_unless_profiling_is_enabled():
+    assert profiling.span("a") is profiling.span("b")
+    items = [1, 2, 3]
+    assert profiling.iter_with_span(items, "read") is items
+
+
+def test_session_reports_stages_and_merges_worker_stats(tmp_path, capsys):
+    parser = argparse.ArgumentParser()
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args(["--profile", "--profile-memory", "--profile-output", str(tmp_path)])
+
+    with profiling.profiling_session(args, "test"):
+        for _ in profiling.iter_with_span(range(3), "test.read"):
+            with profiling.span("test.work"):
+                data = [0] * 100_000
+        # ワーカープロセスから返された集計を合算する
+        profiling.merge_stats({"test.work": {"count": 2, "wall_seconds": 1.0, "cpu_seconds": 0.5,
+                                             "peak_alloc_bytes": 0}})
+    del data
+
+    assert not profiling.is_enabled()
+    [report_path] = tmp_path.glob("test_*.json")
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    stages = {stage["name"]: stage for stage in report["stages"]}
+    assert stages["test.read"]["count"] == 4  # 最後の StopIteration まで計測する
+    assert stages["test.work"]["count"] == 5 and stages["test.work"]["wall_seconds"] >= 1.0
+    assert stages["test.work"]["peak_alloc_bytes"] >= 800_000
+    assert report["stages"][0]["name"] == "test.work"
+    assert "test.work" in capsys.readouterr().out
@@ -0,0 +1,48 @@
+import os
+
+from src.prompts.prompt_manager import CompiledTemplate, PromptManager
+
+
+def _write_template(directory, name, content):
+    path = directory / name
+    path.write_text(content, encoding="utf-8")
+    return path
+
+
+def test_render_matches_str_replace_semantics():
+    source = "映画「{{movie_title}}」\n{{movie_title}}の感想\n{{unknown}} {{ spaced }} {{"
+    context = {"movie_title": "君の名は。", "unused": "x"}
+
+    expected = source
+    for key, value in context.items():
+        expected = expected.replace("{{" + key + "}}", str(value))
+    assert CompiledTemplate(source).render(context) == expected
+
+
+def test_template_is_cached_and_reloaded_on_mtime_change(tmp_path, capsys):
+    path = _write_template(tmp_path, "t.txt", "A {{x}}")
+    manager = PromptManager(template_dir=str(tmp_path), check_interval_seconds=0)
+
+    assert manager.build_prompt("t.txt", {"x": 1}) == "A 1"
+    first = manager.get_compiled_template("t.txt")
+    assert manager.get_compiled_template("t.txt") is first
+
+    path.write_text("B {{x}}", encoding="utf-8")
+    os.utime(path, (os.path.getatime(path), os.path.getmtime(path) + 10))
+    assert manager.build_prompt("t.txt", {"x": 2}) == "B 2"
+
+
+def test_missing_and_unused_keys_are_reported_once(tmp_path, capsys):
+    _write_template(tmp_path, "t.txt", "{{a}} {{b}}")
+    manager = PromptManager(template_dir=str(tmp_path))
+
+    manager.build_prompt("t.txt", {"a": 1, "c": 3})
+    manager.build_prompt("t.txt", {"a": 1, "c": 3})
+    output = capsys.readouterr().out
+    assert output.count("値がありません: b") == 1
+    assert output.count("使われていないキーがあります: c") == 1
+
+
+def test_missing_template_returns_empty_string(tmp_path):
+    manager = PromptManager(template_dir=str(tmp_path))
+    assert manager.build_prompt("missing.txt", {"a": 1}) == ""
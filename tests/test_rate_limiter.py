@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from src.core.rate_limiter import RateLimiter, get_retry_after_seconds
+
+
+class _FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class _RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.response = _FakeResponse(headers)
+
+
+def test_retry_after_headers_are_parsed():
+    assert get_retry_after_seconds(_RateLimitError({"retry-after-ms": "250"})) == 0.25
+    assert get_retry_after_seconds(_RateLimitError({"retry-after": "2"})) == 2.0
+    assert get_retry_after_seconds(_RateLimitError({})) is None
+
+
+def test_call_retries_after_429_and_shrinks_concurrency():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=1_000_000, max_concurrency=8)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise _RateLimitError({"retry-after-ms": "100"})
+        return "ok"
+
+    assert limiter.call(flaky) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.1
+    assert limiter.concurrency_limit < 8
+    assert limiter.in_flight == 0
+
+
+def test_non_retryable_errors_are_raised_immediately():
+    limiter = RateLimiter()
+
+    def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        limiter.call(broken)
+    assert limiter.in_flight == 0
+
+
+def test_request_bucket_paces_calls():
+    # 1分あたり600リクエスト = 0.1秒ごとに1件。容量を使い切った後は補充を待つ
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=1_000_000)
+    limiter._request_bucket.available = 0
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.call(lambda: None)
+    assert time.monotonic() - start >= 0.25
+
+
+def test_stream_holds_the_slot_until_it_is_read():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=1000, max_concurrency=1)
+    with limiter.hold_stream(lambda: iter(["a", "b"]), estimated_tokens=500) as lease:
+        for _ in lease.stream:
+            # 応答を読み終えるまでは枠が埋まったまま
+            assert limiter.in_flight == 1 and limiter._try_acquire(0) > 0
+        lease.usage = type("Usage", (), {"total_tokens": 100})()
+    assert limiter.in_flight == 0
+    # 見積もりの500トークンのうち、使わなかった400トークンが戻る
+    assert limiter._token_bucket.available == pytest.approx(900, abs=5)
+
+    with pytest.raises(RuntimeError):
+        with limiter.hold_stream(lambda: iter([]), estimated_tokens=0):
+            raise RuntimeError("consumer failed")
+    assert limiter.in_flight == 0
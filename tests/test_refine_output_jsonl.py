@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from scripts import refine_output_jsonl as refine
+from src.config import settings
+from src.core.instrumentation import add_event_hook, remove_event_hook
+from src.utils.corpus_store import CorpusStore
+from tools.mock_openai_server import StubConfig, start_server_in_thread
+
+ARTICLES = [
+    {"id": 1, "title": "映画「作品A」", "text": "本文A", "category": "映画", "post_date": "2018-01-12 19:19:01"},
+    # title が文字列でないため前処理に失敗する
+    {"id": 2, "title": 123, "text": "本文B", "category": "映画", "post_date": "2019-05-01 10:00:00"},
+    {"title": "映画「作品C」", "text": "本文C", "category": "映画", "post_date": "2019-12-31 23:00:00"},
+]
+
+
+def _write_corpus(path, articles):
+    path.write_text("".join(json.dumps(a, ensure_ascii=False) + "\n" for a in articles), encoding="utf-8")
+
+
+def _read_checkpoint(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batch_mode_records_preprocess_failures_once(tmp_path):
+    openai = pytest.importorskip("openai")
+    corpus_path = tmp_path / "output.jsonl"
+    _write_corpus(corpus_path, ARTICLES)
+    checkpoint_path = str(tmp_path / "refined.jsonl.checkpoint")
+
+    server, base_url = start_server_in_thread(StubConfig(latency="fixed:0", batch_seconds=0.2))
+    try:
+        client = openai.OpenAI(api_key="test", base_url=base_url, max_retries=0)
+        with CorpusStore(str(corpus_path)) as corpus:
+            processed, failed, skipped, _ = refine.run_refine_batch(
+                client, corpus, checkpoint_path, str(tmp_path / "state.json"), None, {"9"},
+                poll_interval_seconds=0.1
+            )
+    finally:
+        server.shutdown()
+
+    records = _read_checkpoint(checkpoint_path)
+    assert (processed, failed, skipped) == (3, 1, 0)
+    assert sorted(record["key"] for record in records) == ["1", "2", "line_3"]
+    failures = [record for record in records if record["record"].get("error")]
+    assert [record["key"] for record in failures] == ["2"]
+    assert {record["key"]: record["record"]["title"] for record in records}["line_3"] == "「作品C」"
+
+
+def test_rerun_skips_succeeded_articles_and_retries_failures(monkeypatch, tmp_path):
+    pytest.importorskip("openai")
+    corpus_path = tmp_path / "output.jsonl"
+    _write_corpus(corpus_path, ARTICLES)
+    output_path = tmp_path / "data" / "finetuning_data" / "output_refined_by_ai.jsonl"
+
+    server, base_url = start_server_in_thread(StubConfig(latency="fixed:0", completion_chars=200))
+    monkeypatch.setattr(settings, "CORPUS_PATH", str(corpus_path))
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", False)
+    events = []
+    add_event_hook(events.append)
+    api_calls = []
+    try:
+        refine.main(max_workers=2)
+        api_calls.append(len(events))
+        first_output = _read_checkpoint(output_path)
+        # 前処理に失敗した記事を直してから再実行すると、その記事だけを処理する
+        _write_corpus(corpus_path, [ARTICLES[0], {**ARTICLES[1], "title": "映画「作品B」"}, ARTICLES[2]])
+        refine.main(max_workers=2)
+        api_calls.append(len(events))
+        second_output = _read_checkpoint(output_path)
+        refine.main(force_reprocess=True, max_workers=2)
+        api_calls.append(len(events))
+        forced_output = _read_checkpoint(output_path)
+    finally:
+        remove_event_hook(events.append)
+        server.shutdown()
+
+    assert api_calls == [2, 3, 6]
+    assert [record.get("error") is not None for record in first_output] == [False, True, False]
+    assert [record.get("id") for record in second_output] == [1, 2, None]
+    assert not any("error" in record for record in second_output)
+    assert second_output[0] == first_output[0] and second_output[1]["title"] == "「作品B」"
+    # --force ではチェックポイントを破棄するため、全件を処理し直した結果だけが残る
+    assert [record["title"] for record in forced_output] == [record["title"] for record in second_output]
+    assert len(_read_checkpoint(str(output_path) + ".checkpoint")) == 3
+
+
+def test_refine_cache_uses_the_response_cache_settings(monkeypatch, tmp_path):
+    pytest.importorskip("openai")
+    corpus_path = tmp_path / "output.jsonl"
+    _write_corpus(corpus_path, ARTICLES[:1])
+    cache_path = tmp_path / "custom" / "refine_cache.sqlite3"
+
+    server, base_url = start_server_in_thread(StubConfig(latency="fixed:0", completion_chars=200))
+    monkeypatch.setattr(settings, "CORPUS_PATH", str(corpus_path))
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_PATH", str(cache_path))
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_MAX_ENTRIES", 5)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_MAX_AGE_DAYS", 2)
+    caches = []
+    original_init = refine.ResponseCache.__init__
+    monkeypatch.setattr(refine.ResponseCache, "__init__",
+                        lambda self, *args, **kwargs: caches.append(self) or original_init(self, *args, **kwargs))
+    try:
+        refine.main(max_workers=1)
+    finally:
+        server.shutdown()
+
+    assert len(caches) == 1 and cache_path.exists()
+    assert (caches[0].max_entries, caches[0].max_age_seconds, caches[0].deterministic_only) == (5, 2 * 86400, False)
+    assert not (tmp_path / "data" / "cache").exists()
@@ -0,0 +1,41 @@
+from src.core.response_cache import ResponseCache
+
+MESSAGES = [
+    {"role": "system", "content": "system"},
+    {"role": "user", "content": "user"},
+]
+
+
+def test_deterministic_request_hits_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    params = {"temperature": 0, "max_tokens": 100}
+
+    assert cache.get("gpt-3.5-turbo", MESSAGES, params) is None
+    cache.put("gpt-3.5-turbo", MESSAGES, params, "生成結果")
+    assert cache.get("gpt-3.5-turbo", MESSAGES, params) == "生成結果"
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_key_ignores_message_key_order():
+    reordered = [{"content": m["content"], "role": m["role"]} for m in MESSAGES]
+    assert ResponseCache.make_key("m", MESSAGES, {"seed": 1}) == ResponseCache.make_key("m", reordered, {"seed": 1})
+    assert ResponseCache.make_key("m", MESSAGES, {"seed": 1}) != ResponseCache.make_key("m", MESSAGES, {"seed": 2})
+
+
+def test_error_and_nondeterministic_responses_are_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+
+    cache.put("m", MESSAGES, {"temperature": 0}, "エラー: OpenAI API呼び出し中にエラーが発生しました")
+    cache.put("m", MESSAGES, {"temperature": 0.7}, "ランダムな結果")
+    assert cache.stats()["entries"] == 0
+
+
+def test_eviction_by_size_and_age(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    for i in range(3):
+        cache.put("m", [{"role": "user", "content": str(i)}], {"temperature": 0}, f"結果{i}")
+    assert cache.stats()["entries"] == 2
+    assert cache.get("m", [{"role": "user", "content": "0"}], {"temperature": 0}) is None
+
+    cache.max_age_seconds = -1
+    assert cache.get("m", [{"role": "user", "content": "2"}], {"temperature": 0}) is None
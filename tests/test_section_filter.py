@@ -0,0 +1,43 @@
+import json
+import os
+import time
+
+import pytest
+
+from src.utils.section_filter import strip_unwanted_sections
+from tools.benchmark_section_filter import ADVERSARIAL_INPUTS, legacy_clean_text_python_pre_ai
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), '..', 'output.jsonl.bk')
+
+
+def _load_corpus_texts():
+    with open(CORPUS_PATH, 'r', encoding='utf-8') as f:
+        return [json.loads(line).get("text") or "" for line in f]
+
+
+@pytest.mark.skipif(not os.path.exists(CORPUS_PATH), reason="output.jsonl.bk がありません")
+def test_matches_legacy_regex_output_on_corpus():
+    for text in _load_corpus_texts():
+        assert strip_unwanted_sections(text) == legacy_clean_text_python_pre_ai(text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("前文\n関連記事\n\n他の記事へのリンク\n本文", "前文\n\n本文"),
+    ("前文\n引用元: https://example.com\n本文", "前文\n\n本文"),
+    ("前文\n海外での Twitter の反応\nツイート\n本文", "前文\n\n本文"),
+    ("本文\nAmazon | 商品\n映画 予告編 YouTube\n映画「X」公式サイト 2023年公開\n続き", "本文\n\n続き"),
+    ("目次\n- 導入\n- 感想\n本文", "本文"),
+    ("目次\n本文", "目次\n本文"),
+    ("フォローは \n@miyakawa2449\n まで", "フォローは@miyakawa2449まで"),
+])
+def test_rules(text, expected):
+    assert strip_unwanted_sections(text) == expected
+
+
+@pytest.mark.parametrize("name", sorted(ADVERSARIAL_INPUTS))
+def test_worst_case_inputs_run_in_linear_time(name):
+    # 旧実装では数秒から数分かかるサイズでも、行単位の処理なら短時間で終わる
+    text = ADVERSARIAL_INPUTS[name](200000)
+    start = time.perf_counter()
+    strip_unwanted_sections(text)
+    assert time.perf_counter() - start < 2.0
@@ -0,0 +1,85 @@
+import importlib
+import os
+
+from src.utils.structure_validator import STRUCTURE_RETRY_PREFIX, SectionStructureValidator
+from tools.mock_openai_server import StubConfig, build_stub_article, start_server_in_thread
+
+
+def _feed_in_chunks(validator, text, size=3):
+    for start in range(0, len(text), size):
+        if validator.feed(text[start:start + size]):
+            return start
+    return None
+
+
+def test_validator_accepts_six_sections_split_across_chunks():
+    article = build_stub_article([{"role": "user", "content": "映画「作品」"}], 600)
+    validator = SectionStructureValidator()
+    assert _feed_in_chunks(validator, article + "\n## 補足\n本文") is None
+    assert validator.finish() is None and validator.sections_found == 6
+
+
+def test_validator_accepts_the_heading_style_of_the_prompt_template():
+    template_path = os.path.join(os.path.dirname(__file__), "..", "src", "prompts", "templates",
+                                 "movie_review_template.txt")
+    with open(template_path, encoding="utf-8") as f:
+        headings = [line.strip() for line in f if line.startswith("**#")]
+    # テンプレートの見出し ("**# 感想・レビュー**" など) をそのまま使って書かれた記事
+    article = "\n".join(f"{heading}\n*   本文です。\n" for heading in headings)
+    validator = SectionStructureValidator()
+    assert len(headings) == 6
+    assert _feed_in_chunks(validator, article) is None
+    assert validator.finish() is None and validator.sections_found == 6
+
+    swapped = SectionStructureValidator()
+    swapped.feed("**# 導入**\n本文\n**# 感想・レビュー**\n")
+    assert "「# 予告編とあらすじ」の位置に「# 感想・レビュー」" in swapped.violation
+
+
+def test_validator_stops_at_the_first_out_of_order_heading():
+    article = build_stub_article([{"role": "user", "content": "映画「作品」"}], 600, malformed=True)
+    validator = SectionStructureValidator()
+    stopped_at = _feed_in_chunks(validator, article)
+    # 2番目の見出しの行を受信し終えた時点で検出する
+    assert stopped_at is not None and stopped_at < article.index("# 予告編とあらすじ")
+    assert "「# 予告編とあらすじ」の位置に「# 出演者・スタッフ情報」" in validator.violation
+
+
+def test_validator_rejects_text_without_headings_before_the_line_ends():
+    validator = SectionStructureValidator()
+    assert validator.feed("\n\n") is None
+    assert validator.feed("「君の名は。」は") is not None
+    missing = SectionStructureValidator()
+    missing.feed("# 導入\n本文\n# 予告編とあらすじ\n#ハッシュタグ")
+    assert missing.finish().startswith("見出しが不足しています: # 出演者・スタッフ情報")
+
+
+def test_generator_aborts_malformed_streams_and_retries(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    openai_adapter = importlib.import_module("src.core.openai_adapter")
+    from src.config import settings
+    from src.core.rate_limiter import RateLimiter
+    from src.generator.article_generator import ArticleGenerator
+
+    server, base_url = start_server_in_thread(StubConfig(
+        latency="fixed:0", completion_chars=3000, tokens_per_second=2000, malformed_probability=1.0
+    ))
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+    monkeypatch.setattr(settings, "STRUCTURE_MAX_ATTEMPTS", 2)
+    try:
+        adapter = openai_adapter.OpenAIAdapter(
+            api_key="sk-test", rate_limiter=RateLimiter(requests_per_minute=60000, tokens_per_minute=10_000_000)
+        )
+        generator = ArticleGenerator(client_adapter=adapter)
+        chunks = list(generator.generate_movie_review_stream("作品", validate_structure=True,
+                                                             generation_params={"max_tokens": 3000}))
+        many = generator.generate_many(["作品"], validate_structure=True, generation_params={"max_tokens": 3000})
+    finally:
+        server.shutdown()
+
+    assert sum(chunk.startswith(STRUCTURE_RETRY_PREFIX) for chunk in chunks) == 1
+    assert chunks[-1].startswith("エラー: 記事の構成が崩れたため生成を中断しました")
+    # 2番目の見出しまでで打ち切り、3000文字の残りは受信しない
+    assert sum(len(chunk) for chunk in chunks if not chunk.startswith(("エラー:", STRUCTURE_RETRY_PREFIX))) < 1200
+    assert adapter.last_stream_metrics["total_latency"] < 1.0
+    assert many[0].startswith("エラー: 記事の構成が崩れたため生成を中断しました")
@@ -0,0 +1,43 @@
+import json
+
+from src.utils.style_index import StyleExampleIndex, select_style_example
+
+
+def _write_corpus(path, articles):
+    path.write_text("".join(json.dumps(a, ensure_ascii=False) + "\n" for a in articles), encoding="utf-8")
+
+
+ARTICLES = [
+    {"id": 1, "title": "君の名は。を観てきました", "text": "新海誠監督の彗星と入れ替わりの物語。" * 20, "category": "映画"},
+    {"id": 2, "title": "死霊館の感想", "text": "悪魔祓いと神父が登場するホラー映画。" * 20, "category": "映画"},
+    {"id": 3, "title": "孤独のグルメ", "text": "食事をするだけのドラマ。" * 20, "category": "ドラマ"},
+]
+
+
+def test_search_returns_related_review_and_reads_text(tmp_path):
+    corpus = tmp_path / "output.jsonl"
+    _write_corpus(corpus, ARTICLES)
+    index, stats = StyleExampleIndex.build_or_update(str(corpus), str(tmp_path / "index"))
+    assert stats == {"documents": 3, "analyzed": 3, "reused": 0}
+
+    assert index.search("君の名は。")[0]["id"] == "1"
+    assert index.search("ヴァチカンのエクソシスト ホラー")[0]["id"] == "2"
+    assert [r["id"] for r in index.search("神父のドラマ", category="ドラマ")] == ["3"]
+    # 同じカテゴリーに一致する記事がなければ全記事から選ぶ
+    assert index.search("グルメ", category="映画")[0]["id"] == "3"
+    assert select_style_example(str(corpus), str(tmp_path / "index"), "死霊館 2", num_chars=10) == ARTICLES[1]["text"][:10]
+
+
+def test_build_or_update_reanalyzes_only_changed_articles(tmp_path):
+    corpus = tmp_path / "output.jsonl"
+    _write_corpus(corpus, ARTICLES)
+    StyleExampleIndex.build_or_update(str(corpus), str(tmp_path / "index"))
+
+    _, stats = StyleExampleIndex.build_or_update(str(corpus), str(tmp_path / "index"))
+    assert stats["analyzed"] == 0
+
+    added = {"id": 4, "title": "インターステラー", "text": "宇宙とブラックホールのSF映画。" * 20, "category": "映画"}
+    _write_corpus(corpus, ARTICLES + [added])
+    index, stats = StyleExampleIndex.build_or_update(str(corpus), str(tmp_path / "index"))
+    assert stats == {"documents": 4, "analyzed": 1, "reused": 3}
+    assert index.search("インターステラー")[0]["id"] == "4"
@@ -0,0 +1,47 @@
+from src.core.token_budget import TokenCounter, fit_text_to_budget, get_context_window, plan_request
+
+
+def test_context_window_lookup():
+    assert get_context_window("gpt-3.5-turbo") == 16385
+    assert get_context_window("ft:gpt-3.5-turbo-0125:personal:movieblog:abc") == 16385
+    assert get_context_window("gpt-4o-2024-08-06") == 128000
+
+
+def test_plan_request_clamps_max_tokens_to_remaining_context():
+    messages = [{"role": "user", "content": "あ" * 12000}]
+    plan = plan_request(messages, "gpt-3.5-turbo", max_tokens=5000)
+    assert plan["clamped"]
+    assert plan["prompt_tokens"] + plan["max_tokens"] <= plan["context_window"]
+
+    short_plan = plan_request([{"role": "user", "content": "短い"}], "gpt-3.5-turbo", max_tokens=500)
+    assert not short_plan["clamped"] and short_plan["max_tokens"] == 500 and short_plan["fits"]
+
+
+def test_fit_text_to_budget_trims_at_sentence_boundary():
+    skeleton = [{"role": "user", "content": "文体例:"}]
+    text = "これは文体例の文章です。" * 3000
+    fitted = fit_text_to_budget(skeleton, text, "gpt-4", max_tokens=2000)
+    assert fitted.endswith("。")
+    assert len(fitted) < len(text)
+    messages = [{"role": "user", "content": "文体例:" + fitted}]
+    assert plan_request(messages, "gpt-4", 2000)["fits"]
+    assert TokenCounter("gpt-4").count_text("") == 0
+
+
+def test_counter_falls_back_to_the_heuristic_when_the_encoding_cannot_be_loaded(monkeypatch):
+    from src.core import token_budget
+
+    class _OfflineTiktoken:
+        calls = 0
+
+        @classmethod
+        def encoding_for_model(cls, model):
+            cls.calls += 1
+            raise ConnectionError("オフライン")
+
+    monkeypatch.setattr(token_budget, "tiktoken", _OfflineTiktoken)
+    monkeypatch.setattr(token_budget, "_encoding_load_error", None)
+    counter = TokenCounter("gpt-4o")
+    assert not counter.is_exact and counter.count_text("あいう") == 4
+    # 一度失敗した後は、読み込みを試み直さない
+    assert not TokenCounter("gpt-4").is_exact and _OfflineTiktoken.calls == 1
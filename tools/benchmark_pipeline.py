@@ -0,0 +1,283 @@
+import argparse
+import gc
+import html
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List
+
+# --- sys.path の調整 ---
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
+# --- ここまで追加 ---
+
+from src.prompts.prompt_manager import PromptManager
+
+DEFAULT_CORPUS_PATH = os.path.join(project_root_for_sys_path, "output.jsonl.bk")
+DEFAULT_RESULTS_DIR = os.path.join(project_root_for_sys_path, "data", "benchmarks")
+DEFAULT_BASELINE_PATH = os.path.join(DEFAULT_RESULTS_DIR, "baseline.json")
+# ベースラインからこの割合以上悪化したら劣化とみなす
+DEFAULT_TOLERANCE = 0.2
+# 劣化の判定に使う指標と、値が大きいほど良いかどうか
+REGRESSION_METRICS = {
+    "items_per_second": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "peak_memory_mb": False,
+}
+
+
+def load_corpus(corpus_path: str) -> List[Dict[str, Any]]:
+    """
+    ベンチマークの元になる記事データ (JSON Lines) を読み込む。
+    """
+    articles = []
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                articles.append(json.loads(line))
+    return articles
+
+
+def replicate_corpus(articles: List[Dict[str, Any]], target_count: int) -> Iterator[Dict[str, Any]]:
+    """
+    記事データを target_count 件になるまで繰り返し、id とタイトルが重複しないようにして返す。
+    複製はジェネレーターで1件ずつ作るため、件数を増やしてもメモリ使用量は増えない。
+    """
+    for index in range(target_count):
+        article = articles[index % len(articles)]
+        copy_number = index // len(articles)
+        if copy_number == 0:
+            yield article
+            continue
+        yield {
+            **article,
+            "id": f"{article.get('id', index)}-{copy_number}",
+            "title": f"{article.get('title', '')} ({copy_number})",
+        }
+
+
+def article_text_to_html(text: str) -> str:
+    """
+    clean_content の入力にするため、記事本文を WordPress の投稿に近い HTML に戻す。
+    段落は <p>、段落内の改行は <br /> にする。
+    """
+    paragraphs = [paragraph for paragraph in text.split("\n\n") if paragraph.strip()]
+    return "<!--more-->\n" + "\n".join(
+        "<p>" + html.escape(paragraph).replace("\n", "<br />\n") + "</p>" for paragraph in paragraphs
+    )
+
+
+def build_stages() -> Dict[str, Callable[[Dict[str, Any]], Any]]:
+    """
+    計測対象の各ステージを、記事1件を受け取って処理する関数として返す。
+    各スクリプトの依存パッケージ (bs4, openai など) はここで読み込む。
+    """
+    from tools.process_download_data import clean_content
+    from scripts.refine_output_jsonl import clean_text_python_pre_ai
+    from scripts.prepare_finetuning_data import build_finetuning_record
+    from src.generator.article_generator import MOVIE_REVIEW_TEMPLATE_NAME
+
+    prompt_manager = PromptManager()
+    # HTML への変換は計測対象外なので、元記事ごとに1回だけ行って使い回す
+    html_by_text: Dict[str, str] = {}
+
+    def _clean_content(article):
+        text = article.get("text", "")
+        if text not in html_by_text:
+            html_by_text[text] = article_text_to_html(text)
+        return clean_content(html_by_text[text])
+
+    def _clean_text_python_pre_ai(article):
+        return clean_text_python_pre_ai(article.get("text", ""), article.get("title", ""))
+
+    def _build_prompt(article):
+        return prompt_manager.build_prompt(MOVIE_REVIEW_TEMPLATE_NAME, {
+            "movie_title": article.get("title", ""),
+            "user_blog_style_example": article.get("text", "")[:1000],
+            "tone_and_style_details": "親しみやすく、率直な感想を交えたトーン",
+            "other_notes": "ネタバレは避けてください。",
+        })
+
+    def _convert_to_finetuning_format(article):
+        record = build_finetuning_record(article)
+        return json.dumps(record, ensure_ascii=False) if record else None
+
+    return {
+        "clean_content": _clean_content,
+        "clean_text_python_pre_ai": _clean_text_python_pre_ai,
+        "PromptManager.build_prompt": _build_prompt,
+        "convert_to_finetuning_format": _convert_to_finetuning_format,
+    }
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    昇順に並んだ値から最近接順位法でパーセンタイルを求める。
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def measure_stage(stage: Callable[[Dict[str, Any]], Any], articles: List[Dict[str, Any]], article_count: int,
+                  measure_memory: bool = True) -> Dict[str, float]:
+    """
+    1つのステージを article_count 件の記事で実行し、スループットと1件あたりの処理時間を計測する。
+    ピークメモリは tracemalloc による別パスで計測する (tracemalloc は処理を遅くするため時間計測とは分ける)。
+    """
+    # 初回呼び出しのみ発生するコスト (テンプレートの読み込みなど) は計測から除く
+    stage(articles[0])
+
+    latencies = []
+    input_chars = 0
+    gc.collect()
+    started = time.perf_counter()
+    for article in replicate_corpus(articles, article_count):
+        item_started = time.perf_counter()
+        stage(article)
+        latencies.append(time.perf_counter() - item_started)
+        input_chars += len(article.get("text", ""))
+    total_seconds = time.perf_counter() - started
+
+    peak_memory_mb = None
+    if measure_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            for article in replicate_corpus(articles, article_count):
+                stage(article)
+            peak_memory_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "items": article_count,
+        "total_seconds": round(total_seconds, 4),
+        "items_per_second": round(article_count / total_seconds, 2) if total_seconds > 0 else 0.0,
+        "mb_per_second": round(input_chars / (1024 * 1024) / total_seconds, 3) if total_seconds > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4),
+        "peak_memory_mb": round(peak_memory_mb, 3) if peak_memory_mb is not None else None,
+    }
+
+
+def run_benchmark(corpus_path: str, article_count: int, stage_names: List[str] = None,
+                  measure_memory: bool = True) -> Dict[str, Any]:
+    """
+    全ステージ (または stage_names で指定したステージ) を計測し、結果を辞書で返す。
+    """
+    articles = load_corpus(corpus_path)
+    stages = build_stages()
+    if stage_names:
+        unknown = [name for name in stage_names if name not in stages]
+        if unknown:
+            raise ValueError(f"未知のステージです: {', '.join(unknown)} (指定可能: {', '.join(stages)})")
+        stages = {name: stages[name] for name in stage_names}
+
+    results = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "corpus": os.path.basename(corpus_path),
+            "corpus_articles": len(articles),
+            "articles": article_count,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "stages": {},
+    }
+    for name, stage in stages.items():
+        print(f"計測中: {name} ({article_count} 件)...", flush=True)
+        results["stages"][name] = measure_stage(stage, articles, article_count, measure_memory)
+    return results
+
+
+def find_regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    ベースラインと比べて tolerance の割合以上悪化した指標を、説明文のリストで返す。
+    """
+    regressions = []
+    for name, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if not previous:
+            continue
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            old_value, new_value = previous.get(metric), current.get(metric)
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{name}: {metric} {old_value} -> {new_value} ({change:+.1%})")
+    return regressions
+
+
+def print_results(results: Dict[str, Any], baseline: Dict[str, Any] = None) -> None:
+    print(f"\n{'stage':30} {'items/s':>10} {'MB/s':>8} {'p50 (ms)':>10} {'p99 (ms)':>10} {'peak MB':>9} {'vs base':>8}")
+    for name, stage_result in results["stages"].items():
+        comparison = "-"
+        previous = (baseline or {}).get("stages", {}).get(name)
+        if previous and previous.get("items_per_second"):
+            comparison = f"{stage_result['items_per_second'] / previous['items_per_second']:.2f}x"
+        peak = stage_result["peak_memory_mb"]
+        print(f"{name:30} {stage_result['items_per_second']:>10.1f} {stage_result['mb_per_second']:>8.2f} "
+              f"{stage_result['p50_ms']:>10.3f} {stage_result['p99_ms']:>10.3f} "
+              f"{(f'{peak:.2f}' if peak is not None else '-'):>9} {comparison:>8}")
+
+
+def save_json(data: Dict[str, Any], file_path: str) -> None:
+    output_dir = os.path.dirname(file_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="データ処理パイプラインのCPU処理部分のベンチマーク")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_PATH, help="元になる記事データ (JSON Lines)")
+    parser.add_argument("--articles", type=int, default=10000, help="複製後の記事数 (10000〜100000 程度)")
+    parser.add_argument("--stages", nargs="+", help="計測するステージ (省略時はすべて)")
+    parser.add_argument("--output", help="結果のJSONの保存先 (省略時は data/benchmarks/pipeline_<日時>.json)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="比較するベースラインのJSON")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存する")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="劣化とみなす悪化の割合 (0.2 なら 20%%)")
+    parser.add_argument("--skip-memory", action="store_true", help="ピークメモリの計測を省略する")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.corpus, args.articles, args.stages, measure_memory=not args.skip_memory)
+
+    baseline_results = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline_results = json.load(f)
+    print_results(benchmark_results, baseline_results)
+
+    output_path = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    save_json(benchmark_results, output_path)
+    print(f"\n結果を保存しました: {output_path}")
+
+    if args.save_baseline:
+        save_json(benchmark_results, args.baseline)
+        print(f"ベースラインを更新しました: {args.baseline}")
+    elif baseline_results:
+        regressions = find_regressions(benchmark_results, baseline_results, args.tolerance)
+        if regressions:
+            print(f"\n警告: ベースラインから {args.tolerance:.0%} 以上の劣化が見つかりました。")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\nベースラインからの劣化は見つかりませんでした。")
+    else:
+        print("ベースラインがありません。--save-baseline で今回の結果を保存できます。")
@@ -0,0 +1,84 @@
+import argparse
+import os
+import re
+import sys
+import time
+
+# --- sys.path の調整 ---
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
+# --- ここまで追加 ---
+
+from src.utils.section_filter import strip_unwanted_sections
+
+
+def legacy_clean_text_python_pre_ai(text_content: str) -> str:
+    """
+    置き換え前の正規表現による実装 (scripts/refine_output_jsonl.py の旧 clean_text_python_pre_ai)。
+    新実装との出力比較と、最悪ケースの計測にのみ使用する。
+    """
+    text_content = re.sub(r"\s*@miyakawa2449\s*", "@miyakawa2449", text_content)
+    text_content = re.sub(r"^(関連記事|関連する記事|■関連記事)\s*\n(.|\n)*?(?=\n\n(?:#|\*{2,}.*\*{2,}|\w)|$)", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^引用元:.*$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^(海外での\s*Twitter\s*の反応|海外の反応)\s*\n(.|\n)*?(?=\n\n(?:#|\*{2,}.*\*{2,}|\w)|$)", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^Amazon\s*\|.*$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^.*(通販\s*\|\s*Amazon|Amazon\s*で見る)$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^\s*<a href=.*amazon\.co\.jp.*<\/a>\s*$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^.*YouTube$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^映画「.*?」公式サイト.*公開$", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"^(目次|この記事の目次)\s*\n(-|\*|\d\.).*\n((?:-|\*|\d\.).*\n)*", "", text_content, flags=re.MULTILINE | re.IGNORECASE)
+    text_content = re.sub(r"\n\s*\n", "\n\n", text_content)
+    return text_content.strip()
+
+
+# 最悪ケースの入力。size は繰り返し回数 (おおよその文字数)
+ADVERSARIAL_INPUTS = {
+    # @miyakawa2449 が現れない長い空白: 旧実装は空白の開始位置ごとに末尾まで走査する
+    "whitespace_run": lambda size: "本文" + " \t" * (size // 2) + "終わり",
+    # 改行を含む空白の連続
+    "blank_lines": lambda size: "本文\n" + " \n" * (size // 2) + "終わり",
+    # 見出しの後に長い空白が続き、本文がない
+    "heading_then_whitespace": lambda size: "関連記事\n" + " " * size,
+    # 改行のない非常に長い1行
+    "long_single_line": lambda size: "あ" * size + "YouTube",
+    # 目次見出しの後にリストでない行が延々と続く
+    "table_of_contents_without_list": lambda size: ("目次\n" + "本文\n") * (size // 8),
+}
+
+
+def _time_call(func, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(sizes, repeat: int = 3, include_legacy: bool = True) -> None:
+    """
+    各最悪ケース入力について、入力サイズを変えながら新旧実装の処理時間を表示する。
+    新実装はサイズに比例して増えるが、旧実装は入力によってサイズの2乗で増える。
+    """
+    print(f"{'input':34} {'size':>8} {'new (ms)':>10} {'legacy (ms)':>12}")
+    for name, build in ADVERSARIAL_INPUTS.items():
+        for size in sizes:
+            text = build(size)
+            new_ms = _time_call(strip_unwanted_sections, text, repeat) * 1000
+            legacy_column = "-"
+            if include_legacy:
+                legacy_ms = _time_call(legacy_clean_text_python_pre_ai, text, 1) * 1000
+                legacy_column = f"{legacy_ms:.2f}"
+            print(f"{name:34} {size:>8} {new_ms:>10.2f} {legacy_column:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="不要セクション除去処理の最悪ケースのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000],
+                        help="入力サイズ (文字数の目安)")
+    parser.add_argument("--repeat", type=int, default=3, help="新実装の計測回数 (最良値を表示)")
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="旧実装の計測を省略する (大きなサイズでは旧実装が非常に遅くなるため)")
+    args = parser.parse_args()
+    run_benchmark(args.sizes, repeat=args.repeat, include_legacy=not args.skip_legacy)
@@ -0,0 +1,782 @@
+"""
+OpenAI API 互換のローカルスタブサーバー。
+
+chat completions (ストリーミング含む)・moderations・files・fine_tuning・batches のエンドポイントを
+模倣し、応答遅延の分布、429 の注入 (Retry-After 付き)、RPM/TPM の上限を設定できる。
+OPENAI_BASE_URL=http://127.0.0.1:8010/v1 を設定すると、アダプターや各スクリプトをこのサーバーに向けられる。
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from email.parser import BytesParser
+from email.policy import default as default_email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Moderation API のカテゴリ (応答の categories / category_scores のキー)
+MODERATION_CATEGORIES = [
+    "sexual", "hate", "harassment", "self-harm", "sexual/minors", "hate/threatening",
+    "violence/graphic", "self-harm/intent", "self-harm/instructions", "harassment/threatening", "violence",
+]
+
+# スタブが生成する記事の6部構成
+ARTICLE_SECTIONS = ["導入", "予告編とあらすじ", "出演者・スタッフ情報", "感想レビュー", "メインキャスト紹介", "まとめ"]
+
+
+class LatencyDistribution:
+    """
+    応答遅延 (秒) の分布。"fixed:0.5"、"uniform:0.2,1.0"、"lognormal:0.8,0.5" (中央値, シグマ) の形式で指定する。
+    """
+
+    def __init__(self, spec: str = "fixed:0", seed: int = None):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",") if value] or [0.0]
+        self._random = random.Random(seed)
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"未対応の遅延分布です: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "uniform":
+            low, high = (self.params + self.params)[:2]
+            return self._random.uniform(low, high)
+        if self.kind == "lognormal":
+            median, sigma = (self.params + [0.5])[:2]
+            return self._random.lognormvariate(math.log(max(median, 1e-6)), sigma)
+        return self.params[0]
+
+
+class QuotaTracker:
+    """
+    直近60秒のリクエスト数とトークン数を数え、RPM/TPM の上限を超えるかどうかを判定する。
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._window = deque()
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def try_consume(self, tokens: int):
+        """
+        枠があれば消費して None を返し、なければ枠が空くまでの秒数を返す。
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] >= 60:
+                self._tokens_in_window -= self._window.popleft()[1]
+
+            if self.requests_per_minute and len(self._window) + 1 > self.requests_per_minute:
+                return max(0.001, 60 - (now - self._window[0][0]))
+            if self.tokens_per_minute and self._tokens_in_window + tokens > self.tokens_per_minute:
+                # 古いエントリから順に期限切れになったとき、必要な分が空く時刻を求める
+                freed = 0
+                for timestamp, used in self._window:
+                    freed += used
+                    if self._tokens_in_window - freed + tokens <= self.tokens_per_minute:
+                        return max(0.001, 60 - (now - timestamp))
+                return 60.0
+
+            self._window.append((now, tokens))
+            self._tokens_in_window += tokens
+            return None
+
+    def headers(self) -> dict:
+        with self._lock:
+            headers = {}
+            if self.requests_per_minute:
+                headers["x-ratelimit-limit-requests"] = str(int(self.requests_per_minute))
+                headers["x-ratelimit-remaining-requests"] = str(max(0, int(self.requests_per_minute) - len(self._window)))
+            if self.tokens_per_minute:
+                headers["x-ratelimit-limit-tokens"] = str(int(self.tokens_per_minute))
+                headers["x-ratelimit-remaining-tokens"] = str(max(0, int(self.tokens_per_minute) - self._tokens_in_window))
+            return headers
+
+
+class StubConfig:
+    """
+    スタブサーバーの動作設定。
+    """
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        tokens_per_second: float = 200.0,
+        stream_chunk_chars: int = 8,
+        rate_limit_probability: float = 0.0,
+        retry_after_seconds: float = 1.0,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        completion_chars: int = 1200,
+        malformed_probability: float = 0.0,
+        fine_tuning_seconds: float = 10.0,
+        batch_seconds: float = 5.0,
+        seed: int = None
+    ):
+        self.latency = LatencyDistribution(latency, seed)
+        self.tokens_per_second = tokens_per_second
+        self.stream_chunk_chars = stream_chunk_chars
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after_seconds = retry_after_seconds
+        self.quota = QuotaTracker(requests_per_minute, tokens_per_minute)
+        self.completion_chars = completion_chars
+        self.malformed_probability = malformed_probability
+        self.fine_tuning_seconds = fine_tuning_seconds
+        self.batch_seconds = batch_seconds
+        self.random = random.Random(seed)
+
+
+class StubState:
+    """
+    アップロードされたファイル、ファインチューニングジョブ、バッチをメモリ上に保持する。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.jobs = {}
+        self.batches = {}
+        self.batch_lock = threading.Lock()
+        self.counter = 0
+        self.request_count = 0
+
+    def next_id(self, prefix: str) -> str:
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}-stub{self.counter:06d}"
+
+
+def build_stub_article(messages: list, max_chars: int, malformed: bool = False) -> str:
+    """
+    6部構成の記事を模した応答本文を生成する。内容はユーザープロンプトから決定的に作る。
+    malformed が真の場合は、2番目と3番目のセクションを入れ替えた (構成の崩れた) 記事を返す。
+    """
+    user_content = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    title_start = user_content.find("「")
+    title_end = user_content.find("」", title_start + 1)
+    title = user_content[title_start + 1:title_end] if 0 <= title_start < title_end else "この映画"
+
+    per_section = max(1, max_chars // len(ARTICLE_SECTIONS))
+    headings = list(ARTICLE_SECTIONS)
+    if malformed:
+        headings[1], headings[2] = headings[2], headings[1]
+    sections = []
+    for heading in headings:
+        sentence = f"{title}の{heading}について書いたスタブの文章です。"
+        body = (sentence * (per_section // len(sentence) + 1))[:per_section]
+        sections.append(f"# {heading}\n{body}")
+    return "\n\n".join(sections)[:max_chars]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text)
+
+
+def _requested_max_tokens(request: dict, config: StubConfig) -> int:
+    return request.get("max_tokens") or request.get("max_completion_tokens") or config.completion_chars
+
+
+def build_chat_completion(request: dict, config: StubConfig, state: StubState) -> dict:
+    """
+    chat completions のリクエストに対する応答本文を組み立てる。バッチの処理でも使う。
+    """
+    messages = request.get("messages") or []
+    max_tokens = _requested_max_tokens(request, config)
+    prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+    malformed = config.malformed_probability > 0 and config.random.random() < config.malformed_probability
+    text = build_stub_article(messages, min(max_tokens, config.completion_chars), malformed=malformed)
+    return {
+        "id": state.next_id("chatcmpl"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "gpt-3.5-turbo"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "length" if max_tokens < config.completion_chars else "stop",
+            "logprobs": None,
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(text),
+            "total_tokens": prompt_tokens + estimate_tokens(text),
+        },
+    }
+
+
+def _moderation_inputs(request: dict) -> list:
+    inputs = request.get("input")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    return inputs or []
+
+
+def build_moderation_response(request: dict, state: StubState) -> dict:
+    """
+    moderations のリクエストに対する応答本文を組み立てる。すべての入力を問題なしとして返す。
+    """
+    return {
+        "id": state.next_id("modr"),
+        "model": request.get("model") or "omni-moderation-latest",
+        "results": [
+            {
+                "flagged": False,
+                "categories": {category: False for category in MODERATION_CATEGORIES},
+                "category_scores": {category: 0.0001 for category in MODERATION_CATEGORIES},
+            }
+            for _ in _moderation_inputs(request)
+        ],
+    }
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "OpenAIStub/1.0"
+
+    # --- 共通処理 ---
+
+    @property
+    def config(self) -> StubConfig:
+        return self.server.stub_config
+
+    @property
+    def state(self) -> StubState:
+        return self.server.stub_state
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _read_json(self) -> dict:
+        body = self._read_body()
+        return json.loads(body) if body else {}
+
+    def _send_json(self, status: int, payload, headers: dict = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, code: str = None, headers: dict = None) -> None:
+        self._send_json(status, {
+            "error": {"message": message, "type": "invalid_request_error", "param": None, "code": code}
+        }, headers)
+
+    def _check_rate_limits(self, tokens: int) -> bool:
+        """
+        429 の注入と RPM/TPM の上限を確認する。429 を返した場合は False。
+        """
+        with self.state.lock:
+            self.state.request_count += 1
+            inject = self.config.random.random() < self.config.rate_limit_probability
+
+        retry_after = self.config.retry_after_seconds if inject else self.config.quota.try_consume(tokens)
+        if retry_after is None:
+            return True
+
+        headers = {
+            "retry-after": str(max(1, math.ceil(retry_after))),
+            "retry-after-ms": str(int(retry_after * 1000)),
+            **self.config.quota.headers(),
+        }
+        self._send_error(429, f"Rate limit reached (stub). Please try again in {retry_after:.3f}s.",
+                         code="rate_limit_exceeded", headers=headers)
+        return False
+
+    def _route(self, method: str) -> None:
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip("/")
+        if path.startswith("/v1"):
+            path = path[len("/v1"):]
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        parts = [part for part in path.split("/") if part]
+
+        try:
+            if method == "POST" and parts == ["chat", "completions"]:
+                return self._chat_completions()
+            if method == "POST" and parts == ["moderations"]:
+                return self._moderations()
+            if method == "POST" and parts == ["files"]:
+                return self._upload_file()
+            if method == "GET" and len(parts) == 2 and parts[0] == "files":
+                return self._retrieve_file(parts[1])
+            if method == "GET" and len(parts) == 3 and parts[0] == "files" and parts[2] == "content":
+                return self._file_content(parts[1])
+            if parts[:1] == ["batches"]:
+                if method == "POST" and len(parts) == 1:
+                    return self._create_batch()
+                if method == "GET" and len(parts) == 2:
+                    return self._retrieve_batch(parts[1])
+                if method == "POST" and len(parts) == 3 and parts[2] == "cancel":
+                    return self._cancel_batch(parts[1])
+            if parts[:2] == ["fine_tuning", "jobs"]:
+                if method == "POST" and len(parts) == 2:
+                    return self._create_job()
+                if method == "GET" and len(parts) == 3:
+                    return self._retrieve_job(parts[2])
+                if method == "GET" and len(parts) == 4 and parts[3] == "events":
+                    return self._list_job_events(parts[2], query)
+                if method == "POST" and len(parts) == 4 and parts[3] == "cancel":
+                    return self._cancel_job(parts[2])
+            self._send_error(404, f"Unknown endpoint: {method} {parsed.path}")
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアント側で中断されたストリーミングなど
+            self.close_connection = True
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    # --- chat completions ---
+
+    def _chat_completions(self) -> None:
+        request = self._read_json()
+        messages = request.get("messages") or []
+        prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+        if not self._check_rate_limits(prompt_tokens + _requested_max_tokens(request, self.config)):
+            return
+
+        completion = build_chat_completion(request, self.config, self.state)
+        time.sleep(self.config.latency.sample())
+
+        if not request.get("stream"):
+            self._send_json(200, completion, self.config.quota.headers())
+            return
+
+        completion_id, created, model = completion["id"], completion["created"], completion["model"]
+        text = completion["choices"][0]["message"]["content"]
+        finish_reason = completion["choices"][0]["finish_reason"]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def _send_event(delta: dict, finish: str = None, usage: dict = None) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish, "logprobs": None}],
+            }
+            if usage is not None:
+                # stream_options.include_usage 指定時の最後のチャンク (choices は空で usage だけを持つ)
+                chunk["choices"] = []
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        _send_event({"role": "assistant", "content": ""})
+        chunk_chars = max(1, self.config.stream_chunk_chars)
+        delay_per_chunk = chunk_chars / self.config.tokens_per_second if self.config.tokens_per_second else 0
+        for start in range(0, len(text), chunk_chars):
+            _send_event({"content": text[start:start + chunk_chars]})
+            if delay_per_chunk:
+                time.sleep(delay_per_chunk)
+        _send_event({}, finish_reason)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            _send_event({}, usage=completion["usage"])
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    # --- moderations ---
+
+    def _moderations(self) -> None:
+        request = self._read_json()
+        if not self._check_rate_limits(sum(estimate_tokens(str(text)) for text in _moderation_inputs(request))):
+            return
+
+        time.sleep(self.config.latency.sample())
+        self._send_json(200, build_moderation_response(request, self.state), self.config.quota.headers())
+
+    # --- files ---
+
+    def _file_object(self, file_record: dict) -> dict:
+        return {key: value for key, value in file_record.items() if key != "content"}
+
+    def _upload_file(self) -> None:
+        body = self._read_body()
+        if not self._check_rate_limits(0):
+            return
+        content_type = self.headers.get("Content-Type", "")
+        message = BytesParser(policy=default_email_policy).parsebytes(
+            b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+        )
+        fields = {}
+        content = b""
+        filename = "upload.jsonl"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                filename = part.get_filename()
+                content = part.get_payload(decode=True) or b""
+            else:
+                fields[name] = part.get_content().strip()
+
+        file_id = self.state.next_id("file")
+        file_record = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": fields.get("purpose", "fine-tune"),
+            "status": "processed",
+            "content": content,
+        }
+        with self.state.lock:
+            self.state.files[file_id] = file_record
+        self._send_json(200, self._file_object(file_record))
+
+    def _retrieve_file(self, file_id: str) -> None:
+        file_record = self.state.files.get(file_id)
+        if not file_record:
+            return self._send_error(404, f"No such File object: {file_id}")
+        self._send_json(200, self._file_object(file_record))
+
+    def _file_content(self, file_id: str) -> None:
+        file_record = self.state.files.get(file_id)
+        if not file_record:
+            return self._send_error(404, f"No such File object: {file_id}")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(file_record["content"])))
+        self.end_headers()
+        self.wfile.write(file_record["content"])
+
+    # --- fine-tuning ---
+
+    def _job_snapshot(self, job: dict) -> dict:
+        """
+        作成からの経過時間に応じてジョブの状態を進めた応答を返す。
+        """
+        elapsed = time.time() - job["created_at"]
+        duration = self.config.fine_tuning_seconds
+        status = job["status"]
+        if status not in ("cancelled", "failed"):
+            if elapsed < duration * 0.1:
+                status = "validating_files"
+            elif elapsed < duration:
+                status = "running"
+            else:
+                status = "succeeded"
+
+        snapshot = {key: value for key, value in job.items() if key != "suffix"}
+        snapshot["status"] = status
+        if status == "succeeded":
+            snapshot["fine_tuned_model"] = f"ft:{job['model']}:personal:{job['suffix'] or 'stub'}:{job['id'][-6:]}"
+            snapshot["finished_at"] = int(job["created_at"] + duration)
+            snapshot["trained_tokens"] = 1000
+        return snapshot
+
+    def _job_events(self, job: dict) -> list:
+        """
+        ジョブの経過時間までに発生したイベントを古い順に返す。
+        """
+        snapshot = self._job_snapshot(job)
+        created_at = job["created_at"]
+        duration = self.config.fine_tuning_seconds
+        n_epochs = int(job["hyperparameters"].get("n_epochs") or 3)
+        steps = n_epochs * 10
+        now = time.time()
+
+        events = [(created_at, "info", f"Created fine-tuning job: {job['id']}")]
+        events.append((created_at + duration * 0.05, "info", "Validating training file"))
+        events.append((created_at + duration * 0.1, "info", "Fine-tuning job started"))
+        for step in range(1, steps + 1):
+            timestamp = created_at + duration * (0.1 + 0.9 * step / steps)
+            loss = 2.0 / (1 + step / 5)
+            events.append((timestamp, "info", f"Step {step}/{steps}: training loss={loss:.4f}"))
+        if snapshot["status"] == "succeeded":
+            events.append((created_at + duration, "info", "The job has successfully completed"))
+        elif snapshot["status"] == "cancelled":
+            events.append((job.get("cancelled_at", now), "info", "Fine-tuning job cancelled"))
+
+        cutoff = job.get("cancelled_at", now)
+        return [
+            {
+                "id": f"ftevent-{job['id'][-6:]}-{index:04d}",
+                "object": "fine_tuning.job.event",
+                "created_at": int(timestamp),
+                "level": level,
+                "message": message,
+                "type": "message",
+                "data": {},
+            }
+            for index, (timestamp, level, message) in enumerate(events)
+            if timestamp <= cutoff or message.startswith("Fine-tuning job cancelled")
+        ]
+
+    def _create_job(self) -> None:
+        request = self._read_json()
+        if not self._check_rate_limits(0):
+            return
+        training_file = request.get("training_file")
+        if training_file not in self.state.files:
+            return self._send_error(400, f"invalid training_file: {training_file}")
+
+        hyperparameters = request.get("hyperparameters") or {}
+        method = request.get("method") or {}
+        method_hyperparameters = (method.get("supervised") or {}).get("hyperparameters") or {}
+        job = {
+            "id": self.state.next_id("ftjob"),
+            "object": "fine_tuning.job",
+            "created_at": time.time(),
+            "model": request.get("model", "gpt-3.5-turbo-0125"),
+            "suffix": request.get("suffix"),
+            "training_file": training_file,
+            "validation_file": request.get("validation_file"),
+            "hyperparameters": {"n_epochs": hyperparameters.get("n_epochs") or method_hyperparameters.get("n_epochs") or 3},
+            "status": "validating_files",
+            "fine_tuned_model": None,
+            "finished_at": None,
+            "trained_tokens": None,
+            "error": None,
+            "organization_id": "org-stub",
+            "result_files": [],
+            "seed": request.get("seed") or 0,
+        }
+        with self.state.lock:
+            self.state.jobs[job["id"]] = job
+        self._send_json(200, self._job_snapshot(job))
+
+    def _retrieve_job(self, job_id: str) -> None:
+        job = self.state.jobs.get(job_id)
+        if not job:
+            return self._send_error(404, f"No such fine-tuning job: {job_id}")
+        self._send_json(200, self._job_snapshot(job))
+
+    def _cancel_job(self, job_id: str) -> None:
+        job = self.state.jobs.get(job_id)
+        if not job:
+            return self._send_error(404, f"No such fine-tuning job: {job_id}")
+        if self._job_snapshot(job)["status"] in ("validating_files", "running"):
+            job["status"] = "cancelled"
+            job["cancelled_at"] = time.time()
+        self._send_json(200, self._job_snapshot(job))
+
+    def _list_job_events(self, job_id: str, query: dict) -> None:
+        job = self.state.jobs.get(job_id)
+        if not job:
+            return self._send_error(404, f"No such fine-tuning job: {job_id}")
+        # OpenAI と同様に新しい順で返し、after には前回受け取ったイベントIDを指定する (それより古いものを返す)
+        events = list(reversed(self._job_events(job)))
+        after = query.get("after")
+        if after:
+            ids = [event["id"] for event in events]
+            events = events[ids.index(after) + 1:] if after in ids else []
+        limit = int(query.get("limit") or 20)
+        self._send_json(200, {"object": "list", "data": events[:limit], "has_more": len(events) > limit})
+
+
+    # --- batches ---
+
+    def _store_file(self, filename: str, purpose: str, content: bytes) -> str:
+        file_id = self.state.next_id("file")
+        with self.state.lock:
+            self.state.files[file_id] = {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+                "content": content,
+            }
+        return file_id
+
+    def _run_batch(self, batch: dict) -> None:
+        """
+        バッチの入力ファイルの各リクエストを処理し、結果ファイルとエラーファイルを作る。
+        """
+        output_lines, error_lines = [], []
+        for raw_line in self.state.files[batch["input_file_id"]]["content"].splitlines():
+            if not raw_line.strip():
+                continue
+            request_line = json.loads(raw_line)
+            body = request_line.get("body") or {}
+            if request_line.get("url") == "/v1/chat/completions":
+                response_body = build_chat_completion(body, self.config, self.state)
+            elif request_line.get("url") == "/v1/moderations":
+                response_body = build_moderation_response(body, self.state)
+            else:
+                error_lines.append({
+                    "id": self.state.next_id("batch_req"),
+                    "custom_id": request_line.get("custom_id"),
+                    "response": None,
+                    "error": {"code": "invalid_url", "message": f"Unsupported url: {request_line.get('url')}"},
+                })
+                continue
+            output_lines.append({
+                "id": self.state.next_id("batch_req"),
+                "custom_id": request_line.get("custom_id"),
+                "response": {"status_code": 200, "request_id": self.state.next_id("req"), "body": response_body},
+                "error": None,
+            })
+
+        def _encode(lines: list) -> bytes:
+            return "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+
+        if output_lines:
+            batch["output_file_id"] = self._store_file("batch_output.jsonl", "batch_output", _encode(output_lines))
+        if error_lines:
+            batch["error_file_id"] = self._store_file("batch_errors.jsonl", "batch_output", _encode(error_lines))
+        batch["request_counts"] = {
+            "total": len(output_lines) + len(error_lines),
+            "completed": len(output_lines),
+            "failed": len(error_lines),
+        }
+
+    def _batch_snapshot(self, batch: dict) -> dict:
+        """
+        作成からの経過時間に応じてバッチの状態を進めた応答を返す。完了時に一度だけ処理を実行する。
+        """
+        # 同じバッチへの同時の問い合わせで結果ファイルが二重に作られないよう、バッチ専用のロックで直列化する
+        with self.state.batch_lock:
+            elapsed = time.time() - batch["created_at"]
+            if batch["status"] not in ("cancelled", "completed"):
+                if elapsed < self.config.batch_seconds * 0.1:
+                    batch["status"] = "validating"
+                elif elapsed < self.config.batch_seconds:
+                    batch["status"] = "in_progress"
+                else:
+                    self._run_batch(batch)
+                    batch["status"] = "completed"
+                    batch["completed_at"] = int(time.time())
+            snapshot = dict(batch)
+        snapshot["created_at"] = int(snapshot["created_at"])
+        return snapshot
+
+    def _create_batch(self) -> None:
+        request = self._read_json()
+        if not self._check_rate_limits(0):
+            return
+        input_file_id = request.get("input_file_id")
+        if input_file_id not in self.state.files:
+            return self._send_error(400, f"invalid input_file_id: {input_file_id}")
+        batch = {
+            "id": self.state.next_id("batch"),
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": input_file_id,
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": time.time(),
+            "completed_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+            "errors": None,
+        }
+        with self.state.lock:
+            self.state.batches[batch["id"]] = batch
+        self._send_json(200, self._batch_snapshot(batch))
+
+    def _retrieve_batch(self, batch_id: str) -> None:
+        batch = self.state.batches.get(batch_id)
+        if not batch:
+            return self._send_error(404, f"No such batch: {batch_id}")
+        self._send_json(200, self._batch_snapshot(batch))
+
+    def _cancel_batch(self, batch_id: str) -> None:
+        batch = self.state.batches.get(batch_id)
+        if not batch:
+            return self._send_error(404, f"No such batch: {batch_id}")
+        if self._batch_snapshot(batch)["status"] in ("validating", "in_progress"):
+            with self.state.batch_lock:
+                batch["status"] = "cancelled"
+                batch["cancelled_at"] = int(time.time())
+        self._send_json(200, self._batch_snapshot(batch))
+
+def create_server(host: str = "127.0.0.1", port: int = 8010, config: StubConfig = None, quiet: bool = False) -> ThreadingHTTPServer:
+    """
+    スタブサーバーを生成する (起動はしない)。port に 0 を指定すると空いているポートを使用する。
+    """
+    server = ThreadingHTTPServer((host, port), StubRequestHandler)
+    server.daemon_threads = True
+    server.stub_config = config or StubConfig()
+    server.stub_state = StubState()
+    server.quiet = quiet
+    return server
+
+
+def start_server_in_thread(config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """
+    スタブサーバーをバックグラウンドスレッドで起動し、(server, base_url) を返す。
+    テストやベンチマークから利用する。停止は server.shutdown() で行う。
+    """
+    server = create_server(host, port, config, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI API 互換のローカルスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="応答遅延の分布 (例: fixed:0.5, uniform:0.2,1.0, lognormal:0.8,0.5)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0,
+                        help="ストリーミング時の生成速度 (文字/秒)")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0,
+                        help="ランダムに 429 を返す確率 (0.0-1.0)")
+    parser.add_argument("--retry-after", type=float, default=1.0,
+                        help="ランダムな 429 に付与する Retry-After (秒)")
+    parser.add_argument("--rpm", type=float, default=0, help="1分あたりのリクエスト数上限 (0で無制限)")
+    parser.add_argument("--tpm", type=float, default=0, help="1分あたりのトークン数上限 (0で無制限)")
+    parser.add_argument("--completion-chars", type=int, default=1200, help="生成する応答の最大文字数")
+    parser.add_argument("--malformed-probability", type=float, default=0.0,
+                        help="セクションの順序が崩れた記事を返す確率 (0.0-1.0)")
+    parser.add_argument("--fine-tuning-seconds", type=float, default=10.0,
+                        help="ファインチューニングジョブが完了するまでの秒数")
+    parser.add_argument("--batch-seconds", type=float, default=5.0,
+                        help="バッチが完了するまでの秒数")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード (再現性のある負荷試験用)")
+    parser.add_argument("--quiet", action="store_true", help="アクセスログを表示しない")
+    args = parser.parse_args()
+
+    stub_config = StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        rate_limit_probability=args.rate_limit_probability,
+        retry_after_seconds=args.retry_after,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        completion_chars=args.completion_chars,
+        malformed_probability=args.malformed_probability,
+        fine_tuning_seconds=args.fine_tuning_seconds,
+        batch_seconds=args.batch_seconds,
+        seed=args.seed,
+    )
+    stub_server = create_server(args.host, args.port, stub_config, quiet=args.quiet)
+    print(f"OpenAI スタブサーバーを起動しました: http://{args.host}:{args.port}/v1")
+    print(f"利用するには OPENAI_BASE_URL=http://{args.host}:{args.port}/v1 を設定してください。(Ctrl+Cで終了)")
+    try:
+        stub_server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nスタブサーバーを停止します。")
+    finally:
+        stub_server.server_close()
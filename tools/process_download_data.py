@@ -1,7 +1,20 @@
+import argparse
 import csv
 import json
+import os
 import re
-from bs4 import BeautifulSoup, Comment # Comment をインポートに追加
+import sys
+import time
+from collections import deque
+
+# --- sys.path の調整 ---
+project_root_for_sys_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root_for_sys_path not in sys.path:
+    sys.path.insert(0, project_root_for_sys_path)
+# --- ここまで追加 ---
+
+from src.core import profiling
+from src.core.profiling import span
 
 # --- 追加ここから ---
 # アフィリエイト関連のHTML要素を特定するためのセレクタリスト
@@ -33,23 +46,36 @@ def clean_content(html_content): # 関数名を元のまま使用
     if not html_content or not isinstance(html_content, str):
         return ""
 
-    soup = BeautifulSoup(html_content, 'html.parser')
+    # bs4 の読み込みには時間がかかるため、最初に変換するときにインポートする (2回目以降はキャッシュを参照するだけ)
+    from bs4 import BeautifulSoup, Comment
+    with span("convert.html_parse"):
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+    with span("convert.html_cleanup"):
+        # 1. HTMLコメントを除去 (例: <!--more-->)
+        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+            comment.extract()
+
+        # 2. HTML構造ベースのアフィリエイト要素を除去
+        for selector in AFFILIATE_HTML_SELECTORS:
+            for element in soup.find_all(selector["name"], selector.get("attrs", {})):
+                element.decompose() # 要素ごと削除
 
-    # 1. HTMLコメントを除去 (例: <!--more-->)
-    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-        comment.extract()
+        # 3. <br> タグを改行文字に置換 (テキスト抽出前に)
+        for br_tag in soup.find_all('br'):
+            br_tag.replace_with('\n')
 
-    # 2. HTML構造ベースのアフィリエイト要素を除去
-    for selector in AFFILIATE_HTML_SELECTORS:
-        for element in soup.find_all(selector["name"], selector.get("attrs", {})):
-            element.decompose() # 要素ごと削除
+        # 4. テキスト抽出 (ブロック要素間の区切りとして改行を意識)
+        raw_text = soup.get_text(separator='\n', strip=True)
 
-    # 3. <br> タグを改行文字に置換 (テキスト抽出前に)
-    for br_tag in soup.find_all('br'):
-        br_tag.replace_with('\n')
+    with span("convert.text_regex"):
+        return _clean_extracted_text(raw_text)
 
-    # 4. テキスト抽出 (ブロック要素間の区切りとして改行を意識)
-    raw_text = soup.get_text(separator='\n', strip=True)
+
+def _clean_extracted_text(raw_text):
+    """
+    clean_content の後半。抽出したテキストからショートコードやアフィリエイト段落を除去し、段落を整形する。
+    """
 
     # 5. テキストレベルでのショートコード除去
     for pattern in SHORTCODE_PATTERNS_TO_REMOVE:
@@ -108,59 +134,119 @@ def clean_content(html_content): # 関数名を元のまま使用
     
     return result.strip() # 全体の先頭末尾の空白も除去
 
-def convert_csv_to_jsonl(input_csv_filepath, output_jsonl_filepath):
+# 必要なCSV列
+REQUIRED_COLUMNS = ["ID", "post_title", "post_content", "post_date", "category"]
+# 巨大な投稿本文を読み込めるよう、CSVフィールドの最大サイズを既定 (128KB) より大きくする
+DEFAULT_CSV_FIELD_SIZE_LIMIT = 16 * 1024 * 1024
+# 並列モードで1タスクとしてワーカープロセスに渡す行数
+DEFAULT_CHUNK_SIZE = 64
+# 進捗を表示する間隔 (行数)
+PROGRESS_INTERVAL_ROWS = 1000
+
+def _has_required_columns(reader, input_csv_filepath):
+    """
+    CSVヘッダーの存在と必要な列を確認する。問題があればエラーを表示して False を返す。
+    """
+    # CSVヘッダーの存在確認
+    if not reader.fieldnames:
+        print(f"エラー: CSVファイル '{input_csv_filepath}' が空か、ヘッダー行がありません。")
+        return False
+
+    # 必要な列が存在するか確認
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in reader.fieldnames]
+    if missing_cols:
+        print(f"エラー: CSVファイル '{input_csv_filepath}' に必要な列がありません: {', '.join(missing_cols)}")
+        return False
+    return True
+
+def convert_row_to_json_line(row):
+    """
+    CSVの1行をクリーニングし、JSONLの1行 (末尾の改行を含む) に変換する。
+    """
+    post_id = row.get("ID", "").strip()
+    post_title = row.get("post_title", "").strip()
+    post_content_raw = row.get("post_content", "")
+    post_date = row.get("post_date", "").strip()
+    category = row.get("category", "").strip()
+
+    # post_contentのクリーニング
+    cleaned_text = clean_content(post_content_raw)
+
+    # JSONLオブジェクトの作成
+    # キーの順番: id, title, text, category, post_date
+    json_record = {
+        "id": post_id,
+        "title": post_title,
+        "text": cleaned_text,
+        "category": category,
+        "post_date": post_date
+    }
+    with span("convert.json_encode"):
+        return json.dumps(json_record, ensure_ascii=False) + '\n'
+
+def _convert_rows_chunk(rows):
+    """
+    ワーカープロセスで実行する。行のリストを変換し、((JSONL行, エラーメッセージ) のリスト, ステージの計測値) を返す。
+    計測値は --profile 指定時のみ返し (profiling.drain_stats)、親プロセスで合算する。
+    """
+    results = []
+    for row in rows:
+        try:
+            results.append((convert_row_to_json_line(row), None))
+        except Exception as e:
+            results.append((None, f"行の処理中にエラーが発生しました (ID: {row.get('ID', 'N/A')}): {e}"))
+    return results, profiling.drain_stats()
+
+def _iter_row_chunks(reader, chunk_size):
+    """
+    CSVリーダーから chunk_size 行ずつのリストを順に返す。必要な列のみを保持する。
+    """
+    chunk = []
+    for row in reader:
+        chunk.append({col: row.get(col, "") for col in REQUIRED_COLUMNS})
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _print_progress(processed_count, start_time, final=False):
+    elapsed = time.perf_counter() - start_time
+    rows_per_second = processed_count / elapsed if elapsed > 0 else 0.0
+    label = "完了" if final else "処理中"
+    print(f"{label}: {processed_count}行 ({elapsed:.1f}秒, {rows_per_second:.1f}行/秒)")
+
+def convert_csv_to_jsonl(input_csv_filepath, output_jsonl_filepath, field_size_limit=DEFAULT_CSV_FIELD_SIZE_LIMIT):
     """
     CSVファイルを読み込み、指定された形式でJSONLファイルに変換する。
     """
     processed_count = 0
+    csv.field_size_limit(field_size_limit)
+    start_time = time.perf_counter()
     try:
         with open(input_csv_filepath, 'r', encoding='utf-8', newline='') as csvfile, \
              open(output_jsonl_filepath, 'w', encoding='utf-8') as jsonlfile:
 
             reader = csv.DictReader(csvfile)
-
-            # CSVヘッダーの存在確認
-            if not reader.fieldnames:
-                print(f"エラー: CSVファイル '{input_csv_filepath}' が空か、ヘッダー行がありません。")
+            if not _has_required_columns(reader, input_csv_filepath):
                 return
 
-            # 必要な列が存在するか確認
-            required_cols = ["ID", "post_title", "post_content", "post_date", "category"]
-            missing_cols = [col for col in required_cols if col not in reader.fieldnames]
-            if missing_cols:
-                print(f"エラー: CSVファイル '{input_csv_filepath}' に必要な列がありません: {', '.join(missing_cols)}")
-                return
-
-            for row in reader:
+            for row in profiling.iter_with_span(reader, "convert.csv_read"):
                 try:
-                    post_id = row.get("ID", "").strip()
-                    post_title = row.get("post_title", "").strip()
-                    post_content_raw = row.get("post_content", "")
-                    post_date = row.get("post_date", "").strip()
-                    category = row.get("category", "").strip()
-
-                    # post_contentのクリーニング
-                    cleaned_text = clean_content(post_content_raw)
-
-                    # JSONLオブジェクトの作成
-                    # キーの順番: id, title, text, category, post_date
-                    json_record = {
-                        "id": post_id,
-                        "title": post_title,
-                        "text": cleaned_text,
-                        "category": category,
-                        "post_date": post_date
-                    }
-
                     # JSONLファイルに書き込み
-                    jsonlfile.write(json.dumps(json_record, ensure_ascii=False) + '\n')
+                    json_line = convert_row_to_json_line(row)
+                    with span("convert.write"):
+                        jsonlfile.write(json_line)
                     processed_count += 1
+                    if processed_count % PROGRESS_INTERVAL_ROWS == 0:
+                        _print_progress(processed_count, start_time)
 
                 except Exception as e:
                     print(f"行の処理中にエラーが発生しました (ID: {row.get('ID', 'N/A')}): {e}")
                     # エラーが発生した行をスキップして処理を続ける場合は以下をコメント解除
                     # continue
 
+            _print_progress(processed_count, start_time, final=True)
             print(f"処理が完了しました。{processed_count}件のレコードが '{output_jsonl_filepath}' に出力されました。")
 
     except FileNotFoundError:
@@ -168,14 +254,115 @@ def convert_csv_to_jsonl(input_csv_filepath, output_jsonl_filepath):
     except Exception as e:
         print(f"予期せぬエラーが発生しました: {e}")
 
-if __name__ == '__main__':
+def convert_csv_to_jsonl_parallel(
+    input_csv_filepath,
+    output_jsonl_filepath,
+    workers=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    field_size_limit=DEFAULT_CSV_FIELD_SIZE_LIMIT
+):
+    """
+    convert_csv_to_jsonl の並列版。CSVを読み進めながら chunk_size 行ずつワーカープロセスに渡して
+    clean_content を並列に実行し、元の行順でJSONLに書き出す。
+
+    処理待ちのチャンクは workers * 2 個までに制限するため、入力が大きくてもメモリ使用量は一定に保たれる。
+
+    Args:
+        input_csv_filepath (str): 入力CSVファイルのパス。
+        output_jsonl_filepath (str): 出力JSONLファイルのパス。
+        workers (int, optional): ワーカープロセス数。Noneの場合、CPUコア数。
+        chunk_size (int): 1タスクあたりの行数。
+        field_size_limit (int): CSVフィールドの最大サイズ (バイト)。
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending_chunks = workers * 2
+    processed_count = 0
+    csv.field_size_limit(field_size_limit)
+    start_time = time.perf_counter()
+    next_progress = PROGRESS_INTERVAL_ROWS
+    # multiprocessing の読み込みには時間がかかるため、並列モードで実行するときにインポートする
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        with open(input_csv_filepath, 'r', encoding='utf-8', newline='') as csvfile, \
+             open(output_jsonl_filepath, 'w', encoding='utf-8') as jsonlfile, \
+             ProcessPoolExecutor(max_workers=workers, initializer=profiling.worker_initializer,
+                                 initargs=(profiling.is_enabled(),)) as executor:
+
+            reader = csv.DictReader(csvfile)
+            if not _has_required_columns(reader, input_csv_filepath):
+                return
+
+            pending = deque()
+
+            def _write_oldest():
+                # 投入順に結果を取り出すことで、出力を元の行順に保つ
+                nonlocal processed_count, next_progress
+                with span("convert.wait_workers"):
+                    results, stage_stats = pending.popleft().result()
+                profiling.merge_stats(stage_stats)
+                for json_line, error_message in results:
+                    if error_message:
+                        print(error_message)
+                        continue
+                    with span("convert.write"):
+                        jsonlfile.write(json_line)
+                    processed_count += 1
+                if processed_count >= next_progress:
+                    _print_progress(processed_count, start_time)
+                    next_progress += PROGRESS_INTERVAL_ROWS
+
+            for chunk in profiling.iter_with_span(_iter_row_chunks(reader, chunk_size), "convert.csv_read"):
+                if len(pending) >= max_pending_chunks:
+                    _write_oldest()
+                pending.append(executor.submit(_convert_rows_chunk, chunk))
+            while pending:
+                _write_oldest()
+
+            _print_progress(processed_count, start_time, final=True)
+            print(f"処理が完了しました。{processed_count}件のレコードが '{output_jsonl_filepath}' に出力されました。(ワーカー数: {workers})")
+
+    except FileNotFoundError:
+        print(f"エラー: 入力ファイル '{input_csv_filepath}' が見つかりません。")
+    except Exception as e:
+        print(f"予期せぬエラーが発生しました: {e}")
+
+
+def run_cli(argv: list = None, prog: str = None) -> None:
+    """
+    コマンドライン引数を解釈してCSVからJSONLへの変換を実行する (python -m src convert)。
+
+    Args:
+        argv (list, optional): コマンドライン引数。Noneの場合、sys.argv を使用。
+        prog (str, optional): ヘルプに表示するプログラム名。
+    """
     # 入力CSVファイル名と出力JSONLファイル名を指定
     # このファイル名は実際の環境に合わせて変更してください
-    input_file = 'downloaded_data.csv'
-    output_file = 'output.jsonl'
+    parser = argparse.ArgumentParser(prog=prog, description="WordPressのCSVエクスポートをJSONLに変換する。")
+    parser.add_argument("input_file", nargs="?", default='downloaded_data.csv', help="入力CSVファイル")
+    parser.add_argument("output_file", nargs="?", default='output.jsonl', help="出力JSONLファイル")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="ワーカープロセス数。2以上を指定すると並列モードで処理する (0でCPUコア数)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"並列モードで1タスクあたりに処理する行数 (デフォルト: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--field-size-limit", type=int, default=DEFAULT_CSV_FIELD_SIZE_LIMIT,
+                        help=f"CSVフィールドの最大サイズ (バイト, デフォルト: {DEFAULT_CSV_FIELD_SIZE_LIMIT})")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    input_file = args.input_file
+    output_file = args.output_file
 
     print(f"'{input_file}' を処理して '{output_file}' に出力します...")
-    convert_csv_to_jsonl(input_file, output_file)
+    with profiling.profiling_session(args, "convert"):
+        if args.workers == 1:
+            convert_csv_to_jsonl(input_file, output_file, field_size_limit=args.field_size_limit)
+        else:
+            convert_csv_to_jsonl_parallel(
+                input_file,
+                output_file,
+                workers=args.workers or None,
+                chunk_size=max(1, args.chunk_size),
+                field_size_limit=args.field_size_limit
+            )
 
     # --- 使用例 ---
     # スクリプトと同じディレクトリに 'downlooaded_data.csv' があると仮定します。
@@ -188,3 +375,7 @@ if __name__ == '__main__':
     # 例: output.jsonl の期待される内容 (1行1JSON)
     # {"id": "1", "title": "最初の記事", "text": "これは 最初の 記事です。 改行1\n改行2 追加テキスト", "category": "技術", "post_date": "2023-01-01"}
     # {"id": "2", "title": "２番目の記事", "text": "記事の本文。 さらにテキスト。", "category": "趣味", "post_date": "2023-01-02"}
+
+
+if __name__ == '__main__':
+    run_cli()